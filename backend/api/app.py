@@ -48,6 +48,7 @@ def _run_migrations(engine):
     migrations = [
         ("classroom", "joins_paused", "BOOLEAN NOT NULL DEFAULT 0"),
         ("classroom", "grading_mode", "TEXT NOT NULL DEFAULT 'equal'"),
+        ("classroom", "auto_grade", "BOOLEAN NOT NULL DEFAULT 0"),
     ]
 
     with engine.connect() as conn:
@@ -196,9 +197,33 @@ async def lifespan(app: FastAPI):
     from .subdomain_caddy import ensure_app_server
     ensure_app_server()
 
+    from .grading import install_auto_grader
+    install_auto_grader(engine)
+
+    from .fs_watcher import install_fs_watcher
+    fs_watcher = install_fs_watcher()
+
+    from .publish import install_publish_jobs
+    install_publish_jobs()
+
+    from .loop_monitor import install_loop_monitor
+    loop_monitor = install_loop_monitor()
+
+    # Pre-start the warm grading sandboxes off the startup path.
+    import threading
+    from backend.docker import get_grading_pool
+    threading.Thread(target=get_grading_pool().warm, name="grading-pool-warm", daemon=True).start()
+
     logger.info("CS Room API started")
     yield
     logger.info("Shutting down")
+    if fs_watcher is not None:
+        fs_watcher.stop()
+    get_grading_pool().shutdown()
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+    from .offload import shutdown_offload
+    shutdown_offload()
 
 
 def create_app():
@@ -220,6 +245,7 @@ def create_app():
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-File-Size", "X-File-Preview", "X-File-Version"],
     )
 
     app.include_router(admin.router, prefix="/api/admin", tags=["admin"])
@@ -3,7 +3,8 @@ from datetime import datetime
 from typing import Optional
 import uuid
 
-from sqlalchemy import inspect, text
+from sqlalchemy import Index, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlmodel import SQLModel, Field, create_engine, Session
 
 logger = logging.getLogger("database")
@@ -29,6 +30,8 @@ class Classroom(SQLModel, table=True):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     joins_paused: bool = Field(default=False)
     grading_mode: str = Field(default="equal")  # "equal", "weighted", "manual"
+    # Re-grade a participant's assignment in the background when they save.
+    auto_grade: bool = Field(default=False)
 
 
 class ClassroomMember(SQLModel, table=True):
@@ -55,6 +58,9 @@ class Template(SQLModel, table=True):
 
 class AssignmentWeight(SQLModel, table=True):
     __tablename__ = "assignment_weight"
+    __table_args__ = (
+        Index("ux_assignment_weight_template", "classroom_id", "template_name", unique=True),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     classroom_id: str = Field(foreign_key="classroom.id", index=True)
     template_name: str
@@ -63,6 +69,11 @@ class AssignmentWeight(SQLModel, table=True):
 
 class TestResult(SQLModel, table=True):
     __tablename__ = "test_result"
+    __table_args__ = (
+        Index(
+            "ux_test_result_owner", "classroom_id", "user_id", "template_name", unique=True,
+        ),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     classroom_id: str = Field(foreign_key="classroom.id", index=True)
     user_id: str = Field(foreign_key="user.id", index=True)
@@ -70,10 +81,37 @@ class TestResult(SQLModel, table=True):
     tests_passed: int = Field(default=0)
     tests_total: int = Field(default=0)
     last_run: datetime = Field(default_factory=datetime.utcnow)
+    # Hash of the student's files, the template's test files and the runner
+    # version this result was graded against (see test_runner.fingerprint).
+    fingerprint: Optional[str] = None
+    output: Optional[str] = None
+    # Hash of just the test files, and per-file scores as JSON, so a later
+    # "failed only" run can merge into this result.
+    tests_fingerprint: Optional[str] = None
+    file_scores: Optional[str] = None
+
+
+class TestCaseResult(SQLModel, table=True):
+    """One test's outcome within a TestResult."""
+
+    __tablename__ = "test_case_result"
+    id: Optional[int] = Field(default=None, primary_key=True)
+    test_result_id: int = Field(foreign_key="test_result.id", index=True)
+    classroom_id: str = Field(foreign_key="classroom.id", index=True)
+    user_id: str = Field(foreign_key="user.id", index=True)
+    file: str
+    test_id: str
+    outcome: str  # "passed", "failed", "error", "skipped"
+    message: Optional[str] = None
 
 
 class ManualScore(SQLModel, table=True):
     __tablename__ = "manual_score"
+    __table_args__ = (
+        Index(
+            "ux_manual_score_owner", "classroom_id", "user_id", "template_name", unique=True,
+        ),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     classroom_id: str = Field(foreign_key="classroom.id", index=True)
     user_id: str = Field(foreign_key="user.id", index=True)
@@ -157,6 +195,7 @@ def get_engine(database_url: str = "sqlite:///backend/csroom.db"):
 def create_db_and_tables(engine):
     SQLModel.metadata.create_all(engine)
     add_missing_columns(engine)
+    add_unique_indexes(engine)
 
 
 def add_missing_columns(engine) -> None:
@@ -212,6 +251,80 @@ def add_missing_columns(engine) -> None:
             logger.info("Added column %s.%s (%s)", table_name, column.name, col_type)
 
 
+def add_unique_indexes(engine) -> None:
+    """Create any unique index a model declares that an existing table lacks.
+
+    ``create_all`` only builds indexes along with new tables. Before the index
+    can exist, duplicate rows (from racing upserts on older versions) are
+    collapsed, keeping the newest row (highest id) of each group; per-test
+    rows of a dropped ``test_result`` go with it.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    for table_name, table in SQLModel.metadata.tables.items():
+        if table_name not in existing_tables or "id" not in table.c:
+            continue
+        present = {ix["name"] for ix in inspector.get_indexes(table_name)}
+        for index in table.indexes:
+            if not index.unique or index.name in present:
+                continue
+            cols = ", ".join(f'"{c.name}"' for c in index.columns)
+            with engine.begin() as conn:
+                removed = conn.execute(text(
+                    f'DELETE FROM "{table_name}" WHERE id NOT IN '
+                    f'(SELECT MAX(id) FROM "{table_name}" GROUP BY {cols})'
+                )).rowcount
+                if removed and table_name == "test_result":
+                    conn.execute(text(
+                        "DELETE FROM test_case_result WHERE test_result_id NOT IN "
+                        "(SELECT id FROM test_result)"
+                    ))
+                conn.execute(text(
+                    f'CREATE UNIQUE INDEX IF NOT EXISTS "{index.name}" '
+                    f'ON "{table_name}" ({cols})'
+                ))
+            logger.info(
+                "Added unique index %s (dropped %d duplicate rows)", index.name, removed,
+            )
+
+
+def upsert(
+    db: Session,
+    model,
+    rows: list[dict],
+    keys: tuple[str, ...],
+    returning: tuple[str, ...] = (),
+) -> list[tuple]:
+    """Batched ``INSERT ... ON CONFLICT (keys) DO UPDATE`` of *rows*.
+
+    Every row must carry the same columns; the non-key ones are overwritten
+    on conflict. *keys* must match a unique index. Rows are sent in chunks
+    that stay under SQLite's bound-parameter limit. Returns the *returning*
+    columns of every written row.
+    """
+    if not rows:
+        return []
+    table = model.__table__
+    update_cols = [c for c in rows[0] if c not in keys]
+    chunk = max(1, 900 // len(rows[0]))
+    out: list[tuple] = []
+    for i in range(0, len(rows), chunk):
+        stmt = sqlite_insert(table).values(rows[i:i + chunk])
+        if update_cols:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(keys),
+                set_={c: stmt.excluded[c] for c in update_cols},
+            )
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=list(keys))
+        if returning:
+            stmt = stmt.returning(*(table.c[c] for c in returning))
+            out.extend(tuple(r) for r in db.execute(stmt).all())
+        else:
+            db.execute(stmt)
+    return out
+
+
 def get_session(engine):
     with Session(engine) as session:
         yield session
@@ -0,0 +1,177 @@
+"""Cached per-user workspace trees for ``/api/files/list``.
+
+Building the explorer tree walks ``UPLOADS_ROOT/{uid}`` and every classroom
+mount beneath it, which for a workspace holding a venv is tens of thousands
+of syscalls, and the client refetches it after every ``files-changed``
+event and terminal command. The index keeps each built tree in memory along
+with the mtime of every directory it listed:
+
+- API mutations (via ``notify_files_changed`` listeners) drop the affected
+  trees outright;
+- otherwise, at most once per ``FILE_TREE_REVALIDATE`` seconds a cached tree
+  is checked by stat-ing its directories — adding, removing or renaming an
+  entry always bumps the parent directory's mtime — which catches changes
+  made from the terminal without re-listing anything;
+- while ``fs_watcher`` has a user's whole visible tree under inotify it
+  invalidates as events arrive, and that user's default (non-hidden) tree is
+  trusted without stat-ing.
+
+Each tree carries a content-hash ``version`` so unchanged lists can be
+answered with a 304.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+FILE_TREE_REVALIDATE = 1.0
+FILE_TREE_MAX_ENTRIES = 2000
+
+# Filesystem timestamps come from a coarse clock; treat directories touched
+# within this margin of the build as possibly changed mid-walk.
+_MTIME_SLACK_NS = 20_000_000
+
+
+class FileTree:
+    __slots__ = ("files", "classrooms", "dirs", "version", "checked_at", "settled")
+
+    def __init__(self, files, classrooms, dirs, version, checked_at):
+        self.files: list[str] = files
+        # Top-level classroom slug -> classroom id.
+        self.classrooms: dict[str, str] = classrooms
+        # Directory path -> st_mtime_ns when it was listed (-1: recheck).
+        self.dirs: dict[str, int] = dirs
+        self.version: str = version
+        self.checked_at: float = checked_at
+        # False if a directory changed mid-build; never trusted then.
+        self.settled: bool = all(m >= 0 for m in dirs.values())
+
+
+BuildFn = Callable[[], tuple[list[str], dict[str, str], list[str]]]
+
+
+class FileTreeIndex:
+    """LRU of built trees keyed by ``(user_id, show_hidden)``."""
+
+    def __init__(
+        self,
+        revalidate_interval: float = FILE_TREE_REVALIDATE,
+        max_entries: int = FILE_TREE_MAX_ENTRIES,
+        clock=time.monotonic,
+    ):
+        self._interval = revalidate_interval
+        self._max_entries = max_entries
+        self._clock = clock
+        self._entries: "OrderedDict[tuple[str, bool], FileTree]" = OrderedDict()
+        self._watched: set[str] = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str, show_hidden: bool, build: BuildFn) -> FileTree:
+        """Return the cached tree, rebuilding it with *build* if it changed.
+
+        *build* returns ``(files, classrooms, dirs)`` where *dirs* lists
+        every directory whose entries were read."""
+        key = (user_id, show_hidden)
+        with self._lock:
+            tree = self._entries.get(key)
+            if tree is not None:
+                self._entries.move_to_end(key)
+        if tree is not None and self._fresh(key, tree):
+            self.hits += 1
+            return tree
+
+        self.misses += 1
+        started_ns = time.time_ns() - _MTIME_SLACK_NS
+        files, classrooms, dirs = build()
+        mtimes: dict[str, int] = {}
+        for d in dirs:
+            try:
+                m = os.stat(d).st_mtime_ns
+            except OSError:
+                m = -1
+            mtimes[d] = -1 if m >= started_ns else m
+        digest = hashlib.sha256(
+            json.dumps([files, classrooms], separators=(",", ":")).encode()
+        ).hexdigest()[:32]
+        tree = FileTree(files, classrooms, mtimes, digest, self._clock())
+        with self._lock:
+            self._entries[key] = tree
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return tree
+
+    def _fresh(self, key: tuple[str, bool], tree: FileTree) -> bool:
+        if not key[1] and key[0] in self._watched:
+            return tree.settled
+        now = self._clock()
+        if now - tree.checked_at < self._interval:
+            return True
+        for d, m in tree.dirs.items():
+            if m < 0:
+                return False
+            try:
+                if os.stat(d).st_mtime_ns != m:
+                    return False
+            except OSError:
+                return False
+        tree.checked_at = now
+        return True
+
+    def set_watched(self, user_id: str, watched: bool) -> None:
+        """Mark whether a file watcher is invalidating *user_id*'s tree."""
+        with self._lock:
+            if watched:
+                self._watched.add(user_id)
+            else:
+                self._watched.discard(user_id)
+
+    def invalidate_user(self, user_id: str) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[key]
+
+    def invalidate_paths(self, paths: list[str]) -> None:
+        """Drop every tree that listed the parent directory of any of
+        *paths* (or the path itself, for directories)."""
+        targets = set()
+        for p in paths:
+            p = os.path.normpath(p)
+            targets.add(p)
+            targets.add(os.path.dirname(p))
+        with self._lock:
+            for key in [k for k, t in self._entries.items() if not targets.isdisjoint(t.dirs)]:
+                del self._entries[key]
+
+    async def on_files_changed(self, user_id: str, paths: list[str] | None) -> None:
+        self.invalidate_user(user_id)
+        if paths:
+            self.invalidate_paths(paths)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+            watched = len(self._watched)
+        return {
+            "entries": entries, "hits": self.hits, "misses": self.misses, "watched": watched,
+        }
+
+
+_file_index: FileTreeIndex | None = None
+
+
+def get_file_index() -> FileTreeIndex:
+    """Return the process-wide tree index, creating it on first use."""
+    global _file_index
+    if _file_index is None:
+        _file_index = FileTreeIndex()
+    return _file_index
+
+
+__all__ = ["FileTree", "FileTreeIndex", "get_file_index"]
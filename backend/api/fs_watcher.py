@@ -0,0 +1,575 @@
+"""inotify-backed ``files-changed`` events for active workspaces.
+
+API routes announce their own mutations through ``notify_files_changed``,
+but anything done from the terminal (``git clone``, ``pip install``, an
+editor saving) used to go unnoticed until the client polled. While a user
+has a socket session open, this service watches their workspace and every
+classroom mount the explorer shows them and turns kernel events into
+debounced, coalesced batches:
+
+    {"added": [...], "removed": [...], "modified": [...], "overflow": False}
+
+Paths are explorer paths (directories end in ``/``), so the client can patch
+its tree instead of refetching it. Hidden names are skipped and hidden
+directories are not descended into, matching the default listing.
+
+inotify watches are per directory, so the watcher keeps one per visible
+directory, adds watches for directories as they appear (listing them to
+catch entries created before the watch landed) and drops them when they
+go. A directory shared between users (a classroom mount) has a single
+watch with several owners. If the kernel queue overflows, a user exceeds
+``FS_WATCH_MAX_DIRS`` or a batch grows past ``FS_WATCH_MAX_PATHS``, the
+affected users get ``overflow: true`` and refetch the whole tree.
+
+While a user is fully watched, the ``FileTreeIndex`` stops stat-revalidating
+their tree and relies on the watcher's invalidations instead.
+
+Linux only; elsewhere (or with ``FS_WATCH=0``) nothing is installed and the
+explorer falls back to polling.
+"""
+
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Awaitable, Callable
+
+logger = logging.getLogger("fs_watcher")
+
+FS_WATCH_ENABLED = os.environ.get("FS_WATCH", "1") != "0"
+FS_WATCH_DEBOUNCE = 0.25
+FS_WATCH_MAX_DELAY = 1.0
+FS_WATCH_MAX_DIRS = int(os.environ.get("FS_WATCH_MAX_DIRS", "8192"))
+FS_WATCH_MAX_PATHS = 1000
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+_EVENT = struct.Struct("iIII")
+
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+
+
+class _Inotify:
+    """Minimal ctypes binding; raises OSError when inotify is unavailable."""
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify requires Linux")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add_watch(self, path: str, mask: int = _WATCH_MASK) -> int:
+        wd = self._add(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self._rm(self.fd, wd)  # EINVAL once the kernel already dropped it
+
+    def read(self) -> list[tuple[int, int, str]]:
+        """Drain pending events as ``(wd, mask, name)``."""
+        events = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return events
+            pos = 0
+            while pos + _EVENT.size <= len(buf):
+                wd, mask, _cookie, length = _EVENT.unpack_from(buf, pos)
+                pos += _EVENT.size
+                name = os.fsdecode(buf[pos:pos + length].rstrip(b"\0"))
+                pos += length
+                events.append((wd, mask, name))
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class ChangeSet:
+    """Coalesces a burst of path events into net added/removed/modified.
+
+    A path created and deleted within one batch disappears; one deleted and
+    recreated is reported as modified; removing a directory drops anything
+    already queued beneath it (the client removes the whole subtree).
+    """
+
+    def __init__(self):
+        self._paths: dict[str, tuple[str, bool]] = {}
+        self.host_paths: set[str] = set()
+        self.overflow = False
+        self.first_at = 0.0
+        self.last_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def record(self, path: str, kind: str, is_dir: bool) -> None:
+        prev = self._paths.get(path)
+        if kind == REMOVED:
+            if is_dir:
+                prefix = path + "/"
+                for p in [p for p in self._paths if p.startswith(prefix)]:
+                    del self._paths[p]
+            if prev is not None and prev[0] == ADDED:
+                del self._paths[path]
+            else:
+                self._paths[path] = (REMOVED, is_dir)
+        elif kind == ADDED:
+            if prev is not None and prev[0] == REMOVED:
+                self._paths[path] = (MODIFIED, is_dir)
+            elif prev is None:
+                self._paths[path] = (ADDED, is_dir)
+        elif prev is None:
+            self._paths[path] = (MODIFIED, is_dir)
+
+    def payload(self) -> dict:
+        out = {ADDED: [], REMOVED: [], MODIFIED: [], "overflow": self.overflow}
+        if not self.overflow:
+            for path, (kind, is_dir) in sorted(self._paths.items()):
+                out[kind].append(path + "/" if is_dir else path)
+        return out
+
+
+class _Watch:
+    __slots__ = ("path", "owners")
+
+    def __init__(self, path: str):
+        self.path = path
+        # (user_id, explorer path of this directory; "" for a workspace root)
+        self.owners: set[tuple[str, str]] = set()
+
+
+class _User:
+    __slots__ = ("roots", "wds", "degraded", "changes", "resync")
+
+    def __init__(self):
+        self.roots: list[tuple[str, str]] = []
+        self.wds: set[int] = set()
+        self.degraded = False
+        self.changes: ChangeSet | None = None
+        self.resync = False
+
+
+RootsFn = Callable[[str], list[tuple[str, str]]]
+DeliverFn = Callable[[str, list[str] | None, bool, dict], Awaitable[None]]
+
+
+class FsWatcher:
+    """Watches active users' trees on a background thread.
+
+    *roots_for(user_id)* returns ``(host_dir, explorer_prefix)`` pairs: the
+    workspace with prefix ``""`` plus one per classroom mount. *deliver* is
+    awaited on *loop* with ``(user_id, host_paths, tree_changed, payload)``.
+    *index* (a ``FileTreeIndex``) is invalidated as events are read.
+    """
+
+    def __init__(
+        self,
+        roots_for: RootsFn,
+        deliver: DeliverFn,
+        loop: asyncio.AbstractEventLoop,
+        index=None,
+        is_hidden: Callable[[str], bool] = lambda name: False,
+        debounce: float = FS_WATCH_DEBOUNCE,
+        max_delay: float = FS_WATCH_MAX_DELAY,
+        max_dirs: int = FS_WATCH_MAX_DIRS,
+        max_paths: int = FS_WATCH_MAX_PATHS,
+    ):
+        self._inotify = _Inotify()
+        self._roots_for = roots_for
+        self._deliver = deliver
+        self._loop = loop
+        self._index = index
+        self._is_hidden = is_hidden
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._max_dirs = max_dirs
+        self._max_paths = max_paths
+        self._watches: dict[int, _Watch] = {}
+        self._users: dict[str, _User] = {}
+        self._commands: list[tuple[str, str]] = []
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        self._stopping = False
+        self.events = 0
+        self.overflows = 0
+        self._thread = threading.Thread(target=self._run, name="fs-watcher", daemon=True)
+        self._thread.start()
+
+    # -- called from the event loop -------------------------------------
+
+    def watch_user(self, user_id: str) -> None:
+        self._command("watch", user_id)
+
+    def unwatch_user(self, user_id: str) -> None:
+        self._command("unwatch", user_id)
+
+    def resync_user(self, user_id: str) -> None:
+        """Re-read the user's mounts, e.g. after joining a classroom."""
+        self._command("resync", user_id)
+
+    def stop(self) -> None:
+        self._stopping = True
+        os.write(self._wake_w, b"x")
+        self._thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "watches": len(self._watches),
+                "degraded": sum(u.degraded for u in self._users.values()),
+                "events": self.events,
+                "overflows": self.overflows,
+            }
+
+    def _command(self, op: str, user_id: str) -> None:
+        with self._lock:
+            self._commands.append((op, user_id))
+        os.write(self._wake_w, b"x")
+
+    # -- watcher thread ---------------------------------------------------
+
+    def _run(self) -> None:
+        poller = select.poll()
+        poller.register(self._inotify.fd, select.POLLIN)
+        poller.register(self._wake_r, select.POLLIN)
+        while not self._stopping:
+            timeout = self._next_deadline()
+            try:
+                ready = poller.poll(None if timeout is None else max(0, timeout * 1000))
+            except InterruptedError:
+                continue
+            try:
+                for fd, _ev in ready:
+                    if fd == self._wake_r:
+                        os.read(self._wake_r, 4096)
+                        self._run_commands()
+                    else:
+                        self._handle(self._inotify.read())
+                self._flush_due()
+            except Exception:
+                logger.exception("fs watcher iteration failed")
+        for uid in list(self._users):
+            self._unwatch(uid)
+        self._inotify.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _run_commands(self) -> None:
+        with self._lock:
+            commands, self._commands = self._commands, []
+        for op, uid in commands:
+            if op == "unwatch":
+                self._unwatch(uid)
+            elif op == "watch" and uid in self._users:
+                continue
+            else:
+                self._sync(uid)
+
+    def _sync(self, uid: str) -> None:
+        """(Re)establish watches on every directory the user can see."""
+        user = self._users.get(uid)
+        fresh = user is None
+        if fresh:
+            with self._lock:
+                user = self._users[uid] = _User()
+        try:
+            user.roots = self._roots_for(uid)
+        except Exception:
+            logger.exception("fs watcher: could not resolve roots for %s", uid)
+            user.roots = []
+        old = {(wd, c) for wd in user.wds for u, c in self._watches[wd].owners if u == uid}
+        new: set[tuple[int, str]] = set()
+        user.degraded = False
+        for host, prefix in user.roots:
+            self._add_tree(uid, user, host, prefix, new, None)
+        for wd, client in old - new:
+            self._release(wd, uid, client)
+        if self._index is not None:
+            self._index.invalidate_user(uid)
+            self._index.set_watched(uid, not user.degraded)
+        if not fresh:
+            self._pending(user).overflow = True
+
+    def _add_tree(
+        self,
+        uid: str,
+        user: _User,
+        host: str,
+        client: str,
+        added: set[tuple[int, str]],
+        changes: ChangeSet | None,
+    ) -> None:
+        """Watch *host* and every visible directory below it. With
+        *changes*, also record everything found as added (a directory that
+        appeared after its parent was watched)."""
+        for root, dirs, files in os.walk(host, followlinks=False):
+            rel = os.path.relpath(root, host)
+            here = client if rel == "." else _join(client, rel)
+            if len(user.wds) >= self._max_dirs:
+                if not user.degraded:
+                    logger.warning("fs watcher: %s exceeds %d directories", uid, self._max_dirs)
+                user.degraded = True
+                dirs[:] = []
+                continue
+            try:
+                wd = self._inotify.add_watch(root)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    logger.warning("fs watcher: inotify watch limit reached")
+                    user.degraded = True
+                dirs[:] = []
+                continue
+            watch = self._watches.get(wd)
+            if watch is None or watch.path != root:
+                # A reused wd (directory moved) gets its new path.
+                watch = watch or _Watch(root)
+                watch.path = root
+                self._watches[wd] = watch
+            watch.owners.add((uid, here))
+            user.wds.add(wd)
+            added.add((wd, here))
+            dirs[:] = [
+                d for d in dirs
+                if not self._is_hidden(d) and not os.path.islink(os.path.join(root, d))
+            ]
+            if changes is not None:
+                for d in dirs:
+                    changes.record(_join(here, d), ADDED, True)
+                for f in files:
+                    if not self._visible(f):
+                        continue
+                    changes.record(_join(here, f), ADDED, False)
+                    changes.host_paths.add(os.path.join(root, f))
+
+    def _release(self, wd: int, uid: str, client: str) -> None:
+        watch = self._watches.get(wd)
+        if watch is None:
+            return
+        watch.owners.discard((uid, client))
+        user = self._users.get(uid)
+        if user is not None and not any(u == uid for u, _c in watch.owners):
+            user.wds.discard(wd)
+        if not watch.owners:
+            del self._watches[wd]
+            self._inotify.rm_watch(wd)
+
+    def _unwatch(self, uid: str) -> None:
+        user = self._users.get(uid)
+        if user is None:
+            return
+        for wd in list(user.wds):
+            watch = self._watches.get(wd)
+            if watch is not None:
+                for owner in [o for o in watch.owners if o[0] == uid]:
+                    self._release(wd, *owner)
+        with self._lock:
+            del self._users[uid]
+        if self._index is not None:
+            self._index.set_watched(uid, False)
+
+    def _drop_subtree(self, path: str) -> None:
+        """Forget watches at or below *path* (moved away or deleted)."""
+        prefix = path + "/"
+        for wd, watch in list(self._watches.items()):
+            if watch.path == path or watch.path.startswith(prefix):
+                for uid, _c in watch.owners:
+                    user = self._users.get(uid)
+                    if user is not None:
+                        user.wds.discard(wd)
+                del self._watches[wd]
+                self._inotify.rm_watch(wd)
+
+    def _visible(self, name: str) -> bool:
+        return not self._is_hidden(name) and not name.endswith(".pyc")
+
+    def _pending(self, user: _User) -> ChangeSet:
+        if user.changes is None:
+            user.changes = ChangeSet()
+            user.changes.first_at = time.monotonic()
+        user.changes.last_at = time.monotonic()
+        return user.changes
+
+    def _handle(self, events: list[tuple[int, int, str]]) -> None:
+        self.events += len(events)
+        touched_dirs: set[str] = set()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self._overflow()
+                continue
+            watch = self._watches.get(wd)
+            if watch is None:
+                continue
+            if mask & IN_IGNORED:
+                for uid, _c in watch.owners:
+                    user = self._users.get(uid)
+                    if user is not None:
+                        user.wds.discard(wd)
+                del self._watches[wd]
+                continue
+            if not name or not self._visible(name):
+                continue
+            host = os.path.join(watch.path, name)
+            is_dir = bool(mask & IN_ISDIR)
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                kind = ADDED
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                kind = REMOVED
+            else:
+                kind = MODIFIED
+            if kind != MODIFIED:
+                touched_dirs.add(host)
+            if kind == REMOVED and is_dir:
+                self._drop_subtree(host)
+            for uid, client in list(watch.owners):
+                user = self._users.get(uid)
+                if user is None:
+                    continue
+                changes = self._pending(user)
+                path = _join(client, name)
+                if kind != MODIFIED and (
+                    (kind == ADDED and os.path.islink(host))
+                    or any(p == path for _h, p in user.roots)
+                ):
+                    # A classroom mount appeared or went away.
+                    user.resync = True
+                changes.record(path, kind, is_dir)
+                changes.host_paths.add(host)
+                if kind == ADDED and is_dir and os.path.isdir(host):
+                    self._add_tree(uid, user, host, path, set(), changes)
+                    if user.degraded and self._index is not None:
+                        self._index.set_watched(uid, False)
+        if touched_dirs and self._index is not None:
+            self._index.invalidate_paths(sorted(touched_dirs))
+
+    def _overflow(self) -> None:
+        """The kernel dropped events: resync everyone and have clients refetch."""
+        self.overflows += 1
+        logger.warning("fs watcher: inotify queue overflowed")
+        for uid in list(self._users):
+            self._sync(uid)
+
+    def _next_deadline(self) -> float | None:
+        deadlines = [
+            min(u.changes.last_at + self._debounce, u.changes.first_at + self._max_delay)
+            for u in self._users.values()
+            if u.changes is not None
+        ]
+        if not deadlines:
+            return None
+        return min(deadlines) - time.monotonic()
+
+    def _flush_due(self) -> None:
+        now = time.monotonic()
+        for uid, user in list(self._users.items()):
+            changes = user.changes
+            if changes is None:
+                continue
+            if (
+                now < changes.last_at + self._debounce
+                and now < changes.first_at + self._max_delay
+            ):
+                continue
+            user.changes = None
+            if user.resync:
+                user.resync = False
+                self._sync(uid)
+                user.changes = None
+                changes.overflow = True
+            if len(changes) > self._max_paths:
+                changes.overflow = True
+            payload = changes.payload()
+            if not (payload["overflow"] or payload[ADDED] or payload[REMOVED] or payload[MODIFIED]):
+                continue
+            tree_changed = bool(payload["overflow"] or payload[ADDED] or payload[REMOVED])
+            host_paths = None if changes.overflow else sorted(changes.host_paths)
+            asyncio.run_coroutine_threadsafe(
+                self._deliver(uid, host_paths, tree_changed, payload), self._loop,
+            )
+
+
+def _join(client: str, rel: str) -> str:
+    return f"{client}/{rel}" if client else rel
+
+
+_fs_watcher: FsWatcher | None = None
+
+
+def install_fs_watcher() -> FsWatcher | None:
+    """Start the process-wide watcher on the running loop. Returns None
+    where inotify is unavailable or ``FS_WATCH=0``."""
+    global _fs_watcher
+    if _fs_watcher is not None or not FS_WATCH_ENABLED:
+        return _fs_watcher
+
+    from .file_index import get_file_index
+    from .routers.files import _is_hidden, _watch_roots
+    from .terminal import notify_files_changed, session_map
+
+    async def deliver(user_id, paths, tree_changed, payload):
+        await notify_files_changed(user_id, paths, tree_changed=tree_changed, changes=payload)
+
+    try:
+        _fs_watcher = FsWatcher(
+            _watch_roots,
+            deliver,
+            asyncio.get_running_loop(),
+            index=get_file_index(),
+            is_hidden=_is_hidden,
+        )
+    except OSError as e:
+        logger.info("File watching disabled: %s", e)
+        return None
+    for uid in {s["user_id"] for s in session_map.values()}:
+        _fs_watcher.watch_user(uid)
+    return _fs_watcher
+
+
+def get_fs_watcher() -> FsWatcher | None:
+    """Return the installed watcher, if any."""
+    return _fs_watcher
+
+
+__all__ = [
+    "ChangeSet",
+    "FsWatcher",
+    "get_fs_watcher",
+    "install_fs_watcher",
+]
@@ -0,0 +1,321 @@
+"""Materialized gradebook behind ``/classrooms/{id}/progress``.
+
+Teachers poll /progress constantly during class. Instead of listing the
+assignments directory and loading every participant and TestResult on each
+poll, a classroom's gradebook is built once and then patched in place by the
+code paths that change it:
+
+- grading results (``store_outcomes``) update single cells;
+- weight/mode and manual-score edits update the grading inputs;
+- membership changes and assignment upload/publish/restore/delete drop the
+  entry so the next poll rebuilds it, as do changes to the assignments
+  directory made through /api/files (see ``on_files_changed``).
+
+Builds read the database without holding the lock, so every change also
+bumps a per-classroom generation; a build that overlaps a change is not
+cached, since it may have read the state from before it.
+
+Weighted/manual totals are computed here rather than in the browser. The
+serialized payload and a content-hash ETag are cached until the next change,
+so an unchanged poll is a dict lookup and a 304. Entries are also rebuilt
+after ``GRADEBOOK_MAX_AGE`` seconds to pick up anything changed outside the
+API (e.g. assignment folders edited on disk); a rebuild that changes nothing
+keeps the same ETag.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from sqlmodel import Session, select
+
+from backend.docker import CLASSROOMS_ROOT
+
+from .database import (
+    AssignmentWeight,
+    Classroom,
+    ClassroomMember,
+    ManualScore,
+    TestResult,
+    User,
+)
+
+GRADEBOOK_MAX_AGE = 300.0
+
+# Attempts at a build that is not overtaken by a change before the last
+# one is served without being cached.
+_BUILD_ATTEMPTS = 3
+
+
+def list_assignments(classroom_id: str) -> list[str]:
+    templates_dir = os.path.join(CLASSROOMS_ROOT, classroom_id, "assignments")
+    if not os.path.isdir(templates_dir):
+        return []
+    return sorted(
+        e for e in os.listdir(templates_dir)
+        if os.path.isdir(os.path.join(templates_dir, e))
+    )
+
+
+def student_grade(
+    templates: list[str],
+    results: dict[str, dict],
+    mode: str,
+    weights: dict[str, float],
+    manual: dict[str, float],
+) -> dict:
+    """A student's overall grade under *mode*, matching the gradebook UI.
+
+    ``percent`` is None when nothing counts toward the grade yet. In manual
+    mode ``earned``/``possible`` are the summed points; otherwise they are
+    the summed passed/total test counts.
+    """
+    if mode == "manual":
+        earned = sum(manual.get(t, 0) for t in templates)
+        possible = sum(weights.get(t, 0) for t in templates)
+        counted = [t for t in templates if weights.get(t, 0)]
+        total_points = sum(weights[t] for t in counted)
+        percent = (
+            sum(manual.get(t, 0) for t in counted) / total_points * 100
+            if total_points else None
+        )
+        return {"percent": percent, "earned": earned, "possible": possible}
+
+    total_weight = 0.0
+    weighted_sum = 0.0
+    passed = total = 0
+    for t in templates:
+        r = results.get(t)
+        if not r or not r["total"]:
+            continue
+        w = 1.0 if mode == "equal" else weights.get(t, 0)
+        total_weight += w
+        weighted_sum += w * (r["passed"] / r["total"])
+        passed += r["passed"]
+        total += r["total"]
+    percent = weighted_sum / total_weight * 100 if total_weight else None
+    return {"percent": percent, "earned": passed, "possible": total}
+
+
+class _Entry:
+    def __init__(self, built_at: float):
+        self.built_at = built_at
+        self.templates: list[str] = []
+        self.students: list[dict] = []  # {"id", "email", "name"}, sorted
+        self.results: dict[str, dict[str, dict]] = {}
+        self.mode = "equal"
+        self.weights: dict[str, float] = {}
+        self.manual: dict[str, dict[str, float]] = {}
+        self.body: bytes | None = None
+        self.etag = ""
+
+
+class GradebookCache:
+    """Per-classroom gradebooks, built lazily and patched on change."""
+
+    def __init__(self, max_age: float = GRADEBOOK_MAX_AGE, clock=time.monotonic):
+        self._max_age = max_age
+        self._clock = clock
+        self._entries: dict[str, _Entry] = {}
+        # Bumped on every change to a classroom; ``_epoch`` on changes that
+        # may touch any classroom (invalidate_user).
+        self._generations: dict[str, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def get(self, db: Session, classroom_id: str) -> tuple[bytes, str]:
+        """Return ``(json_body, etag)`` for the classroom's gradebook."""
+        with self._lock:
+            entry = self._entries.get(classroom_id)
+            if entry is not None and self._clock() - entry.built_at > self._max_age:
+                entry = None
+        for _ in range(_BUILD_ATTEMPTS):
+            if entry is not None:
+                break
+            with self._lock:
+                started = self._version(classroom_id)
+            built = self._build(db, classroom_id)
+            with self._lock:
+                if self._version(classroom_id) == started:
+                    self._entries[classroom_id] = entry = built
+        if entry is None:
+            # Changes kept landing mid-build: serve the last one uncached.
+            entry = built
+        with self._lock:
+            if entry.body is None:
+                entry.body = json.dumps(self._payload(entry), separators=(",", ":")).encode()
+                entry.etag = '"' + hashlib.sha256(entry.body).hexdigest()[:32] + '"'
+            return entry.body, entry.etag
+
+    def apply_results(self, classroom_id: str, rows) -> None:
+        """Patch ``(user_id, template_name, passed, total)`` cells."""
+        with self._lock:
+            entry = self._changed(classroom_id)
+            if entry is None:
+                return
+            for user_id, template_name, passed, total in rows:
+                entry.results.setdefault(user_id, {})[template_name] = {
+                    "passed": passed, "total": total,
+                }
+            entry.body = None
+
+    def set_grading(self, classroom_id: str, mode: str, weights: dict[str, float]) -> None:
+        with self._lock:
+            entry = self._changed(classroom_id)
+            if entry is None:
+                return
+            entry.mode = mode
+            entry.weights = dict(weights)
+            entry.body = None
+
+    def set_manual_score(
+        self, classroom_id: str, user_id: str, template_name: str, score: float,
+    ) -> None:
+        with self._lock:
+            entry = self._changed(classroom_id)
+            if entry is None:
+                return
+            entry.manual.setdefault(user_id, {})[template_name] = score
+            entry.body = None
+
+    def invalidate(self, classroom_id: str) -> None:
+        """Drop a classroom's gradebook; the next read rebuilds it."""
+        with self._lock:
+            self._changed(classroom_id)
+            self._entries.pop(classroom_id, None)
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Drop every gradebook listing *user_id* (e.g. their name changed)."""
+        with self._lock:
+            # A build in flight may list them too, whichever classroom it is.
+            self._epoch += 1
+            for cid in [
+                cid for cid, e in self._entries.items()
+                if any(s["id"] == user_id for s in e.students)
+            ]:
+                del self._entries[cid]
+
+    async def on_files_changed(self, user_id: str, paths: list[str] | None) -> None:
+        """Drop gradebooks whose assignment folders *paths* may have added,
+        removed or renamed. Edits inside an existing assignment do not
+        change the gradebook and are ignored."""
+        root = os.path.realpath(CLASSROOMS_ROOT)
+        for path in paths or []:
+            rel = os.path.relpath(os.path.realpath(path), root)
+            parts = rel.split(os.sep)
+            if rel.startswith(os.pardir) or len(parts) < 2 or parts[1] != "assignments":
+                continue
+            classroom_id = parts[0]
+            if len(parts) > 2:
+                with self._lock:
+                    entry = self._entries.get(classroom_id)
+                    listed = entry is not None and parts[2] in entry.templates
+                exists = os.path.isdir(os.path.join(root, classroom_id, "assignments", parts[2]))
+                if entry is not None and listed == exists:
+                    continue
+            self.invalidate(classroom_id)
+
+    def _changed(self, classroom_id: str) -> _Entry | None:
+        """Record a change to *classroom_id* and return its entry, if any.
+        Caller holds the lock."""
+        self._generations[classroom_id] = self._generations.get(classroom_id, 0) + 1
+        return self._entries.get(classroom_id)
+
+    def _version(self, classroom_id: str) -> tuple[int, int]:
+        return self._epoch, self._generations.get(classroom_id, 0)
+
+    def _build(self, db: Session, classroom_id: str) -> _Entry:
+        entry = _Entry(self._clock())
+        classroom = db.get(Classroom, classroom_id)
+        entry.mode = classroom.grading_mode if classroom else "equal"
+        entry.templates = list_assignments(classroom_id)
+
+        participant_ids = list(db.exec(
+            select(ClassroomMember.user_id).where(
+                ClassroomMember.classroom_id == classroom_id,
+                ClassroomMember.role == "participant",
+            )
+        ).all())
+        user_map = {}
+        if participant_ids:
+            user_map = {
+                uid: (email, name)
+                for uid, email, name in db.exec(
+                    select(User.id, User.email, User.name).where(User.id.in_(participant_ids))
+                ).all()
+            }
+        for pid in participant_ids:
+            email, name = user_map.get(pid, (pid, pid))
+            entry.students.append({"id": pid, "email": email, "name": name})
+        entry.students.sort(key=lambda p: (p["name"] or p["email"] or "").lower())
+
+        # Only the score columns: the stored output can be large.
+        for uid, tmpl, passed, total in db.exec(
+            select(
+                TestResult.user_id,
+                TestResult.template_name,
+                TestResult.tests_passed,
+                TestResult.tests_total,
+            ).where(TestResult.classroom_id == classroom_id)
+        ).all():
+            entry.results.setdefault(uid, {})[tmpl] = {"passed": passed, "total": total}
+
+        entry.weights = {
+            t: w
+            for t, w in db.exec(
+                select(AssignmentWeight.template_name, AssignmentWeight.weight).where(
+                    AssignmentWeight.classroom_id == classroom_id
+                )
+            ).all()
+        }
+        for uid, tmpl, score in db.exec(
+            select(ManualScore.user_id, ManualScore.template_name, ManualScore.score).where(
+                ManualScore.classroom_id == classroom_id
+            )
+        ).all():
+            entry.manual.setdefault(uid, {})[tmpl] = score
+        return entry
+
+    @staticmethod
+    def _payload(entry: _Entry) -> dict:
+        students = []
+        for s in entry.students:
+            results = entry.results.get(s["id"], {})
+            manual = entry.manual.get(s["id"], {})
+            students.append({
+                **s,
+                "results": {
+                    t: results.get(t, {"passed": 0, "total": 0}) for t in entry.templates
+                },
+                "manual_scores": {t: manual[t] for t in entry.templates if t in manual},
+                "grade": student_grade(
+                    entry.templates, results, entry.mode, entry.weights, manual,
+                ),
+            })
+        return {
+            "students": students,
+            "templates": entry.templates,
+            "grading_mode": entry.mode,
+            "weights": entry.weights,
+        }
+
+
+_gradebooks: GradebookCache | None = None
+
+
+def get_gradebooks() -> GradebookCache:
+    """Return the process-wide gradebook cache, creating it on first use."""
+    global _gradebooks
+    if _gradebooks is None:
+        _gradebooks = GradebookCache()
+    return _gradebooks
+
+
+__all__ = [
+    "GradebookCache",
+    "get_gradebooks",
+    "list_assignments",
+    "student_grade",
+]
@@ -0,0 +1,369 @@
+"""Persisting grading results, batch runs, and opt-in background auto-grading.
+
+A teacher's "Run tests" starts a batch run that grades in the background;
+the request returns once every job is queued and the classroom page polls
+``/grading-runs`` for progress, refreshing the gradebook as results land.
+
+When a classroom has ``auto_grade`` enabled, every API write under
+``participants/{email}/{template}/`` (re)starts a short debounce timer for
+that (classroom, student, template). When the timer fires, one low-priority
+job goes through the shared grading queue and its result is stored, so the
+``/progress`` gradebook stays current without bulk re-runs. A burst of saves
+collapses into a single grading run.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from sqlalchemy import delete, event, insert
+from sqlmodel import Session, select
+
+from backend.docker import CLASSROOMS_ROOT
+from backend.grading_queue import PRIORITY_BACKGROUND, get_grading_scheduler
+from backend.test_runner import GradingOutcome, grade_student
+
+from .database import (
+    Classroom,
+    TestCaseResult,
+    TestResult,
+    User,
+    upsert,
+)
+from .gradebook import get_gradebooks
+from .offload import run_db, run_fs
+from .terminal import add_files_changed_listener
+
+logger = logging.getLogger("grading")
+
+# Cap on how much raw test output is kept per TestResult row.
+STORED_OUTPUT_MAX = 64 * 1024
+# Caps on per-test rows kept per TestResult, and on each row's message.
+MAX_STORED_CASES = 2000
+STORED_MESSAGE_MAX = 2000
+
+# Seconds of quiet after the last save before a student is re-graded.
+AUTO_GRADE_DEBOUNCE = 10.0
+
+
+def previous_outcome(
+    row: TestResult | None,
+    cases: list[TestCaseResult] | None = None,
+) -> GradingOutcome | None:
+    """Stored result as a GradingOutcome the runner can reuse, or None.
+
+    Pass the row's *cases* when the per-test records are needed (a "failed
+    only" re-run); a fingerprint hit doesn't need them."""
+    if row is None:
+        return None
+    try:
+        file_scores = json.loads(row.file_scores) if row.file_scores else {}
+    except ValueError:
+        file_scores = {}
+    return GradingOutcome(
+        passed=row.tests_passed,
+        total=row.tests_total,
+        output=row.output or "",
+        fingerprint=row.fingerprint or "",
+        tests=[
+            {"file": c.file, "test_id": c.test_id, "outcome": c.outcome, "message": c.message or ""}
+            for c in cases or []
+        ],
+        file_scores=file_scores,
+        tests_fingerprint=row.tests_fingerprint or "",
+    )
+
+
+def load_cases(db: Session, rows: list[TestResult]) -> dict[int, list[TestCaseResult]]:
+    """Per-test records for *rows*, keyed by test_result id, in one query."""
+    ids = [r.id for r in rows if r is not None and r.id is not None]
+    cases: dict[int, list[TestCaseResult]] = {i: [] for i in ids}
+    if ids:
+        for c in db.exec(
+            select(TestCaseResult)
+            .where(TestCaseResult.test_result_id.in_(ids))
+            .order_by(TestCaseResult.id)
+        ).all():
+            cases[c.test_result_id].append(c)
+    return cases
+
+
+def store_outcomes(
+    db: Session,
+    classroom_id: str,
+    results: list[tuple[str, str, GradingOutcome]],
+) -> None:
+    """Upsert ``(user_id, template_name, outcome)`` results and their
+    per-test rows in a handful of statements (caller commits; the cached
+    gradebook is patched when it does). Cached
+    outcomes are skipped and keep their original ``last_run`` — nothing was
+    actually re-run."""
+    fresh = {
+        (user_id, template_name): outcome
+        for user_id, template_name, outcome in results
+        if not outcome.cached
+    }
+    if not fresh:
+        return
+    now = datetime.utcnow()
+    written = upsert(
+        db,
+        TestResult,
+        [
+            {
+                "classroom_id": classroom_id,
+                "user_id": user_id,
+                "template_name": template_name,
+                "tests_passed": outcome.passed,
+                "tests_total": outcome.total,
+                "last_run": now,
+                "fingerprint": outcome.fingerprint or None,
+                "output": outcome.output[-STORED_OUTPUT_MAX:],
+                "tests_fingerprint": outcome.tests_fingerprint or None,
+                "file_scores": json.dumps(outcome.file_scores) if outcome.file_scores else None,
+            }
+            for (user_id, template_name), outcome in fresh.items()
+        ],
+        keys=("classroom_id", "user_id", "template_name"),
+        returning=("id", "user_id", "template_name"),
+    )
+    ids = {(user_id, template_name): row_id for row_id, user_id, template_name in written}
+    cells = [
+        (user_id, template_name, outcome.passed, outcome.total)
+        for (user_id, template_name), outcome in fresh.items()
+    ]
+    # Patch the gradebook once the rows are visible: a rebuild before the
+    # commit would read, and cache, the old scores.
+    event.listen(
+        db, "after_commit",
+        lambda _session: get_gradebooks().apply_results(classroom_id, cells),
+        once=True,
+    )
+
+    db.execute(delete(TestCaseResult).where(TestCaseResult.test_result_id.in_(ids.values())))
+    cases = [
+        {
+            "test_result_id": ids[key],
+            "classroom_id": classroom_id,
+            "user_id": key[0],
+            "file": t["file"],
+            "test_id": t["test_id"][:500],
+            "outcome": t["outcome"],
+            "message": (t.get("message") or "")[:STORED_MESSAGE_MAX] or None,
+        }
+        for key, outcome in fresh.items()
+        for t in outcome.tests[:MAX_STORED_CASES]
+    ]
+    if cases:
+        db.execute(insert(TestCaseResult), cases)
+
+
+def store_outcome(
+    db: Session,
+    classroom_id: str,
+    user_id: str,
+    template_name: str,
+    outcome: GradingOutcome,
+) -> None:
+    """Upsert a single result; see ``store_outcomes``."""
+    store_outcomes(db, classroom_id, [(user_id, template_name, outcome)])
+
+
+def _assignment_for_path(path: str) -> tuple[str, str, str] | None:
+    """Map a host path to ``(classroom_id, participant_dir_name, template)``
+    if it lies inside a participant's copy of an assignment."""
+    try:
+        rel = os.path.relpath(os.path.normpath(path), CLASSROOMS_ROOT)
+    except ValueError:
+        return None
+    parts = rel.split(os.sep)
+    if len(parts) < 4 or parts[0] in ("..", ".") or parts[1] != "participants":
+        return None
+    template = parts[3]
+    if not template or template.startswith("."):
+        return None
+    return parts[0], parts[2], template
+
+
+class AutoGrader:
+    """Debounces file-change notifications into background grading jobs."""
+
+    def __init__(self, engine, debounce: float = AUTO_GRADE_DEBOUNCE):
+        self._engine = engine
+        self._debounce = debounce
+        self._timers: dict[tuple[str, str, str], asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def on_files_changed(self, user_id: str, paths: list[str] | None) -> None:
+        if not paths:
+            return
+        keys = {k for k in map(_assignment_for_path, paths) if k is not None}
+        if not keys:
+            return
+        enabled = await run_db(self._auto_graded, {cid for cid, _e, _t in keys})
+        for key in keys:
+            if key[0] in enabled:
+                self._schedule(key)
+
+    def _schedule(self, key: tuple[str, str, str]) -> None:
+        loop = asyncio.get_running_loop()
+        handle = self._timers.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        self._timers[key] = loop.call_later(self._debounce, self._fire, key)
+
+    def _fire(self, key: tuple[str, str, str]) -> None:
+        self._timers.pop(key, None)
+        task = asyncio.get_running_loop().create_task(self._grade(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _grade(self, key: tuple[str, str, str]) -> None:
+        classroom_id, email, template_name = key
+        if not await run_fs(
+            os.path.isdir,
+            os.path.join(CLASSROOMS_ROOT, classroom_id, "assignments", template_name),
+        ):
+            return  # not a published assignment
+
+        inputs = await run_db(self._grading_inputs, classroom_id, email, template_name)
+        if inputs is None:
+            return
+        student_id, previous = inputs
+
+        try:
+            outcome = await asyncio.wrap_future(get_grading_scheduler().submit(
+                classroom_id,
+                grade_student,
+                classroom_id, template_name, email, previous,
+                priority=PRIORITY_BACKGROUND,
+                key=(classroom_id, template_name, email),
+            ))
+        except Exception:
+            logger.exception("Auto-grade failed for %s", key)
+            return
+        if outcome.cached:
+            return
+        await run_db(self._store, classroom_id, student_id, template_name, outcome)
+
+    def _auto_graded(self, classroom_ids: set[str]) -> set[str]:
+        """Those of *classroom_ids* with auto-grading turned on."""
+        with Session(self._engine) as db:
+            return set(db.exec(
+                select(Classroom.id).where(
+                    Classroom.id.in_(classroom_ids),
+                    Classroom.auto_grade == True,  # noqa: E712
+                )
+            ).all())
+
+    def _grading_inputs(
+        self, classroom_id: str, email: str, template_name: str,
+    ) -> tuple[str, GradingOutcome | None] | None:
+        """``(student_id, previous)`` for a job, or None if it should not run."""
+        with Session(self._engine) as db:
+            classroom = db.get(Classroom, classroom_id)
+            student = db.exec(select(User).where(User.email == email)).first()
+            if not classroom or not classroom.auto_grade or not student:
+                return None
+            student_id = str(student.id)
+            return student_id, previous_outcome(db.exec(
+                select(TestResult).where(
+                    TestResult.classroom_id == classroom_id,
+                    TestResult.user_id == student_id,
+                    TestResult.template_name == template_name,
+                )
+            ).first())
+
+    def _store(
+        self, classroom_id: str, student_id: str, template_name: str, outcome: GradingOutcome,
+    ) -> None:
+        with Session(self._engine) as db:
+            store_outcome(db, classroom_id, student_id, template_name, outcome)
+            db.commit()
+
+
+class GradingRuns:
+    """Batch grading runs in flight, kept for the classroom page to poll."""
+
+    def __init__(self):
+        self._active: dict[str, dict] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(
+        self,
+        classroom_id: str,
+        count: int,
+        work: Callable[[dict], Awaitable[None]],
+    ) -> dict:
+        """Run ``work(run)`` in the background. *work* bumps
+        ``run["completed"]`` as results are stored."""
+        run = {
+            "run_id": secrets.token_hex(8),
+            "classroom_id": classroom_id,
+            "completed": 0,
+            "count": count,
+            "started_at": time.time(),
+        }
+        self._active[run["run_id"]] = run
+        task = asyncio.get_running_loop().create_task(self._run(run, work))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return run
+
+    def runs_for(self, classroom_id: str) -> list[dict]:
+        """Progress of the running batches for *classroom_id*."""
+        return [
+            {k: r[k] for k in ("run_id", "completed", "count", "started_at")}
+            for r in self._active.values()
+            if r["classroom_id"] == classroom_id
+        ]
+
+    async def wait(self) -> None:
+        """Wait for every running batch (used by tests)."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _run(self, run: dict, work: Callable[[dict], Awaitable[None]]) -> None:
+        try:
+            await work(run)
+        except Exception:
+            logger.exception(
+                "Grading run %s failed in classroom %s", run["run_id"], run["classroom_id"],
+            )
+        finally:
+            self._active.pop(run["run_id"], None)
+
+
+_grading_runs: GradingRuns | None = None
+
+
+def get_grading_runs() -> GradingRuns:
+    """Return the process-wide batch run registry, creating it on first use."""
+    global _grading_runs
+    if _grading_runs is None:
+        _grading_runs = GradingRuns()
+    return _grading_runs
+
+
+def install_auto_grader(engine) -> AutoGrader:
+    """Create the auto-grader and subscribe it to file-change notifications."""
+    grader = AutoGrader(engine)
+    add_files_changed_listener(grader.on_files_changed)
+    return grader
+
+
+__all__ = [
+    "AutoGrader",
+    "GradingRuns",
+    "get_grading_runs",
+    "install_auto_grader",
+    "load_cases",
+    "previous_outcome",
+    "store_outcome",
+    "store_outcomes",
+]
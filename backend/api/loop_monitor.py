@@ -0,0 +1,218 @@
+"""Event-loop lag sampling and slow-callback capture.
+
+Everything interactive (terminal output, sockets, every async route) shares
+one event loop, so a callback that runs for 300 ms is 300 ms of frozen
+terminals. ``LoopMonitor`` measures that two ways:
+
+* a sampler task sleeps ``LOOP_SAMPLE_INTERVAL`` and records how late it
+  woke up into a fixed-bucket histogram;
+* a watchdog thread notices when the sampler has not run for
+  ``LOOP_SLOW_MS`` and grabs the loop thread's stack while it is still
+  stuck, so the report names the code that blocked rather than the code
+  that happened to run next. Captures are rate-limited to one per
+  ``LOOP_STACK_COOLDOWN`` seconds; stalls in between are only counted.
+
+The process-wide monitor is started by ``install_loop_monitor`` and
+reported in ``/api/admin/stats``. Tests use a ``LoopMonitor`` directly as
+an async context manager to assert a code path never stalls the loop.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+logger = logging.getLogger("loop_monitor")
+
+LOOP_MONITOR_ENABLED = os.environ.get("LOOP_MONITOR", "1") != "0"
+LOOP_SAMPLE_INTERVAL = float(os.environ.get("LOOP_SAMPLE_INTERVAL", "0.05"))
+LOOP_SLOW_MS = float(os.environ.get("LOOP_SLOW_MS", "100"))
+LOOP_STACK_COOLDOWN = float(os.environ.get("LOOP_STACK_COOLDOWN", "10"))
+LOOP_STACK_DEPTH = 30
+
+# Upper bounds (ms) of the lag histogram buckets; the last bucket is open.
+LAG_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+_KEPT_CAPTURES = 20
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = LOOP_SAMPLE_INTERVAL,
+        slow_ms: float = LOOP_SLOW_MS,
+        cooldown: float = LOOP_STACK_COOLDOWN,
+    ):
+        self.interval = interval
+        self.slow_ms = slow_ms
+        self.cooldown = cooldown
+        self.samples = 0
+        self.max_lag_ms = 0.0
+        self._lag_sum_ms = 0.0
+        self._buckets = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.stalls = 0
+        self.suppressed = 0
+        self.captures: deque[dict] = deque(maxlen=_KEPT_CAPTURES)
+        self._lock = threading.Lock()
+        self._beat = time.monotonic()
+        self._pending: dict | None = None
+        self._last_capture = float("-inf")
+        self._loop_thread: int | None = None
+        self._task: asyncio.Task | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopping = threading.Event()
+
+    # -- lifecycle ----------------------------------------------------------
+
+    def start(self) -> None:
+        """Start sampling the running loop (call from the loop's thread)."""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.get_running_loop().create_task(self._sample())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True,
+        )
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def __aenter__(self) -> "LoopMonitor":
+        self.start()
+        # Let the sampler take its first timestamp before the caller blocks.
+        await asyncio.sleep(0)
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        # One more tick so a stall right at the end is sampled too.
+        await asyncio.sleep(self.interval)
+        await self.stop()
+
+    # -- sampler (loop thread) -------------------------------------------------
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._record(max(0.0, loop.time() - expected) * 1000)
+
+    def _record(self, lag_ms: float) -> None:
+        with self._lock:
+            self.samples += 1
+            self._lag_sum_ms += lag_ms
+            self.max_lag_ms = max(self.max_lag_ms, lag_ms)
+            for i, bound in enumerate(LAG_BUCKETS_MS):
+                if lag_ms <= bound:
+                    self._buckets[i] += 1
+                    break
+            else:
+                self._buckets[-1] += 1
+            if self._pending is not None:
+                # The stall the watchdog caught has ended; now we know how long.
+                self._pending["blocked_ms"] = round(lag_ms, 1)
+                self._pending = None
+
+    # -- watchdog (own thread) ---------------------------------------------
+
+    def _watch(self) -> None:
+        slow = self.slow_ms / 1000
+        seen_beat = None
+        while not self._stopping.wait(min(slow / 4, 0.05)):
+            beat = self._beat
+            if beat == seen_beat or time.monotonic() - beat < slow + self.interval:
+                continue
+            seen_beat = beat  # one report per stall
+            self._on_stall(beat)
+
+    def _on_stall(self, since: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.stalls += 1
+            if now - self._last_capture < self.cooldown:
+                self.suppressed += 1
+                return
+            self._last_capture = now
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.format_stack(frame, limit=LOOP_STACK_DEPTH) if frame else []
+        capture = {
+            "at": time.time(),
+            "blocked_ms": round((now - since - self.interval) * 1000, 1),
+            "stack": "".join(stack),
+        }
+        with self._lock:
+            self.captures.append(capture)
+            self._pending = capture
+        logger.warning(
+            "Event loop blocked for more than %.0f ms in:\n%s", self.slow_ms, capture["stack"],
+        )
+
+    # -- reporting ----------------------------------------------------------
+
+    def _percentile(self, q: float) -> float | None:
+        if not self.samples:
+            return None
+        rank = q * self.samples
+        seen = 0
+        for bound, count in zip((*LAG_BUCKETS_MS, None), self._buckets):
+            seen += count
+            if seen >= rank:
+                return bound if bound is not None else round(self.max_lag_ms, 1)
+        return round(self.max_lag_ms, 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            labels = [f"le_{b}" for b in LAG_BUCKETS_MS] + ["inf"]
+            return {
+                "interval_ms": round(self.interval * 1000),
+                "slow_ms": self.slow_ms,
+                "samples": self.samples,
+                "lag_ms": {
+                    "mean": round(self._lag_sum_ms / self.samples, 2) if self.samples else None,
+                    "p50": self._percentile(0.5),
+                    "p99": self._percentile(0.99),
+                    "max": round(self.max_lag_ms, 1),
+                },
+                "histogram": dict(zip(labels, self._buckets)),
+                "stalls": self.stalls,
+                "stacks_suppressed": self.suppressed,
+                "slow_callbacks": list(self.captures),
+            }
+
+
+_loop_monitor: LoopMonitor | None = None
+
+
+def install_loop_monitor() -> LoopMonitor | None:
+    """Start the process-wide monitor on the running loop. Returns None when
+    ``LOOP_MONITOR=0``."""
+    global _loop_monitor
+    if _loop_monitor is None and LOOP_MONITOR_ENABLED:
+        _loop_monitor = LoopMonitor()
+        _loop_monitor.start()
+    return _loop_monitor
+
+
+def get_loop_monitor() -> LoopMonitor | None:
+    """Return the installed monitor, if any."""
+    return _loop_monitor
+
+
+__all__ = ["LAG_BUCKETS_MS", "LoopMonitor", "get_loop_monitor", "install_loop_monitor"]
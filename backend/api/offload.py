@@ -0,0 +1,76 @@
+"""Thread pools for blocking work done on behalf of async routes.
+
+The API is one uvicorn process whose event loop also drives every terminal
+stream and socket, so a handler that walks, copies or deletes a tree inline
+freezes all of them for as long as it takes. Routes hand that work to
+``run_fs`` (filesystem) or ``run_db`` (SQLModel queries) instead. The two
+pools are separate and bounded: a burst of large deletes queues behind
+``FS_WORKERS`` threads without starving database access, and neither pool
+grows without limit.
+
+A request's Session is only ever used by one thread at a time (the route
+awaits each ``run_db`` call), which is all SQLite's file-backed engine
+needs.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+FS_WORKERS = int(os.environ.get("FS_WORKERS", "8"))
+DB_WORKERS = int(os.environ.get("DB_WORKERS", "4"))
+
+_executors: dict[str, ThreadPoolExecutor] = {}
+_lock = threading.Lock()
+
+
+def _executor(kind: str, workers: int) -> ThreadPoolExecutor:
+    with _lock:
+        executor = _executors.get(kind)
+        if executor is None:
+            executor = _executors[kind] = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=f"{kind}-offload",
+            )
+        return executor
+
+
+async def _run(kind: str, workers: int, fn: Callable[..., T], args, kwargs) -> T:
+    loop = asyncio.get_running_loop()
+    call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+    return await loop.run_in_executor(_executor(kind, workers), call)
+
+
+async def run_fs(fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """Run blocking filesystem work *fn(*args, **kwargs)* on the FS pool."""
+    return await _run("fs", FS_WORKERS, fn, args, kwargs)
+
+
+async def run_db(fn: Callable[..., T], /, *args: Any, **kwargs: Any) -> T:
+    """Run blocking database work *fn(*args, **kwargs)* on the DB pool."""
+    return await _run("db", DB_WORKERS, fn, args, kwargs)
+
+
+def offload_stats() -> dict:
+    """Queue depth per pool, for /api/admin/stats."""
+    with _lock:
+        return {
+            kind: {"workers": ex._max_workers, "queued": ex._work_queue.qsize()}
+            for kind, ex in _executors.items()
+        }
+
+
+def shutdown_offload() -> None:
+    with _lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for ex in executors:
+        ex.shutdown(wait=False, cancel_futures=True)
+
+
+__all__ = ["offload_stats", "run_db", "run_fs", "shutdown_offload"]
@@ -0,0 +1,191 @@
+"""Background jobs that copy a published assignment to its participants.
+
+Publishing returns as soon as the assignment itself is in place; copying it
+into every participant's workspace runs as a job on the fan-out pool, and
+the classroom page polls ``jobs_for`` (``/classrooms/{id}/publish-jobs``)
+for its progress. Finished jobs stay listed, flagged ``finished``, for
+``PUBLISH_FINISHED_TTL`` seconds so the page sees the final count. Each job
+is journaled to ``PUBLISH_JOBS_DIR`` before it starts and the journal is
+removed once it finishes, so jobs cut short by a restart are picked up again
+by ``install_publish_jobs``. Copies are renamed into place whole, which is
+what makes a re-run safe: students whose copy already exists are skipped,
+not copied twice.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+
+from backend.docker import CLASSROOMS_ROOT
+
+from .fanout import FanoutResult, fan_out
+from .gradebook import get_gradebooks
+from .offload import run_fs
+from .terminal import notify_files_changed
+
+logger = logging.getLogger("publish")
+
+PUBLISH_JOBS_DIR = os.environ.get(
+    "PUBLISH_JOBS_DIR",
+    os.path.join(os.path.dirname(CLASSROOMS_ROOT.rstrip("/")), "publish-jobs"),
+)
+PUBLISH_FINISHED_TTL = 300.0
+
+
+class PublishJobs:
+    def __init__(self, root: str = PUBLISH_JOBS_DIR, clock=time.monotonic):
+        self.root = root
+        self._clock = clock
+        self._active: dict[str, dict] = {}
+        self._finished: dict[str, dict] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def start(
+        self,
+        classroom_id: str,
+        template_name: str,
+        src: str,
+        targets: list[tuple[str, str]],
+        modes: dict | None = None,
+    ) -> dict:
+        """Journal and start a job copying *src* to each ``(user_id, dest)``;
+        *modes* are passed through to ``clone_tree``."""
+        job = {
+            "id": secrets.token_hex(8),
+            "classroom_id": classroom_id,
+            "template_name": template_name,
+            "src": src,
+            "targets": [list(t) for t in targets],
+            "modes": modes or {},
+            "created_at": time.time(),
+        }
+        await run_fs(self._save, job)
+        self._spawn(job)
+        return job
+
+    def resume(self) -> int:
+        """Restart every journaled job; returns how many."""
+        try:
+            names = sorted(os.listdir(self.root))
+        except FileNotFoundError:
+            return 0
+        resumed = 0
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.root, name)) as fh:
+                    job = json.load(fh)
+            except (OSError, ValueError) as e:
+                logger.warning("Dropping unreadable publish job %s: %s", name, e)
+                self._discard(name[:-len(".json")])
+                continue
+            if job.get("id") in self._active:
+                continue
+            logger.info(
+                "Resuming publish of %s/%s to %d participants",
+                job["classroom_id"], job["template_name"], len(job["targets"]),
+            )
+            self._spawn(job)
+            resumed += 1
+        return resumed
+
+    def jobs_for(self, classroom_id: str) -> list[dict]:
+        """Progress of the running jobs for *classroom_id*, and of those
+        finished in the last PUBLISH_FINISHED_TTL seconds."""
+        cutoff = self._clock() - PUBLISH_FINISHED_TTL
+        for job_id in [k for k, j in self._finished.items() if j["finished_at"] < cutoff]:
+            del self._finished[job_id]
+        jobs = [*self._active.values(), *self._finished.values()]
+        return [self._view(j) for j in jobs if j["classroom_id"] == classroom_id]
+
+    async def wait(self) -> None:
+        """Wait for every running job (used by tests)."""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def _spawn(self, job: dict) -> None:
+        job["done"] = 0
+        job["failed"] = 0
+        self._active[job["id"]] = job
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: dict) -> None:
+        async def progress(result: FanoutResult) -> None:
+            job["done"] += 1
+            if result.error:
+                job["failed"] += 1
+            elif not result.skipped:
+                await notify_files_changed(result.key)
+
+        try:
+            if await run_fs(os.path.isdir, job["src"]):
+                await fan_out(
+                    job["src"], [tuple(t) for t in job["targets"]],
+                    on_result=progress, **job["modes"],
+                )
+            else:
+                logger.warning("Publish source is gone, dropping job: %s", job["src"])
+        except Exception:
+            # Keep the journal; the next start retries the students not done.
+            logger.exception("Publish job %s failed", job["id"])
+            self._active.pop(job["id"], None)
+            return
+        await run_fs(self._discard, job["id"])
+        get_gradebooks().invalidate(job["classroom_id"])
+        job["finished_at"] = self._clock()
+        self._finished[job["id"]] = job
+        self._active.pop(job["id"], None)
+
+    @staticmethod
+    def _view(job: dict) -> dict:
+        return {
+            "job_id": job["id"],
+            "template_name": job["template_name"],
+            "done": job["done"],
+            "failed": job["failed"],
+            "total": len(job["targets"]),
+            "finished": "finished_at" in job,
+        }
+
+    def _journal_path(self, job_id: str) -> str:
+        return os.path.join(self.root, f"{job_id}.json")
+
+    def _save(self, job: dict) -> None:
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        tmp = self._journal_path(job["id"]) + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump(job, fh)
+        os.replace(tmp, self._journal_path(job["id"]))
+
+    def _discard(self, job_id: str) -> None:
+        try:
+            os.remove(self._journal_path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+_publish_jobs: PublishJobs | None = None
+
+
+def get_publish_jobs() -> PublishJobs:
+    """Return the process-wide job runner, creating it on first use."""
+    global _publish_jobs
+    if _publish_jobs is None:
+        _publish_jobs = PublishJobs()
+    return _publish_jobs
+
+
+def install_publish_jobs() -> PublishJobs:
+    """Resume publish jobs interrupted by the last shutdown."""
+    jobs = get_publish_jobs()
+    jobs.resume()
+    return jobs
+
+
+__all__ = ["PublishJobs", "get_publish_jobs", "install_publish_jobs"]
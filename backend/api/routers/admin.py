@@ -17,7 +17,9 @@ from sqlmodel import Session, select
 
 from pydantic import BaseModel
 
-from backend.docker import CLASSROOMS_ROOT, UPLOADS_ROOT
+from backend.docker import CLASSROOMS_ROOT, UPLOADS_ROOT, get_grading_pool
+from backend.grading_queue import get_grading_scheduler
+from backend.test_runner import precheck_stats
 
 from ..database import (
     AccessRequest,
@@ -29,10 +31,17 @@ from ..database import (
     PortSubdomain,
     SignupCode,
     Template,
+    TestCaseResult,
     TestResult,
     User,
 )
 from ..dependencies import get_current_user, get_db
+from ..file_index import get_file_index
+from ..fs_watcher import get_fs_watcher
+from ..gradebook import get_gradebooks
+from ..loop_monitor import get_loop_monitor
+from ..offload import offload_stats
+from ..search_index import get_search_indexes
 
 logger = logging.getLogger("admin")
 
@@ -201,6 +210,18 @@ async def stats(
             "active_24h": active_24h,
         },
         "containers": containers,
+        "grading": {
+            **get_grading_scheduler().stats(),
+            "sandbox_pool": get_grading_pool().stats(),
+            "syntax_precheck": precheck_stats(),
+        },
+        "file_index": get_file_index().stats(),
+        "search_index": get_search_indexes().stats(),
+        "fs_watch": get_fs_watcher().stats() if get_fs_watcher() else None,
+        "event_loop": {
+            "monitor": get_loop_monitor().stats() if get_loop_monitor() else None,
+            "offload": offload_stats(),
+        },
         "classrooms": {
             "total": total_classrooms,
             "memberships": total_memberships,
@@ -610,7 +631,7 @@ async def delete_user(
         )
 
     # Cascade-delete per-user rows.
-    for model in (ClassroomMember, TestResult, ManualScore, PortSubdomain):
+    for model in (ClassroomMember, TestCaseResult, TestResult, ManualScore, PortSubdomain):
         for row in db.exec(select(model).where(model.user_id == target.id)).all():
             db.delete(row)
 
@@ -642,6 +663,7 @@ async def delete_user(
     email = target.email
     db.delete(target)
     db.commit()
+    get_gradebooks().invalidate_user(user_id)
 
     # External cleanup after the DB commit succeeds — safer to leave files
     # behind than to delete them and roll back.
@@ -730,6 +752,7 @@ async def delete_classroom_admin(
         ClassroomMember,
         AssignmentWeight,
         Template,
+        TestCaseResult,
         TestResult,
         ManualScore,
     ):
@@ -740,6 +763,7 @@ async def delete_classroom_admin(
 
     db.delete(classroom)
     db.commit()
+    get_gradebooks().invalidate(classroom_id)
 
     base = os.path.join(CLASSROOMS_ROOT, classroom_id)
     if os.path.isdir(base):
@@ -11,6 +11,7 @@ from sqlalchemy import func
 
 from ..database import User
 from ..dependencies import get_db, get_optional_user
+from ..gradebook import get_gradebooks
 
 logger = logging.getLogger("auth")
 router = APIRouter()
@@ -121,10 +122,13 @@ async def callback(request: Request, db: Session = Depends(get_db)):
     existing = db.get(User, google_id)
     if existing:
         existing.last_login = datetime.utcnow()
+        name_changed = existing.name != name
         existing.name = name
         existing.avatar_url = avatar
         db.add(existing)
         db.commit()
+        if name_changed:
+            get_gradebooks().invalidate_user(google_id)
         request.session["user_id"] = google_id
         return RedirectResponse(url=f"{settings.frontend_origin}/ide")
 
@@ -6,20 +6,39 @@ import shutil
 import string
 import subprocess
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, Response, UploadFile
 from pydantic import BaseModel
 from sqlmodel import Session, select
 
 from backend.docker import (
     CLASSROOMS_ROOT,
-    CONTAINER_USER_GID,
-    CONTAINER_USER_UID,
     container_exists,
     spawn_container,
 )
-
-from ..database import AssignmentWeight, Classroom, ClassroomMember, ManualScore, TestResult, User
+from backend.ownership import normalize_paths, normalize_tree
+
+from ..database import (
+    AssignmentWeight,
+    Classroom,
+    ClassroomMember,
+    ManualScore,
+    TestCaseResult,
+    TestResult,
+    User,
+    upsert,
+)
 from ..dependencies import get_db, get_onboarded_user, require_teacher
+from ..fanout import clone_tree
+from ..gradebook import get_gradebooks, list_assignments
+from ..grading import (
+    get_grading_runs,
+    load_cases,
+    previous_outcome,
+    store_outcome,
+    store_outcomes,
+)
+from ..offload import run_db, run_fs
+from ..publish import get_publish_jobs
 from ..terminal import notify_files_changed
 
 try:
@@ -62,20 +81,8 @@ def _ensure_classroom_dirs(classroom_id: str) -> str:
     os.makedirs(templates_dir, exist_ok=True)
     os.makedirs(participants_dir, exist_ok=True)
     os.makedirs(drafts_dir, exist_ok=True)
-    try:
-        for root, dirs, files in os.walk(base):
-            os.chown(root, os.getuid(), CONTAINER_USER_GID)
-            os.chmod(root, 0o2775)
-            for d in dirs:
-                p = os.path.join(root, d)
-                os.chown(p, os.getuid(), CONTAINER_USER_GID)
-                os.chmod(p, 0o2775)
-            for f in files:
-                fp = os.path.join(root, f)
-                os.chown(fp, os.getuid(), CONTAINER_USER_GID)
-                os.chmod(fp, 0o664)
-    except PermissionError as e:
-        logger.warning(f"Failed chown classroom dir {base}: {e}")
+    if normalize_tree(base, uid=os.getuid()).errors:
+        logger.warning(f"Failed chown classroom dir {base}")
     return base
 
 
@@ -100,20 +107,7 @@ def _populate_templates_for_participant(
         if not os.path.isdir(src) or os.path.exists(dst):
             continue
         try:
-            shutil.copytree(src, dst)
-            for dirpath, _dirnames, filenames in os.walk(dst):
-                try:
-                    os.chown(dirpath, CONTAINER_USER_UID, CONTAINER_USER_GID)
-                    os.chmod(dirpath, 0o775)
-                except OSError:
-                    pass
-                for fn in filenames:
-                    try:
-                        fp = os.path.join(dirpath, fn)
-                        os.chown(fp, CONTAINER_USER_UID, CONTAINER_USER_GID)
-                        os.chmod(fp, 0o664)
-                    except OSError:
-                        pass
+            clone_tree(src, dst, dir_mode=0o775, file_mode=0o664)
         except Exception as e:
             logger.warning(
                 "Failed to copy template %s for %s: %s", entry, sanitized, e
@@ -149,6 +143,7 @@ def _classroom_to_dict(
         "archived_by": archived_by,
         "joins_paused": getattr(classroom, "joins_paused", False),
         "grading_mode": getattr(classroom, "grading_mode", "equal"),
+        "auto_grade": getattr(classroom, "auto_grade", False),
     }
 
 
@@ -216,6 +211,7 @@ class UpdateClassroomRequest(BaseModel):
     name: str | None = None
     joins_paused: bool | None = None
     grading_mode: str | None = None  # "equal", "weighted", "manual"
+    auto_grade: bool | None = None
 
 
 class ArchiveClassroomRequest(BaseModel):
@@ -241,8 +237,11 @@ async def list_classrooms(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    user_id = str(user.id)
+    return await run_db(_classroom_lists, db, str(user.id))
+
 
+def _classroom_lists(db: Session, user_id: str) -> dict:
+    """The caller's classrooms, split by role and archived state."""
     memberships = db.exec(
         select(ClassroomMember).where(ClassroomMember.user_id == user_id)
     ).all()
@@ -351,12 +350,12 @@ async def create_classroom(
         db.commit()
 
         try:
-            _ensure_classroom_dirs(classroom.id)
+            await run_fs(_ensure_classroom_dirs, classroom.id)
         except Exception as e:
             logger.error(f"Failed to ensure classroom dirs for {classroom.id}: {e}")
 
         port_range = _get_user_port_range(user)
-        restarted = _restart_user_container(user.id, user.email, port_range)
+        restarted = await run_fs(_restart_user_container, user.id, user.email, port_range)
 
         logger.info(f"Created classroom {classroom.id} by user {user.id}")
         return {
@@ -436,12 +435,13 @@ async def join_classroom(
         )
         db.add(member)
         db.commit()
+        get_gradebooks().invalidate(classroom.id)
 
         port_range = _get_user_port_range(user)
-        restarted = _restart_user_container(user.id, user.email, port_range)
+        restarted = await run_fs(_restart_user_container, user.id, user.email, port_range)
 
         # Populate existing assignments into the new participant's workspace
-        _populate_templates_for_participant(classroom.id, user.email)
+        await run_fs(_populate_templates_for_participant, classroom.id, user.email)
 
         logger.info(
             f"JOIN: user {user.id} joined classroom {classroom.id} "
@@ -533,7 +533,7 @@ async def restore_by_slug(
     db.commit()
 
     port_range = _get_user_port_range(user)
-    restarted = _restart_user_container(user.id, user.email, port_range)
+    restarted = await run_fs(_restart_user_container, user.id, user.email, port_range)
 
     logger.info(
         f"User {user_id} restored classroom {target_classroom.id} from archive"
@@ -545,6 +545,24 @@ async def restore_by_slug(
     }
 
 
+def _list_templates(templates_dir: str) -> list[dict]:
+    """``{name, files}`` for each non-empty assignment in *templates_dir*."""
+    templates = []
+    for entry in os.listdir(templates_dir):
+        template_path = os.path.join(templates_dir, entry)
+        if os.path.isdir(template_path):
+            files: list[str] = []
+            for root, _dirs, filenames in os.walk(template_path):
+                for filename in filenames:
+                    rel_path = os.path.relpath(
+                        os.path.join(root, filename), template_path
+                    )
+                    files.append(rel_path)
+            if files:
+                templates.append({"name": entry, "files": files})
+    return templates
+
+
 @router.get("/assignments")
 async def list_classroom_assignments(
     user: User = Depends(get_onboarded_user),
@@ -575,20 +593,8 @@ async def list_classroom_assignments(
         if not os.path.isdir(templates_dir):
             continue
 
-        templates = []
         try:
-            for entry in os.listdir(templates_dir):
-                template_path = os.path.join(templates_dir, entry)
-                if os.path.isdir(template_path):
-                    files: list[str] = []
-                    for root, _dirs, filenames in os.walk(template_path):
-                        for filename in filenames:
-                            rel_path = os.path.relpath(
-                                os.path.join(root, filename), template_path
-                            )
-                            files.append(rel_path)
-                    if files:
-                        templates.append({"name": entry, "files": files})
+            templates = await run_fs(_list_templates, templates_dir)
         except Exception as e:
             logger.warning(
                 f"Failed to list assignments for classroom {classroom.id}: {e}"
@@ -618,8 +624,8 @@ async def get_access_code(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    classroom = _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    classroom = await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
     return {"access_code": classroom.access_code}
 
 
@@ -629,8 +635,8 @@ async def regenerate_access_code(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    classroom = _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    classroom = await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     new_code = _generate_access_code()
     classroom.access_code = new_code
@@ -646,8 +652,8 @@ async def update_classroom(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    classroom = _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    classroom = await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     if body.name is not None:
         new_name = body.name.strip()
@@ -663,13 +669,19 @@ async def update_classroom(
             raise HTTPException(status_code=400, detail="Invalid grading mode")
         classroom.grading_mode = body.grading_mode
 
+    if body.auto_grade is not None:
+        classroom.auto_grade = body.auto_grade
+
     db.add(classroom)
     db.commit()
+    if body.grading_mode is not None:
+        get_gradebooks().invalidate(classroom_id)
     return {
         "id": classroom_id,
         "name": classroom.name,
         "joins_paused": classroom.joins_paused,
         "grading_mode": classroom.grading_mode,
+        "auto_grade": classroom.auto_grade,
     }
 
 
@@ -679,13 +691,13 @@ async def delete_classroom(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    classroom = _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    classroom = await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     try:
         base = os.path.join(CLASSROOMS_ROOT, classroom_id)
         if os.path.isdir(base):
-            shutil.rmtree(base)
+            await run_fs(shutil.rmtree, base)
     except Exception as e:
         logger.warning(f"Failed removing classroom dir {classroom_id}: {e}")
 
@@ -698,6 +710,7 @@ async def delete_classroom(
         db.delete(m)
     db.delete(classroom)
     db.commit()
+    get_gradebooks().invalidate(classroom_id)
     return {"deleted": True}
 
 
@@ -708,7 +721,7 @@ async def archive_classroom(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
+    await run_db(_require_classroom, db, classroom_id)
 
     user_id = str(user.id)
     membership = db.exec(
@@ -726,7 +739,7 @@ async def archive_classroom(
     db.commit()
 
     port_range = _get_user_port_range(user)
-    restarted = _restart_user_container(user.id, user.email, port_range)
+    restarted = await run_fs(_restart_user_container, user.id, user.email, port_range)
     return {"archived": body.archived, "restarted": restarted}
 
 
@@ -736,16 +749,19 @@ async def list_participants(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
-    participants = db.exec(
-        select(ClassroomMember).where(
+    return {"participants": await run_db(_participant_ids, db, classroom_id)}
+
+
+def _participant_ids(db: Session, classroom_id: str) -> list[str]:
+    return list(db.exec(
+        select(ClassroomMember.user_id).where(
             ClassroomMember.classroom_id == classroom_id,
             ClassroomMember.role == "participant",
         )
-    ).all()
-    return {"participants": [m.user_id for m in participants]}
+    ).all())
 
 
 @router.post("/{classroom_id}/participants")
@@ -755,8 +771,8 @@ async def add_participant(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     target_user_id = body.user_id.strip()
     if not target_user_id:
@@ -791,6 +807,7 @@ async def add_participant(
     )
     db.add(member)
     db.commit()
+    get_gradebooks().invalidate(classroom_id)
     return {"added": True}
 
 
@@ -801,8 +818,8 @@ async def remove_participant(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     target_user_id = body.user_id.strip()
     if not target_user_id:
@@ -821,6 +838,7 @@ async def remove_participant(
 
     db.delete(membership)
     db.commit()
+    get_gradebooks().invalidate(classroom_id)
     return {"removed": True}
 
 
@@ -830,8 +848,8 @@ async def list_instructors(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     instructors = db.exec(
         select(ClassroomMember).where(
@@ -849,8 +867,8 @@ async def add_instructor(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     target_user_id = body.user_id.strip()
     if not target_user_id:
@@ -880,6 +898,7 @@ async def add_instructor(
         existing.role = "instructor"
         db.add(existing)
         db.commit()
+        get_gradebooks().invalidate(classroom_id)
         return {"added": True}
 
     member = ClassroomMember(
@@ -899,8 +918,8 @@ async def remove_instructor(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     target_user_id = body.user_id.strip()
     if not target_user_id:
@@ -932,10 +951,16 @@ async def remove_instructor(
 
     db.delete(membership)
     db.commit()
+    get_gradebooks().invalidate(classroom_id)
     return {"removed": True}
 
 
 
+def _write_bytes(path: str, content: bytes) -> None:
+    with open(path, "wb") as fh:
+        fh.write(content)
+
+
 @router.post("/{classroom_id}/assignments/upload")
 async def upload_classroom_assignment(
     classroom_id: str,
@@ -944,8 +969,8 @@ async def upload_classroom_assignment(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
@@ -964,6 +989,9 @@ async def upload_classroom_assignment(
             target_dir = templates_dir
 
         saved_files: list[str] = []
+        # Uploaded files plus every directory between them and templates_dir,
+        # normalized in one batch once everything is written.
+        written: set[str] = set()
         for file in files:
             if not file.filename:
                 continue
@@ -980,28 +1008,26 @@ async def upload_classroom_assignment(
             else:
                 filepath = os.path.join(target_dir, filename)
 
-            content = await file.read()
-            with open(filepath, "wb") as fh:
-                fh.write(content)
+            await run_fs(_write_bytes, filepath, await file.read())
 
-            try:
-                os.chown(filepath, CONTAINER_USER_UID, CONTAINER_USER_GID)
-                parent = os.path.dirname(filepath)
-                while parent.startswith(templates_dir):
-                    os.chown(parent, CONTAINER_USER_UID, CONTAINER_USER_GID)
-                    os.chmod(parent, 0o775)
-                    if parent == templates_dir:
-                        break
-                    parent = os.path.dirname(parent)
-            except PermissionError as e:
-                logger.warning(f"Failed to chown {filepath}: {e}")
+            written.add(filepath)
+            parent = os.path.dirname(filepath)
+            while parent.startswith(templates_dir) and parent not in written:
+                written.add(parent)
+                if parent == templates_dir:
+                    break
+                parent = os.path.dirname(parent)
 
             saved_files.append(filename)
 
+        if (await run_fs(normalize_paths, written, dir_mode=0o775)).errors:
+            logger.warning(f"Failed to chown some uploaded templates in {templates_dir}")
+
         logger.info(
             f"Uploaded {len(saved_files)} template files to classroom "
             f"{classroom_id} by user {user.id}"
         )
+        get_gradebooks().invalidate(classroom_id)
 
         return {
             "uploaded": True,
@@ -1036,6 +1062,46 @@ class RestoreAssignmentRequest(BaseModel):
     paths: list[str] | None = None  # None or empty list ⇒ restore everything
 
 
+def _restore_template_files(
+    template_dir: str, participant_template_dir: str, paths: list[str] | None, user_id: str,
+) -> list[str]:
+    """Copy *paths* (all files when empty) from the template over the
+    participant's copy; returns the relative paths restored."""
+    # Build the list of relative paths to restore.
+    if paths:
+        rel_paths: list[str] = []
+        for p in paths:
+            # Validate each path is inside the template.
+            if not _safe_join_under(template_dir, p):
+                continue
+            rel_paths.append(p)
+    else:
+        rel_paths = []
+        for root, _dirs, filenames in os.walk(template_dir):
+            for filename in filenames:
+                rel_paths.append(
+                    os.path.relpath(os.path.join(root, filename), template_dir)
+                )
+
+    os.makedirs(participant_template_dir, exist_ok=True)
+
+    restored: list[str] = []
+    for rel in rel_paths:
+        src = _safe_join_under(template_dir, rel)
+        dst = _safe_join_under(participant_template_dir, rel)
+        if not src or not dst or not os.path.isfile(src):
+            continue
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            shutil.copy2(src, dst)
+        except OSError as e:
+            logger.warning("Failed to restore %s for %s: %s", rel, user_id, e)
+            continue
+        restored.append(rel)
+    normalize_paths(os.path.join(participant_template_dir, rel) for rel in restored)
+    return restored
+
+
 @router.post("/{classroom_id}/assignments/{template_name}/restore")
 async def restore_assignment_files(
     classroom_id: str,
@@ -1047,7 +1113,7 @@ async def restore_assignment_files(
     """Copy template file(s) over the participant's working copy so they can
     start fresh after breaking something. Only participants can restore
     their own files."""
-    _require_classroom(db, classroom_id)
+    await run_db(_require_classroom, db, classroom_id)
     membership = db.exec(
         select(ClassroomMember).where(
             ClassroomMember.classroom_id == classroom_id,
@@ -1076,42 +1142,9 @@ async def restore_assignment_files(
         template_name,
     )
 
-    # Build the list of relative paths to restore.
-    if body.paths:
-        rel_paths: list[str] = []
-        for p in body.paths:
-            # Validate each path is inside the template.
-            if not _safe_join_under(template_dir, p):
-                continue
-            rel_paths.append(p)
-    else:
-        rel_paths = []
-        for root, _dirs, filenames in os.walk(template_dir):
-            for filename in filenames:
-                rel_paths.append(
-                    os.path.relpath(os.path.join(root, filename), template_dir)
-                )
-
-    os.makedirs(participant_template_dir, exist_ok=True)
-
-    restored: list[str] = []
-    for rel in rel_paths:
-        src = _safe_join_under(template_dir, rel)
-        dst = _safe_join_under(participant_template_dir, rel)
-        if not src or not dst or not os.path.isfile(src):
-            continue
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        try:
-            shutil.copy2(src, dst)
-        except OSError as e:
-            logger.warning("Failed to restore %s for %s: %s", rel, user.id, e)
-            continue
-        try:
-            os.chown(dst, CONTAINER_USER_UID, CONTAINER_USER_GID)
-            os.chmod(dst, 0o664)
-        except OSError:
-            pass
-        restored.append(rel)
+    restored = await run_fs(
+        _restore_template_files, template_dir, participant_template_dir, body.paths, str(user.id),
+    )
 
     try:
         await notify_files_changed(str(user.id))
@@ -1129,76 +1162,24 @@ async def restore_assignment_files(
 @router.get("/{classroom_id}/progress")
 async def get_classroom_progress(
     classroom_id: str,
+    request: Request,
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    """Get all students' test results for all templates in a classroom."""
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
-
-    # Get all participants
-    participant_members = db.exec(
-        select(ClassroomMember).where(
-            ClassroomMember.classroom_id == classroom_id,
-            ClassroomMember.role == "participant",
-        )
-    ).all()
-
-    participant_ids = [m.user_id for m in participant_members]
-    participants_info: list[dict] = []
-    if participant_ids:
-        users = db.exec(
-            select(User).where(User.id.in_(participant_ids))
-        ).all()
-        user_map = {u.id: u for u in users}
-        for pid in participant_ids:
-            u = user_map.get(pid)
-            participants_info.append({
-                "id": pid,
-                "email": u.email if u else pid,
-                "name": u.name if u else pid,
-            })
+    """Get all students' test results for all templates in a classroom.
 
-    # Sort alphabetically by name
-    participants_info.sort(key=lambda p: (p["name"] or p["email"] or "").lower())
-
-    # Get assignments
-    templates_dir = os.path.join(CLASSROOMS_ROOT, classroom_id, "assignments")
-    templates: list[str] = []
-    if os.path.isdir(templates_dir):
-        templates = sorted(
-            e for e in os.listdir(templates_dir)
-            if os.path.isdir(os.path.join(templates_dir, e))
-        )
-
-    # Get test results
-    results = db.exec(
-        select(TestResult).where(TestResult.classroom_id == classroom_id)
-    ).all()
-    result_map: dict[str, dict[str, dict]] = {}
-    for r in results:
-        result_map.setdefault(r.user_id, {})[r.template_name] = {
-            "passed": r.tests_passed,
-            "total": r.tests_total,
-        }
-
-    students = []
-    for p in participants_info:
-        student_results = result_map.get(p["id"], {})
-        students.append({
-            "id": p["id"],
-            "email": p["email"],
-            "name": p["name"],
-            "results": {
-                t: student_results.get(t, {"passed": 0, "total": 0})
-                for t in templates
-            },
-        })
+    Served from the materialized gradebook (see ``api.gradebook``) with an
+    ETag, so a poll that finds nothing changed gets a bodiless 304.
+    """
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
-    return {
-        "students": students,
-        "templates": templates,
-    }
+    body, etag = await run_db(get_gradebooks().get, db, classroom_id)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in (t.strip() for t in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @router.get("/{classroom_id}/my-progress")
@@ -1213,44 +1194,100 @@ async def get_my_progress(
     Available to any member of the classroom so students can see what they've
     been assigned without exposing the rest of the cohort.
     """
-    _require_classroom(db, classroom_id)
+    await run_db(_require_classroom, db, classroom_id)
+    result_map = await run_db(_own_scores, db, classroom_id, str(user.id))
+    if result_map is None:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    templates = await run_fs(list_assignments, classroom_id)
+    return {
+        "templates": templates,
+        "results": {t: result_map.get(t, {"passed": 0, "total": 0}) for t in templates},
+    }
+
+
+def _own_scores(db: Session, classroom_id: str, user_id: str) -> dict[str, dict] | None:
+    """*user_id*'s scores by template, or None if they are not a member."""
     member = db.exec(
         select(ClassroomMember).where(
             ClassroomMember.classroom_id == classroom_id,
-            ClassroomMember.user_id == str(user.id),
+            ClassroomMember.user_id == user_id,
         )
     ).first()
     if not member:
-        raise HTTPException(status_code=403, detail="Forbidden")
-
-    templates_dir = os.path.join(CLASSROOMS_ROOT, classroom_id, "assignments")
-    templates: list[str] = []
-    if os.path.isdir(templates_dir):
-        templates = sorted(
-            e for e in os.listdir(templates_dir)
-            if os.path.isdir(os.path.join(templates_dir, e))
-        )
-
-    own_results = db.exec(
-        select(TestResult).where(
-            TestResult.classroom_id == classroom_id,
-            TestResult.user_id == str(user.id),
-        )
-    ).all()
-    result_map = {
-        r.template_name: {"passed": r.tests_passed, "total": r.tests_total}
-        for r in own_results
-    }
-
+        return None
     return {
-        "templates": templates,
-        "results": {t: result_map.get(t, {"passed": 0, "total": 0}) for t in templates},
+        template_name: {"passed": passed, "total": total}
+        for template_name, passed, total in db.exec(
+            select(TestResult.template_name, TestResult.tests_passed, TestResult.tests_total).where(
+                TestResult.classroom_id == classroom_id,
+                TestResult.user_id == user_id,
+            )
+        ).all()
     }
 
 
 class RunStudentTestsRequest(BaseModel):
     student_email: str
     template_name: str
+    # Re-run even if the student's files are unchanged since the last run.
+    force: bool = False
+    # Only re-run the tests that failed last time.
+    failed_only: bool = False
+
+
+def _previous_for_run(
+    db: Session, row: TestResult | None, force: bool, failed_only: bool,
+):
+    """The stored result to hand to the runner for this request."""
+    cases = load_cases(db, [row]).get(row.id) if failed_only and row else None
+    previous = previous_outcome(row, cases)
+    if previous is not None and force:
+        previous.fingerprint = ""  # never a cache hit
+    return previous
+
+
+def _student_run_inputs(
+    db: Session, classroom_id: str, email: str, template_name: str,
+    force: bool, failed_only: bool,
+):
+    """``(student_id, previous)`` for a single-student run; the id is None
+    if no user has *email*."""
+    student_user = db.exec(select(User).where(User.email == email)).first()
+    existing = None
+    if student_user:
+        existing = db.exec(
+            select(TestResult).where(
+                TestResult.classroom_id == classroom_id,
+                TestResult.user_id == student_user.id,
+                TestResult.template_name == template_name,
+            )
+        ).first()
+    previous = _previous_for_run(db, existing, force, failed_only)
+    return (student_user.id if student_user else None), previous
+
+
+def _store_student_outcome(
+    db: Session, classroom_id: str, user_id: str, template_name: str, outcome,
+) -> None:
+    store_outcome(db, classroom_id, user_id, template_name, outcome)
+    db.commit()
+
+
+def _grading_key(classroom_id: str, template_name: str, email: str, failed_only: bool):
+    key = (classroom_id, template_name, email)
+    return key + ("failed-only",) if failed_only else key
+
+
+def _case_dicts(tests: list[dict]) -> list[dict]:
+    return [
+        {
+            "file": t["file"],
+            "test_id": t["test_id"],
+            "outcome": t["outcome"],
+            "message": t.get("message") or "",
+        }
+        for t in tests
+    ]
 
 
 @router.post("/{classroom_id}/run-student-tests")
@@ -1261,23 +1298,30 @@ async def run_student_tests(
     db: Session = Depends(get_db),
 ):
     """Run tests for a single student on a single template and return raw output."""
-    from backend.test_runner import run_tests_for_student_with_output
+    from backend.grading_queue import PRIORITY_INTERACTIVE, get_grading_scheduler
+    from backend.test_runner import grade_student
 
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
-    import asyncio
-    from concurrent.futures import ThreadPoolExecutor
-    from datetime import datetime
+    student_id, previous = await run_db(
+        _student_run_inputs, db, classroom_id, body.student_email, body.template_name,
+        body.force, body.failed_only,
+    )
 
-    loop = asyncio.get_event_loop()
     try:
-        with ThreadPoolExecutor() as pool:
-            passed, total, output = await loop.run_in_executor(
-                pool,
-                run_tests_for_student_with_output,
-                classroom_id, body.template_name, body.student_email,
-            )
+        # A teacher is waiting on this one, so it jumps ahead of any batch
+        # run; if the same student/template is already queued it is reused.
+        outcome = await get_grading_scheduler().run(
+            classroom_id,
+            grade_student,
+            classroom_id, body.template_name, body.student_email, previous,
+            failed_only=body.failed_only,
+            priority=PRIORITY_INTERACTIVE,
+            key=_grading_key(
+                classroom_id, body.template_name, body.student_email, body.failed_only,
+            ),
+        )
     except Exception as e:
         logger.exception(
             "run_student_tests crashed for classroom=%s template=%s student=%s",
@@ -1292,42 +1336,29 @@ async def run_student_tests(
         }
 
     # Also persist the result
-    student_email_sanitized = (body.student_email or "").replace("/", "_")
-    student_user = db.exec(
-        select(User).where(User.email == body.student_email)
-    ).first()
-    if student_user:
-        existing = db.exec(
-            select(TestResult).where(
-                TestResult.classroom_id == classroom_id,
-                TestResult.user_id == student_user.id,
-                TestResult.template_name == body.template_name,
-            )
-        ).first()
-        if existing:
-            existing.tests_passed = passed
-            existing.tests_total = total
-            existing.last_run = datetime.utcnow()
-            db.add(existing)
-        else:
-            db.add(TestResult(
-                classroom_id=classroom_id,
-                user_id=student_user.id,
-                template_name=body.template_name,
-                tests_passed=passed,
-                tests_total=total,
-            ))
-        db.commit()
+    if student_id:
+        await run_db(_store_student_outcome, db, classroom_id, student_id,
+                     body.template_name, outcome)
 
     return {
-        "passed": passed,
-        "total": total,
-        "output": output,
+        "passed": outcome.passed,
+        "total": outcome.total,
+        "output": outcome.output,
+        "cached": outcome.cached,
+        "tests": _case_dicts(outcome.tests),
     }
 
 
+# Longest a finished batch-grading result waits before it is written.
+_RESULT_FLUSH_INTERVAL = 0.5
+
+
 class RunTestsRequest(BaseModel):
     template_name: str | None = None
+    # Re-run even students whose files are unchanged since the last run.
+    force: bool = False
+    # Only re-run the tests that failed last time.
+    failed_only: bool = False
 
 
 @router.post("/{classroom_id}/run-tests")
@@ -1337,43 +1368,87 @@ async def run_classroom_tests(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    """Run tests for all students on a specific template (or all templates)."""
-    from backend.test_runner import run_tests_for_student
+    """Queue tests for all students on a specific template (or all templates).
+
+    Returns as soon as every job is queued; progress is at ``/grading-runs``.
+    """
+    from backend.test_runner import grade_student
 
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     # Get assignments to test
-    templates_dir = os.path.join(CLASSROOMS_ROOT, classroom_id, "assignments")
     if body.template_name:
         templates = [body.template_name]
-    elif os.path.isdir(templates_dir):
-        templates = [
-            e for e in os.listdir(templates_dir)
-            if os.path.isdir(os.path.join(templates_dir, e))
-        ]
     else:
-        templates = []
+        templates = await run_fs(list_assignments, classroom_id)
+    jobs, previous_by_key = await run_db(
+        _batch_jobs, db, classroom_id, templates, body.force, body.failed_only,
+    )
 
-    # Get participants
-    participant_members = db.exec(
-        select(ClassroomMember).where(
-            ClassroomMember.classroom_id == classroom_id,
-            ClassroomMember.role == "participant",
-        )
-    ).all()
+    import asyncio
 
-    participant_ids = [m.user_id for m in participant_members]
+    from backend.grading_queue import PRIORITY_BATCH, get_grading_scheduler
+
+    # Hand every job to the shared grading queue; it decides how many run at
+    # once and interleaves them fairly with other classrooms' work.
+    scheduler = get_grading_scheduler()
+
+    async def _grade(job: tuple[str, str, str]):
+        tmpl, pid, email = job
+        previous = previous_by_key.get((pid, tmpl))
+        outcome = await asyncio.wrap_future(scheduler.submit(
+            classroom_id,
+            grade_student,
+            classroom_id, tmpl, email, previous,
+            failed_only=body.failed_only,
+            priority=PRIORITY_BATCH,
+            key=_grading_key(classroom_id, tmpl, email, body.failed_only),
+        ))
+        return job, outcome
+
+    # Grading runs in the background; the classroom page polls
+    # /grading-runs and refreshes the gradebook as results are stored.
+    # Completions are collected for up to _RESULT_FLUSH_INTERVAL and written
+    # with one upsert and one commit, so a big run doesn't turn into a
+    # round trip per student×template.
+    engine = db.get_bind()
+    pending = {asyncio.ensure_future(_grade(j)) for j in jobs}
+
+    async def _collect(run: dict) -> None:
+        nonlocal pending
+        while pending:
+            done, pending = await asyncio.wait(pending, timeout=_RESULT_FLUSH_INTERVAL)
+            batch = []
+            for task in done:
+                try:
+                    batch.append(task.result())
+                except Exception:
+                    logger.exception("Grading job failed in classroom %s", classroom_id)
+                    run["completed"] += 1
+            if not batch:
+                continue
+            await run_db(_store_batch, engine, classroom_id, [
+                (pid, template_name, outcome)
+                for (template_name, pid, _email), outcome in batch
+            ])
+            run["completed"] += len(batch)
+
+    run = get_grading_runs().start(classroom_id, len(jobs), _collect)
+    return {"run_id": run["run_id"], "count": len(jobs)}
+
+
+def _batch_jobs(
+    db: Session, classroom_id: str, templates: list[str], force: bool, failed_only: bool,
+) -> tuple[list[tuple[str, str, str]], dict]:
+    """``(template, participant_id, email)`` jobs for every participant and
+    template, and the stored outcome to hand the runner for each."""
+    participant_ids = _participant_ids(db, classroom_id)
     users = db.exec(
         select(User).where(User.id.in_(participant_ids))
     ).all() if participant_ids else []
     user_map = {u.id: u for u in users}
 
-    import asyncio
-    from concurrent.futures import ThreadPoolExecutor
-    from datetime import datetime
-
-    # Build list of (template, participant_id, email) jobs
     jobs: list[tuple[str, str, str]] = []
     for template_name in templates:
         for pid in participant_ids:
@@ -1382,53 +1457,87 @@ async def run_classroom_tests(
                 continue
             jobs.append((template_name, pid, u.email))
 
-    # Run all test jobs in parallel using a thread pool
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor() as pool:
-        futures = [
-            loop.run_in_executor(
-                pool,
-                run_tests_for_student,
-                classroom_id, tmpl, email,
-            )
-            for tmpl, _pid, email in jobs
-        ]
-        results = await asyncio.gather(*futures)
+    # Stored results, so unchanged submissions are answered from their
+    # fingerprint instead of a fresh container.
+    stored = {
+        (r.user_id, r.template_name): r
+        for r in db.exec(
+            select(TestResult).where(TestResult.classroom_id == classroom_id)
+        ).all()
+    }
+    stored_cases = load_cases(db, list(stored.values())) if failed_only else {}
 
-    # Write all results to DB
-    updated_results = []
-    for (template_name, pid, _email), (passed, total) in zip(jobs, results):
-        existing = db.exec(
-            select(TestResult).where(
-                TestResult.classroom_id == classroom_id,
-                TestResult.user_id == pid,
-                TestResult.template_name == template_name,
-            )
-        ).first()
+    # Built up front: committing a batch expires the stored rows, and reading
+    # them afterwards would cost a query each.
+    previous_by_key = {}
+    for (pid, tmpl), row in stored.items():
+        previous = previous_outcome(row, stored_cases.get(row.id))
+        if force:
+            previous.fingerprint = ""
+        previous_by_key[(pid, tmpl)] = previous
+    return jobs, previous_by_key
 
-        if existing:
-            existing.tests_passed = passed
-            existing.tests_total = total
-            existing.last_run = datetime.utcnow()
-            db.add(existing)
-        else:
-            db.add(TestResult(
-                classroom_id=classroom_id,
-                user_id=pid,
-                template_name=template_name,
-                tests_passed=passed,
-                tests_total=total,
-            ))
-
-        updated_results.append({
-            "user_id": pid,
-            "template_name": template_name,
-            "passed": passed,
-            "total": total,
-        })
 
-    db.commit()
-    return {"results": updated_results}
+def _store_batch(engine, classroom_id: str, results) -> None:
+    with Session(engine) as session:
+        store_outcomes(session, classroom_id, results)
+        session.commit()
+
+
+@router.get("/{classroom_id}/grading-runs")
+async def list_grading_runs(
+    classroom_id: str,
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    """Progress of batch grading runs still in flight for this classroom."""
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
+    return {"runs": get_grading_runs().runs_for(classroom_id)}
+
+
+@router.get("/{classroom_id}/test-cases")
+async def get_test_cases(
+    classroom_id: str,
+    user_id: str,
+    template_name: str,
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    """Per-test outcomes from a student's last graded run of a template."""
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
+
+    result = await run_db(_test_cases, db, classroom_id, user_id, template_name)
+    if result is None:
+        raise HTTPException(status_code=404, detail="No test results")
+    return result
+
+
+def _test_cases(db: Session, classroom_id: str, user_id: str, template_name: str) -> dict | None:
+    row = db.exec(
+        select(TestResult).where(
+            TestResult.classroom_id == classroom_id,
+            TestResult.user_id == user_id,
+            TestResult.template_name == template_name,
+        )
+    ).first()
+    if not row:
+        return None
+    cases = db.exec(
+        select(TestCaseResult)
+        .where(TestCaseResult.test_result_id == row.id)
+        .order_by(TestCaseResult.id)
+    ).all()
+    return {
+        "passed": row.tests_passed,
+        "total": row.tests_total,
+        "last_run": row.last_run.isoformat() + "Z",
+        "tests": [
+            {"file": c.file, "test_id": c.test_id, "outcome": c.outcome, "message": c.message or ""}
+            for c in cases
+        ],
+    }
 
 
 # ---------------------------------------------------------------------------
@@ -1447,18 +1556,23 @@ async def get_weights(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    classroom = _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
-
-    weights = db.exec(
-        select(AssignmentWeight).where(
-            AssignmentWeight.classroom_id == classroom_id
-        )
-    ).all()
+    classroom = await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     return {
         "grading_mode": classroom.grading_mode,
-        "weights": {w.template_name: w.weight for w in weights},
+        "weights": await run_db(_stored_weights, db, classroom_id),
+    }
+
+
+def _stored_weights(db: Session, classroom_id: str) -> dict[str, float]:
+    return {
+        w.template_name: w.weight
+        for w in db.exec(
+            select(AssignmentWeight).where(
+                AssignmentWeight.classroom_id == classroom_id
+            )
+        ).all()
     }
 
 
@@ -1469,46 +1583,53 @@ async def update_weights(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    classroom = _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    classroom = await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     if body.grading_mode not in ("equal", "weighted", "manual"):
         raise HTTPException(status_code=400, detail="Invalid grading mode")
 
-    classroom.grading_mode = body.grading_mode
+    weights = await run_db(_save_weights, db, classroom, body.grading_mode, body.weights)
+    get_gradebooks().set_grading(classroom_id, body.grading_mode, weights)
+    return {
+        "grading_mode": body.grading_mode,
+        "weights": weights,
+    }
+
+
+def _save_weights(
+    db: Session, classroom: Classroom, grading_mode: str, new_weights: dict[str, float],
+) -> dict[str, float]:
+    """Store the grading mode (and weights, for modes that use them);
+    returns the weights now stored."""
+    classroom.grading_mode = grading_mode
     db.add(classroom)
 
     # Only update stored weights when the mode actually uses them.
     # Switching to "equal" just changes the mode — existing weights are
     # preserved so nothing is lost if the teacher switches back.
-    if body.grading_mode != "equal":
-        existing = db.exec(
+    if grading_mode != "equal":
+        upsert(
+            db,
+            AssignmentWeight,
+            [
+                {"classroom_id": classroom.id, "template_name": t, "weight": w}
+                for t, w in new_weights.items()
+            ],
+            keys=("classroom_id", "template_name"),
+        )
+        for w in db.exec(
             select(AssignmentWeight).where(
-                AssignmentWeight.classroom_id == classroom_id
+                AssignmentWeight.classroom_id == classroom.id,
+                AssignmentWeight.template_name.not_in(list(new_weights)),
             )
-        ).all()
-        for w in existing:
+        ).all():
             db.delete(w)
 
-        for template_name, weight in body.weights.items():
-            db.add(AssignmentWeight(
-                classroom_id=classroom_id,
-                template_name=template_name,
-                weight=weight,
-            ))
-
     db.commit()
 
     # Return current weights from DB so frontend stays in sync
-    weights = db.exec(
-        select(AssignmentWeight).where(
-            AssignmentWeight.classroom_id == classroom_id
-        )
-    ).all()
-    return {
-        "grading_mode": body.grading_mode,
-        "weights": {w.template_name: w.weight for w in weights},
-    }
+    return _stored_weights(db, classroom.id)
 
 
 # ---------------------------------------------------------------------------
@@ -1528,9 +1649,13 @@ async def get_manual_scores(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
+    return {"scores": await run_db(_stored_manual_scores, db, classroom_id)}
+
+
+def _stored_manual_scores(db: Session, classroom_id: str) -> dict[str, dict[str, float]]:
     scores = db.exec(
         select(ManualScore).where(ManualScore.classroom_id == classroom_id)
     ).all()
@@ -1538,8 +1663,7 @@ async def get_manual_scores(
     result: dict[str, dict[str, float]] = {}
     for s in scores:
         result.setdefault(s.user_id, {})[s.template_name] = s.score
-
-    return {"scores": result}
+    return result
 
 
 @router.put("/{classroom_id}/manual-score")
@@ -1549,30 +1673,29 @@ async def update_manual_score(
     user: User = Depends(get_onboarded_user),
     db: Session = Depends(get_db),
 ):
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
-    existing = db.exec(
-        select(ManualScore).where(
-            ManualScore.classroom_id == classroom_id,
-            ManualScore.user_id == body.user_id,
-            ManualScore.template_name == body.template_name,
-        )
-    ).first()
+    await run_db(_save_manual_score, db, classroom_id, body)
+    get_gradebooks().set_manual_score(
+        classroom_id, body.user_id, body.template_name, body.score,
+    )
+    return {"ok": True}
 
-    if existing:
-        existing.score = body.score
-        db.add(existing)
-    else:
-        db.add(ManualScore(
-            classroom_id=classroom_id,
-            user_id=body.user_id,
-            template_name=body.template_name,
-            score=body.score,
-        ))
 
+def _save_manual_score(db: Session, classroom_id: str, body: UpdateManualScoreRequest) -> None:
+    upsert(
+        db,
+        ManualScore,
+        [{
+            "classroom_id": classroom_id,
+            "user_id": body.user_id,
+            "template_name": body.template_name,
+            "score": body.score,
+        }],
+        keys=("classroom_id", "user_id", "template_name"),
+    )
     db.commit()
-    return {"ok": True}
 
 
 # ---------------------------------------------------------------------------
@@ -1580,6 +1703,32 @@ async def update_manual_score(
 # ---------------------------------------------------------------------------
 
 
+def _student_file_list(base: str, templates_dir: str) -> list[str]:
+    """Visible files in a student's copy *base*, plus the assignment's tests."""
+    files: set[str] = set()
+    for root, dirs, fnames in os.walk(base):
+        # Skip hidden dirs and __pycache__
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__']
+        for fn in fnames:
+            if fn.startswith('.'):
+                continue
+            rel = os.path.relpath(os.path.join(root, fn), base)
+            files.add(rel)
+
+    # Also include test files from the assignment directory so teachers
+    # can always see them in the student file listing.
+    if os.path.isdir(templates_dir):
+        for root, dirs, fnames in os.walk(templates_dir):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__']
+            for fn in fnames:
+                if fn.startswith('.'):
+                    continue
+                if fn.startswith('test_'):
+                    rel = os.path.relpath(os.path.join(root, fn), templates_dir)
+                    files.add(rel)
+    return sorted(files)
+
+
 @router.get("/{classroom_id}/student-files")
 async def list_student_files(
     classroom_id: str,
@@ -1589,22 +1738,10 @@ async def list_student_files(
     db: Session = Depends(get_db),
 ):
     """List files in a student's assignment directory. Teacher-only."""
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
-
-    target_user = db.exec(select(User).where(User.email == email)).first()
-    if not target_user:
-        raise HTTPException(status_code=404, detail="Student not found")
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
-    member = db.exec(
-        select(ClassroomMember).where(
-            ClassroomMember.classroom_id == classroom_id,
-            ClassroomMember.user_id == target_user.id,
-            ClassroomMember.role == "participant",
-        )
-    ).first()
-    if not member:
-        raise HTTPException(status_code=404, detail="Student is not in this classroom")
+    await run_db(_require_participant_email, db, classroom_id, email)
 
     safe_template = os.path.normpath(template).lstrip("/")
     if ".." in safe_template.split(os.sep):
@@ -1614,35 +1751,29 @@ async def list_student_files(
     base = os.path.join(
         CLASSROOMS_ROOT, classroom_id, "participants", sanitized_email, safe_template
     )
-    if not os.path.isdir(base):
+    if not await run_fs(os.path.isdir, base):
         return {"files": []}
 
-    files: set[str] = set()
-    for root, dirs, fnames in os.walk(base):
-        # Skip hidden dirs and __pycache__
-        dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__']
-        for fn in fnames:
-            if fn.startswith('.'):
-                continue
-            rel = os.path.relpath(os.path.join(root, fn), base)
-            files.add(rel)
-
-    # Also include test files from the assignment directory so teachers
-    # can always see them in the student file listing.
     templates_dir = os.path.join(
         CLASSROOMS_ROOT, classroom_id, "assignments", safe_template
     )
-    if os.path.isdir(templates_dir):
-        for root, dirs, fnames in os.walk(templates_dir):
-            dirs[:] = [d for d in dirs if not d.startswith('.') and d != '__pycache__']
-            for fn in fnames:
-                if fn.startswith('.'):
-                    continue
-                if fn.startswith('test_'):
-                    rel = os.path.relpath(os.path.join(root, fn), templates_dir)
-                    files.add(rel)
+    return {"files": await run_fs(_student_file_list, base, templates_dir)}
 
-    return {"files": sorted(files)}
+
+def _require_participant_email(db: Session, classroom_id: str, email: str) -> None:
+    target_user = db.exec(select(User).where(User.email == email)).first()
+    if not target_user:
+        raise HTTPException(status_code=404, detail="Student not found")
+
+    member = db.exec(
+        select(ClassroomMember).where(
+            ClassroomMember.classroom_id == classroom_id,
+            ClassroomMember.user_id == target_user.id,
+            ClassroomMember.role == "participant",
+        )
+    ).first()
+    if not member:
+        raise HTTPException(status_code=404, detail="Student is not in this classroom")
 
 
 @router.get("/{classroom_id}/student-file")
@@ -1654,8 +1785,8 @@ async def get_student_file(
     db: Session = Depends(get_db),
 ):
     """Read a student's file content. Teacher-only."""
-    _require_classroom(db, classroom_id)
-    _require_instructor(db, classroom_id, str(user.id))
+    await run_db(_require_classroom, db, classroom_id)
+    await run_db(_require_instructor, db, classroom_id, str(user.id))
 
     # Validate email belongs to a participant
     target_user = db.exec(
@@ -1701,8 +1832,7 @@ async def get_student_file(
         raise HTTPException(status_code=404, detail="File not found")
 
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            content = f.read()
+        content = await run_fs(_read_text, file_path)
         return {"content": content, "path": path}
     except UnicodeDecodeError:
         raise HTTPException(status_code=400, detail="Binary file cannot be read")
@@ -1713,42 +1843,9 @@ async def get_student_file(
 # ---------------------------------------------------------------------------
 
 
-def _set_ownership_recursive(path: str) -> None:
-    """Normalize ownership and permissions on a directory tree so that both
-    the backend (www-data, supplementary group csroom-container=995) and
-    the container user (999:995) can read/write everything.
-
-    Dirs: 999:995 mode 2775 — setgid so any new child inherits GID 995 even
-    if it was created by a process with a different primary group.
-    Files: 999:995 mode 0664 — group-writable so either side can edit.
-
-    Non-root chown falls back to chgrp-only; chmod still succeeds.
-    """
-    for dirpath, _dirnames, filenames in os.walk(path):
-        try:
-            os.chown(dirpath, CONTAINER_USER_UID, CONTAINER_USER_GID)
-        except OSError:
-            try:
-                os.chown(dirpath, -1, CONTAINER_USER_GID)
-            except OSError:
-                pass
-        try:
-            os.chmod(dirpath, 0o2775)
-        except OSError:
-            pass
-        for fn in filenames:
-            fp = os.path.join(dirpath, fn)
-            try:
-                os.chown(fp, CONTAINER_USER_UID, CONTAINER_USER_GID)
-            except OSError:
-                try:
-                    os.chown(fp, -1, CONTAINER_USER_GID)
-                except OSError:
-                    pass
-            try:
-                os.chmod(fp, 0o664)
-            except OSError:
-                pass
+def _read_text(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
 
 
 def _list_dir_files(base: str) -> list[str]:
@@ -1763,6 +1860,16 @@ def _list_dir_files(base: str) -> list[str]:
     return sorted(result)
 
 
+def _list_drafts(drafts_dir: str) -> list[dict]:
+    drafts = []
+    for entry in sorted(os.listdir(drafts_dir)):
+        entry_path = os.path.join(drafts_dir, entry)
+        if os.path.isdir(entry_path):
+            files = _list_dir_files(entry_path)
+            drafts.append({"name": entry, "files": files})
+    return drafts
+
+
 @router.get("/{classroom_id}/drafts")
 async def list_drafts(
     classroom_id: str,
@@ -1776,13 +1883,7 @@ async def list_drafts(
     if not os.path.isdir(drafts_dir):
         return {"drafts": []}
 
-    drafts = []
-    for entry in sorted(os.listdir(drafts_dir)):
-        entry_path = os.path.join(drafts_dir, entry)
-        if os.path.isdir(entry_path):
-            files = _list_dir_files(entry_path)
-            drafts.append({"name": entry, "files": files})
-    return {"drafts": drafts}
+    return {"drafts": await run_fs(_list_drafts, drafts_dir)}
 
 
 @router.post("/{classroom_id}/drafts")
@@ -1804,13 +1905,13 @@ async def upload_draft(
     if not draft_name:
         raise HTTPException(status_code=400, detail="Could not determine draft name")
 
-    _ensure_classroom_dirs(classroom_id)
+    await run_fs(_ensure_classroom_dirs, classroom_id)
     drafts_dir = os.path.join(CLASSROOMS_ROOT, classroom_id, "drafts")
     draft_path = os.path.join(drafts_dir, draft_name)
 
     # Remove existing draft with same name so re-uploads replace cleanly
     if os.path.exists(draft_path):
-        shutil.rmtree(draft_path)
+        await run_fs(shutil.rmtree, draft_path)
 
     for f in files:
         rel = f.filename or ""
@@ -1818,13 +1919,11 @@ async def upload_draft(
         if not safe.startswith(draft_path):
             continue
         os.makedirs(os.path.dirname(safe), exist_ok=True)
-        content = await f.read()
-        with open(safe, "wb") as fh:
-            fh.write(content)
+        await run_fs(_write_bytes, safe, await f.read())
 
-    _set_ownership_recursive(draft_path)
+    await run_fs(normalize_tree, draft_path)
     await notify_files_changed(str(user.id))
-    return {"name": draft_name, "files": _list_dir_files(draft_path)}
+    return {"name": draft_name, "files": await run_fs(_list_dir_files, draft_path)}
 
 
 @router.delete("/{classroom_id}/drafts/{draft_name}")
@@ -1841,7 +1940,7 @@ async def delete_draft(
     if not os.path.isdir(draft_path):
         raise HTTPException(status_code=404, detail="Draft not found")
 
-    shutil.rmtree(draft_path)
+    await run_fs(shutil.rmtree, draft_path)
     await notify_files_changed(str(user.id))
     return {"message": "Draft deleted"}
 
@@ -1891,6 +1990,39 @@ async def rename_draft(
     return {"message": "Draft renamed", "name": new_name}
 
 
+def _publish_targets(db: Session, classroom_id: str, draft_name: str) -> list[tuple[str, str]]:
+    """``(participant_id, dest)`` for every participant without a copy yet."""
+    participants = db.exec(
+        select(ClassroomMember).where(
+            ClassroomMember.classroom_id == classroom_id,
+            ClassroomMember.role == "participant",
+        )
+    ).all()
+
+    targets = []
+    if participants:
+        participant_users = db.exec(
+            select(User).where(User.id.in_([p.user_id for p in participants]))
+        ).all()
+        for pu in participant_users:
+            sanitized = (pu.email or "participant").replace("/", "_")
+            participant_dir = os.path.join(
+                CLASSROOMS_ROOT, classroom_id, "participants", sanitized
+            )
+            student_dest = os.path.join(participant_dir, draft_name)
+            if os.path.exists(student_dest):
+                continue  # Don't overwrite existing student work
+            try:
+                os.makedirs(participant_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(
+                    "Failed to push template %s to %s: %s", draft_name, pu.email, e
+                )
+                continue
+            targets.append((str(pu.id), student_dest))
+    return targets
+
+
 @router.post("/{classroom_id}/drafts/{draft_name}/publish")
 async def publish_draft(
     classroom_id: str,
@@ -1940,19 +2072,17 @@ async def publish_draft(
         # BOTH folders on disk — the student-facing state would be confusing
         # and the frontend would show duplicates.
         try:
-            shutil.copytree(draft_path, dest)
+            await run_fs(clone_tree, draft_path, dest)
         except Exception as e:
-            if os.path.exists(dest):
-                shutil.rmtree(dest, ignore_errors=True)
             raise HTTPException(
                 status_code=500,
                 detail=f"Failed to copy draft into assignments: {e}",
             )
         try:
-            shutil.rmtree(draft_path)
+            await run_fs(shutil.rmtree, draft_path)
         except OSError as e:
             # Roll back the copy so we don't leave duplicates.
-            shutil.rmtree(dest, ignore_errors=True)
+            await run_fs(shutil.rmtree, dest, ignore_errors=True)
             logger.warning(
                 "Publish: could not remove draft %s after copy: %s (rolled back)",
                 draft_path, e,
@@ -1965,40 +2095,36 @@ async def publish_draft(
                 ),
             )
 
-    _set_ownership_recursive(dest)
+    await run_fs(normalize_tree, dest)
 
     # Push to all current participants
-    participants = db.exec(
-        select(ClassroomMember).where(
-            ClassroomMember.classroom_id == classroom_id,
-            ClassroomMember.role == "participant",
-        )
-    ).all()
+    targets = await run_db(_publish_targets, db, classroom_id, draft_name)
 
-    if participants:
-        participant_users = db.exec(
-            select(User).where(User.id.in_([p.user_id for p in participants]))
-        ).all()
-        for pu in participant_users:
-            sanitized = (pu.email or "participant").replace("/", "_")
-            participant_dir = os.path.join(
-                CLASSROOMS_ROOT, classroom_id, "participants", sanitized
-            )
-            student_dest = os.path.join(participant_dir, draft_name)
-            if os.path.exists(student_dest):
-                continue  # Don't overwrite existing student work
-            try:
-                os.makedirs(participant_dir, exist_ok=True)
-                shutil.copytree(dest, student_dest)
-                _set_ownership_recursive(student_dest)
-                await notify_files_changed(str(pu.id))
-            except Exception as e:
-                logger.warning(
-                    "Failed to push template %s to %s: %s", draft_name, pu.email, e
-                )
+    # Student copies are made by a background job; the page polls
+    # /publish-jobs for its progress.
+    job = await get_publish_jobs().start(classroom_id, draft_name, dest, targets)
 
+    get_gradebooks().invalidate(classroom_id)
     await notify_files_changed(str(user.id))
-    return {"message": "Published", "name": draft_name}
+    return {
+        "message": "Published",
+        "name": draft_name,
+        "job_id": job["id"],
+        "participants": len(targets),
+    }
+
+
+@router.get("/{classroom_id}/publish-jobs")
+async def list_publish_jobs(
+    classroom_id: str,
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    """Progress of assignment copies running for this classroom, and of
+    those that finished in the last few minutes (``finished`` set)."""
+    if not _is_instructor(db, classroom_id, str(user.id)):
+        raise HTTPException(status_code=403, detail="Not an instructor")
+    return {"jobs": get_publish_jobs().jobs_for(classroom_id)}
 
 
 @router.delete("/{classroom_id}/assignments/{template_name}")
@@ -2017,6 +2143,7 @@ async def delete_assignment(
     if not os.path.isdir(assignment_path):
         raise HTTPException(status_code=404, detail="Assignment not found")
 
-    shutil.rmtree(assignment_path)
+    await run_fs(shutil.rmtree, assignment_path)
+    get_gradebooks().invalidate(classroom_id)
     await notify_files_changed(str(user.id))
     return {"message": "Assignment deleted"}
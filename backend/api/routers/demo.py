@@ -29,6 +29,7 @@ from ..demo import (
     TESTS_PER_TEMPLATE,
     student_file_content,
 )
+from ..gradebook import student_grade
 
 logger = logging.getLogger("demo-router")
 
@@ -69,20 +70,28 @@ async def get_demo_progress():
     students = []
     for sid, name, email in DEMO_STUDENTS:
         student_results = DEMO_TEST_RESULTS.get(sid, {})
+        results = {
+            t: {
+                "passed": student_results.get(t, 0),
+                "total": TESTS_PER_TEMPLATE.get(t, 0),
+            }
+            for t in templates
+        }
         students.append({
             "id": sid,
             "email": email,
             "name": name,
-            "results": {
-                t: {
-                    "passed": student_results.get(t, 0),
-                    "total": TESTS_PER_TEMPLATE.get(t, 0),
-                }
-                for t in templates
-            },
+            "results": results,
+            "manual_scores": {},
+            "grade": student_grade(templates, results, DEMO_GRADING_MODE, {}, {}),
         })
     students.sort(key=lambda p: (p["name"] or p["email"] or "").lower())
-    return {"students": students, "templates": templates}
+    return {
+        "students": students,
+        "templates": templates,
+        "grading_mode": DEMO_GRADING_MODE,
+        "weights": {},
+    }
 
 
 @router.get("/weights")
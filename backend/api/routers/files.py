@@ -1,25 +1,46 @@
-import io
+import base64
+import codecs
+import errno
+import hashlib
+import json
 import logging
 import os
 import shutil
+import stat
 import subprocess
+import tarfile
+import tempfile
 import zipfile
+import zlib
+from typing import IO, Callable, Iterator
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, Response, UploadFile
 from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from sqlmodel import Session, select
 
-from backend.docker import CLASSROOMS_ROOT, UPLOADS_ROOT, CONTAINER_USER_UID, CONTAINER_USER_GID
+from backend.docker import CLASSROOMS_ROOT, UPLOADS_ROOT
+from backend.ownership import normalize_paths, normalize_tree
 
 from ..database import Classroom, ClassroomMember, User
 from ..dependencies import get_db, get_onboarded_user
-from ..terminal import notify_files_changed, session_map
+from ..file_index import get_file_index
+from ..gradebook import get_gradebooks
+from ..offload import run_db, run_fs
+from ..publish import get_publish_jobs
+from ..search_index import get_search_indexes
+from ..terminal import add_files_changed_listener, notify_files_changed, session_map
+from ..upload_sessions import RESUMABLE_CHUNK_BYTES, UploadSessionError, get_upload_sessions
+from ..zipstream import iter_zip
 
 logger = logging.getLogger("files")
 
 router = APIRouter()
 
+add_files_changed_listener(get_file_index().on_files_changed)
+add_files_changed_listener(get_search_indexes().on_files_changed)
+add_files_changed_listener(get_gradebooks().on_files_changed)
+
 
 # ---------------------------------------------------------------------------
 # Helpers
@@ -33,25 +54,11 @@ def set_container_ownership(path: str) -> None:
     Directories: 2775 — setgid-group-writable so children inherit GID 995.
     Files: 664 — group-writable so the backend (www-data, member of
     csroom-container / GID 995) and the container user can both edit.
-    chown to 999:995 requires CAP_CHOWN; if unavailable we fall back to a
-    group-only chgrp so group access still survives.
+    Only *path* itself is touched, and only where it differs; see
+    backend.ownership for trees and batches.
     """
-    try:
-        # chown applies to both dirs and files. Try the full chown first,
-        # fall back to group-only (survives non-root).
-        try:
-            os.chown(path, CONTAINER_USER_UID, CONTAINER_USER_GID)
-        except OSError:
-            try:
-                os.chown(path, -1, CONTAINER_USER_GID)
-            except OSError:
-                pass
-        if os.path.isdir(path):
-            os.chmod(path, 0o2775)
-        else:
-            os.chmod(path, 0o664)
-    except OSError as e:
-        logger.warning(f"Failed to set ownership for {path}: {e}")
+    if normalize_paths([path]).errors:
+        logger.warning(f"Failed to set ownership for {path}")
 
 
 def _translate_container_path(path: str) -> str:
@@ -154,9 +161,12 @@ def _append_classroom_tree_entries(
     host_base: str,
     _visited_paths: set[str] | None = None,
     show_hidden: bool = False,
+    dirs_read: list[str] | None = None,
+    mounts: list[tuple[str, str]] | None = None,
 ) -> None:
     """Append directory and file entries for a classroom mount under the
-    given slug name."""
+    given slug name. Every directory listed is appended to *dirs_read* and
+    every mount expanded to *mounts* as ``(host_base, slug_name)``."""
     if not os.path.isdir(host_base):
         return
 
@@ -172,6 +182,8 @@ def _append_classroom_tree_entries(
         return
 
     file_list.append(f"{slug_name}/")
+    if mounts is not None:
+        mounts.append((host_base, slug_name))
 
     # First pass: handle symlinks specially at this level
     try:
@@ -202,6 +214,8 @@ def _append_classroom_tree_entries(
                                 target_host,
                                 _visited_paths,
                                 show_hidden=show_hidden,
+                                dirs_read=dirs_read,
+                                mounts=mounts,
                             )
                     else:
                         file_entry = f"{slug_name}/{entry}"
@@ -214,6 +228,8 @@ def _append_classroom_tree_entries(
 
     # Second pass: os.walk for regular files and directories (skip symlinks)
     for root, dirs, files_in_dir in os.walk(host_base, followlinks=False):
+        if dirs_read is not None:
+            dirs_read.append(root)
         rel = os.path.relpath(root, host_base)
         prefix = slug_name if rel == "." else f"{slug_name}/{rel}"
 
@@ -446,19 +462,15 @@ def _ensure_readme(upload_dir: str, user: User) -> None:
 # ---------------------------------------------------------------------------
 
 
-@router.get("/list")
-async def list_files(
-    show_hidden: bool = False,
-    user: User = Depends(get_onboarded_user),
-    db: Session = Depends(get_db),
-):
-    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
-    _ensure_readme(upload_dir, user)
-
-    if not os.path.exists(upload_dir):
-        return {"files": [], "classroomMeta": {}}
-
+def _build_file_tree(
+    upload_dir: str, show_hidden: bool, mounts: list[tuple[str, str]] | None = None,
+) -> tuple[list[str], dict[str, str], list[str]]:
+    """Walk a workspace for the explorer. Returns the flat entry list
+    (directories end in ``/``), top-level classroom slug -> classroom id,
+    and every directory that was listed (for cache revalidation). Classroom
+    mounts expanded along the way are appended to *mounts*."""
     file_tree: list[str] = []
+    dirs_read: list[str] = [upload_dir]
     expanded_symlinks: set[str] = set()
     classroom_symlinks: dict[str, str] = {}
     top_level_symlinks: set[str] = set()
@@ -478,12 +490,13 @@ async def list_files(
             host_base = os.path.join(CLASSROOMS_ROOT, tail)
             if not os.path.exists(host_base):
                 logger.warning(
-                    f"[{user.id}] Host classroom path missing for symlink {entry}: {host_base}"
+                    f"[{upload_dir}] Host classroom path missing for symlink {entry}: {host_base}"
                 )
                 continue
 
             _append_classroom_tree_entries(
-                file_tree, entry, host_base, show_hidden=show_hidden
+                file_tree, entry, host_base, show_hidden=show_hidden, dirs_read=dirs_read,
+                mounts=mounts,
             )
             expanded_symlinks.add(f"{entry}/")
             top_level_symlinks.add(entry)
@@ -495,6 +508,7 @@ async def list_files(
 
     # Walk user files under UPLOADS_ROOT/<id>
     for root, dirs, files_in_dir in os.walk(upload_dir):
+        dirs_read.append(root)
         for d in list(dirs):
             # Skip hidden directories (dotfiles except .env*, __pycache__, etc.)
             if not show_hidden and _is_hidden(d):
@@ -514,7 +528,8 @@ async def list_files(
                 if tail:
                     host_base = os.path.join(CLASSROOMS_ROOT, tail)
                     _append_classroom_tree_entries(
-                        file_tree, relative_path, host_base, show_hidden=show_hidden
+                        file_tree, relative_path, host_base, show_hidden=show_hidden,
+                        dirs_read=dirs_read, mounts=mounts,
                     )
                     expanded_symlinks.add(f"{relative_path}/")
                     if "/" not in relative_path:
@@ -537,7 +552,8 @@ async def list_files(
                 if tail:
                     host_base = os.path.join(CLASSROOMS_ROOT, tail)
                     _append_classroom_tree_entries(
-                        file_tree, relative_path, host_base, show_hidden=show_hidden
+                        file_tree, relative_path, host_base, show_hidden=show_hidden,
+                        dirs_read=dirs_read, mounts=mounts,
                     )
                     expanded_symlinks.add(relative_path)
                     continue
@@ -558,7 +574,24 @@ async def list_files(
         seen: set[str] = set()
         file_tree = [e for e in file_tree if not (e in seen or seen.add(e))]
 
-    # Build classroom metadata from the database
+    return file_tree, classroom_symlinks, dirs_read
+
+
+def _watch_roots(user_id: str) -> list[tuple[str, str]]:
+    """Host directories the explorer shows *user_id*, as ``(host_dir,
+    explorer_prefix)``: the workspace itself plus every classroom mount."""
+    upload_dir = os.path.join(UPLOADS_ROOT, user_id)
+    if not os.path.isdir(upload_dir):
+        return []
+    mounts: list[tuple[str, str]] = []
+    _build_file_tree(upload_dir, False, mounts)
+    return [(upload_dir, ""), *mounts]
+
+
+def _classroom_meta(
+    db: Session, user_id: str, classroom_symlinks: dict[str, str],
+) -> dict[str, dict]:
+    """Explorer metadata for each top-level classroom slug."""
     classroom_meta: dict[str, dict] = {}
     if classroom_symlinks:
         classroom_ids = list(set(classroom_symlinks.values()))
@@ -570,7 +603,7 @@ async def list_files(
         members = db.exec(
             select(ClassroomMember).where(
                 ClassroomMember.classroom_id.in_(classroom_ids),
-                ClassroomMember.user_id == str(user.id),
+                ClassroomMember.user_id == user_id,
             )
         ).all()
         member_map = {m.classroom_id: m for m in members}
@@ -583,8 +616,255 @@ async def list_files(
                 "archived": member.archived if member else False,
                 "isInstructor": (member.role == "instructor") if member else False,
             }
+    return classroom_meta
 
-    return {"files": file_tree, "classroomMeta": classroom_meta}
+
+@router.get("/list")
+async def list_files(
+    request: Request,
+    show_hidden: bool = False,
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
+    _ensure_readme(upload_dir, user)
+
+    if not os.path.exists(upload_dir):
+        return {"files": [], "classroomMeta": {}}
+
+    # Served from the per-user index (see api.file_index); the walk only
+    # happens when something under the workspace changed.
+    tree = await run_fs(
+        get_file_index().get,
+        str(user.id), show_hidden, lambda: _build_file_tree(upload_dir, show_hidden),
+    )
+    file_tree = tree.files
+    classroom_symlinks = tree.classrooms
+
+    classroom_meta = await run_db(_classroom_meta, db, str(user.id), classroom_symlinks)
+
+    body = {"files": file_tree, "classroomMeta": classroom_meta, "version": tree.version}
+    etag = '"' + hashlib.sha256(
+        f"{tree.version}:{json.dumps(classroom_meta, sort_keys=True)}".encode()
+    ).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in (t.strip() for t in request.headers.get("if-none-match", "").split(",")):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
+
+
+# ---------------------------------------------------------------------------
+# Full-text search
+# ---------------------------------------------------------------------------
+
+SEARCH_DEFAULT_LIMIT = 100
+SEARCH_MAX_LIMIT = 500
+
+
+def _searchable_files(user_id: str) -> dict[str, str]:
+    """Explorer path -> host path for every file ``/list`` shows *user_id*
+    (hidden files excluded)."""
+    upload_dir = f"{UPLOADS_ROOT}/{user_id}"
+    tree = get_file_index().get(
+        user_id, False, lambda: _build_file_tree(upload_dir, False),
+    )
+    return {
+        rel: _resolve_abs_path(upload_dir, rel)
+        for rel in tree.files
+        if not rel.endswith("/")
+    }
+
+
+def _search_workspace(user_id: str, query: str, limit: int) -> dict:
+    index = get_search_indexes().get(user_id, lambda: _searchable_files(user_id), _is_hidden)
+    return index.search(query, limit)
+
+
+@router.get("/search")
+async def search_files(
+    q: str,
+    limit: int = SEARCH_DEFAULT_LIMIT,
+    user: User = Depends(get_onboarded_user),
+):
+    """Case-insensitive substring search over the workspace and classroom
+    mounts, limited to what the explorer shows. Returns ``{path, line,
+    column, text}`` per matching line, files in path order."""
+    if len(q) < 3:
+        raise HTTPException(status_code=400, detail="Search for at least 3 characters")
+    if not os.path.isdir(f"{UPLOADS_ROOT}/{user.id}"):
+        return {"query": q, "results": [], "files": 0, "truncated": False}
+    limit = max(1, min(limit, SEARCH_MAX_LIMIT))
+    body = await run_fs(_search_workspace, str(user.id), q, limit)
+    return {"query": q, **body}
+
+
+# ---------------------------------------------------------------------------
+# Lazy per-directory listing
+# ---------------------------------------------------------------------------
+
+LIST_DIR_DEFAULT_LIMIT = 200
+LIST_DIR_MAX_LIMIT = 1000
+
+# How list_files treats a directory's contents, by where the directory sits:
+# the workspace itself, the root of a classroom mount (whose symlinks are
+# expanded), deeper inside a mount (symlinks dropped), or a non-classroom
+# symlinked directory (listed, never descended into).
+_WORKSPACE, _MOUNT_ROOT, _MOUNT, _OPAQUE = "workspace", "mount-root", "mount", "opaque"
+
+
+def _dir_level(
+    host_dir: str, state: str, show_hidden: bool,
+) -> list[tuple[str, bool, str, str, str | None]]:
+    """One level of the explorer tree, applying the same rules as
+    ``_build_file_tree``. Returns ``(name, is_dir, host_path, child_state,
+    classroom_id)`` per visible entry; *classroom_id* is set for classroom
+    mounts found in the workspace."""
+    if state == _OPAQUE:
+        return []
+    try:
+        entries = list(os.scandir(host_dir))
+    except OSError:
+        return []
+    out = []
+    for e in entries:
+        if not show_hidden and _is_hidden(e.name):
+            continue
+        try:
+            is_link = e.is_symlink()
+            is_dir = e.is_dir()  # follows symlinks
+        except OSError:
+            continue
+        if state == _WORKSPACE:
+            if is_link:
+                tail = _classroom_tail_from_symlink(e.path, os.readlink(e.path))
+                if tail:
+                    host_base = os.path.join(CLASSROOMS_ROOT, tail)
+                    if os.path.isdir(host_base):
+                        out.append((e.name, True, host_base, _MOUNT_ROOT, tail.split("/", 1)[0]))
+                    continue
+                if is_dir:
+                    out.append((e.name, True, e.path, _OPAQUE, None))
+                    continue
+            if is_dir:
+                out.append((e.name, True, e.path, _WORKSPACE, None))
+            elif not e.name.endswith(".pyc"):
+                out.append((e.name, False, e.path, "", None))
+        elif is_link:
+            if state != _MOUNT_ROOT:
+                continue
+            target = _translate_container_path(os.readlink(e.path))
+            target_host = os.path.join(host_dir, target)
+            if os.path.isdir(target_host):
+                out.append((e.name, True, target_host, _MOUNT_ROOT, None))
+            else:
+                out.append((e.name, False, e.path, "", None))
+        else:
+            out.append((e.name, is_dir, e.path, _MOUNT if is_dir else "", None))
+    return out
+
+
+def _resolve_list_dir(upload_dir: str, rel_path: str, show_hidden: bool) -> tuple[str, str]:
+    """Walk explorer path *rel_path* component by component, returning the
+    host directory and its listing state; 404 for anything list_files
+    would not show."""
+    host, state = upload_dir, _WORKSPACE
+    for part in [p for p in rel_path.split("/") if p]:
+        match = next(
+            (e for e in _dir_level(host, state, show_hidden) if e[0] == part and e[1]), None,
+        )
+        if match is None:
+            raise HTTPException(status_code=404, detail="Directory not found")
+        host, state = match[2], match[3]
+    return host, state
+
+
+def _encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        rank, folded, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(rank), str(folded), str(name)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _list_dir_page(
+    upload_dir: str, rel_path: str, show_hidden: bool, cursor: str | None, limit: int,
+) -> tuple[list[dict], int, str | None, dict[str, str]]:
+    """Return ``(entries, total, next_cursor, classroom_symlinks)`` for one
+    page of *rel_path*; *classroom_symlinks* is only filled at the root."""
+    rel_path = rel_path.strip("/")
+    host, state = _resolve_list_dir(upload_dir, rel_path, show_hidden)
+    level = _dir_level(host, state, show_hidden)
+    classrooms = {n: c for n, _d, _h, _s, c in level if c} if not rel_path else {}
+    inherited = None
+    if rel_path:
+        top = rel_path.split("/", 1)[0]
+        inherited = next(
+            (c for n, _d, _h, _s, c in _dir_level(upload_dir, _WORKSPACE, True) if n == top),
+            None,
+        )
+
+    # Folders first, then case-insensitive by name — the explorer's order.
+    keyed = sorted(((0 if e[1] else 1, e[0].lower(), e[0]), e) for e in level)
+    if cursor:
+        after = _decode_cursor(cursor)
+        keyed = [kv for kv in keyed if kv[0] > after]
+    page = keyed[:limit]
+
+    entries = []
+    for _key, (name, is_dir, child_host, child_state, classroom_id) in page:
+        entry = {"name": name, "path": f"{rel_path}/{name}" if rel_path else name}
+        if is_dir:
+            entry["type"] = "dir"
+            entry["children"] = len(_dir_level(child_host, child_state, show_hidden))
+        else:
+            entry["type"] = "file"
+            try:
+                entry["size"] = os.stat(child_host).st_size
+            except OSError:
+                entry["size"] = None
+        if classroom_id or inherited:
+            entry["classroomId"] = classroom_id or inherited
+        entries.append(entry)
+    next_cursor = _encode_cursor(page[-1][0]) if len(keyed) > limit else None
+    return entries, len(level), next_cursor, classrooms
+
+
+@router.get("/list-dir")
+async def list_dir(
+    path: str = "",
+    show_hidden: bool = False,
+    cursor: str | None = None,
+    limit: int = LIST_DIR_DEFAULT_LIMIT,
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    """One directory level of the explorer tree, for expanding folders on
+    demand. Entries are ``{name, path, type}`` plus ``children`` (visible
+    entry count) for directories and ``size`` for files, sorted folders
+    first; pass ``nextCursor`` back as *cursor* for the following page.
+    Listing the root also returns ``classroomMeta`` as ``/list`` does."""
+    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
+    _ensure_readme(upload_dir, user)
+    if not os.path.isdir(upload_dir):
+        raise HTTPException(status_code=404, detail="Directory not found")
+    limit = max(1, min(limit, LIST_DIR_MAX_LIMIT))
+
+    entries, total, next_cursor, classrooms = await run_fs(
+        _list_dir_page, upload_dir, path, show_hidden, cursor, limit,
+    )
+    body = {
+        "path": path.strip("/"),
+        "entries": entries,
+        "total": total,
+        "nextCursor": next_cursor,
+    }
+    if not body["path"]:
+        body["classroomMeta"] = await run_db(_classroom_meta, db, str(user.id), classrooms)
+    return body
 
 
 @router.post("/move")
@@ -679,14 +959,14 @@ async def move_file_or_folder(
                     status_code=409, detail="Destination already exists"
                 )
             if os.path.isdir(dst_path):
-                shutil.rmtree(dst_path)
+                await run_fs(shutil.rmtree, dst_path)
             else:
                 os.remove(dst_path)
 
-        shutil.move(src_path, dst_path)
+        await run_fs(shutil.move, src_path, dst_path)
         set_container_ownership(dst_path)
 
-        await notify_files_changed(str(user.id))
+        await notify_files_changed(str(user.id), [src_path, dst_path])
         return {"message": "Moved successfully"}
     except HTTPException:
         raise
@@ -757,43 +1037,122 @@ async def copy_file_or_folder(
 
     try:
         if os.path.isdir(src_path):
-            shutil.copytree(src_path, final_dst)
-            for root, dirs, fnames in os.walk(final_dst):
-                set_container_ownership(root)
-                for fn in fnames:
-                    set_container_ownership(os.path.join(root, fn))
+            await run_fs(shutil.copytree, src_path, final_dst)
+            await run_fs(normalize_tree, final_dst)
         else:
             dst_parent = os.path.dirname(final_dst)
             os.makedirs(dst_parent, exist_ok=True)
             set_container_ownership(dst_parent)
-            shutil.copy2(src_path, final_dst)
+            await run_fs(shutil.copy2, src_path, final_dst)
             set_container_ownership(final_dst)
     except PermissionError:
         raise HTTPException(status_code=403, detail="Permission denied")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to copy: {e}")
 
-    await notify_files_changed(str(user.id))
+    await notify_files_changed(str(user.id), [final_dst])
     return {"message": "Copied successfully"}
 
 
-@router.post("/upload")
-async def upload(
-    files: list[UploadFile] = File(...),
-    destination: str = Form(default=""),
-    overwrite: bool = Form(default=False),
-    user: User = Depends(get_onboarded_user),
-    db: Session = Depends(get_db),
-):
-    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
-    os.makedirs(upload_dir, exist_ok=True)
-    set_container_ownership(upload_dir)
+# ---------------------------------------------------------------------------
+# Streaming uploads
+# ---------------------------------------------------------------------------
 
-    if not files:
-        raise HTTPException(status_code=400, detail="No files provided")
+MAX_UPLOAD_BYTES = 1_000_000_000  # 1 GB per request
+UPLOAD_CHUNK_BYTES = 1 << 20
+# Refuse to write the last of the disk: uploads stop while less than this
+# would remain free on the target filesystem.
+UPLOAD_MIN_FREE_BYTES = 512 * 1024 * 1024
+
+
+class _UploadBudget:
+    """Bytes written so far by one request, checked chunk by chunk."""
+
+    def __init__(self, limit: int = MAX_UPLOAD_BYTES):
+        self.limit = limit
+        self.used = 0
+
+    def take(self, n: int) -> None:
+        self.used += n
+        if self.used > self.limit:
+            raise HTTPException(status_code=413, detail="Upload exceeds 1 GB limit")
+
+
+def _check_free_space(fd: int, incoming: int) -> None:
+    st = os.fstatvfs(fd)
+    if st.f_bavail * st.f_frsize - incoming < UPLOAD_MIN_FREE_BYTES:
+        raise HTTPException(status_code=507, detail="Not enough disk space for upload")
+
+
+def _write_chunk(fh, chunk: bytes) -> None:
+    _check_free_space(fh.fileno(), len(chunk))
+    fh.write(chunk)
+
+
+def _replace_with(tmp_path: str, dest_path: str) -> None:
+    if os.path.isdir(dest_path) and not os.path.islink(dest_path):
+        shutil.rmtree(dest_path)
+    os.replace(tmp_path, dest_path)
+
+
+def _move_into_place(src_path: str, dest_path: str) -> None:
+    """Move a finished resumable upload to *dest_path* and fix its owner.
+
+    The part file usually sits on another filesystem (a different docker
+    volume) than the workspace, where ``rename`` fails with EXDEV; it is
+    then copied to a hidden temp file next to the destination and renamed
+    over, so the destination is never seen half-written.
+    """
+    try:
+        _replace_with(src_path, dest_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path), prefix=".upload-")
+        try:
+            with open(src_path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                shutil.copyfileobj(src, dst, UPLOAD_CHUNK_BYTES)
+            _replace_with(tmp_path, dest_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        os.unlink(src_path)
+    set_container_ownership(dest_path)
+
+
+async def _stream_upload(f: UploadFile, dest_path: str, budget: _UploadBudget) -> None:
+    """Copy *f* to *dest_path* in ``UPLOAD_CHUNK_BYTES`` chunks.
+
+    Data goes to a hidden temp file next to the destination and is renamed
+    into place only once complete, so a rejected or aborted upload never
+    leaves a truncated file (or clobbers the old one). An existing directory
+    of the same name is replaced. Every write runs on the FS pool.
+    """
+    fd, tmp_path = await run_fs(
+        tempfile.mkstemp, dir=os.path.dirname(dest_path), prefix=".upload-",
+    )
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            while chunk := await f.read(UPLOAD_CHUNK_BYTES):
+                budget.take(len(chunk))
+                await run_fs(_write_chunk, fh, chunk)
+        await run_fs(_replace_with, tmp_path, dest_path)
+    except BaseException:
+        # Inline on purpose: one unlink, and it must run even when the
+        # request is being cancelled.
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
 
-    MAX_UPLOAD_BYTES = 1_000_000_000  # 1 GB
 
+def _upload_target_dir(upload_dir: str, destination: str, user: User, db: Session) -> str:
+    """Directory /upload writes into: *destination* inside the workspace
+    (created if needed), or the workspace root."""
     destination = destination.strip("/")
 
     if destination:
@@ -819,8 +1178,26 @@ async def upload(
             os.chmod(target_dir, 0o777)
         except PermissionError:
             pass
-    else:
-        target_dir = upload_dir
+        return target_dir
+    return upload_dir
+
+
+@router.post("/upload")
+async def upload(
+    files: list[UploadFile] = File(...),
+    destination: str = Form(default=""),
+    overwrite: bool = Form(default=False),
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
+    os.makedirs(upload_dir, exist_ok=True)
+    set_container_ownership(upload_dir)
+
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+
+    target_dir = _upload_target_dir(upload_dir, destination, user, db)
 
     # Mirror /files/move: if any uploaded name already exists at target,
     # return 409 with the conflicting names so the frontend can prompt
@@ -837,63 +1214,186 @@ async def upload(
                 content={"detail": "Files already exist", "conflicts": conflicts},
             )
 
-    total_size = 0
+    budget = _UploadBudget()
+    written = [target_dir] if destination else []
     for f in files:
         file_path = os.path.join(target_dir, os.path.basename(f.filename))
-        content = await f.read()
-        total_size += len(content)
-        if total_size > MAX_UPLOAD_BYTES:
-            raise HTTPException(status_code=413, detail="Upload exceeds 1 GB limit")
-        # On overwrite, replace existing files/dirs cleanly. A pre-existing
-        # directory of the same name would otherwise break `open(..., "wb")`.
-        if os.path.isdir(file_path):
-            shutil.rmtree(file_path)
-        with open(file_path, "wb") as fh:
-            fh.write(content)
-        set_container_ownership(file_path)
+        await _stream_upload(f, file_path, budget)
+        written.append(file_path)
+    await run_fs(normalize_paths, written)
 
-    if destination:
-        set_container_ownership(target_dir)
+    await notify_files_changed(str(user.id), [target_dir])
+    return PlainTextResponse("File uploaded successfully")
+
+
+# ---------------------------------------------------------------------------
+# Resumable uploads
+#
+#   POST   /uploads                 {filename, size, destination, overwrite}
+#   GET    /uploads/{id}            -> {offset, size}
+#   PUT    /uploads/{id}?offset=N   raw bytes appended at N
+#   POST   /uploads/{id}/complete   moves the file into place; 409 if the
+#                                   name was taken meanwhile, retry with
+#                                   ?overwrite=true to replace it
+#   DELETE /uploads/{id}
+# ---------------------------------------------------------------------------
+
+
+class ResumableUploadRequest(BaseModel):
+    filename: str
+    size: int
+    destination: str = ""
+    overwrite: bool = False
+
+
+def _session_error(e: UploadSessionError) -> JSONResponse:
+    return JSONResponse(status_code=e.status_code, content={"detail": e.detail, **e.extra})
+
+
+def _session_view(session: dict) -> dict:
+    return {
+        "id": session["id"],
+        "filename": session["filename"],
+        "offset": session.get("offset", 0),
+        "size": session["size"],
+        "chunkSize": RESUMABLE_CHUNK_BYTES,
+    }
+
+
+@router.post("/uploads")
+async def create_resumable_upload(
+    body: ResumableUploadRequest,
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    filename = os.path.basename(body.filename.replace("\\", "/"))
+    if not filename or filename in (".", ".."):
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    if body.size < 0 or body.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Upload exceeds 1 GB limit")
+    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
+    await run_fs(os.makedirs, upload_dir, exist_ok=True)
+    target_dir = _upload_target_dir(upload_dir, body.destination, user, db)
+    if not body.overwrite and await run_fs(os.path.exists, os.path.join(target_dir, filename)):
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Files already exist", "conflicts": [filename]},
+        )
+    st = await run_fs(os.statvfs, target_dir)
+    if st.f_bavail * st.f_frsize - body.size < UPLOAD_MIN_FREE_BYTES:
+        raise HTTPException(status_code=507, detail="Not enough disk space for upload")
+    try:
+        session = await run_fs(
+            get_upload_sessions().create,
+            str(user.id),
+            filename=filename,
+            destination=body.destination,
+            size=body.size,
+            overwrite=body.overwrite,
+        )
+    except UploadSessionError as e:
+        return _session_error(e)
+    return _session_view(session)
+
+
+@router.get("/uploads/{upload_id}")
+async def get_resumable_upload(upload_id: str, user: User = Depends(get_onboarded_user)):
+    try:
+        return _session_view(get_upload_sessions().load(str(user.id), upload_id))
+    except UploadSessionError as e:
+        return _session_error(e)
 
-    await notify_files_changed(str(user.id))
+
+@router.put("/uploads/{upload_id}")
+async def put_resumable_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    user: User = Depends(get_onboarded_user),
+):
+    """Append the request body at *offset*. Whatever arrives is kept even if
+    the connection drops mid-chunk; the client resumes from ``GET``'s offset."""
+    store = get_upload_sessions()
+    try:
+        session = store.load(str(user.id), upload_id)
+        fh = store.open_for_append(session, offset)
+    except UploadSessionError as e:
+        return _session_error(e)
+    with fh:
+        written = offset
+        async for chunk in request.stream():
+            if written + len(chunk) > session["size"]:
+                fh.truncate(written)
+                raise HTTPException(status_code=413, detail="Chunk runs past the declared size")
+            await run_fs(_write_chunk, fh, chunk)
+            written += len(chunk)
+    store.touch(session)
+    return {"offset": written, "size": session["size"]}
+
+
+@router.post("/uploads/{upload_id}/complete")
+async def complete_resumable_upload(
+    upload_id: str,
+    overwrite: bool = False,
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    """Move the finished upload into place. The name is checked again, as
+    on ``/upload``: something may have been created there since the
+    session started, and only an overwrite the user confirmed (at create
+    or on this call) may replace it."""
+    store = get_upload_sessions()
+    try:
+        session = store.load(str(user.id), upload_id)
+    except UploadSessionError as e:
+        return _session_error(e)
+    if session["offset"] != session["size"]:
+        return JSONResponse(
+            status_code=409,
+            content={"detail": "Upload is incomplete", "offset": session["offset"]},
+        )
+    # Re-resolve: classroom membership may have changed since the upload began.
+    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
+    target_dir = _upload_target_dir(upload_dir, session["destination"], user, db)
+    file_path = os.path.join(target_dir, session["filename"])
+    if await run_fs(os.path.lexists, file_path):
+        if not (overwrite or session.get("overwrite")):
+            # The session stays, so the client can confirm and retry.
+            return JSONResponse(
+                status_code=409,
+                content={"detail": "Files already exist", "conflicts": [session["filename"]]},
+            )
+    await run_fs(_move_into_place, store.part_path(upload_id), file_path)
+    await run_fs(store.remove, upload_id)
+    await notify_files_changed(str(user.id), [file_path])
     return PlainTextResponse("File uploaded successfully")
 
 
-def _collision_safe_copy(src_dir: str, dest_parent: str, name: str) -> None:
-    """Copy src_dir into dest_parent as *name*, appending (1), (2), … on collision."""
+@router.delete("/uploads/{upload_id}")
+async def abort_resumable_upload(upload_id: str, user: User = Depends(get_onboarded_user)):
+    store = get_upload_sessions()
+    try:
+        store.load(str(user.id), upload_id)
+    except UploadSessionError as e:
+        return _session_error(e)
+    store.remove(upload_id)
+    return PlainTextResponse("Upload cancelled")
+
+
+def _collision_safe_name(dest_parent: str, name: str) -> str:
+    """Path for *name* in dest_parent, appending (1), (2), … on collision."""
     candidate = os.path.join(dest_parent, name)
     if os.path.exists(candidate):
         i = 1
         while os.path.exists(os.path.join(dest_parent, f"{name} ({i})")):
             i += 1
         candidate = os.path.join(dest_parent, f"{name} ({i})")
-    shutil.copytree(src_dir, candidate)
-    for root, dirs, fnames in os.walk(candidate):
-        try:
-            os.chmod(root, 0o775)
-            os.chown(root, CONTAINER_USER_UID, CONTAINER_USER_GID)
-        except OSError:
-            pass
-        for fn in fnames:
-            fp = os.path.join(root, fn)
-            try:
-                os.chown(fp, CONTAINER_USER_UID, CONTAINER_USER_GID)
-                os.chmod(fp, 0o664)
-            except OSError:
-                pass
-
+    return candidate
 
-async def _push_template_to_participants(
-    cid: str,
-    template_name: str,
-    src: str,
-    db: Session,
-) -> None:
-    """Copy *src* directory into every participant's workspace as *template_name*."""
-    if not os.path.isdir(src):
-        logger.warning("Template source not found, skipping push: %s", src)
-        return
 
+def _template_push_targets(cid: str, template_name: str, db: Session) -> list[tuple[str, str]]:
+    """``(participant_id, dest)`` for every participant of *cid* whose
+    classroom directory exists."""
     participants = db.exec(
         select(ClassroomMember).where(
             ClassroomMember.classroom_id == cid,
@@ -901,25 +1401,45 @@ async def _push_template_to_participants(
         )
     ).all()
     if not participants:
-        return
+        return []
 
     participant_users = db.exec(
         select(User).where(User.id.in_([p.user_id for p in participants]))
     ).all()
 
+    targets = []
     for participant in participant_users:
         sanitized_email = (participant.email or "participant").replace("/", "_")
         classroom_participant_dir = os.path.join(CLASSROOMS_ROOT, cid, "participants", sanitized_email)
         if not os.path.isdir(classroom_participant_dir):
             continue
-        try:
-            _collision_safe_copy(src, classroom_participant_dir, template_name)
-            await notify_files_changed(str(participant.id))
-        except Exception as e:
-            logger.warning(
-                "Failed to push template %s to participant %s: %s",
-                template_name, participant.id, e,
-            )
+        # Resolved now and journaled with the job, so a resumed job finds
+        # the copies it already made instead of adding "(1)" siblings.
+        targets.append((
+            str(participant.id),
+            _collision_safe_name(classroom_participant_dir, template_name),
+        ))
+    return targets
+
+
+async def _push_template_to_participants(
+    cid: str,
+    template_name: str,
+    src: str,
+    db: Session,
+) -> None:
+    """Start a background job copying *src* into every participant's
+    workspace as *template_name*."""
+    if not os.path.isdir(src):
+        logger.warning("Template source not found, skipping push: %s", src)
+        return
+
+    targets = await run_db(_template_push_targets, cid, template_name, db)
+    if targets:
+        await get_publish_jobs().start(
+            cid, template_name, src, targets,
+            modes={"dir_mode": 0o775, "file_mode": 0o664},
+        )
 
 
 async def _push_classroom_templates_to_participants(
@@ -932,26 +1452,13 @@ async def _push_classroom_templates_to_participants(
         await _push_template_to_participants(cid, template_name, src, db)
 
 
-@router.post("/upload-folder")
-async def upload_folder(
-    request: Request,
-    files: list[UploadFile] = File(...),
-    user: User = Depends(get_onboarded_user),
-    db: Session = Depends(get_db),
-):
-    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
-    os.makedirs(upload_dir, exist_ok=True)
-    set_container_ownership(upload_dir)
-
-    if not files:
-        raise HTTPException(status_code=400, detail="No files provided")
-
-    MAX_UPLOAD_BYTES = 1_000_000_000  # 1 GB
-
-    # When classroom_id is provided, import into that classroom's templates dir
-    form = await request.form()
-    classroom_id = form.get("classroom_id")
-    destination_form = form.get("destination") if not classroom_id else None
+def _folder_upload_base(
+    upload_dir: str, classroom_id, destination, user: User, db: Session,
+) -> str:
+    """Directory a folder upload lands in: the classroom's assignments dir
+    when *classroom_id* is given (instructors only), else *destination*
+    inside the workspace (possibly through a classroom symlink), else the
+    workspace root."""
     target_base = upload_dir
 
     if classroom_id:
@@ -968,11 +1475,11 @@ async def upload_folder(
         target_base = os.path.join(CLASSROOMS_ROOT, str(classroom_id), "assignments")
         os.makedirs(target_base, exist_ok=True)
         set_container_ownership(target_base)
-    elif destination_form:
+    elif destination:
         # Upload into a specific subfolder of the user's workspace (e.g. the
         # explorer's currently-selected folder). Strip slashes so the join
         # below is safe; reject anything that escapes upload_dir.
-        rel = str(destination_form).strip("/")
+        rel = str(destination).strip("/")
         if rel:
             classroom_dest = _resolve_classroom_path(upload_dir, rel)
             if classroom_dest:
@@ -986,18 +1493,54 @@ async def upload_folder(
                     raise HTTPException(status_code=400, detail="Invalid destination")
             os.makedirs(target_base, exist_ok=True)
             set_container_ownership(target_base)
+    return target_base
 
-    # Mirror /files/upload's 409-then-retry pattern, but at the top-level
-    # entry granularity (the folder name the user dropped, not every file
-    # inside it). Without this, uploading "solution/" over an existing
-    # "solution/" silently merges files — old extras stay, new files
-    # overwrite, no warning. The retry path rm-rf's the colliding top-level
-    # before the write loop recreates it from the upload.
-    overwrite = (str(form.get("overwrite") or "").lower() in ("1", "true", "yes"))
-    top_levels = {str(f.filename).split("/", 1)[0] for f in files if f.filename}
+
+def _check_upload_dest(
+    dest_path: str,
+    user_id: str,
+    db: Session,
+    templates_written: set[tuple[str, str]],
+) -> None:
+    """Enforce classroom rules for one uploaded path: assignments are
+    instructor-only and participants stay in their own folder. Records
+    ``(classroom_id, template_name)`` for writes into assignments."""
+    if not dest_path.startswith(CLASSROOMS_ROOT):
+        return
+    rel_to_classrooms = dest_path[len(CLASSROOMS_ROOT) :].lstrip("/")
+    is_templates_path = (
+        "/assignments/" in f"/{rel_to_classrooms}"
+        or rel_to_classrooms.endswith("/assignments")
+    )
+    if is_templates_path:
+        parts = rel_to_classrooms.split("/")
+        cid = parts[0] if parts else None
+        if not cid or not _is_instructor_for_classroom(
+            db, cid, user_id
+        ):
+            raise HTTPException(
+                status_code=403,
+                detail="Assignments folder is read-only for participants",
+            )
+
+    # Check participant scope for non-assignment paths
+    err = _check_participant_scope(dest_path, user_id, db)
+    if err:
+        raise HTTPException(status_code=403, detail=err)
+
+    # Track writes to assignments/{template_name}/
+    parts = rel_to_classrooms.split("/")
+    if len(parts) >= 3 and parts[1] == "assignments":
+        templates_written.add((parts[0], parts[2]))
+
+
+def _overwrite_check(target_base: str, top_levels, overwrite: bool) -> JSONResponse | None:
+    """Mirror /files/upload's 409-then-retry pattern at the top-level entry
+    granularity. Returns the 409 response, or clears the colliding entries
+    when *overwrite* is set."""
     conflicting_tops = sorted(
         t for t in top_levels
-        if t and os.path.exists(os.path.join(target_base, t))
+        if t and os.path.lexists(os.path.join(target_base, t))
     )
     if conflicting_tops and not overwrite:
         return JSONResponse(
@@ -1011,72 +1554,19 @@ async def upload_folder(
                 shutil.rmtree(existing)
             else:
                 os.remove(existing)
+    return None
 
-    # Track (classroom_id, template_name) pairs written to assignments
-    classroom_templates_written: set[tuple[str, str]] = set()
-
-    total_size = 0
-    for f in files:
-        safe_path = os.path.normpath(os.path.join(target_base, f.filename))
-        if not safe_path.startswith(target_base):
-            continue
-
-        if not classroom_id:
-            classroom_target = _resolve_classroom_path(upload_dir, f.filename)
-            dest_path = classroom_target if classroom_target else safe_path
-
-            if dest_path.startswith(CLASSROOMS_ROOT):
-                rel_to_classrooms = dest_path[len(CLASSROOMS_ROOT) :].lstrip("/")
-                is_templates_path = (
-                    "/assignments/" in f"/{rel_to_classrooms}"
-                    or rel_to_classrooms.endswith("/assignments")
-                )
-                if is_templates_path:
-                    parts = rel_to_classrooms.split("/")
-                    cid = parts[0] if parts else None
-                    if not cid or not _is_instructor_for_classroom(
-                        db, cid, str(user.id)
-                    ):
-                        raise HTTPException(
-                            status_code=403,
-                            detail="Assignments folder is read-only for participants",
-                        )
-
-                # Check participant scope for non-assignment paths
-                err = _check_participant_scope(dest_path, str(user.id), db)
-                if err:
-                    raise HTTPException(status_code=403, detail=err)
-
-                # Track writes to assignments/{template_name}/
-                parts = rel_to_classrooms.split("/")
-                if len(parts) >= 3 and parts[1] == "assignments":
-                    classroom_templates_written.add((parts[0], parts[2]))
-        else:
-            dest_path = safe_path
 
-        dir_path = os.path.dirname(dest_path)
-        # Ensure existing parent dirs inside CLASSROOMS_ROOT are writable.
-        # Dirs are always kept www-data 777 so chown is not needed here.
-        if dest_path.startswith(CLASSROOMS_ROOT):
-            p = dir_path
-            while p.startswith(CLASSROOMS_ROOT) and p != CLASSROOMS_ROOT:
-                if os.path.exists(p):
-                    try:
-                        os.chmod(p, 0o777)
-                    except OSError:
-                        pass
-                p = os.path.dirname(p)
-        os.makedirs(dir_path, exist_ok=True)
-        content = await f.read()
-        total_size += len(content)
-        if total_size > MAX_UPLOAD_BYTES:
-            raise HTTPException(status_code=413, detail="Upload exceeds 1 GB limit")
-        with open(dest_path, "wb") as fh:
-            fh.write(content)
-        set_container_ownership(dir_path)
-        set_container_ownership(dest_path)
-
-    move_into = form.get("move-into")
+async def _finish_folder_upload(
+    user: User,
+    db: Session,
+    classroom_id,
+    move_into,
+    templates_written: set[tuple[str, str]],
+    written_dirs: list[str],
+) -> None:
+    """Shared tail of folder and archive uploads: cd the terminal into the
+    new folder, push touched assignments to participants, notify."""
     if move_into and not classroom_id:
         # Auto-cd the first active terminal tab to the target directory.
         # Write directly to the PTY master fd — Ctrl+U clears any in-progress
@@ -1092,7 +1582,7 @@ async def upload_folder(
                 break
 
     # Push to student workspaces if files landed in assignments (teacher drag-drop)
-    await _push_classroom_templates_to_participants(classroom_templates_written, db)
+    await _push_classroom_templates_to_participants(templates_written, db)
 
     # Push to student workspaces for lesson imports (classroom_id + move-into provided)
     move_into_str = str(move_into) if move_into else ""
@@ -1100,15 +1590,348 @@ async def upload_folder(
         src = os.path.join(CLASSROOMS_ROOT, str(classroom_id), "assignments", move_into_str)
         await _push_template_to_participants(str(classroom_id), move_into_str, src, db)
 
-    await notify_files_changed(str(user.id))
+    await notify_files_changed(str(user.id), sorted(written_dirs))
+
+
+@router.post("/upload-folder")
+async def upload_folder(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
+    os.makedirs(upload_dir, exist_ok=True)
+    set_container_ownership(upload_dir)
+
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+
+    # When classroom_id is provided, import into that classroom's templates dir
+    form = await request.form()
+    classroom_id = form.get("classroom_id")
+    destination_form = form.get("destination") if not classroom_id else None
+    target_base = _folder_upload_base(upload_dir, classroom_id, destination_form, user, db)
+
+    # Without the 409, uploading "solution/" over an existing "solution/"
+    # silently merges files — old extras stay, new files overwrite, no
+    # warning. The retry path rm-rf's the colliding top-level before the
+    # write loop recreates it from the upload.
+    overwrite = (str(form.get("overwrite") or "").lower() in ("1", "true", "yes"))
+    top_levels = {str(f.filename).split("/", 1)[0] for f in files if f.filename}
+    conflict = await run_fs(_overwrite_check, target_base, top_levels, overwrite)
+    if conflict is not None:
+        return conflict
+
+    # Track (classroom_id, template_name) pairs written to assignments
+    classroom_templates_written: set[tuple[str, str]] = set()
+    written_dirs: set[str] = set()
+
+    budget = _UploadBudget()
+    # Everything created, normalized in one batch at the end; and parents
+    # already opened up, so each is chmod-ed once rather than per file.
+    created: set[str] = set()
+    opened: set[str] = set()
+    for f in files:
+        safe_path = os.path.normpath(os.path.join(target_base, f.filename))
+        if not safe_path.startswith(target_base):
+            continue
+
+        if not classroom_id:
+            classroom_target = _resolve_classroom_path(upload_dir, f.filename)
+            dest_path = classroom_target if classroom_target else safe_path
+            _check_upload_dest(dest_path, str(user.id), db, classroom_templates_written)
+        else:
+            dest_path = safe_path
+
+        dir_path = os.path.dirname(dest_path)
+        # Ensure existing parent dirs inside CLASSROOMS_ROOT are writable.
+        # Dirs are always kept www-data 777 so chown is not needed here.
+        if dest_path.startswith(CLASSROOMS_ROOT):
+            _open_classroom_parents(dir_path, opened)
+        os.makedirs(dir_path, exist_ok=True)
+        await _stream_upload(f, dest_path, budget)
+        created.add(dest_path)
+        parent = dir_path
+        while parent not in created:
+            created.add(parent)
+            if not parent.startswith(target_base + os.sep):
+                break
+            parent = os.path.dirname(parent)
+        written_dirs.add(dir_path)
+    await run_fs(normalize_paths, created)
+
+    await _finish_folder_upload(
+        user, db, classroom_id, form.get("move-into"), classroom_templates_written,
+        sorted(written_dirs),
+    )
     return PlainTextResponse("Folder uploaded successfully")
 
 
+def _open_classroom_parents(dir_path: str, seen: set[str] | None = None) -> None:
+    """Make existing directories from *dir_path* up to CLASSROOMS_ROOT mode
+    777. With *seen*, stops at the first one already handled."""
+    p = dir_path
+    while p.startswith(CLASSROOMS_ROOT) and p != CLASSROOMS_ROOT:
+        if seen is not None:
+            if p in seen:
+                break
+            seen.add(p)
+        try:
+            if stat.S_IMODE(os.stat(p).st_mode) != 0o777:
+                os.chmod(p, 0o777)
+        except OSError:
+            pass
+        p = os.path.dirname(p)
+
+
+# ---------------------------------------------------------------------------
+# Archive uploads
+# ---------------------------------------------------------------------------
+
+ARCHIVE_MAX_ENTRIES = 20_000
+# A zip member declaring more than this expansion is treated as a bomb.
+# Actual extracted bytes are also counted against the upload budget, so a
+# lying header only gets as far as MAX_UPLOAD_BYTES.
+ARCHIVE_MAX_RATIO = 200
+# Metadata folders added by macOS Finder's "Compress".
+_ARCHIVE_SKIP_TOPS = frozenset({"__MACOSX"})
+
+
+def _archive_member_path(name: str) -> str | None:
+    """Normalized relative path of an archive member, or None for names
+    that are absolute, climb out with ``..`` or should be dropped."""
+    name = name.replace("\\", "/")
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+    if (
+        not parts
+        or name.startswith("/")
+        or ".." in parts
+        or ":" in parts[0]
+        or parts[0] in _ARCHIVE_SKIP_TOPS
+    ):
+        return None
+    return "/".join(parts)
+
+
+def _iter_archive(fileobj) -> Iterator[tuple[str, bool, IO[bytes] | None]]:
+    """Yield ``(name, is_dir, stream)`` for each directory and regular file
+    of a zip or (optionally compressed) tar, in archive order. Symlinks,
+    hard links and devices are skipped."""
+    head = fileobj.read(4)
+    fileobj.seek(0)
+    if head[:2] == b"PK":
+        try:
+            zf = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="Not a valid zip archive")
+        with zf:
+            infos = zf.infolist()
+            if len(infos) > ARCHIVE_MAX_ENTRIES:
+                raise HTTPException(status_code=413, detail="Archive has too many entries")
+            for info in infos:
+                if stat.S_ISLNK(info.external_attr >> 16):
+                    continue
+                if info.is_dir():
+                    yield info.filename, True, None
+                    continue
+                if (
+                    info.file_size > UPLOAD_CHUNK_BYTES
+                    and info.file_size > ARCHIVE_MAX_RATIO * max(info.compress_size, 1)
+                ):
+                    raise HTTPException(
+                        status_code=413, detail=f"Suspicious compression ratio: {info.filename}",
+                    )
+                with zf.open(info) as src:
+                    yield info.filename, False, src
+        return
+
+    try:
+        tf = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError:
+        raise HTTPException(
+            status_code=400, detail="Unsupported archive (expected .zip, .tar or .tar.gz)",
+        )
+    with tf:
+        for member in tf:
+            if member.isdir():
+                yield member.name, True, None
+            elif member.isfile():
+                yield member.name, False, tf.extractfile(member)
+
+
+def _extract_archive(
+    fileobj, staging: str, budget: _UploadBudget, check: Callable[[str], None],
+) -> None:
+    """Stream every member of the archive into *staging*, calling
+    *check(rel_path)* first so classroom rules can reject it."""
+    count = 0
+    try:
+        for name, is_dir, src in _iter_archive(fileobj):
+            count += 1
+            if count > ARCHIVE_MAX_ENTRIES:
+                raise HTTPException(status_code=413, detail="Archive has too many entries")
+            rel = _archive_member_path(name)
+            if rel is None:
+                continue
+            check(rel)
+            dest = os.path.join(staging, rel)
+            if is_dir:
+                os.makedirs(dest, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            with open(dest, "wb") as fh:
+                while chunk := src.read(UPLOAD_CHUNK_BYTES):
+                    budget.take(len(chunk))
+                    _check_free_space(fh.fileno(), len(chunk))
+                    fh.write(chunk)
+    except (tarfile.TarError, zipfile.BadZipFile, zlib.error, EOFError):
+        raise HTTPException(status_code=400, detail="Archive is corrupt or truncated")
+    except (IsADirectoryError, NotADirectoryError, FileExistsError):
+        raise HTTPException(status_code=400, detail="Archive has conflicting entries")
+
+
+@router.post("/upload-archive")
+async def upload_archive(
+    request: Request,
+    file: UploadFile = File(...),
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    """Extract one .zip/.tar/.tar.gz server-side. Accepts the same form
+    fields as /upload-folder (``destination``, ``classroom_id``,
+    ``overwrite``, ``move-into``) and applies the same rules."""
+    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
+    os.makedirs(upload_dir, exist_ok=True)
+    set_container_ownership(upload_dir)
+
+    form = await request.form()
+    classroom_id = form.get("classroom_id")
+    destination_form = form.get("destination") if not classroom_id else None
+    target_base = _folder_upload_base(upload_dir, classroom_id, destination_form, user, db)
+    overwrite = (str(form.get("overwrite") or "").lower() in ("1", "true", "yes"))
+
+    templates_written: set[tuple[str, str]] = set()
+    # The rules only look at the first few components below CLASSROOMS_ROOT,
+    # so each distinct prefix is checked once rather than once per member.
+    checked: set[tuple] = set()
+
+    def check(rel: str) -> None:
+        if classroom_id:
+            return
+        dest_path = os.path.join(target_base, rel)
+        parts = dest_path[len(CLASSROOMS_ROOT):].lstrip("/").split("/")
+        key = (tuple(parts[:4]), len(parts) >= 4, "assignments" in parts[1:])
+        if key not in checked:
+            _check_upload_dest(dest_path, str(user.id), db, templates_written)
+            checked.add(key)
+
+    staging = tempfile.mkdtemp(dir=target_base, prefix=".upload-")
+    try:
+        # *check* runs on the FS thread too; the request awaits it, so the
+        # Session is still only used by one thread at a time.
+        await run_fs(_extract_archive, file.file, staging, _UploadBudget(), check)
+        tops = sorted(os.listdir(staging))
+        if not tops:
+            raise HTTPException(status_code=400, detail="Archive is empty")
+        conflict = await run_fs(_overwrite_check, target_base, tops, overwrite)
+        if conflict is not None:
+            return conflict
+        await run_fs(normalize_tree, staging)
+        if target_base.startswith(CLASSROOMS_ROOT):
+            _open_classroom_parents(target_base)
+        for t in tops:
+            os.rename(os.path.join(staging, t), os.path.join(target_base, t))
+    finally:
+        await run_fs(shutil.rmtree, staging, ignore_errors=True)
+
+    await _finish_folder_upload(
+        user, db, classroom_id, form.get("move-into"), templates_written, [target_base],
+    )
+    return PlainTextResponse("Archive extracted successfully")
+
+
+# Text up to this size is decoded and returned in one response; bigger
+# files are streamed (or previewed), so an editor open never buffers more.
+READ_TEXT_MAX_BYTES = 4 * 1024 * 1024
+# How much of the start of a file decides text vs. binary.
+READ_SNIFF_BYTES = 8192
+# What the editor (Editor.tsx MAX_EDITOR_CHARS / MAX_EDITOR_LINES) refuses to
+# open; ?preview=1 answers these with an excerpt instead of the whole file.
+EDITOR_MAX_CHARS = 1_000_000
+EDITOR_MAX_LINES = 10_000
+# Bytes, and lines, of each end shown by ?preview=1.
+READ_PREVIEW_BYTES = 64 * 1024
+READ_PREVIEW_LINES = 2_000
+
+
+def _looks_binary(block: bytes) -> bool:
+    if b"\0" in block:
+        return True
+    try:
+        # Not final: the block may end in the middle of a character.
+        codecs.getincrementaldecoder("utf-8")().decode(block, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def _too_big_for_editor(text: str) -> bool:
+    # The editor counts UTF-16 code units, as JavaScript strings do.
+    return (
+        text.count("\n") >= EDITOR_MAX_LINES
+        or len(text) > EDITOR_MAX_CHARS
+        and len(text.encode("utf-16-le")) // 2 > EDITOR_MAX_CHARS
+    )
+
+
+def _head_tail_preview(fh: IO[bytes], size: int) -> str:
+    """First and last READ_PREVIEW_BYTES (at most READ_PREVIEW_LINES lines)
+    of a large text file, cut at line boundaries, with a marker for what was
+    left out."""
+    fh.seek(0)
+    head = fh.read(READ_PREVIEW_BYTES)
+    lines = head.split(b"\n", READ_PREVIEW_LINES)
+    if len(lines) > READ_PREVIEW_LINES:
+        head = b"\n".join(lines[:READ_PREVIEW_LINES]) + b"\n"
+    else:
+        head = head[: head.rfind(b"\n") + 1] or head
+    # Never start the tail inside the head: short files with many lines
+    # would otherwise show the same lines twice.
+    start = max(size - READ_PREVIEW_BYTES, len(head))
+    fh.seek(start)
+    tail = fh.read(READ_PREVIEW_BYTES)
+    end = b"\n" if tail.endswith(b"\n") else b""
+    lines = tail[: len(tail) - len(end)].rsplit(b"\n", READ_PREVIEW_LINES)
+    if len(lines) > READ_PREVIEW_LINES:
+        tail = b"\n".join(lines[1:]) + end
+    elif start > len(head):
+        tail = tail[tail.find(b"\n") + 1:] or tail
+    omitted = size - len(head) - len(tail)
+    return (
+        head.decode("utf-8", errors="replace")
+        + f"\n… {omitted:,} bytes not shown …\n\n"
+        + tail.decode("utf-8", errors="replace")
+    )
+
+
 @router.get("/file/{file_path:path}")
 async def read_file(
     file_path: str,
+    request: Request,
+    preview: bool = False,
     user: User = Depends(get_onboarded_user),
 ):
+    """Serve a file for the editor.
+
+    Range requests, images and anything whose first block looks binary are
+    handed to FileResponse, which streams and honours ``Range``. Text up to
+    READ_TEXT_MAX_BYTES is returned whole; larger text is streamed. With
+    ``?preview=1`` anything the editor would refuse (over READ_TEXT_MAX_BYTES,
+    EDITOR_MAX_CHARS or EDITOR_MAX_LINES) is replaced by a head/tail excerpt
+    marked ``X-File-Preview``.
+    Whole-text responses carry ``X-File-Version``, the base for PATCH.
+    """
     upload_dir = f"{UPLOADS_ROOT}/{user.id}"
     abs_path = _resolve_abs_path(upload_dir, file_path)
     _validate_path_within_roots(abs_path, upload_dir)
@@ -1119,15 +1942,42 @@ async def read_file(
     image_extensions = {"jpg", "jpeg", "png", "gif", "bmp", "webp", "svg", "ico"}
     file_ext = file_path.rsplit(".", 1)[-1].lower() if "." in file_path else ""
 
-    if file_ext in image_extensions:
+    if file_ext in image_extensions or "range" in request.headers:
         return FileResponse(abs_path)
+    return await run_fs(_read_for_editor, abs_path, preview)
 
+
+def _read_for_editor(abs_path: str, preview: bool) -> Response:
+    """The body of read_file once images and ranges are out of the way."""
     try:
-        with open(abs_path, "r", encoding="utf-8") as fh:
-            content = fh.read()
-        return PlainTextResponse(content)
-    except UnicodeDecodeError:
-        return FileResponse(abs_path)
+        fh = open(abs_path, "rb")
+    except IsADirectoryError:
+        raise HTTPException(status_code=400, detail="Not a file")
+    with fh:
+        size = os.fstat(fh.fileno()).st_size
+        if _looks_binary(fh.read(READ_SNIFF_BYTES)):
+            return FileResponse(abs_path)
+        if size > READ_TEXT_MAX_BYTES:
+            headers = {"X-File-Size": str(size)}
+            if preview:
+                headers["X-File-Preview"] = "head-tail"
+                return PlainTextResponse(_head_tail_preview(fh, size), headers=headers)
+            return FileResponse(
+                abs_path, media_type="text/plain; charset=utf-8", headers=headers,
+            )
+        fh.seek(0)
+        data = fh.read(READ_TEXT_MAX_BYTES)
+        try:
+            # Without the BOM, as the browser's decoder would drop it anyway;
+            # PATCH offsets count from the first character after it.
+            text = data.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            return FileResponse(abs_path)
+        if preview and _too_big_for_editor(text):
+            return PlainTextResponse(_head_tail_preview(fh, size), headers={
+                "X-File-Size": str(size), "X-File-Preview": "head-tail",
+            })
+    return PlainTextResponse(text, headers={"X-File-Version": _content_version(data)})
 
 
 @router.get("/download/{file_path:path}")
@@ -1153,54 +2003,52 @@ async def download_file(
             headers={"Content-Disposition": f'attachment; filename="{filename}"'},
         )
 
-    # Folder — zip it in memory and stream back. Resolve symlinks recursively
-    # so the archive contains real content (the common case here is a
-    # classroom slug folder that's itself a symlink, plus `.templates/`
-    # inside it which links to the teacher's assignments). Broken links are
-    # skipped instead of crashing the whole download, and we track visited
-    # real paths to prevent cycles.
+    # Folder — stream a zip of it as we walk (see _iter_download_entries).
     folder_name = os.path.basename(abs_path.rstrip("/")) or "download"
-    visited: set[str] = set()
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, dirs, files_in_dir in os.walk(real_path, followlinks=True):
-            try:
-                root_real = os.path.realpath(root)
-            except OSError:
-                dirs[:] = []
-                continue
-            if root_real in visited:
-                dirs[:] = []
-                continue
-            visited.add(root_real)
-
-            rel_root = os.path.relpath(root, real_path)
-            for name in files_in_dir:
-                full = os.path.join(root, name)
-                try:
-                    target = os.path.realpath(full)
-                    if not os.path.exists(target) or not os.path.isfile(target):
-                        # Broken link or a dir-link masquerading as a file — skip.
-                        continue
-                except OSError:
-                    continue
-                arcname = os.path.join(
-                    folder_name,
-                    name if rel_root == "." else os.path.join(rel_root, name),
-                )
-                try:
-                    zf.write(target, arcname)
-                except (OSError, ValueError) as e:
-                    logger.warning("Skipping %s in download: %s", full, e)
-                    continue
-    buf.seek(0)
     return StreamingResponse(
-        iter([buf.read()]),
+        iter_zip(_iter_download_entries(real_path, folder_name)),
         media_type="application/zip",
         headers={"Content-Disposition": f'attachment; filename="{folder_name}.zip"'},
     )
 
 
+def _iter_download_entries(real_path: str, folder_name: str) -> Iterator[tuple[str, str]]:
+    """Yield ``(file, arcname)`` for every file under *real_path*.
+
+    Symlinks are resolved recursively so the archive contains real content
+    (the common case here is a classroom slug folder that's itself a
+    symlink, plus `.templates/` inside it which links to the teacher's
+    assignments). Broken links are skipped instead of crashing the whole
+    download, and we track visited real paths to prevent cycles.
+    """
+    visited: set[str] = set()
+    for root, dirs, files_in_dir in os.walk(real_path, followlinks=True):
+        try:
+            root_real = os.path.realpath(root)
+        except OSError:
+            dirs[:] = []
+            continue
+        if root_real in visited:
+            dirs[:] = []
+            continue
+        visited.add(root_real)
+
+        rel_root = os.path.relpath(root, real_path)
+        for name in files_in_dir:
+            full = os.path.join(root, name)
+            try:
+                target = os.path.realpath(full)
+                if not os.path.exists(target) or not os.path.isfile(target):
+                    # Broken link or a dir-link masquerading as a file — skip.
+                    continue
+            except OSError:
+                continue
+            yield target, os.path.join(
+                folder_name,
+                name if rel_root == "." else os.path.join(rel_root, name),
+            )
+
+
 @router.put("/file/{file_path:path}")
 async def update_file(
     file_path: str,
@@ -1225,6 +2073,44 @@ async def update_file(
 
     body = await request.body()
     content = body.decode("utf-8")
+    data = content.encode("utf-8")
+    # The editor never sees a BOM (see _read_for_editor), so keep the
+    # file's own rather than dropping it on every save.
+    if not data.startswith(codecs.BOM_UTF8) and (
+        await run_fs(_read_prefix, abs_path, len(codecs.BOM_UTF8)) == codecs.BOM_UTF8
+    ):
+        data = codecs.BOM_UTF8 + data
+    await run_fs(_write_text_file, abs_path, data)
+    # Content-only edit: the open file tree is still accurate, but listeners
+    # (e.g. auto-grading) need to hear about it.
+    await notify_files_changed(str(user.id), [abs_path], tree_changed=False)
+    return PlainTextResponse(
+        "File updated successfully", headers={"X-File-Version": _content_version(data)},
+    )
+
+
+class TextEdit(BaseModel):
+    # Offsets count UTF-16 code units, like JS string indices and Monaco.
+    offset: int = Field(ge=0)
+    delete: int = Field(default=0, ge=0)
+    text: str = ""
+
+
+class FilePatchRequest(BaseModel):
+    base: str
+    edits: list[TextEdit] = Field(max_length=1000)
+
+
+def _content_version(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _read_prefix(abs_path: str, limit: int) -> bytes:
+    with open(abs_path, "rb") as fh:
+        return fh.read(limit)
+
+
+def _write_text_file(abs_path: str, data: bytes) -> None:
     # Take ownership before writing — the file may be owned by the container user
     # (999:995) and www-data won't have write permission without GID 995.
     # CAP_CHOWN lets us change ownership regardless of current owner.
@@ -1232,10 +2118,79 @@ async def update_file(
         os.chown(abs_path, os.getuid(), os.getgid())
     except OSError:
         pass
-    with open(abs_path, "w") as fh:
-        fh.write(content)
+    with open(abs_path, "wb") as fh:
+        fh.write(data)
     set_container_ownership(abs_path)
-    return PlainTextResponse("File updated successfully")
+
+
+def _apply_text_edits(text: str, edits: list[TextEdit]) -> str:
+    """Apply *edits* in order, each against the result of the previous one.
+
+    Works on the UTF-16 encoding so offsets line up with the editor's even
+    when the text holds characters outside the BMP.
+    """
+    units = bytearray(text.encode("utf-16-le"))
+    for edit in edits:
+        start = edit.offset * 2
+        end = start + edit.delete * 2
+        if end > len(units):
+            raise HTTPException(status_code=400, detail="Edit out of range")
+        units[start:end] = edit.text.encode("utf-16-le")
+    try:
+        return units.decode("utf-16-le")
+    except UnicodeDecodeError:
+        # An offset split a surrogate pair.
+        raise HTTPException(status_code=400, detail="Edit splits a character")
+
+
+@router.patch("/file/{file_path:path}")
+async def patch_file(
+    file_path: str,
+    body: FilePatchRequest,
+    user: User = Depends(get_onboarded_user),
+    db: Session = Depends(get_db),
+):
+    """Delta save: apply *edits* to the file if it is still at version
+    *base*; 409 with the current version otherwise, so the client can fall
+    back to a full PUT."""
+    upload_dir = f"{UPLOADS_ROOT}/{user.id}"
+    abs_path = _resolve_abs_path(upload_dir, file_path)
+    _validate_path_within_roots(abs_path, upload_dir)
+
+    parts = file_path.strip("/").split("/")
+    if parts and parts[0] == "archive":
+        raise HTTPException(status_code=403, detail="The archive folder is read-only")
+
+    err = _check_templates_write_access(abs_path, file_path, user.id, db)
+    if err:
+        raise HTTPException(status_code=403, detail=err)
+
+    try:
+        data = await run_fs(_read_prefix, abs_path, READ_TEXT_MAX_BYTES + 1)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    except IsADirectoryError:
+        raise HTTPException(status_code=400, detail="Not a file")
+    if len(data) > READ_TEXT_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="File too large to patch")
+    current = _content_version(data)
+    if current != body.base:
+        return JSONResponse(
+            status_code=409, content={"detail": "Version mismatch", "version": current},
+        )
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Not a text file")
+
+    # Offsets are into the text as the editor has it, without the BOM.
+    bom = codecs.BOM_UTF8 if data.startswith(codecs.BOM_UTF8) else b""
+    new_data = bom + _apply_text_edits(text, body.edits).encode("utf-8")
+    await run_fs(_write_text_file, abs_path, new_data)
+    await notify_files_changed(str(user.id), [abs_path], tree_changed=False)
+    return PlainTextResponse(
+        "File updated successfully", headers={"X-File-Version": _content_version(new_data)},
+    )
 
 
 @router.delete("/file/{file_path:path}")
@@ -1271,10 +2226,10 @@ async def delete_file(
         # Don't recurse into a symlink's target when deleting.
         os.unlink(abs_path)
     elif os.path.isdir(abs_path):
-        shutil.rmtree(abs_path)
+        await run_fs(shutil.rmtree, abs_path)
     else:
         os.remove(abs_path)
-    await notify_files_changed(str(user.id))
+    await notify_files_changed(str(user.id), [abs_path])
     return PlainTextResponse("File deleted successfully")
 
 
@@ -1361,5 +2316,5 @@ async def create_file(
     except OSError as e:
         raise HTTPException(status_code=500, detail=f"Failed to create file: {e}")
 
-    await notify_files_changed(str(user.id))
+    await notify_files_changed(str(user.id), [abs_path])
     return PlainTextResponse("File created successfully")
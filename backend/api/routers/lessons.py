@@ -1,6 +1,4 @@
-import io
 import re
-import zipfile
 from pathlib import Path
 
 from fastapi import APIRouter, Depends, HTTPException
@@ -8,6 +6,7 @@ from fastapi.responses import FileResponse, StreamingResponse
 
 from ..database import User
 from ..dependencies import require_teacher
+from ..zipstream import iter_zip
 
 router = APIRouter()
 
@@ -60,16 +59,14 @@ def download_solutions_zip(
     if not lesson_dir.is_dir():
         raise HTTPException(status_code=404, detail="Lesson solutions not found")
 
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for path in sorted(lesson_dir.rglob("*")):
-            if path.is_file():
-                zf.write(path, path.relative_to(lesson_dir))
-    buf.seek(0)
-
+    entries = (
+        (str(path), str(path.relative_to(lesson_dir)))
+        for path in sorted(lesson_dir.rglob("*"))
+        if path.is_file()
+    )
     filename = f"{lesson_name}-solutions.zip"
     return StreamingResponse(
-        buf,
+        iter_zip(entries),
         media_type="application/zip",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
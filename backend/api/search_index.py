@@ -0,0 +1,364 @@
+"""Per-user trigram index for workspace full-text search.
+
+Each user's index maps every lower-cased three-character sequence to the
+files containing it. A query is answered by intersecting the posting sets of
+its trigrams and then reading only the surviving candidates to find the
+matching lines, so the cost tracks the number of real hits rather than the
+size of the workspace.
+
+Which files are indexed is decided by the caller (``routers.files`` hands in
+the same entry list ``/list`` shows, so hidden files and classroom scope
+follow the explorer's rules). The index is kept current incrementally:
+
+- ``notify_files_changed`` listeners (API writes and the inotify watcher)
+  mark paths dirty; the next search re-reads just those files;
+- an unknown path, or an event with no paths, makes the next search compare
+  the explorer listing with the indexed set and ``stat`` each indexed file,
+  re-reading only those whose size or mtime moved. That sweep also runs at
+  most every ``SEARCH_REVALIDATE`` seconds to catch edits nothing reported.
+
+Indexes are saved to ``SEARCH_INDEX_DIR`` after each change (gzipped JSON,
+each posting list packed as a uint32 array) and reloaded on first use. A
+reloaded index is swept once before use, so edits made while the backend
+was down are picked up too. Deleted or rewritten files leave dead ids in
+the posting lists; those are filtered at query time and compacted away once
+they outnumber the live files (and before every save).
+"""
+
+import base64
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Callable
+
+from backend.docker import CLASSROOMS_ROOT
+
+logger = logging.getLogger("search_index")
+
+SEARCH_INDEX_DIR = os.environ.get(
+    "SEARCH_INDEX_DIR",
+    os.path.join(os.path.dirname(CLASSROOMS_ROOT.rstrip("/")), "search-index"),
+)
+SEARCH_MAX_FILE_BYTES = 512 * 1024
+SEARCH_REVALIDATE = 30.0
+SEARCH_MAX_LOADED = int(os.environ.get("SEARCH_MAX_LOADED", "32"))
+SEARCH_LINE_CHARS = 200
+_SNIFF_BYTES = 8192
+_FORMAT = 2
+
+# Explorer path -> host path for every file that should be searchable.
+ListFn = Callable[[], dict[str, str]]
+
+
+def trigrams(text: str) -> set[str]:
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _read_text(host: str) -> str | None:
+    """Contents of *host* if it is a reasonably small text file."""
+    try:
+        with open(host, "rb") as fh:
+            data = fh.read(SEARCH_MAX_FILE_BYTES + 1)
+    except OSError:
+        return None
+    if len(data) > SEARCH_MAX_FILE_BYTES or b"\0" in data[:_SNIFF_BYTES]:
+        return None
+    return data.decode("utf-8", errors="replace")
+
+
+def _signature(host: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(host)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class SearchIndex:
+    """Trigram index over one user's searchable files."""
+
+    def __init__(
+        self,
+        user_id: str,
+        list_files: ListFn,
+        path: str | None = None,
+        is_hidden: Callable[[str], bool] | None = None,
+    ):
+        self.user_id = user_id
+        self._list_files = list_files
+        self._path = path
+        # Changes below a hidden directory (a venv being installed, .git)
+        # can never affect results, so they are not even recorded.
+        self._is_hidden = is_hidden
+        # doc id -> [explorer path, host path, mtime_ns, size]
+        self._docs: dict[int, list] = {}
+        self._by_host: dict[str, int] = {}
+        self._postings: dict[str, set[int]] = {}
+        self._next_id = 0
+        self._dead = 0
+        self._dirty: set[str] = set()
+        self._sweep = True
+        self._swept_at = float("-inf")
+        self._lock = threading.Lock()
+        self._dirty_lock = threading.Lock()
+
+    # -- events (event loop) -----------------------------------------------
+
+    def mark_dirty(self, paths: list[str] | None) -> None:
+        if paths is not None and self._is_hidden is not None:
+            paths = [p for p in paths if not any(map(self._is_hidden, p.split(os.sep)))]
+            if not paths:
+                return
+        with self._dirty_lock:
+            if paths is None:
+                self._sweep = True
+            else:
+                self._dirty.update(os.path.normpath(p) for p in paths)
+
+    # -- maintenance (worker thread) -------------------------------------
+
+    def _add(self, rel: str, host: str, sig: tuple[int, int]) -> None:
+        text = _read_text(host)
+        doc_id = self._next_id
+        self._next_id += 1
+        self._docs[doc_id] = [rel, host, *sig]
+        self._by_host[host] = doc_id
+        for gram in trigrams(text) if text else ():
+            self._postings.setdefault(gram, set()).add(doc_id)
+
+    def _drop(self, doc_id: int) -> None:
+        _rel, host, *_ = self._docs.pop(doc_id)
+        if self._by_host.get(host) == doc_id:
+            del self._by_host[host]
+        self._dead += 1
+
+    def _reconcile(self, doc_ids) -> bool:
+        changed = False
+        for doc_id in list(doc_ids):
+            rel, host, mtime, size = self._docs[doc_id]
+            sig = _signature(host)
+            if sig == (mtime, size):
+                continue
+            self._drop(doc_id)
+            if sig is not None:
+                self._add(rel, host, sig)
+            changed = True
+        return changed
+
+    def refresh(self) -> bool:
+        """Apply pending changes; returns whether anything was re-indexed."""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+            sweep, self._sweep = self._sweep, False
+        if time.monotonic() - self._swept_at > SEARCH_REVALIDATE:
+            sweep = True
+
+        # Dirty paths that are (or contain) indexed files are re-read on
+        # their own; anything else may be a new file, which only the
+        # explorer listing can place.
+        targets: set[int] = set()
+        for p in dirty:
+            doc_id = self._by_host.get(p)
+            if doc_id is not None:
+                targets.add(doc_id)
+                continue
+            prefix = p + os.sep
+            under = [i for h, i in self._by_host.items() if h.startswith(prefix)]
+            targets.update(under)
+            if not under or os.path.isdir(p):
+                sweep = True
+
+        changed = False
+        if sweep:
+            listed = self._list_files()
+            indexed = {d[0]: i for i, d in self._docs.items()}
+            for rel, doc_id in indexed.items():
+                if listed.get(rel) != self._docs[doc_id][1]:
+                    self._drop(doc_id)
+                    changed = True
+            targets = set(self._docs)
+            for rel, host in listed.items():
+                if rel not in indexed or indexed[rel] not in self._docs:
+                    sig = _signature(host)
+                    if sig is not None:
+                        self._add(rel, host, sig)
+                        changed = True
+            self._swept_at = time.monotonic()
+        changed = self._reconcile(targets & self._docs.keys()) or changed
+
+        if self._dead > max(256, len(self._docs)):
+            self._compact()
+        return changed
+
+    def _compact(self) -> None:
+        live = self._docs.keys()
+        for gram in list(self._postings):
+            ids = self._postings[gram] & live
+            if ids:
+                self._postings[gram] = ids
+            else:
+                del self._postings[gram]
+        self._dead = 0
+
+    # -- queries ------------------------------------------------------------
+
+    def search(self, query: str, limit: int, per_file: int = 20) -> dict:
+        """Refresh, then return up to *limit* matching lines for *query*
+        (case-insensitive substring, at least three characters)."""
+        with self._lock:
+            if self.refresh():
+                self.save()
+            grams = sorted(trigrams(query), key=lambda g: len(self._postings.get(g, ())))
+            candidates: set[int] = set(self._postings.get(grams[0], ())) if grams else set()
+            for gram in grams[1:]:
+                if not candidates:
+                    break
+                candidates &= self._postings.get(gram, set())
+            docs = sorted(
+                (self._docs[i] for i in candidates if i in self._docs), key=lambda d: d[0],
+            )
+
+        needle = query.lower()
+        results: list[dict] = []
+        files = 0
+        truncated = False
+        for rel, host, *_ in docs:
+            text = _read_text(host)
+            if text is None or needle not in text.lower():
+                continue
+            files += 1
+            hits = 0
+            for lineno, line in enumerate(text.splitlines(), 1):
+                col = line.lower().find(needle)
+                if col < 0:
+                    continue
+                if len(results) >= limit:
+                    truncated = True
+                    break
+                start = max(0, col - SEARCH_LINE_CHARS // 2)
+                results.append({
+                    "path": rel,
+                    "line": lineno,
+                    "column": col + 1,
+                    "text": line[start:start + SEARCH_LINE_CHARS],
+                })
+                hits += 1
+                if hits >= per_file:
+                    break
+            if truncated:
+                break
+        return {"results": results, "files": files, "truncated": truncated}
+
+    # -- persistence --------------------------------------------------------
+
+    def save(self) -> None:
+        if not self._path:
+            return
+        if self._dead:
+            self._compact()
+        payload = {
+            "format": _FORMAT,
+            "next_id": self._next_id,
+            "docs": {str(i): d for i, d in self._docs.items()},
+            "postings": {
+                g: base64.b64encode(array("I", ids).tobytes()).decode("ascii")
+                for g, ids in self._postings.items()
+            },
+        }
+        try:
+            os.makedirs(os.path.dirname(self._path), mode=0o700, exist_ok=True)
+            tmp = self._path + ".tmp"
+            with gzip.open(tmp, "wt", compresslevel=1) as fh:
+                json.dump(payload, fh, separators=(",", ":"))
+            os.replace(tmp, self._path)
+        except OSError as e:
+            logger.warning("Could not save search index for %s: %s", self.user_id, e)
+
+    def load(self) -> bool:
+        if not self._path:
+            return False
+        try:
+            with gzip.open(self._path, "rt") as fh:
+                payload = json.load(fh)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning("Discarding unreadable search index for %s: %s", self.user_id, e)
+            return False
+        if payload.get("format") != _FORMAT:
+            return False
+        self._docs = {int(i): d for i, d in payload["docs"].items()}
+        self._by_host = {d[1]: i for i, d in self._docs.items()}
+        self._postings = {
+            g: set(array("I", base64.b64decode(ids))) for g, ids in payload["postings"].items()
+        }
+        self._next_id = payload["next_id"]
+        self._dead = 0
+        # Files may have changed while nobody was listening.
+        self._sweep = True
+        return True
+
+    def stats(self) -> dict:
+        return {"files": len(self._docs), "trigrams": len(self._postings), "dead": self._dead}
+
+
+class SearchIndexes:
+    """LRU of loaded per-user indexes."""
+
+    def __init__(self, root: str = SEARCH_INDEX_DIR, max_loaded: int = SEARCH_MAX_LOADED):
+        self.root = root
+        self._max_loaded = max_loaded
+        self._indexes: "OrderedDict[str, SearchIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, user_id: str, list_files: ListFn, is_hidden: Callable[[str], bool] | None = None,
+    ) -> SearchIndex:
+        """The index for *user_id*, loading it from disk on first use.
+        Blocking; call from a worker thread."""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+                return index
+        index = SearchIndex(
+            user_id, list_files, os.path.join(self.root, f"{user_id}.json.gz"), is_hidden,
+        )
+        index.load()
+        with self._lock:
+            index = self._indexes.setdefault(user_id, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self._max_loaded:
+                self._indexes.popitem(last=False)
+        return index
+
+    async def on_files_changed(self, user_id: str, paths: list[str] | None) -> None:
+        # Only loaded indexes need telling; the rest are swept when loaded.
+        index = self._indexes.get(user_id)
+        if index is not None:
+            index.mark_dirty(paths)
+
+    def stats(self) -> dict:
+        with self._lock:
+            indexes = list(self._indexes.values())
+        return {"loaded": len(indexes), "files": sum(len(i._docs) for i in indexes)}
+
+
+_search_indexes: SearchIndexes | None = None
+
+
+def get_search_indexes() -> SearchIndexes:
+    """Return the process-wide index registry, creating it on first use."""
+    global _search_indexes
+    if _search_indexes is None:
+        _search_indexes = SearchIndexes()
+    return _search_indexes
+
+
+__all__ = ["SearchIndex", "SearchIndexes", "get_search_indexes", "trigrams"]
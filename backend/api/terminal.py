@@ -33,6 +33,7 @@ from backend.docker import (
 
 from .config import Settings
 from .database import User, get_engine
+from .fs_watcher import get_fs_watcher
 
 logger = logging.getLogger("terminal")
 
@@ -714,6 +715,10 @@ async def handle_connect(sid, environ, auth=None):
         len(session_map),
     )
 
+    watcher = get_fs_watcher()
+    if watcher is not None:
+        watcher.watch_user(user_id)
+
     # Don't attach the PTY yet — wait for the first resize so the backend has
     # the frontend's actual dimensions before the shell renders anything.
     session_info["read_loop_started"] = False
@@ -743,6 +748,9 @@ async def handle_disconnect(sid):
     remaining = [s["tab_id"] for s in session_map.values() if s["user_id"] == user_id]
     logger.info("[DIAG] handle_disconnect: remaining sessions for user=%s: %s", user_id, remaining)
     if not remaining:
+        watcher = get_fs_watcher()
+        if watcher is not None:
+            watcher.unwatch_user(user_id)
         logger.info("[DIAG] handle_disconnect: no sessions left, starting idle poller for user=%s", user_id)
         _start_idle_poller(user_id)
 
@@ -891,11 +899,43 @@ async def close_tab(user_id: str, tab_id: str) -> tuple[str, int]:
     return "Terminated", 200
 
 
-async def notify_files_changed(user_id: str) -> None:
-    """Emit a ``files-changed`` event to every socket session owned by *user_id*."""
-    for sid, session in session_map.items():
+async def notify_user(user_id: str, event: str, data: dict | None = None) -> None:
+    """Emit *event* to every socket session owned by *user_id*."""
+    for sid, session in list(session_map.items()):
         if session.get("user_id") == user_id:
-            await sio.emit("files-changed", {}, to=sid)
+            await sio.emit(event, data or {}, to=sid)
+
+
+# Async callbacks ``(user_id, paths)`` run on every notify_files_changed.
+_files_changed_listeners: list = []
+
+
+def add_files_changed_listener(callback) -> None:
+    """Register an async ``callback(user_id, paths)`` to run whenever files
+    change through the API. *paths* are absolute host paths, or None when
+    the caller didn't say which paths changed."""
+    if callback not in _files_changed_listeners:
+        _files_changed_listeners.append(callback)
+
+
+async def notify_files_changed(
+    user_id: str,
+    paths: list[str] | None = None,
+    tree_changed: bool = True,
+    changes: dict | None = None,
+) -> None:
+    """Emit a ``files-changed`` event to every socket session owned by *user_id*
+    and run registered listeners. Pass ``tree_changed=False`` for content-only
+    edits that don't need the client to refresh its file tree. *changes* is
+    the file watcher's added/removed/modified payload; without it the client
+    refetches the whole tree."""
+    if tree_changed:
+        await notify_user(user_id, "files-changed", changes)
+    for callback in list(_files_changed_listeners):
+        try:
+            await callback(user_id, paths)
+        except Exception:
+            logger.exception("files-changed listener %r failed", callback)
 
 
 _register_handlers()
@@ -906,5 +946,7 @@ __all__ = [
     "discover_existing_containers",
     "start_pollers_for_orphaned",
     "close_tab",
+    "notify_user",
+    "add_files_changed_listener",
     "notify_files_changed",
 ]
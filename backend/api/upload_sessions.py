@@ -0,0 +1,174 @@
+"""On-disk state for resumable uploads (``/api/files/uploads``).
+
+A session is a ``{id}.json`` metadata file plus a ``{id}.part`` file holding
+the bytes received so far; the part file's size *is* the resume offset, so a
+client that lost its connection asks for the session and continues from
+there. Partial data lives outside the workspaces (next to ``UPLOADS_ROOT``,
+often on a different volume, so completing may have to copy rather than
+rename) and sessions idle for
+``RESUMABLE_UPLOAD_TTL`` are swept by ``gc``, which runs whenever a session
+is created.
+"""
+
+import fcntl
+import json
+import os
+import re
+import secrets
+import time
+
+from backend.docker import UPLOADS_ROOT
+
+RESUMABLE_UPLOADS_DIR = os.environ.get(
+    "RESUMABLE_UPLOADS_DIR",
+    os.path.join(os.path.dirname(UPLOADS_ROOT.rstrip("/")), "partial-uploads"),
+)
+RESUMABLE_UPLOAD_TTL = 24 * 3600
+RESUMABLE_MAX_SESSIONS_PER_USER = 10
+# Suggested PUT size; clients may send any size.
+RESUMABLE_CHUNK_BYTES = 8 * 1024 * 1024
+
+_SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+class UploadSessionError(Exception):
+    def __init__(self, status_code: int, detail: str, **extra):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.extra = extra
+
+
+class UploadSessionStore:
+    def __init__(self, root: str = RESUMABLE_UPLOADS_DIR, ttl: float = RESUMABLE_UPLOAD_TTL,
+                 clock=time.time):
+        self.root = root
+        self._ttl = ttl
+        self._clock = clock
+
+    def _meta_path(self, sid: str) -> str:
+        return os.path.join(self.root, f"{sid}.json")
+
+    def part_path(self, sid: str) -> str:
+        return os.path.join(self.root, f"{sid}.part")
+
+    def create(self, user_id: str, **meta) -> dict:
+        """Start a session; *meta* is stored as-is (filename, target, size…)."""
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        self.gc()
+        if self._count(user_id) >= RESUMABLE_MAX_SESSIONS_PER_USER:
+            raise UploadSessionError(429, "Too many unfinished uploads")
+        sid = secrets.token_urlsafe(18)
+        now = self._clock()
+        session = {**meta, "id": sid, "user_id": user_id, "created_at": now, "updated_at": now}
+        with open(self.part_path(sid), "xb"):
+            pass
+        self._save(session)
+        return session
+
+    def load(self, user_id: str, sid: str) -> dict:
+        """The caller's session with its current ``offset``; 404 otherwise."""
+        if not _SESSION_ID.match(sid):
+            raise UploadSessionError(404, "Upload not found")
+        try:
+            with open(self._meta_path(sid)) as fh:
+                session = json.load(fh)
+            session["offset"] = os.path.getsize(self.part_path(sid))
+        except (OSError, ValueError):
+            raise UploadSessionError(404, "Upload not found")
+        if session.get("user_id") != user_id:
+            raise UploadSessionError(404, "Upload not found")
+        return session
+
+    def open_for_append(self, session: dict, offset: int):
+        """Open the part file for writing at *offset*, locked against
+        concurrent PUTs. 409 (with the real offset) if *offset* is not
+        where the data ends."""
+        fh = open(self.part_path(session["id"]), "r+b")
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fh.close()
+            raise UploadSessionError(409, "Upload is busy", offset=session["offset"])
+        current = os.fstat(fh.fileno()).st_size
+        if offset != current:
+            fh.close()
+            raise UploadSessionError(409, "Offset mismatch", offset=current)
+        fh.seek(current)
+        return fh
+
+    def touch(self, session: dict) -> None:
+        session["updated_at"] = self._clock()
+        self._save(session)
+
+    def remove(self, sid: str) -> None:
+        for path in (self._meta_path(sid), self.part_path(sid)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def gc(self) -> int:
+        """Delete sessions idle for longer than the TTL; returns how many."""
+        cutoff = self._clock() - self._ttl
+        removed = 0
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            sid, ext = os.path.splitext(name)
+            if ext not in (".json", ".part"):
+                continue
+            try:
+                idle = os.stat(os.path.join(self.root, name)).st_mtime < cutoff
+            except FileNotFoundError:
+                continue
+            if idle and ext == ".json":
+                # The part file's mtime moves with every PUT.
+                try:
+                    idle = os.stat(self.part_path(sid)).st_mtime < cutoff
+                except FileNotFoundError:
+                    pass
+            if idle:
+                self.remove(sid)
+                removed += 1
+        return removed
+
+    def _count(self, user_id: str) -> int:
+        count = 0
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.root, name)) as fh:
+                    count += json.load(fh).get("user_id") == user_id
+            except (OSError, ValueError):
+                continue
+        return count
+
+    def _save(self, session: dict) -> None:
+        data = {k: v for k, v in session.items() if k != "offset"}
+        tmp = self._meta_path(session["id"]) + ".tmp"
+        with open(tmp, "w") as fh:
+            json.dump(data, fh)
+        os.replace(tmp, self._meta_path(session["id"]))
+
+
+_upload_sessions: UploadSessionStore | None = None
+
+
+def get_upload_sessions() -> UploadSessionStore:
+    """Return the process-wide session store, creating it on first use."""
+    global _upload_sessions
+    if _upload_sessions is None:
+        _upload_sessions = UploadSessionStore()
+    return _upload_sessions
+
+
+__all__ = [
+    "RESUMABLE_CHUNK_BYTES",
+    "UploadSessionError",
+    "UploadSessionStore",
+    "get_upload_sessions",
+]
@@ -0,0 +1,94 @@
+"""Streaming zip writer for folder downloads.
+
+``zipfile`` already knows how to write to a stream it cannot seek: each
+member gets a data descriptor after its data instead of a patched-up local
+header. ``iter_zip`` feeds it a sink that hands every write straight back to
+the caller, so a download starts with the first member and never holds more
+than one read chunk in memory, however large the folder is.
+"""
+
+import logging
+import os
+import zipfile
+from typing import Iterable, Iterator
+
+logger = logging.getLogger("zipstream")
+
+ZIP_READ_CHUNK_BYTES = 1024 * 1024
+
+# Formats that are already compressed; deflating them again burns CPU for
+# a few bytes (or makes them bigger).
+STORED_EXTENSIONS = frozenset({
+    ".7z", ".apk", ".avi", ".bz2", ".docx", ".epub", ".flac", ".gif", ".gz",
+    ".heic", ".jar", ".jpeg", ".jpg", ".m4a", ".mkv", ".mov", ".mp3", ".mp4",
+    ".odp", ".ods", ".odt", ".ogg", ".opus", ".png", ".pptx", ".rar", ".tgz",
+    ".webm", ".webp", ".whl", ".woff", ".woff2", ".xlsx", ".xz", ".zip", ".zst",
+})
+
+
+class _Sink:
+    """Write-only, non-seekable file object collecting zipfile's output.
+
+    No ``tell``/``seek`` on purpose: that is what makes zipfile switch to
+    data descriptors.
+    """
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def compression_for(name: str) -> int:
+    ext = os.path.splitext(name)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def iter_zip(
+    entries: Iterable[tuple[str, str]],
+    chunk_size: int = ZIP_READ_CHUNK_BYTES,
+) -> Iterator[bytes]:
+    """Yield a zip archive of *entries* (``(path, arcname)`` pairs) in pieces.
+
+    *entries* is consumed lazily, so a directory walk can feed it directly.
+    Files that cannot be opened are skipped with a warning; a read error
+    after a member has started aborts the stream, since its header is
+    already on the wire.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w") as zf:
+        for path, arcname in entries:
+            try:
+                src = open(path, "rb")
+            except OSError as e:
+                logger.warning("Skipping %s in download: %s", path, e)
+                continue
+            with src:
+                try:
+                    info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+                except OSError as e:
+                    logger.warning("Skipping %s in download: %s", path, e)
+                    continue
+                info.compress_type = compression_for(arcname)
+                with zf.open(info, "w") as dst:
+                    while chunk := src.read(chunk_size):
+                        dst.write(chunk)
+                        if data := sink.drain():
+                            yield data
+            if data := sink.drain():
+                yield data
+    # Central directory.
+    yield sink.drain()
+
+
+__all__ = ["STORED_EXTENSIONS", "compression_for", "iter_zip"]
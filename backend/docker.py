@@ -26,6 +26,10 @@ CLASSROOMS_JSON_FILE = "backend/classrooms.json"
 UPLOADS_ROOT = os.environ.get("UPLOADS_ROOT", "/var/lib/csroom/uploads")
 CLASSROOMS_ROOT = os.environ.get("CLASSROOMS_ROOT", "/var/lib/csroom/classrooms")
 
+# Relative CPU weight for grading containers; interactive ones use Docker's
+# default of 1024.
+GRADING_CPU_SHARES = 256
+
 
 def prepare_user_directory(user_id):
     """Ensure user directory exists with 33:995 ownership + setgid so files
@@ -738,6 +742,746 @@ def run_in_ephemeral_container(
         return -1, "", f"[Timeout] Container exceeded {timeout}s limit\n"
 
 
+# In-container driver for run_suite_in_ephemeral_container and the warm
+# grading pool. It runs each step
+# sequentially with its own timeout (killing the whole process group so a
+# forked student process can't outlive its step), captures stdout/stderr per
+# step, and prints one JSON document after a per-run nonce marker. Student
+# output never reaches the container's stdout directly — it's JSON-escaped
+# inside the result — so a test can't forge another step's result.
+_SUITE_DRIVER = r"""
+import json, os, signal, subprocess, sys
+spec = json.loads(os.environ["CSROOM_SUITE"])
+limit = spec["max_output"]
+if os.environ.get("TMPDIR"):
+    os.makedirs(os.environ["TMPDIR"], mode=0o700, exist_ok=True)
+if spec.get("cwd"):
+    os.chdir(spec["cwd"])
+rdir = None
+if spec.get("reporter"):
+    import tempfile
+    rdir = tempfile.mkdtemp(prefix="csroom-report-")
+    with open(os.path.join(rdir, "sitecustomize.py"), "w") as f:
+        f.write(spec["reporter"])
+seq = [0]
+def run(step):
+    env = dict(os.environ)
+    report = None
+    if rdir:
+        seq[0] += 1
+        report = os.path.join(rdir, "%d.jsonl" % seq[0])
+        env["CSROOM_REPORT"] = report
+        env["CSROOM_ONLY"] = "\n".join(step.get("only", []))
+        env["PYTHONPATH"] = rdir + os.pathsep + env.get("PYTHONPATH", "")
+    try:
+        p = subprocess.Popen(step["command"], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, start_new_session=True, env=env)
+    except OSError as e:
+        return {"name": step["name"], "returncode": 127, "stdout": "",
+                "stderr": str(e) + "\n", "timed_out": False, "tests": []}
+    timed_out = False
+    try:
+        out, err = p.communicate(timeout=step["timeout"])
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        out, err = p.communicate()
+    tests = []
+    if report and os.path.exists(report):
+        with open(report, errors="replace") as f:
+            for line in f.read(limit).splitlines()[:spec["max_tests"]]:
+                try:
+                    tests.append(json.loads(line))
+                except ValueError:
+                    pass
+    return {"name": step["name"], "returncode": -1 if timed_out else p.returncode,
+            "stdout": out.decode(errors="replace")[:limit],
+            "stderr": err.decode(errors="replace")[:limit],
+            "timed_out": timed_out, "tests": tests}
+results = [run(s) for s in spec["steps"]]
+fb = spec.get("fallback")
+if fb:
+    scored = False
+    if spec.get("score_parser"):
+        ns = {}
+        exec(spec["score_parser"], ns)
+        scored = any(not r["timed_out"] and ns["_parse_script_output"](r["stdout"])[1] > 0
+                     for r in results)
+    if not scored:
+        r = run(fb)
+        r["fallback"] = True
+        results.append(r)
+sys.stdout.write(spec["marker"] + json.dumps(results) + "\n")
+"""
+
+# Per-stream cap on captured step output. Keeps a chatty (or malicious)
+# test from ballooning the JSON the backend has to parse.
+_SUITE_MAX_OUTPUT = 1_000_000
+# Cap on per-test records kept per step.
+_SUITE_MAX_TESTS = 2000
+
+# Installed by the suite driver as ``sitecustomize`` on each step's
+# PYTHONPATH, so it loads into every test process without the test script
+# doing anything. It appends one JSON line per test outcome to
+# $CSROOM_REPORT: ``{"id", "outcome", "message"}`` with outcome one of
+# passed/failed/error/skipped. unittest results are hooked on
+# unittest.TestResult; under pytest the module doubles as a plugin
+# (``-p sitecustomize``). With $CSROOM_ONLY (newline-separated ids) set,
+# unittest tests with other ids are not run at all.
+_TEST_REPORTER = r"""
+import json, os
+_path = os.environ.get("CSROOM_REPORT")
+_only = set(filter(None, os.environ.get("CSROOM_ONLY", "").split("\n")))
+_out = None
+def _emit(test_id, outcome, message=""):
+    global _out
+    if not _path:
+        return
+    if _out is None:
+        _out = open(_path, "a", buffering=1, encoding="utf-8")
+    _out.write(json.dumps({"id": str(test_id), "outcome": outcome,
+                           "message": str(message)[:2000]}) + "\n")
+def _install_unittest():
+    import unittest
+    R = unittest.TestResult
+    def _hook(name, outcome):
+        orig = getattr(R, name)
+        def hook(self, test, *args):
+            msg = ""
+            if args and outcome in ("failed", "error"):
+                try:
+                    msg = self._exc_info_to_string(args[0], test)
+                except Exception:
+                    msg = repr(args[0][1])
+            elif args and outcome == "skipped":
+                msg = args[0]
+            _emit(test.id(), outcome, msg)
+            return orig(self, test, *args)
+        setattr(R, name, hook)
+    _hook("addSuccess", "passed")
+    _hook("addFailure", "failed")
+    _hook("addError", "error")
+    _hook("addSkip", "skipped")
+    _hook("addExpectedFailure", "passed")
+    _hook("addUnexpectedSuccess", "failed")
+    orig_sub = R.addSubTest
+    def addSubTest(self, test, subtest, err):
+        if err is not None:
+            failed = issubclass(err[0], test.failureException)
+            _emit(subtest.id(), "failed" if failed else "error",
+                  self._exc_info_to_string(err, test))
+        return orig_sub(self, test, subtest, err)
+    R.addSubTest = addSubTest
+    if _only:
+        orig_run = unittest.TestCase.run
+        def run(self, result=None):
+            if self.id() in _only:
+                return orig_run(self, result)
+        unittest.TestCase.run = run
+if _path:
+    try:
+        _install_unittest()
+    except Exception:
+        pass
+def pytest_runtest_logreport(report):
+    if report.when == "call" or (report.when == "setup" and not report.passed):
+        outcome = report.outcome
+        if report.when == "setup" and report.failed:
+            outcome = "error"
+        _emit(report.nodeid, outcome, report.longreprtext if report.failed else "")
+"""
+
+
+def run_suite_in_ephemeral_container(
+    student_dir: str,
+    test_files: dict[str, str],
+    steps: list[dict],
+    fallback: dict | None = None,
+    score_parser: str | None = None,
+) -> list[dict]:
+    """Run several commands sequentially inside ONE hardened container.
+
+    Same sandbox as ``run_in_ephemeral_container`` (student dir read-only at
+    /app, test files staged into /tmp/tests, no network, capped resources),
+    but the create/start/teardown cost is paid once for the whole suite
+    instead of once per command.
+
+    Args:
+        student_dir: Host path to the student's workspace (mounted read-only at /app).
+        test_files: Mapping of {relative_path: host_absolute_path} staged into
+                    /tmp/tests once for every step.
+        steps: ``[{"name": str, "command": list[str], "timeout": int}, ...]``,
+               run in order from /app, each with its own timeout. An
+               optional ``"only": [test ids]`` restricts which unittest
+               tests the step actually runs.
+        fallback: Optional extra step, run last and only if no step that
+                  finished in time reported a score.
+        score_parser: Python source defining ``_parse_script_output(stdout)
+                  -> (passed, total)``; a step reported a score if total > 0.
+                  Without it the fallback always runs.
+
+    Returns:
+        One dict per step that ran, in order:
+        ``{"name", "returncode", "stdout", "stderr", "timed_out", "tests"}``
+        where ``tests`` holds the per-test records from ``_TEST_REPORTER``
+        (the fallback's dict also has ``"fallback": True``). ``returncode`` is -1
+        on timeout. If the container itself fails or overruns, every step is
+        reported with ``returncode`` -1 and the error in ``stderr``.
+    """
+    import shlex
+    import uuid
+
+    container_name = f"3compute-test-{uuid.uuid4().hex[:12]}"
+    marker = f"###CSROOM_SUITE_{uuid.uuid4().hex}###"
+    spec = {
+        "steps": steps,
+        "fallback": fallback,
+        "score_parser": score_parser,
+        "marker": marker,
+        "max_output": _SUITE_MAX_OUTPUT,
+        "max_tests": _SUITE_MAX_TESTS,
+        "reporter": _TEST_REPORTER,
+    }
+
+    copy_cmds = "mkdir -p /tmp/tests"
+    for rel_path in test_files:
+        dest = f"/tmp/tests/{rel_path}"
+        parent = os.path.dirname(dest)
+        if parent != "/tmp/tests":
+            copy_cmds += f" && mkdir -p {parent}"
+        copy_cmds += f" && cp /tmp/_staging/{rel_path} {dest}"
+
+    shell_cmd = f"{copy_cmds} && cd /app && python3 -c {shlex.quote(_SUITE_DRIVER)}"
+
+    cmd = [
+        "docker", "run", "--rm",
+        "--name", container_name,
+        "--network=none",
+        "--cap-drop=ALL",
+        "--user=999:995",
+        "--security-opt", "no-new-privileges",
+        "--read-only",
+        "--tmpfs", "/tmp:exec,size=256m",
+        "-e", "TCOMPUTE_SCORE=1",
+        "-e", "HOME=/app",
+        "-e", "PYTHONPATH=/app",
+        "-e", f"CSROOM_SUITE={json.dumps(spec)}",
+        "--cpus", "1.0",
+        # Grading yields to interactive containers (default weight 1024)
+        # when the host is contended.
+        "--cpu-shares", str(GRADING_CPU_SHARES),
+        "--memory", "512m",
+        "--memory-swap", "512m",
+        "--pids-limit", "128",
+        "-v", f"{student_dir}:/app:ro",
+    ]
+    for rel_path, host_path in test_files.items():
+        cmd.extend(["-v", f"{host_path}:/tmp/_staging/{rel_path}:ro"])
+    cmd.extend(["3compute:latest", "sh", "-c", shell_cmd])
+
+    budget = sum(s["timeout"] for s in steps) + (fallback["timeout"] if fallback else 0)
+
+    def _failed(message: str) -> list[dict]:
+        return [
+            {"name": s["name"], "returncode": -1, "stdout": "", "stderr": message,
+             "timed_out": True, "tests": []}
+            for s in steps
+        ]
+
+    try:
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            timeout=budget + 5,  # extra grace for container startup
+        )
+    except subprocess.TimeoutExpired:
+        subprocess.run(
+            ["docker", "rm", "-f", container_name],
+            capture_output=True,
+            timeout=10,
+        )
+        return _failed(f"[Timeout] Container exceeded {budget}s limit\n")
+
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith(marker):
+            try:
+                return json.loads(line[len(marker):])
+            except ValueError:
+                break
+    logger.warning(
+        f"Suite container {container_name} produced no results "
+        f"(exit={result.returncode}): {result.stderr[:500]!r}"
+    )
+    return _failed(result.stderr or f"[Error] Test container exited with {result.returncode}\n")
+
+
+# ---------------------------------------------------------------------------
+# Warm grading sandbox pool
+# ---------------------------------------------------------------------------
+
+# Pre-started grading sandboxes kept idle (0 disables the pool; grading then
+# always uses run_suite_in_ephemeral_container).
+GRADING_POOL_SIZE = int(
+    os.environ.get("GRADING_POOL_SIZE", str(min(4, max(1, num_cpus // 2))))
+)
+# A sandbox is recycled after this many jobs even if nothing went wrong.
+GRADING_POOL_MAX_JOBS = int(os.environ.get("GRADING_POOL_MAX_JOBS", "50"))
+
+# Largest job tarball streamed into a sandbox; it has to fit the sandbox's
+# 256m /jobs tmpfs next to what the tests write. A bigger workspace is
+# graded in an ephemeral container, which bind-mounts it instead.
+GRADING_JOB_MAX_BYTES = int(os.environ.get("GRADING_JOB_MAX_BYTES", str(128 << 20)))
+_UNPACK_TIMEOUT = 60
+
+_GRADER_PREFIX = "3compute-grader-"
+_JOBS_ROOT = "/jobs"
+# Each job runs as its own uid from this range so nothing a previous job
+# left behind (processes, files) is accessible to the next one.
+_JOB_UID_BASE = 20000
+_JOB_UID_SPAN = 10000
+# World-writable tmpfs mounts in a sandbox, shared by every job it runs.
+# Both must be empty between jobs.
+_SHARED_ROOTS = (_JOBS_ROOT, "/tmp")
+
+
+class _Sandbox:
+    __slots__ = ("name", "jobs")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.jobs = 0
+
+
+# Unpacks a job tarball from stdin into argv[1], run as the sandbox's own
+# user (not the job uid). Everything is then made read-only; since the job
+# uid doesn't own the files it can't chmod them back, so a test can't
+# rewrite the student's code or a later test script.
+_UNPACK_DRIVER = r"""
+import os, sys, tarfile
+dest = sys.argv[1]
+os.makedirs(dest, mode=0o755)
+with tarfile.open(fileobj=sys.stdin.buffer, mode="r|") as tf:
+    tf.extractall(dest, filter="data")
+for dp, dns, fns in os.walk(dest, topdown=False):
+    for fn in fns:
+        if not os.path.islink(os.path.join(dp, fn)):
+            os.chmod(os.path.join(dp, fn), 0o444)
+    os.chmod(dp, 0o555)
+"""
+
+
+class JobTooLarge(Exception):
+    """The job tarball grew past ``GRADING_JOB_MAX_BYTES``."""
+
+
+class _CappedWriter:
+    def __init__(self, raw, limit: int):
+        self.raw = raw
+        self.limit = limit
+        self.written = 0
+
+    def write(self, data) -> int:
+        self.written += len(data)
+        if self.written > self.limit:
+            raise JobTooLarge(f"job exceeds {self.limit} bytes")
+        return self.raw.write(data)
+
+
+def write_job_tar(
+    fileobj, student_dir: str, test_files: dict[str, str], limit: int | None = None,
+) -> None:
+    """Stream the student's workspace as ``app/`` and the test files as
+    ``tests/`` into *fileobj* as an uncompressed tar. Raises ``JobTooLarge``
+    as soon as more than *limit* bytes (default ``GRADING_JOB_MAX_BYTES``)
+    have been written."""
+    import tarfile
+
+    def _reset(info: tarfile.TarInfo) -> tarfile.TarInfo | None:
+        # Links that escape the job directory would be rejected by the
+        # in-sandbox extractor (and abort the job), so leave them out.
+        if (info.issym() or info.islnk()) and (
+            os.path.isabs(info.linkname) or ".." in info.linkname.split("/")
+        ):
+            return None
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""
+        return info
+
+    out = _CappedWriter(fileobj, GRADING_JOB_MAX_BYTES if limit is None else limit)
+    with tarfile.open(fileobj=out, mode="w|") as tf:
+        if os.path.isdir(student_dir):
+            tf.add(student_dir, arcname="app", filter=_reset)
+        else:
+            info = tarfile.TarInfo("app")
+            info.type = tarfile.DIRTYPE
+            info.mode = 0o755
+            tf.addfile(_reset(info))
+        for rel_path, host_path in test_files.items():
+            tf.add(host_path, arcname=f"tests/{rel_path}", filter=_reset)
+
+
+def _sweep_uid_script(uid: int, roots=_SHARED_ROOTS) -> str:
+    """Shell that deletes everything owned by *uid* under *roots*, made
+    writable first, and fails if any of it is left. Run as *uid*: the
+    sticky bit on the roots lets it remove its own entries only."""
+    import shlex
+
+    quoted = " ".join(shlex.quote(r) for r in roots)
+    return (
+        f"find {quoted} -xdev -mindepth 1 -maxdepth 1 -user {uid} "
+        f"-exec chmod -R u+rwx {{}} + 2>/dev/null; "
+        f"find {quoted} -xdev -mindepth 1 -maxdepth 1 -user {uid} -exec rm -rf {{}} +; "
+        f"! find {quoted} -xdev -mindepth 1 -user {uid} -print | grep -q ."
+    )
+
+
+def _remove_job_dir_script(job_dir: str, roots=_SHARED_ROOTS) -> str:
+    """Shell that removes *job_dir* and fails unless *roots* are then
+    empty, whoever owns what is left."""
+    import shlex
+
+    quoted = " ".join(shlex.quote(r) for r in roots)
+    return (
+        f"chmod -R u+w {shlex.quote(job_dir)} 2>/dev/null; "
+        f"rm -rf {shlex.quote(job_dir)} && "
+        f"! find {quoted} -xdev -mindepth 1 -print | grep -q ."
+    )
+
+
+def _rebase_arg(arg: str, job_dir: str) -> str:
+    """Point the ephemeral-container paths used in step commands (/app,
+    /tmp/tests) at this job's directory inside the sandbox."""
+    if arg == "/app" or arg.startswith("/app/"):
+        return f"{job_dir}/app{arg[4:]}"
+    if arg.startswith("/tmp/tests/"):
+        return f"{job_dir}/tests/{arg[len('/tmp/tests/'):]}"
+    return arg
+
+
+class GradingSandboxPool:
+    """Pool of pre-started, locked-down grading containers.
+
+    Sandboxes are started with the same hardening as the ephemeral grading
+    container (no network, no capabilities, read-only root, lower CPU
+    weight) and just sleep. Each job is streamed in as a tarball over
+    ``docker exec -i`` stdin and unpacked by the sandbox user into its own
+    read-only directory on the sandbox's tmpfs; the steps then run as a
+    fresh uid with a private scratch directory. Afterwards every process of
+    that uid is killed and everything it wrote to the shared /jobs and /tmp
+    mounts removed along with the job directory. A sandbox is thrown away
+    after ``max_jobs`` jobs or on any anomaly (timeout, missing results, a
+    cleanup that leaves anything behind).
+    """
+
+    def __init__(self, size: int = GRADING_POOL_SIZE, max_jobs: int = GRADING_POOL_MAX_JOBS):
+        import itertools
+        import threading
+
+        self.size = max(0, size)
+        self.max_jobs = max(1, max_jobs)
+        self._lock = threading.Lock()
+        self._idle: list[_Sandbox] = []
+        self._count = 0  # idle + busy
+        self._uids = itertools.count()
+
+    # -- lifecycle --------------------------------------------------------
+
+    def warm(self) -> None:
+        """Remove sandboxes left over from a previous backend process and
+        start the pool up to ``size``."""
+        if self.size == 0:
+            return
+        try:
+            result = subprocess.run(
+                ["docker", "ps", "-aq", "--filter", f"name={_GRADER_PREFIX}"],
+                capture_output=True, text=True, timeout=10,
+            )
+            stale = result.stdout.split()
+            if stale:
+                subprocess.run(
+                    ["docker", "rm", "-f", *stale], capture_output=True, timeout=30,
+                )
+        except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+            logger.warning(f"Could not clean up stale grading sandboxes: {e}")
+        while True:
+            with self._lock:
+                if self._count >= self.size:
+                    return
+                self._count += 1
+            sandbox = self._start()
+            with self._lock:
+                if sandbox is None:
+                    self._count -= 1
+                    return
+                self._idle.append(sandbox)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        for sandbox in idle:
+            self._discard(sandbox)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": self.size, "idle": len(self._idle), "total": self._count}
+
+    # -- jobs -------------------------------------------------------------
+
+    def run_suite(
+        self,
+        student_dir: str,
+        test_files: dict[str, str],
+        steps: list[dict],
+        fallback: dict | None = None,
+        score_parser: str | None = None,
+    ) -> list[dict] | None:
+        """Run a grading suite in a warm sandbox.
+
+        Same contract as ``run_suite_in_ephemeral_container``, except that it
+        returns None when no sandbox is available or the sandbox misbehaved
+        before producing results; the caller should then fall back to an
+        ephemeral container.
+        """
+        sandbox = self._acquire()
+        if sandbox is None:
+            return None
+        healthy = False
+        try:
+            results, healthy = self._run_job(
+                sandbox, student_dir, test_files, steps, fallback, score_parser,
+            )
+            return results
+        finally:
+            self._release(sandbox, healthy)
+
+    def _run_job(self, sandbox, student_dir, test_files, steps, fallback, score_parser):
+        import secrets
+
+        job_id = secrets.token_hex(8)
+        uid = _JOB_UID_BASE + next(self._uids) % _JOB_UID_SPAN
+        job_dir = f"{_JOBS_ROOT}/{job_id}"
+        scratch = f"{_JOBS_ROOT}/{job_id}.tmp"
+        marker = f"###CSROOM_SUITE_{secrets.token_hex(8)}###"
+
+        def _rebase(step: dict) -> dict:
+            return {**step, "command": [_rebase_arg(a, job_dir) for a in step["command"]]}
+
+        spec = {
+            "steps": [_rebase(s) for s in steps],
+            "fallback": _rebase(fallback) if fallback else None,
+            "score_parser": score_parser,
+            "marker": marker,
+            "max_output": _SUITE_MAX_OUTPUT,
+            "max_tests": _SUITE_MAX_TESTS,
+            "reporter": _TEST_REPORTER,
+            "cwd": f"{job_dir}/app",
+        }
+        try:
+            unpacked = self._unpack(sandbox, job_dir, student_dir, test_files)
+        except (JobTooLarge, OSError) as e:
+            # Not the sandbox's fault: grade this one in an ephemeral container.
+            logger.info(f"Not grading {student_dir} in a warm sandbox: {e}")
+            return None, self._cleanup(sandbox, job_id, None, job_dir)
+        if not unpacked:
+            return None, False
+
+        cmd = [
+            "docker", "exec",
+            "--user", f"{uid}:{uid}",
+            "-w", _JOBS_ROOT,
+            "-e", "TCOMPUTE_SCORE=1",
+            "-e", f"HOME={job_dir}/app",
+            "-e", f"PYTHONPATH={job_dir}/app",
+            "-e", f"TMPDIR={scratch}",
+            "-e", f"CSROOM_SUITE={json.dumps(spec)}",
+            sandbox.name,
+            "python3", "-c", _SUITE_DRIVER,
+        ]
+        budget = sum(s["timeout"] for s in steps) + (fallback["timeout"] if fallback else 0)
+
+        results = None
+        try:
+            result = subprocess.run(cmd, capture_output=True, timeout=budget + 5)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Grading job {job_id} in {sandbox.name} exceeded {budget}s")
+            return None, False
+
+        stdout = result.stdout.decode(errors="replace")
+        for line in reversed(stdout.splitlines()):
+            if line.startswith(marker):
+                try:
+                    results = json.loads(line[len(marker):])
+                except ValueError:
+                    pass
+                break
+        if results is None:
+            logger.warning(
+                f"Grading job {job_id} in {sandbox.name} produced no results "
+                f"(exit={result.returncode}): {result.stderr[:500]!r}"
+            )
+            return None, False
+
+        return results, self._cleanup(sandbox, job_id, uid, job_dir)
+
+    def _unpack(self, sandbox, job_dir: str, student_dir: str, test_files: dict[str, str]) -> bool:
+        """Stream the job into *job_dir* as the sandbox user. Raises
+        ``JobTooLarge`` (after stopping the transfer) if it is over the cap."""
+        import threading
+
+        proc = subprocess.Popen(
+            ["docker", "exec", "-i", sandbox.name, "python3", "-c", _UNPACK_DRIVER, job_dir],
+            stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        # A sandbox that stops reading would otherwise block the write forever.
+        watchdog = threading.Timer(_UNPACK_TIMEOUT, proc.kill)
+        watchdog.start()
+        try:
+            try:
+                write_job_tar(proc.stdin, student_dir, test_files)
+            except BrokenPipeError:
+                pass  # the unpacker exited early; its status says why
+            except BaseException:
+                proc.kill()
+                proc.wait()
+                raise
+            _out, err = proc.communicate()
+        finally:
+            watchdog.cancel()
+        if proc.returncode != 0:
+            logger.warning(
+                f"Unpacking grading job into {sandbox.name} failed "
+                f"(exit={proc.returncode}): {err[:500]!r}"
+            )
+            return False
+        return True
+
+    def _cleanup(self, sandbox, job_id: str, uid: int | None, job_dir: str) -> bool:
+        """Kill everything the job uid still runs (kill -1 skips the caller)
+        and delete every file it owns in /jobs and /tmp, scratch directory
+        included, then remove the job directory as the sandbox user that
+        unpacked it. Returns False if anything is left in either, in which
+        case the sandbox should be retired."""
+        commands = []
+        if uid is not None:
+            commands.append((
+                ["--user", f"{uid}:{uid}"],
+                "kill -9 -1 2>/dev/null; " + _sweep_uid_script(uid),
+            ))
+        commands.append(([], _remove_job_dir_script(job_dir)))
+        healthy = True
+        for user_args, script in commands:
+            try:
+                done = subprocess.run(
+                    ["docker", "exec", *user_args, sandbox.name, "sh", "-c", script],
+                    capture_output=True, timeout=15,
+                )
+                healthy = healthy and done.returncode == 0
+            except subprocess.TimeoutExpired:
+                healthy = False
+        if not healthy:
+            logger.warning(f"Cleanup of grading job {job_id} failed; retiring {sandbox.name}")
+        return healthy
+
+    # -- internals --------------------------------------------------------
+
+    def _acquire(self) -> _Sandbox | None:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            if self._count >= self.size:
+                return None
+            self._count += 1
+        sandbox = self._start()
+        if sandbox is None:
+            with self._lock:
+                self._count -= 1
+        return sandbox
+
+    def _release(self, sandbox: _Sandbox, healthy: bool) -> None:
+        sandbox.jobs += 1
+        if healthy and sandbox.jobs < self.max_jobs:
+            with self._lock:
+                self._idle.append(sandbox)
+            return
+        with self._lock:
+            self._count -= 1
+        self._discard(sandbox)
+
+    def _start(self) -> _Sandbox | None:
+        import uuid
+
+        name = f"{_GRADER_PREFIX}{uuid.uuid4().hex[:12]}"
+        cmd = [
+            "docker", "run", "-d", "--rm",
+            "--name", name,
+            "--network=none",
+            "--cap-drop=ALL",
+            "--user=999:995",
+            "--security-opt", "no-new-privileges",
+            "--read-only",
+            "--tmpfs", f"{_JOBS_ROOT}:exec,size=256m,mode=1777",
+            "--tmpfs", "/tmp:size=16m",
+            "--cpus", "1.0",
+            "--cpu-shares", str(GRADING_CPU_SHARES),
+            "--memory", "512m",
+            "--memory-swap", "512m",
+            "--pids-limit", "128",
+            "3compute:latest",
+            "sleep", "infinity",
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        except (subprocess.TimeoutExpired, FileNotFoundError) as e:
+            logger.warning(f"Could not start grading sandbox: {e}")
+            subprocess.run(["docker", "rm", "-f", name], capture_output=True, timeout=10)
+            return None
+        if result.returncode != 0:
+            logger.warning(f"Could not start grading sandbox: {result.stderr.strip()}")
+            return None
+        return _Sandbox(name)
+
+    def _discard(self, sandbox: _Sandbox) -> None:
+        try:
+            subprocess.run(["docker", "rm", "-f", sandbox.name], capture_output=True, timeout=15)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Timed out removing grading sandbox {sandbox.name}")
+
+
+_grading_pool: GradingSandboxPool | None = None
+
+
+def get_grading_pool() -> GradingSandboxPool:
+    """Return the process-wide warm grading pool, creating it on first use."""
+    global _grading_pool
+    if _grading_pool is None:
+        _grading_pool = GradingSandboxPool()
+    return _grading_pool
+
+
+def run_grading_suite(
+    student_dir: str,
+    test_files: dict[str, str],
+    steps: list[dict],
+    fallback: dict | None = None,
+    score_parser: str | None = None,
+) -> list[dict]:
+    """Run a grading suite in a warm sandbox when one is available, else in
+    a fresh ephemeral container. See ``run_suite_in_ephemeral_container``."""
+    results = get_grading_pool().run_suite(
+        student_dir, test_files, steps, fallback, score_parser,
+    )
+    if results is not None:
+        return results
+    return run_suite_in_ephemeral_container(
+        student_dir, test_files, steps, fallback, score_parser,
+    )
+
+
 __all__ = [
     "setup_isolated_network",
     "spawn_container",
@@ -745,4 +1489,9 @@ __all__ = [
     "container_exists",
     "container_is_running",
     "run_in_ephemeral_container",
+    "run_suite_in_ephemeral_container",
+    "GradingSandboxPool",
+    "JobTooLarge",
+    "get_grading_pool",
+    "run_grading_suite",
 ]
@@ -0,0 +1,280 @@
+"""Process-wide grading queue.
+
+Every grading request (a teacher clicking "Run tests", a single-student
+re-run, later auto-grading) goes through one shared scheduler instead of
+spinning up its own thread pool. The scheduler:
+
+- caps how many grading containers run at once, with the cap derived from
+  how much CPU is currently free (interactive terminals come first);
+- lowers the OS priority of its worker threads, so the host-side work they
+  do (copying starter files, the docker CLI itself) yields to the API;
+- round-robins between classrooms, so one teacher grading 30 students × 10
+  assignments cannot starve another teacher's single re-run;
+- orders by priority within a classroom (interactive before batch);
+- collapses duplicate submissions of the same job while it is still queued.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable
+
+import psutil
+
+logger = logging.getLogger("grading_queue")
+
+# Lower numbers run first.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+PRIORITY_BACKGROUND = 20
+
+# Hard ceiling on concurrent grading jobs. The effective limit is usually
+# lower; see grading_concurrency_limit().
+GRADING_MAX_WORKERS = max(1, int(os.environ.get("GRADING_MAX_WORKERS", os.cpu_count() or 1)))
+
+# Pin the limit instead of deriving it from free CPU (0 = auto).
+GRADING_MAX_CONCURRENCY = int(os.environ.get("GRADING_MAX_CONCURRENCY", "0") or 0)
+
+# Niceness applied to grading worker threads (and the docker CLI processes
+# they spawn). Interactive work stays at the default of 0.
+GRADING_NICENESS = 10
+
+_LIMIT_TTL = 2.0
+_limit_cache: tuple[float, int] = (0.0, 1)
+
+
+def grading_concurrency_limit() -> int:
+    """How many grading jobs may run right now.
+
+    One core is held back for the API process and interactive terminals; the
+    rest of the currently idle CPU is available to grading, capped at half
+    the machine so a burst of grading never owns the box. Always at least 1
+    so queued jobs make progress on a saturated host.
+    """
+    global _limit_cache
+    if GRADING_MAX_CONCURRENCY > 0:
+        return GRADING_MAX_CONCURRENCY
+
+    now = time.monotonic()
+    checked_at, limit = _limit_cache
+    if now - checked_at < _LIMIT_TTL:
+        return limit
+
+    cpus = os.cpu_count() or 1
+    busy = psutil.cpu_percent(interval=None) / 100.0
+    idle_cores = cpus * (1.0 - busy)
+    limit = max(1, min(max(1, cpus // 2), int(idle_cores) - 1, GRADING_MAX_WORKERS))
+    _limit_cache = (now, limit)
+    return limit
+
+
+class _Job:
+    __slots__ = ("classroom_id", "priority", "key", "fn", "args", "kwargs", "future")
+
+    def __init__(self, classroom_id, priority, key, fn, args, kwargs):
+        self.classroom_id = classroom_id
+        self.priority = priority
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+
+
+class GradingScheduler:
+    """Bounded, priority-aware, per-classroom fair job queue backed by a
+    small set of daemon worker threads (started lazily on first submit)."""
+
+    def __init__(
+        self,
+        max_workers: int = GRADING_MAX_WORKERS,
+        limit_fn: Callable[[], int] = grading_concurrency_limit,
+    ):
+        self._max_workers = max(1, max_workers)
+        self._limit_fn = limit_fn
+        self._cond = threading.Condition()
+        # classroom_id -> heap of (priority, seq, job)
+        self._queues: dict[str, list] = {}
+        # Classrooms with queued work, in round-robin order.
+        self._ring: deque[str] = deque()
+        # key -> job, for jobs still waiting to start.
+        self._queued_by_key: dict[Hashable, _Job] = {}
+        self._seq = itertools.count()
+        self._active = 0
+        self._threads: list[threading.Thread] = []
+        self._stopping = False
+
+    def submit(
+        self,
+        classroom_id: str,
+        fn: Callable[..., Any],
+        *args,
+        priority: int = PRIORITY_BATCH,
+        key: Hashable | None = None,
+        **kwargs,
+    ) -> Future:
+        """Queue ``fn(*args, **kwargs)`` and return a Future for its result.
+
+        If *key* matches a job that has not started yet, that job's Future is
+        returned instead of queueing a duplicate (its priority is raised if
+        the new request is more urgent). A job that is already running is
+        never reused, since the files it is grading may have changed since.
+        """
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("grading scheduler is shut down")
+            if key is not None and key in self._queued_by_key:
+                existing = self._queued_by_key[key]
+                if priority < existing.priority:
+                    self._reprioritize(existing, priority)
+                return existing.future
+
+            job = _Job(classroom_id, priority, key, fn, args, kwargs)
+            self._push(job)
+            if key is not None:
+                self._queued_by_key[key] = job
+            self._ensure_workers()
+            self._cond.notify()
+            return job.future
+
+    async def run(self, classroom_id: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Async convenience wrapper: submit and await the result."""
+        return await asyncio.wrap_future(self.submit(classroom_id, fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "queued": sum(len(q) for q in self._queues.values()),
+                "active": self._active,
+                "limit": self._limit_fn(),
+                "classrooms_waiting": len(self._ring),
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting work, cancel queued jobs and stop the workers."""
+        with self._cond:
+            self._stopping = True
+            for heap in self._queues.values():
+                for _prio, _seq, job in heap:
+                    job.future.cancel()
+            self._queues.clear()
+            self._ring.clear()
+            self._queued_by_key.clear()
+            self._cond.notify_all()
+            threads = list(self._threads)
+        if wait:
+            for t in threads:
+                t.join(timeout=5)
+
+    # -- internals (call with self._cond held) ---------------------------
+
+    def _push(self, job: _Job) -> None:
+        heap = self._queues.get(job.classroom_id)
+        if heap is None:
+            heap = self._queues[job.classroom_id] = []
+            self._ring.append(job.classroom_id)
+        heapq.heappush(heap, (job.priority, next(self._seq), job))
+
+    def _reprioritize(self, job: _Job, priority: int) -> None:
+        heap = self._queues[job.classroom_id]
+        heap[:] = [entry for entry in heap if entry[2] is not job]
+        heapq.heapify(heap)
+        job.priority = priority
+        heapq.heappush(heap, (priority, next(self._seq), job))
+
+    def _pop_next(self) -> _Job | None:
+        """Most urgent priority across classrooms; ties go to whichever
+        classroom is next in the round-robin ring."""
+        if not self._ring:
+            return None
+        best = min(self._queues[cid][0][0] for cid in self._ring)
+        for _ in range(len(self._ring)):
+            cid = self._ring[0]
+            self._ring.rotate(-1)
+            heap = self._queues[cid]
+            if heap[0][0] == best:
+                _prio, _seq, job = heapq.heappop(heap)
+                if not heap:
+                    del self._queues[cid]
+                    self._ring.remove(cid)
+                if job.key is not None and self._queued_by_key.get(job.key) is job:
+                    del self._queued_by_key[job.key]
+                return job
+        return None  # unreachable
+
+    def _ensure_workers(self) -> None:
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self._max_workers:
+            t = threading.Thread(
+                target=self._worker,
+                name=f"grading-{len(self._threads)}",
+                daemon=True,
+            )
+            self._threads.append(t)
+            t.start()
+
+    def _worker(self) -> None:
+        _lower_thread_priority()
+        while True:
+            with self._cond:
+                while not self._stopping and (
+                    not self._ring or self._active >= self._limit_fn()
+                ):
+                    # Timed wait so a change in free CPU is picked up even
+                    # when no job finishes.
+                    self._cond.wait(timeout=_LIMIT_TTL)
+                if self._stopping:
+                    return
+                job = self._pop_next()
+                if job is None:
+                    continue
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                self._active += 1
+
+            try:
+                job.future.set_result(job.fn(*job.args, **job.kwargs))
+            except BaseException as e:  # noqa: BLE001 - surfaced via the future
+                job.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+
+def _lower_thread_priority() -> None:
+    """Renice the calling thread (Linux schedules threads individually;
+    children spawned from it inherit the value)."""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), GRADING_NICENESS)
+    except (AttributeError, OSError) as e:
+        logger.debug("Could not lower grading thread priority: %s", e)
+
+
+_scheduler: GradingScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_grading_scheduler() -> GradingScheduler:
+    """Return the process-wide scheduler, creating it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GradingScheduler()
+        return _scheduler
+
+
+__all__ = [
+    "PRIORITY_INTERACTIVE",
+    "PRIORITY_BATCH",
+    "PRIORITY_BACKGROUND",
+    "GradingScheduler",
+    "get_grading_scheduler",
+    "grading_concurrency_limit",
+]
@@ -0,0 +1,189 @@
+"""Owner and mode normalization for files shared with user containers.
+
+Everything under the uploads and classrooms roots has to be usable by both
+the backend (www-data, with supplementary group 995) and the container user
+(999:995): directories 2775, setgid so children inherit GID 995, and files
+0664. This module is the one place that enforces it. Each entry is
+``lstat``-ed first and only gets a ``chown``/``chmod`` when it actually
+differs; trees are walked with ``os.fwalk`` so every call is relative to an
+open directory fd; symlinks are never followed or changed.
+
+Without CAP_CHOWN a full chown fails, so whether the process has it is read
+once at import; without it only the group is fixed (which is what still
+matters for access). An EPERM on one entry despite the capability (e.g. a
+root-squashed mount) falls back to the group for that entry alone.
+Every call returns an ``OwnershipStats`` with the syscalls it issued.
+"""
+
+import errno
+import logging
+import os
+import stat
+from dataclasses import dataclass
+from typing import Iterable
+
+from backend.docker import CONTAINER_USER_GID, CONTAINER_USER_UID
+
+logger = logging.getLogger("ownership")
+
+DIR_MODE = 0o2775
+FILE_MODE = 0o664
+
+CAP_CHOWN = 0
+
+
+def _has_cap_chown() -> bool:
+    """Whether this process may give files away: CAP_CHOWN in its effective
+    set, or root where /proc is not available."""
+    try:
+        with open("/proc/self/status") as fh:
+            for line in fh:
+                if line.startswith("CapEff:"):
+                    return bool(int(line.split()[1], 16) >> CAP_CHOWN & 1)
+    except (OSError, ValueError, IndexError):
+        pass
+    return os.geteuid() == 0
+
+
+_can_chown_owner = _has_cap_chown()
+
+
+@dataclass
+class OwnershipStats:
+    checked: int = 0
+    chown: int = 0
+    chmod: int = 0
+    errors: int = 0
+
+    def __iadd__(self, other: "OwnershipStats") -> "OwnershipStats":
+        self.checked += other.checked
+        self.chown += other.chown
+        self.chmod += other.chmod
+        self.errors += other.errors
+        return self
+
+
+def _fix(target, st: os.stat_result, uid: int, gid: int, dir_mode: int, file_mode: int,
+         stats: OwnershipStats, dir_fd: int | None = None) -> None:
+    """Bring one entry to uid:gid and its mode. *target* is a path (relative
+    to *dir_fd* if given) or an open fd."""
+    stats.checked += 1
+    if stat.S_ISLNK(st.st_mode):
+        return
+    is_dir = stat.S_ISDIR(st.st_mode)
+    kw = {} if isinstance(target, int) else {"dir_fd": dir_fd}
+    nofollow = {} if isinstance(target, int) else {"follow_symlinks": False}
+    try:
+        chowned = False
+        want_owner = uid if _can_chown_owner else st.st_uid
+        if st.st_uid != want_owner or st.st_gid != gid:
+            chowned = True
+            stats.chown += 1
+            try:
+                os.chown(target, want_owner, gid, **kw, **nofollow)
+            except PermissionError:
+                if want_owner == st.st_uid:
+                    raise
+                if st.st_gid != gid:
+                    stats.chown += 1
+                    os.chown(target, -1, gid, **kw, **nofollow)
+        mode = dir_mode if is_dir else file_mode
+        current = st.st_mode
+        if chowned and mode & (stat.S_ISUID | stat.S_ISGID):
+            # chown can clear setuid/setgid; look again before deciding.
+            current = os.stat(target, **kw, **nofollow).st_mode
+        if stat.S_IMODE(current) != mode:
+            stats.chmod += 1
+            os.chmod(target, mode, **kw)
+    except OSError as e:
+        stats.errors += 1
+        if e.errno != errno.ENOENT:
+            logger.debug("Could not normalize %r: %s", target, e)
+
+
+def normalize_tree(
+    root: str,
+    *,
+    uid: int = CONTAINER_USER_UID,
+    gid: int = CONTAINER_USER_GID,
+    dir_mode: int = DIR_MODE,
+    file_mode: int = FILE_MODE,
+) -> OwnershipStats:
+    """Normalize *root* and everything below it (without following links)."""
+    stats = OwnershipStats()
+    try:
+        st = os.stat(root, follow_symlinks=False)
+    except OSError:
+        stats.errors += 1
+        return stats
+    _fix(root, st, uid, gid, dir_mode, file_mode, stats)
+    if not stat.S_ISDIR(st.st_mode):
+        return stats
+    for _dirpath, dirnames, filenames, dirfd in os.fwalk(root, follow_symlinks=False):
+        for name in dirnames + filenames:
+            try:
+                st = os.stat(name, dir_fd=dirfd, follow_symlinks=False)
+            except OSError:
+                stats.errors += 1
+                continue
+            _fix(name, st, uid, gid, dir_mode, file_mode, stats, dir_fd=dirfd)
+    return stats
+
+
+def normalize_paths(
+    paths: Iterable[str],
+    *,
+    uid: int = CONTAINER_USER_UID,
+    gid: int = CONTAINER_USER_GID,
+    dir_mode: int = DIR_MODE,
+    file_mode: int = FILE_MODE,
+) -> OwnershipStats:
+    """Normalize just these entries (not their contents), e.g. the files and
+    directories a request just created. Entries are grouped by parent, and
+    each parent is opened once."""
+    stats = OwnershipStats()
+    by_parent: dict[str, set[str]] = {}
+    for path in paths:
+        path = os.path.normpath(path)
+        by_parent.setdefault(os.path.dirname(path), set()).add(os.path.basename(path))
+    for parent, names in by_parent.items():
+        try:
+            dirfd = os.open(parent or ".", os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            stats.errors += len(names)
+            continue
+        try:
+            for name in sorted(names):
+                try:
+                    st = os.stat(name, dir_fd=dirfd, follow_symlinks=False)
+                except OSError:
+                    stats.errors += 1
+                    continue
+                _fix(name, st, uid, gid, dir_mode, file_mode, stats, dir_fd=dirfd)
+        finally:
+            os.close(dirfd)
+    return stats
+
+
+def normalize_fd(
+    fd: int,
+    *,
+    uid: int = CONTAINER_USER_UID,
+    gid: int = CONTAINER_USER_GID,
+    dir_mode: int = DIR_MODE,
+    file_mode: int = FILE_MODE,
+) -> OwnershipStats:
+    """Normalize the file or directory open as *fd*."""
+    stats = OwnershipStats()
+    _fix(fd, os.fstat(fd), uid, gid, dir_mode, file_mode, stats)
+    return stats
+
+
+__all__ = [
+    "DIR_MODE",
+    "FILE_MODE",
+    "OwnershipStats",
+    "normalize_fd",
+    "normalize_paths",
+    "normalize_tree",
+]
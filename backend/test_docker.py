@@ -2,6 +2,7 @@
 Unit tests for docker.py module
 """
 
+import os
 import subprocess
 from unittest.mock import Mock, patch
 
@@ -409,57 +410,451 @@ class TestRunInEphemeralContainer:
             assert m.endswith(":ro"), f"Staging mount must be read-only: {m}"
 
 
+class TestRunSuiteInEphemeralContainer:
+    """Tests for the one-container-per-suite grading path."""
+
+    @staticmethod
+    def _suite_stdout(results):
+        import json
+
+        def fake_run(cmd, **kwargs):
+            spec = json.loads(
+                next(a for a in cmd if a.startswith("CSROOM_SUITE=")).split("=", 1)[1]
+            )
+            return Mock(
+                returncode=0,
+                stdout="noise\n" + spec["marker"] + json.dumps(results) + "\n",
+                stderr="",
+            )
+
+        return fake_run
+
+    @patch("subprocess.run")
+    def test_single_docker_run_for_all_steps(self, mock_run):
+        from backend.docker import run_suite_in_ephemeral_container
+
+        step_results = [
+            {"name": "test_a.py", "returncode": 0, "stdout": "1/1\n", "stderr": "", "timed_out": False},
+            {"name": "test_b.py", "returncode": 1, "stdout": "0/2\n", "stderr": "boom\n", "timed_out": False},
+        ]
+        mock_run.side_effect = self._suite_stdout(step_results)
+
+        results = run_suite_in_ephemeral_container(
+            student_dir="/data/student",
+            test_files={"test_a.py": "/t/test_a.py", "test_b.py": "/t/test_b.py"},
+            steps=[
+                {"name": "test_a.py", "command": ["python3", "/tmp/tests/test_a.py"], "timeout": 30},
+                {"name": "test_b.py", "command": ["python3", "/tmp/tests/test_b.py"], "timeout": 30},
+            ],
+        )
+
+        assert results == step_results
+        assert mock_run.call_count == 1
+        args = mock_run.call_args[0][0]
+        cmd_str = " ".join(args)
+        assert "--network=none" in cmd_str
+        assert "--read-only" in cmd_str
+        assert "/data/student:/app:ro" in args
+        # Outer timeout covers every step's budget plus startup grace.
+        assert mock_run.call_args[1]["timeout"] == 65
+
+    @patch("subprocess.run")
+    def test_missing_marker_reports_every_step_failed(self, mock_run):
+        from backend.docker import run_suite_in_ephemeral_container
+
+        mock_run.return_value = Mock(returncode=125, stdout="", stderr="no such image\n")
+
+        results = run_suite_in_ephemeral_container(
+            student_dir="/data/student",
+            test_files={"t.py": "/data/t.py"},
+            steps=[{"name": "t.py", "command": ["python3", "/tmp/tests/t.py"], "timeout": 30}],
+        )
+
+        assert len(results) == 1
+        assert results[0]["returncode"] == -1
+        assert "no such image" in results[0]["stderr"]
+
+    @patch("subprocess.run")
+    def test_timeout_kills_container(self, mock_run):
+        from backend.docker import run_suite_in_ephemeral_container
+
+        mock_run.side_effect = [
+            subprocess.TimeoutExpired(cmd="docker run", timeout=35),
+            Mock(returncode=0),  # docker rm -f
+        ]
+
+        results = run_suite_in_ephemeral_container(
+            student_dir="/data/student",
+            test_files={"t.py": "/data/t.py"},
+            steps=[{"name": "t.py", "command": ["python3", "/tmp/tests/t.py"], "timeout": 30}],
+        )
+
+        assert results[0]["timed_out"] is True
+        rm_args = mock_run.call_args_list[1][0][0]
+        assert "rm" in rm_args and "-f" in rm_args
+
+
+class TestSuiteDriverFallback:
+    """The driver skips the pytest fallback by the backend's own score parse."""
+
+    @staticmethod
+    def _drive(tmp_path, stdout):
+        import json
+        import sys
+
+        from backend.docker import _SUITE_DRIVER
+        from backend.test_runner import SCORE_PARSER_SOURCE
+
+        spec = {
+            "steps": [{"name": "t.py", "command": [sys.executable, "-c", f"print({stdout!r})"],
+                       "timeout": 10}],
+            "fallback": {"name": "pytest", "command": [sys.executable, "-c", "print('fb')"],
+                         "timeout": 10},
+            "score_parser": SCORE_PARSER_SOURCE,
+            "marker": "###M###",
+            "max_output": 10_000,
+            "max_tests": 10,
+        }
+        result = subprocess.run(
+            [sys.executable, "-c", _SUITE_DRIVER], capture_output=True, text=True,
+            cwd=tmp_path, env={"CSROOM_SUITE": json.dumps(spec)}, timeout=30,
+        )
+        line = next(ln for ln in result.stdout.splitlines() if ln.startswith("###M###"))
+        return [r["name"] for r in json.loads(line[len("###M###"):])]
+
+    @pytest.mark.parametrize("stdout, runs_fallback", [
+        ("noise\n1/2", False),
+        ("1/2\nmore output after the score", True),
+        ("Ran 3 tests\n\nOK", False),
+        ("nothing useful", True),
+    ])
+    def test_same_rule_as_parser(self, tmp_path, stdout, runs_fallback):
+        from backend.test_runner import _parse_script_output
+
+        assert (_parse_script_output(stdout + "\n")[1] == 0) is runs_fallback
+        names = self._drive(tmp_path, stdout)
+        assert names == (["t.py", "pytest"] if runs_fallback else ["t.py"])
+
+
+class TestGradingSandboxPool:
+    """Warm pool: jobs go over docker exec stdin; sandboxes get recycled."""
+
+    @staticmethod
+    def _docker(results=None, cleanup_rc=0, unpack_rc=0):
+        """Fake subprocess.run / Popen for docker run/exec/rm. Job tarballs
+        streamed to the unpacker over Popen stdin are collected in
+        ``calls`` as ``(cmd, {"input": bytes})``."""
+        import io
+        import json
+
+        calls = []
+
+        def fake_run(cmd, **kwargs):
+            calls.append((cmd, kwargs))
+            if cmd[:3] == ["docker", "run", "-d"]:
+                return Mock(returncode=0, stdout="cid\n", stderr="")
+            if cmd[:2] == ["docker", "exec"] and any(a.startswith("CSROOM_SUITE=") for a in cmd):
+                spec = json.loads(
+                    next(a for a in cmd if a.startswith("CSROOM_SUITE=")).split("=", 1)[1]
+                )
+                out = "" if results is None else spec["marker"] + json.dumps(results) + "\n"
+                return Mock(returncode=0, stdout=out.encode(), stderr=b"")
+            if cmd[:2] == ["docker", "exec"]:
+                return Mock(returncode=cleanup_rc, stdout=b"", stderr=b"")
+            return Mock(returncode=0, stdout="", stderr="")
+
+        class FakePopen:
+            def __init__(self, cmd, **kwargs):
+                self.stdin = io.BytesIO()
+                self.returncode = None
+                self.kwargs = {}
+                calls.append((cmd, self.kwargs))
+
+            def communicate(self, timeout=None):
+                self.kwargs["input"] = self.stdin.getvalue()
+                self.returncode = unpack_rc
+                return None, b""
+
+            def kill(self):
+                self.returncode = -9
+
+            def wait(self, timeout=None):
+                return self.returncode
+
+        def both():
+            return (
+                patch("subprocess.run", side_effect=fake_run),
+                patch("subprocess.Popen", FakePopen),
+            )
+
+        return both, calls
+
+    _steps = [{"name": "t.py", "command": ["python3", "/tmp/tests/t.py"], "timeout": 30}]
+
+    def test_job_streams_tar_and_reuses_sandbox(self, tmp_path):
+        from backend.docker import GradingSandboxPool
+
+        student = tmp_path / "s"
+        student.mkdir()
+        (student / "main.py").write_text("x = 1\n")
+        test = tmp_path / "t.py"
+        test.write_text("print('1/1')\n")
+
+        docker, calls = self._docker([_step("t.py", "1/1\n")])
+        pool = GradingSandboxPool(size=1, max_jobs=5)
+        run, popen = docker()
+        with run, popen:
+            for _ in range(2):
+                results = pool.run_suite(str(student), {"t.py": str(test)}, self._steps)
+                assert results[0]["stdout"] == "1/1\n"
+
+        starts = [c for c, _ in calls if c[:3] == ["docker", "run", "-d"]]
+        assert len(starts) == 1
+        start = " ".join(starts[0])
+        assert "--network=none" in start and "--read-only" in start and "--cap-drop=ALL" in start
+
+        # Payload is a tarball, not bind mounts, unpacked as the sandbox user.
+        unpacks = [(c, kw) for c, kw in calls if c[:3] == ["docker", "exec", "-i"]]
+        assert len(unpacks) == 2
+        assert all(kw["input"][257:262] == b"ustar" for _c, kw in unpacks)
+        assert not any("--user" in c for c, _kw in unpacks)
+        # The steps run as a fresh uid per job.
+        suites = [c for c, _ in calls if any(a.startswith("CSROOM_SUITE=") for a in c)]
+        uids = [c[c.index("--user") + 1] for c in suites]
+        assert len(uids) == 2 and uids[0] != uids[1]
+        assert not any("-v" in c for c, _kw in calls if c[:2] == ["docker", "exec"])
+        # Each job's files are swept from the shared mounts as its own uid.
+        sweeps = [c for c, _ in calls if c[:3] == ["docker", "exec", "--user"] and "find" in c[-1]]
+        assert [c[3] for c in sweeps] == uids
+        assert all("/tmp" in c[-1] and "/jobs" in c[-1] for c in sweeps)
+
+    def test_oversized_job_falls_back_without_retiring(self, tmp_path):
+        from backend.docker import GradingSandboxPool
+
+        (tmp_path / "big.bin").write_bytes(b"x" * 50_000)
+        docker, calls = self._docker([_step("t.py", "1/1\n")])
+        pool = GradingSandboxPool(size=1)
+        run, popen = docker()
+        with run, popen, patch("backend.docker.GRADING_JOB_MAX_BYTES", 20_000):
+            assert pool.run_suite(str(tmp_path), {}, self._steps) is None
+
+        assert not any(any(a.startswith("CSROOM_SUITE=") for a in c) for c, _ in calls)
+        # The partial job directory is removed and the sandbox kept.
+        removals = [c for c, _ in calls if c[:2] == ["docker", "exec"] and "rm -rf" in c[-1]]
+        assert len(removals) == 1 and "--user" not in removals[0]
+        assert pool.stats() == {"size": 1, "idle": 1, "total": 1}
+
+    def test_recycled_after_max_jobs(self, tmp_path):
+        from backend.docker import GradingSandboxPool
+
+        docker, calls = self._docker([_step("t.py", "1/1\n")])
+        pool = GradingSandboxPool(size=1, max_jobs=2)
+        run, popen = docker()
+        with run, popen:
+            for _ in range(3):
+                pool.run_suite(str(tmp_path), {}, self._steps)
+
+        assert len([c for c, _ in calls if c[:3] == ["docker", "run", "-d"]]) == 2
+        assert len([c for c, _ in calls if c[:3] == ["docker", "rm", "-f"]]) == 1
+
+    def test_anomaly_retires_sandbox_and_falls_back(self, tmp_path):
+        from backend.docker import GradingSandboxPool, run_grading_suite
+
+        docker, calls = self._docker(results=None)
+        pool = GradingSandboxPool(size=1)
+        run, popen = docker()
+        with run, popen, \
+                patch("backend.docker.get_grading_pool", return_value=pool), \
+                patch("backend.docker.run_suite_in_ephemeral_container",
+                      return_value=[_step("t.py", "0/1\n")]) as ephemeral:
+            results = run_grading_suite(str(tmp_path), {}, self._steps)
+
+        assert results[0]["stdout"] == "0/1\n"
+        ephemeral.assert_called_once()
+        assert pool.stats()["total"] == 0
+        assert any(c[:3] == ["docker", "rm", "-f"] for c, _ in calls)
+
+    def test_failed_unpack_retires_sandbox(self, tmp_path):
+        from backend.docker import GradingSandboxPool
+
+        docker, calls = self._docker([_step("t.py", "1/1\n")], unpack_rc=1)
+        pool = GradingSandboxPool(size=1)
+        run, popen = docker()
+        with run, popen:
+            assert pool.run_suite(str(tmp_path), {}, self._steps) is None
+
+        assert pool.stats()["total"] == 0
+
+    def test_failed_cleanup_retires_sandbox(self, tmp_path):
+        from backend.docker import GradingSandboxPool
+
+        docker, _calls = self._docker([_step("t.py", "1/1\n")], cleanup_rc=1)
+        pool = GradingSandboxPool(size=1)
+        run, popen = docker()
+        with run, popen:
+            results = pool.run_suite(str(tmp_path), {}, self._steps)
+
+        assert results[0]["stdout"] == "1/1\n"
+        assert pool.stats() == {"size": 1, "idle": 0, "total": 0}
+
+
+class TestJobUnpack:
+    def test_unpacked_job_is_read_only(self, tmp_path):
+        import io
+        import stat
+        import sys
+
+        from backend.docker import _UNPACK_DRIVER, write_job_tar
+
+        student = tmp_path / "s"
+        (student / "pkg").mkdir(parents=True)
+        (student / "pkg" / "main.py").write_text("x = 1\n")
+        test = tmp_path / "test_a.py"
+        test.write_text("print('1/1')\n")
+        buf = io.BytesIO()
+        write_job_tar(buf, str(student), {"test_a.py": str(test)})
+
+        job = tmp_path / "job"
+        subprocess.run(
+            [sys.executable, "-c", _UNPACK_DRIVER, str(job)],
+            input=buf.getvalue(), check=True, capture_output=True,
+        )
+        assert (job / "app" / "pkg" / "main.py").read_text() == "x = 1\n"
+        for path in (job, job / "app" / "pkg", job / "tests" / "test_a.py"):
+            assert not path.stat().st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+        for dp, _dns, _fns in os.walk(job):
+            os.chmod(dp, 0o755)
+
+    def test_cleanup_leaves_nothing_for_the_next_job(self, tmp_path):
+        from backend.docker import _remove_job_dir_script, _sweep_uid_script
+
+        jobs, tmp = tmp_path / "jobs", tmp_path / "tmp"
+        roots = (str(jobs), str(tmp))
+        for root in (jobs, tmp):
+            root.mkdir()
+            root.chmod(0o1777)
+        # Job A writes outside its scratch dir, and locks some of it up.
+        (jobs / "a").mkdir()
+        (jobs / "a" / "app.py").write_text("")
+        (jobs / "a.tmp" / "sub").mkdir(parents=True)
+        (jobs / "a.tmp" / "sub" / "f").write_text("")
+        (jobs / "a.tmp" / "sub").chmod(0o500)
+        (tmp / "x").write_text("secret")
+        (tmp / "d").mkdir(mode=0o000)
+
+        uid = os.getuid()
+        sweep = subprocess.run(["sh", "-c", _sweep_uid_script(uid, roots)])
+        assert sweep.returncode == 0
+        check = subprocess.run(["sh", "-c", _remove_job_dir_script(str(jobs / "a"), roots)])
+        assert check.returncode == 0
+        # Job B finds the shared mounts empty.
+        assert list(jobs.iterdir()) == [] and list(tmp.iterdir()) == []
+
+        # Anything left behind (e.g. by another uid) retires the sandbox.
+        (tmp / "y").write_text("")
+        (jobs / "b").mkdir()
+        check = subprocess.run(["sh", "-c", _remove_job_dir_script(str(jobs / "b"), roots)])
+        assert check.returncode != 0
+
+    def test_tar_stops_at_the_cap(self, tmp_path):
+        import io
+
+        from backend.docker import JobTooLarge, write_job_tar
+
+        (tmp_path / "big.bin").write_bytes(b"x" * 100_000)
+        buf = io.BytesIO()
+        with pytest.raises(JobTooLarge):
+            write_job_tar(buf, str(tmp_path), {}, limit=30_000)
+        assert len(buf.getvalue()) <= 30_000
+
+
+def _step(name, stdout="", stderr="", returncode=0, timed_out=False, fallback=False):
+    res = {
+        "name": name,
+        "returncode": -1 if timed_out else returncode,
+        "stdout": stdout,
+        "stderr": stderr,
+        "timed_out": timed_out,
+    }
+    if fallback:
+        res["fallback"] = True
+    return res
+
+
 class TestTestRunnerContainerIntegration:
-    """Test that test_runner functions use ephemeral containers."""
+    """Test that test_runner grades each student in a single container."""
 
-    @patch("backend.test_runner.run_in_ephemeral_container")
+    @patch("backend.test_runner.run_grading_suite")
     @patch("backend.test_runner._find_test_files")
     @patch("os.path.isdir")
-    def test_run_tests_uses_container(self, mock_isdir, mock_find, mock_container):
-        """run_tests_for_student should call run_in_ephemeral_container."""
+    def test_run_tests_uses_container(self, mock_isdir, mock_find, mock_suite):
+        """run_tests_for_student should run every script in one suite container."""
         from backend.test_runner import run_tests_for_student
 
         mock_isdir.return_value = True
-        mock_find.return_value = ["test_math.py"]
-        mock_container.return_value = (0, "3/3\n", "")
+        mock_find.return_value = ["test_math.py", "test_more.py"]
+        mock_suite.return_value = [
+            _step("test_math.py", "3/3\n"),
+            _step("test_more.py", "1/2\n"),
+        ]
 
         passed, total = run_tests_for_student("c1", "lesson1", "alice@test.com")
 
-        assert passed == 3
-        assert total == 3
-        mock_container.assert_called_once()
-        call_kwargs = mock_container.call_args[1]
-        assert call_kwargs["command"] == ["python3", "/tmp/tests/test_math.py"]
+        assert (passed, total) == (4, 5)
+        mock_suite.assert_called_once()
+        call_kwargs = mock_suite.call_args[1]
+        assert [s["command"] for s in call_kwargs["steps"]] == [
+            ["python3", "/tmp/tests/test_math.py"],
+            ["python3", "/tmp/tests/test_more.py"],
+        ]
+        assert all(s["timeout"] == 30 for s in call_kwargs["steps"])
+        assert call_kwargs["fallback"]["command"][:3] == ["python3", "-m", "pytest"]
         assert ":ro" not in str(call_kwargs)  # ro is handled by docker.py, not test_runner
 
-    @patch("backend.test_runner.run_in_ephemeral_container")
+    @patch("backend.test_runner.run_grading_suite")
     @patch("backend.test_runner._find_test_files")
     @patch("os.path.isdir")
-    def test_run_tests_with_output_uses_container(self, mock_isdir, mock_find, mock_container):
-        """run_tests_for_student_with_output should call run_in_ephemeral_container."""
+    def test_run_tests_with_output_uses_container(self, mock_isdir, mock_find, mock_suite):
+        """run_tests_for_student_with_output should keep per-file output."""
         from backend.test_runner import run_tests_for_student_with_output
 
         mock_isdir.return_value = True
         mock_find.return_value = ["test_math.py"]
-        mock_container.return_value = (0, "5/5\n", "")
+        mock_suite.return_value = [_step("test_math.py", "5/5\n", "warning\n")]
 
         passed, total, output = run_tests_for_student_with_output("c1", "lesson1", "bob@test.com")
 
         assert passed == 5
         assert total == 5
-        assert "5/5" in output
-        mock_container.assert_called_once()
+        assert "5/5" in output and "warning" in output
+        mock_suite.assert_called_once()
+
+    @patch("backend.test_runner.run_grading_suite")
+    @patch("backend.test_runner._find_test_files")
+    @patch("os.path.isdir")
+    def test_pytest_fallback_step_parsed(self, mock_isdir, mock_find, mock_suite):
+        """Without a script score the in-container pytest fallback is used."""
+        from backend.test_runner import run_tests_for_student
+
+        mock_isdir.return_value = True
+        mock_find.return_value = ["test_plain.py"]
+        mock_suite.return_value = [
+            _step("test_plain.py", ""),
+            _step("pytest", "2 passed, 1 failed in 0.1s\n", returncode=1, fallback=True),
+        ]
+
+        assert run_tests_for_student("c1", "lesson1", "alice@test.com") == (2, 3)
 
-    @patch("backend.test_runner.run_in_ephemeral_container")
+    @patch("backend.test_runner.run_grading_suite")
     @patch("backend.test_runner._find_test_files")
     @patch("os.path.isdir")
-    def test_timeout_handled(self, mock_isdir, mock_find, mock_container):
-        """Timeout from ephemeral container should be handled gracefully."""
+    def test_timeout_handled(self, mock_isdir, mock_find, mock_suite):
+        """A step timeout should be handled gracefully."""
         from backend.test_runner import run_tests_for_student_with_output
 
         mock_isdir.return_value = True
         mock_find.return_value = ["test_slow.py"]
-        mock_container.return_value = (-1, "", "[Timeout] Container exceeded 30s limit\n")
+        mock_suite.return_value = [_step("test_slow.py", timed_out=True)]
 
         passed, total, output = run_tests_for_student_with_output("c1", "lesson1", "alice@test.com")
 
@@ -467,5 +862,281 @@ class TestTestRunnerContainerIntegration:
         assert "Timeout" in output
 
 
+class TestGradingFingerprint:
+    """Unchanged submissions reuse their stored result instead of re-running."""
+
+    @pytest.fixture
+    def classroom(self, tmp_path, monkeypatch):
+        root = tmp_path / "classrooms"
+        monkeypatch.setattr("backend.test_runner.CLASSROOMS_ROOT", str(root))
+        tmpl = root / "c1" / "assignments" / "hw1"
+        tmpl.mkdir(parents=True)
+        (tmpl / "test_hw.py").write_text("print('1/1')\n")
+        student = root / "c1" / "participants" / "alice@test.com" / "hw1"
+        student.mkdir(parents=True)
+        (student / "main.py").write_text("x = 1\n")
+        return tmpl, student
+
+    @patch("backend.test_runner.run_grading_suite")
+    def test_cached_when_unchanged(self, mock_suite, classroom):
+        from backend.test_runner import grade_student
+
+        mock_suite.return_value = [_step("test_hw.py", "1/1\n")]
+        first = grade_student("c1", "hw1", "alice@test.com")
+        assert first.fingerprint and not first.cached
+
+        second = grade_student("c1", "hw1", "alice@test.com", previous=first)
+        assert second.cached
+        assert (second.passed, second.total) == (1, 1)
+        assert mock_suite.call_count == 1
+
+    @patch("backend.test_runner.run_grading_suite")
+    def test_student_or_test_change_invalidates(self, mock_suite, classroom):
+        from backend.test_runner import grade_student
+
+        tmpl, student = classroom
+        mock_suite.return_value = [_step("test_hw.py", "1/1\n")]
+        first = grade_student("c1", "hw1", "alice@test.com")
+
+        (student / "main.py").write_text("x = 2\n")
+        second = grade_student("c1", "hw1", "alice@test.com", previous=first)
+        assert not second.cached
+
+        (tmpl / "test_hw.py").write_text("print('2/2')\n")
+        third = grade_student("c1", "hw1", "alice@test.com", previous=second)
+        assert not third.cached
+        assert mock_suite.call_count == 3
+
+    @patch("backend.test_runner.run_grading_suite")
+    def test_timeouts_are_not_memoized(self, mock_suite, classroom):
+        from backend.test_runner import grade_student
+
+        mock_suite.return_value = [_step("test_hw.py", timed_out=True)]
+        outcome = grade_student("c1", "hw1", "alice@test.com")
+        assert outcome.fingerprint == ""
+
+    @pytest.fixture
+    def precheck(self, classroom, monkeypatch):
+        import sys
+
+        tmpl, student = classroom
+        (tmpl / "test_hw.py").write_text("from main import f\nprint('1/1')\n")
+        monkeypatch.setattr(
+            "backend.test_runner.GRADING_SANDBOX_PYTHON", "%d.%d" % sys.version_info[:2],
+        )
+        return tmpl, student
+
+    @patch("backend.test_runner.run_grading_suite")
+    def test_syntax_error_short_circuits(self, mock_suite, precheck):
+        from backend.test_runner import grade_student, precheck_stats
+
+        _tmpl, student = precheck
+        (student / "main.py").write_text("def f(:\n    pass\n")
+        before = precheck_stats()
+        outcome = grade_student("c1", "hw1", "alice@test.com")
+
+        mock_suite.assert_not_called()
+        assert (outcome.passed, outcome.total) == (0, 1)
+        assert "SyntaxError" in outcome.output and "main.py" in outcome.output
+        assert outcome.fingerprint  # deterministic, so reusable
+        assert precheck_stats()["rejected"] == before["rejected"] + 1
+
+    def test_only_modules_the_tests_import_are_checked(self, precheck):
+        from backend.test_runner import syntax_precheck
+
+        tmpl, student = precheck
+        tests = [str(tmpl / "test_hw.py")]
+        (student / "main.py").write_text("from helpers import g\ndef f(): pass\n")
+        (student / "helpers.py").write_text("def g(): pass\n")
+        (student / "scratch.py").write_text("this is not python\n")
+        (student / ".venv" / "lib").mkdir(parents=True)
+        (student / ".venv" / "lib" / "old.py").write_text("print 'py2'\n")
+        assert syntax_precheck(str(student), tests) is None
+
+        # A broken module reached through another import is still caught.
+        (student / "helpers.py").write_text("def g(:\n")
+        assert "helpers.py" in syntax_precheck(str(student), tests)
+
+    def test_other_python_version_skips_the_checker(self, precheck, monkeypatch):
+        from backend.test_runner import precheck_stats, syntax_precheck
+
+        tmpl, student = precheck
+        (student / "main.py").write_text("def f(:\n")
+        monkeypatch.setattr("backend.test_runner.GRADING_SANDBOX_PYTHON", "2.7")
+        with patch("backend.test_runner.subprocess.run") as run:
+            assert syntax_precheck(str(student), [str(tmpl / "test_hw.py")]) is None
+        run.assert_not_called()
+        assert precheck_stats()["enabled"] is False
+
+    def test_precheck_never_executes_code(self, precheck, tmp_path):
+        from backend.test_runner import syntax_precheck
+
+        tmpl, student = precheck
+        marker = tmp_path / "ran"
+        (student / "main.py").write_text(f"open({str(marker)!r}, 'w').close()\n")
+        assert syntax_precheck(str(student), [str(tmpl / "test_hw.py")]) is None
+        assert not marker.exists()
+
+
+class TestPerTestResults:
+    """Per-test rows from the reporter / check lines, and failed-only re-runs."""
+
+    @pytest.fixture
+    def classroom(self, tmp_path, monkeypatch):
+        root = tmp_path / "classrooms"
+        monkeypatch.setattr("backend.test_runner.CLASSROOMS_ROOT", str(root))
+        tmpl = root / "c1" / "assignments" / "hw1"
+        tmpl.mkdir(parents=True)
+        (tmpl / "test_hw.py").write_text("import unittest\n")
+        student = root / "c1" / "participants" / "alice@test.com" / "hw1"
+        student.mkdir(parents=True)
+        (student / "main.py").write_text("x = 1\n")
+        return tmpl, student
+
+    @patch("backend.test_runner.run_grading_suite")
+    def test_check_lines_become_rows(self, mock_suite, classroom):
+        from backend.test_runner import grade_student
+
+        mock_suite.return_value = [
+            _step("test_hw.py", "  \u2705  adds\n  \u274c  subtracts\n1/2\n")
+        ]
+        outcome = grade_student("c1", "hw1", "alice@test.com")
+        assert [(t["test_id"], t["outcome"]) for t in outcome.tests] == [
+            ("adds", "passed"), ("subtracts", "failed"),
+        ]
+        assert outcome.file_scores["test_hw.py"]["granular"] is False
+
+    @patch("backend.test_runner.run_grading_suite")
+    def test_failed_only_reruns_failing_ids(self, mock_suite, classroom):
+        from backend.test_runner import grade_student
+
+        first_step = _step("test_hw.py", "2/3\n")
+        first_step["tests"] = [
+            {"id": "__main__.T.test_a", "outcome": "passed", "message": ""},
+            {"id": "__main__.T.test_b", "outcome": "passed", "message": ""},
+            {"id": "__main__.T.test_c", "outcome": "failed", "message": "boom"},
+        ]
+        mock_suite.return_value = [first_step]
+        first = grade_student("c1", "hw1", "alice@test.com")
+        assert (first.passed, first.total) == (2, 3)
+        assert first.file_scores["test_hw.py"]["granular"] is True
+
+        rerun_step = _step("test_hw.py", "1/1\n")
+        rerun_step["tests"] = [{"id": "__main__.T.test_c", "outcome": "passed", "message": ""}]
+        mock_suite.return_value = [rerun_step]
+        classroom[1].joinpath("main.py").write_text("x = 2\n")
+        second = grade_student("c1", "hw1", "alice@test.com", first, failed_only=True)
+
+        steps = mock_suite.call_args.kwargs["steps"]
+        assert [s.get("only") for s in steps] == [["__main__.T.test_c"]]
+        assert (second.passed, second.total) == (3, 3)
+        assert second.fingerprint == ""
+        assert all(t["outcome"] == "passed" for t in second.tests)
+
+    @patch("backend.test_runner.run_grading_suite")
+    def test_failed_only_skips_when_all_passed(self, mock_suite, classroom):
+        from backend.test_runner import grade_student
+
+        mock_suite.return_value = [_step("test_hw.py", "  \u2705  adds\n1/1\n")]
+        first = grade_student("c1", "hw1", "alice@test.com")
+        classroom[1].joinpath("main.py").write_text("x = 2\n")
+        second = grade_student("c1", "hw1", "alice@test.com", first, failed_only=True)
+        assert mock_suite.call_count == 1
+        assert (second.passed, second.total) == (1, 1)
+
+    def test_store_and_reload_cases(self):
+        from sqlalchemy.pool import StaticPool
+        from sqlmodel import Session, SQLModel, create_engine, select
+
+        from backend.api.database import TestCaseResult, TestResult
+        from backend.api.grading import load_cases, previous_outcome, store_outcome
+        from backend.test_runner import GradingOutcome
+
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+        )
+        SQLModel.metadata.create_all(engine)
+        outcome = GradingOutcome(
+            passed=1, total=2, fingerprint="fp", tests_fingerprint="tfp",
+            tests=[
+                {"file": "test_hw.py", "test_id": "a", "outcome": "passed", "message": ""},
+                {"file": "test_hw.py", "test_id": "b", "outcome": "failed", "message": "x"},
+            ],
+            file_scores={"test_hw.py": {"passed": 1, "total": 2, "granular": True}},
+        )
+        with Session(engine) as db:
+            store_outcome(db, "c1", "u1", "hw1", outcome)
+            db.commit()
+            row = db.exec(select(TestResult)).one()
+            outcome.tests = outcome.tests[1:]
+            store_outcome(db, "c1", "u1", "hw1", outcome)
+            db.commit()
+            assert len(db.exec(select(TestCaseResult)).all()) == 1
+
+            prev = previous_outcome(row, load_cases(db, [row])[row.id])
+        assert prev.tests == outcome.tests
+        assert prev.file_scores == outcome.file_scores
+        assert prev.tests_fingerprint == "tfp"
+
+
+
+class TestResultUpserts:
+    """Grading results are written with batched upserts on a unique key."""
+
+    @staticmethod
+    def _engine():
+        from sqlalchemy.pool import StaticPool
+        from sqlmodel import create_engine
+
+        return create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+        )
+
+    def test_batch_upsert_one_row_per_key(self):
+        from sqlmodel import Session, SQLModel, select
+
+        from backend.api.database import TestResult
+        from backend.api.grading import store_outcomes
+        from backend.test_runner import GradingOutcome
+
+        engine = self._engine()
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as db:
+            store_outcomes(db, "c1", [
+                ("u1", "hw1", GradingOutcome(passed=1, total=2)),
+                ("u2", "hw1", GradingOutcome(passed=0, total=2)),
+            ])
+            db.commit()
+            store_outcomes(db, "c1", [
+                ("u1", "hw1", GradingOutcome(passed=2, total=2)),
+                ("u2", "hw1", GradingOutcome(passed=2, total=2, cached=True)),
+            ])
+            db.commit()
+            rows = {r.user_id: r.tests_passed for r in db.exec(select(TestResult)).all()}
+        assert rows == {"u1": 2, "u2": 0}
+
+    def test_unique_index_added_to_existing_table(self):
+        from sqlalchemy import inspect, text
+
+        from backend.api.database import add_unique_indexes
+
+        engine = self._engine()
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE manual_score (id INTEGER PRIMARY KEY, classroom_id TEXT, "
+                "user_id TEXT, template_name TEXT, score FLOAT)"
+            ))
+            conn.execute(text(
+                "INSERT INTO manual_score (classroom_id, user_id, template_name, score) "
+                "VALUES ('c1', 'u1', 'hw1', 1), ('c1', 'u1', 'hw1', 5)"
+            ))
+        add_unique_indexes(engine)
+
+        names = {ix["name"] for ix in inspect(engine).get_indexes("manual_score")}
+        assert "ux_manual_score_owner" in names
+        with engine.connect() as conn:
+            assert conn.execute(text("SELECT score FROM manual_score")).scalars().all() == [5]
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
@@ -0,0 +1,177 @@
+"""Tests for the assignment fan-out copier and background publish jobs."""
+
+import asyncio
+import os
+import stat
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.api import fanout, publish  # noqa: E402
+
+
+@pytest.fixture
+def assignment(tmp_path):
+    src = tmp_path / "assignments" / "hw1"
+    (src / "data").mkdir(parents=True)
+    (src / "main.py").write_text("print('hi')\n")
+    (src / "data" / "big.csv").write_bytes(os.urandom(300_000))
+    os.symlink("..", src / "data" / "up")
+    os.symlink("missing", src / "broken")
+    os.utime(src / "main.py", ns=(1_000_000_000, 1_000_000_000))
+    return src
+
+
+def _ids():
+    return {"uid": os.getuid(), "gid": os.getgid()}
+
+
+class TestCloneTree:
+    def test_copies_tree_with_modes(self, assignment, tmp_path):
+        dst = tmp_path / "out"
+        stats = fanout.clone_tree(str(assignment), str(dst), dir_mode=0o775, **_ids())
+        assert (dst / "main.py").read_text() == "print('hi')\n"
+        assert (dst / "data" / "big.csv").read_bytes() == (assignment / "data" / "big.csv").read_bytes()
+        assert not (dst / "broken").exists()
+        # The cycle through data/up is cut instead of recursing forever.
+        assert not list((dst / "data" / "up").iterdir())
+        assert stats.files == 2 and stats.bytes == 300_000 + 12
+        assert stat.S_IMODE((dst / "main.py").stat().st_mode) == 0o664
+        assert stat.S_IMODE((dst / "data").stat().st_mode) == 0o775
+        assert (dst / "main.py").stat().st_mtime_ns == 1_000_000_000
+
+    def test_falls_back_when_reflink_unsupported(self, assignment, tmp_path, monkeypatch):
+        def no_clone(fd, op, arg):
+            raise OSError(95, "Operation not supported")
+
+        monkeypatch.setattr(fanout.fcntl, "ioctl", no_clone)
+        monkeypatch.setattr(fanout, "_no_reflink", set())
+        monkeypatch.setattr(fanout, "_no_copy_range", set())
+        stats = fanout.clone_tree(str(assignment), str(tmp_path / "out"), **_ids())
+        assert stats.reflinked == 0
+        assert (tmp_path / "out" / "data" / "big.csv").stat().st_size == 300_000
+        assert fanout._no_reflink
+
+    def test_failure_removes_partial_copy(self, assignment, tmp_path, monkeypatch):
+        def broken(*args):
+            raise OSError(5, "Input/output error")
+
+        monkeypatch.setattr(fanout, "_copy_data", broken)
+        with pytest.raises(OSError):
+            fanout.clone_tree(str(assignment), str(tmp_path / "out"), **_ids())
+        assert not (tmp_path / "out").exists()
+
+
+class TestFanOut:
+    def test_reports_each_destination(self, assignment, tmp_path):
+        (tmp_path / "taken").mkdir()
+        targets = [(f"u{i}", str(tmp_path / f"p{i}")) for i in range(5)]
+        targets.append(("u-taken", str(tmp_path / "taken")))
+        results = asyncio.run(fanout.fan_out(str(assignment), targets, **_ids()))
+        by_key = {r.key: r for r in results}
+        assert all((tmp_path / f"p{i}" / "main.py").exists() for i in range(5))
+        assert by_key["u0"].stats.files == 2 and by_key["u0"].seconds >= 0
+        assert by_key["u-taken"].skipped and by_key["u-taken"].stats is None
+        assert not list((tmp_path / "taken").iterdir())
+        assert set(by_key["u0"].as_dict()) == {"participant", "seconds", "files", "bytes", "reflinked"}
+
+    def test_concurrent_jobs_share_the_pool(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(fanout, "FANOUT_WORKERS", 2)
+        monkeypatch.setattr(fanout, "_executor", None)
+        lock = threading.Lock()
+        running = [0, 0]  # now, peak
+
+        def slow_clone(src, dest, modes):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return fanout.CopyStats()
+
+        monkeypatch.setattr(fanout, "_clone_into_place", slow_clone)
+
+        async def main():
+            return await asyncio.gather(*(
+                fanout.fan_out("src", [(f"u{j}{i}", str(tmp_path / f"{j}{i}")) for i in range(3)])
+                for j in range(3)
+            ))
+
+        try:
+            results = asyncio.run(main())
+        finally:
+            fanout._executor.shutdown()
+        assert [len(r) for r in results] == [3, 3, 3]
+        assert running[1] == 2
+
+
+@pytest.fixture
+def events(monkeypatch):
+    sent = []
+
+    async def notify_files_changed(user_id, *args, **kwargs):
+        sent.append(user_id)
+
+    monkeypatch.setattr(publish, "notify_files_changed", notify_files_changed)
+    return sent
+
+
+class TestPublishJobs:
+    def test_progress_is_polled_and_journaled(self, assignment, tmp_path, events):
+        now = [0.0]
+        jobs = publish.PublishJobs(root=str(tmp_path / "jobs"), clock=lambda: now[0])
+        targets = [(f"u{i}", str(tmp_path / f"p{i}")) for i in range(3)]
+
+        async def main():
+            job = await jobs.start("c1", "hw1", str(assignment), targets, modes=_ids())
+            assert os.listdir(jobs.root) == [f"{job['id']}.json"]
+            [view] = jobs.jobs_for("c1")
+            assert view["total"] == 3 and not view["finished"]
+            await jobs.wait()
+            return job
+
+        job = asyncio.run(main())
+        assert jobs.jobs_for("c1") == [{
+            "job_id": job["id"], "template_name": "hw1",
+            "done": 3, "failed": 0, "total": 3, "finished": True,
+        }]
+        assert jobs.jobs_for("c2") == []
+        assert sorted(events) == ["u0", "u1", "u2"]
+        assert os.listdir(jobs.root) == []
+
+        now[0] = publish.PUBLISH_FINISHED_TTL + 1
+        assert jobs.jobs_for("c1") == []
+
+    def test_resume_skips_students_already_done(self, assignment, tmp_path, events):
+        jobs = publish.PublishJobs(root=str(tmp_path / "jobs"))
+        done = tmp_path / "p0"
+        done.mkdir()
+        (done / "mine.py").write_text("student work")
+        # Leftover staging dir from the interrupted copy to p1.
+        (tmp_path / ".p1.partial-dead").mkdir()
+        jobs._save({
+            "id": "abc", "classroom_id": "c1", "template_name": "hw1",
+            "src": str(assignment), "modes": _ids(),
+            "targets": [["u0", str(done)], ["u1", str(tmp_path / "p1")]],
+        })
+
+        async def main():
+            assert jobs.resume() == 1
+            assert jobs.jobs_for("c1")[0]["total"] == 2
+            await jobs.wait()
+
+        asyncio.run(main())
+        assert (done / "mine.py").read_text() == "student work"
+        assert not (done / "main.py").exists()
+        assert (tmp_path / "p1" / "main.py").exists()
+        assert not (tmp_path / ".p1.partial-dead").exists()
+        # Only the student who actually got a copy hears about it.
+        assert events == ["u1"]
+        assert jobs.jobs_for("c1")[0]["done"] == 2
+        assert os.listdir(jobs.root) == []
@@ -0,0 +1,171 @@
+"""Tests for the cached workspace tree behind /api/files/list."""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.api.file_index import FileTreeIndex  # noqa: E402
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    from backend.api.routers import files
+
+    uploads = tmp_path / "uploads"
+    classrooms = tmp_path / "classrooms"
+    upload_dir = uploads / "u1"
+    (upload_dir / "proj").mkdir(parents=True)
+    (upload_dir / "proj" / "main.py").write_text("print(1)\n")
+    (upload_dir / "node_modules" / "pkg").mkdir(parents=True)
+    (classrooms / "c1" / "participants" / "a@b.c" / "hw1").mkdir(parents=True)
+    (classrooms / "c1" / "participants" / "a@b.c" / "hw1" / "main.py").write_text("")
+    os.symlink("../../classrooms/c1/participants/a@b.c", upload_dir / "my-class")
+    monkeypatch.setattr(files, "CLASSROOMS_ROOT", str(classrooms))
+    # Directories modified during a build are always rechecked; age them.
+    for dirpath, _dirs, _files in os.walk(tmp_path):
+        os.utime(dirpath, (1_000_000_000, 1_000_000_000))
+    return upload_dir
+
+
+def _counting_build(upload_dir, calls):
+    from backend.api.routers.files import _build_file_tree
+
+    def build():
+        calls.append(1)
+        return _build_file_tree(str(upload_dir), False)
+
+    return build
+
+
+class TestFileTreeIndex:
+    def test_build_matches_listing_rules(self, workspace):
+        from backend.api.routers.files import _build_file_tree
+
+        files, classrooms, dirs = _build_file_tree(str(workspace), False)
+        assert "proj/" in files and "proj/main.py" in files
+        assert "my-class/" in files and "my-class/hw1/main.py" in files
+        assert not any(f.startswith("node_modules") for f in files)
+        assert classrooms == {"my-class": "c1"}
+        assert str(workspace) in dirs
+
+    def test_unchanged_tree_is_reused(self, workspace):
+        now = [0.0]
+        index = FileTreeIndex(revalidate_interval=1.0, clock=lambda: now[0])
+        calls = []
+        first = index.get("u1", False, _counting_build(workspace, calls))
+        now[0] = 5.0  # past the interval: revalidated by stat, not rebuilt
+        second = index.get("u1", False, _counting_build(workspace, calls))
+        assert len(calls) == 1
+        assert second.version == first.version
+
+    def test_terminal_change_detected_by_mtime(self, workspace):
+        now = [0.0]
+        index = FileTreeIndex(revalidate_interval=1.0, clock=lambda: now[0])
+        calls = []
+        first = index.get("u1", False, _counting_build(workspace, calls))
+
+        st = os.stat(workspace / "proj")
+        (workspace / "proj" / "new.py").write_text("")
+        os.utime(workspace / "proj", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        # Within the revalidation interval the cached tree is served as-is.
+        assert index.get("u1", False, _counting_build(workspace, calls)) is first
+
+        now[0] = 5.0
+        second = index.get("u1", False, _counting_build(workspace, calls))
+        assert len(calls) == 2
+        assert "proj/new.py" in second.files
+        assert second.version != first.version
+
+    def test_api_notification_invalidates(self, workspace):
+        index = FileTreeIndex(revalidate_interval=60)
+        calls = []
+        index.get("u1", False, _counting_build(workspace, calls))
+        index.get("u2", False, lambda: ([], {}, [str(workspace / "proj")]))
+
+        asyncio.run(index.on_files_changed("u3", [str(workspace / "proj" / "x.py")]))
+        index.get("u1", False, _counting_build(workspace, calls))
+        assert len(calls) == 2
+        assert index.stats()["entries"] == 1  # u2's tree listed proj/ too
+
+
+def _children_from_flat(files):
+    """Group the flat /list output into {dir: {child_name: is_dir}}."""
+    tree = {"": {}}
+    for entry in files:
+        is_dir = entry.endswith("/")
+        path = entry.rstrip("/")
+        parent, _, name = path.rpartition("/")
+        tree.setdefault(parent, {})[name] = is_dir
+        if is_dir:
+            tree.setdefault(path, {})
+    return tree
+
+
+class TestListDir:
+    @pytest.fixture
+    def richer(self, workspace):
+        classroom = workspace.parent.parent / "classrooms" / "c1"
+        (classroom / "shared").mkdir()
+        (classroom / "shared" / "notes.md").write_text("")
+        os.symlink("../../shared", classroom / "participants" / "a@b.c" / "shared")
+        os.symlink("../../shared", classroom / "participants" / "a@b.c" / "hw1" / "deep")
+        (workspace / "proj" / "cache.pyc").write_text("")
+        (workspace / ".hidden").mkdir()
+        outside = workspace.parent.parent / "elsewhere"
+        (outside / "x").mkdir(parents=True)
+        os.symlink(str(outside), workspace / "linked")
+        for i in range(5):
+            (workspace / "many" / f"f{i}.txt").parent.mkdir(exist_ok=True)
+            (workspace / "many" / f"f{i}.txt").write_text("abc")
+        return workspace
+
+    def test_levels_match_flat_listing(self, richer):
+        from backend.api.routers.files import _build_file_tree, _list_dir_page
+
+        files, _classrooms, _dirs = _build_file_tree(str(richer), False)
+        expected = _children_from_flat(files)
+        for path, children in expected.items():
+            entries, total, cursor, _c = _list_dir_page(str(richer), path, False, None, 1000)
+            assert {e["name"]: e["type"] == "dir" for e in entries} == children, path
+            assert total == len(children) and cursor is None
+            for e in entries:
+                if e["type"] == "dir":
+                    assert e["children"] == len(expected[e["path"]]), e["path"]
+
+    def test_root_metadata_and_classroom_ids(self, richer):
+        from backend.api.routers.files import _list_dir_page
+
+        entries, _total, _cursor, classrooms = _list_dir_page(str(richer), "", False, None, 100)
+        assert classrooms == {"my-class": "c1"}
+        assert [e["name"] for e in entries][:4] == ["linked", "many", "my-class", "proj"]
+        inner, *_ = _list_dir_page(str(richer), "my-class/hw1", False, None, 100)
+        assert {e["classroomId"] for e in inner} == {"c1"}
+
+    def test_cursor_pages_through_directory(self, richer):
+        from backend.api.routers.files import _list_dir_page
+
+        seen, cursor = [], None
+        while True:
+            entries, total, cursor, _c = _list_dir_page(str(richer), "many", False, cursor, 2)
+            seen += [e["name"] for e in entries]
+            if cursor is None:
+                break
+        assert seen == [f"f{i}.txt" for i in range(5)] and total == 5
+        assert entries[0]["size"] == 3
+
+    def test_hidden_and_missing_paths_404(self, richer):
+        from fastapi import HTTPException
+
+        from backend.api.routers.files import _list_dir_page
+
+        for path in (".hidden", "node_modules", "nope", "proj/main.py"):
+            with pytest.raises(HTTPException) as exc:
+                _list_dir_page(str(richer), path, False, None, 10)
+            assert exc.value.status_code == 404
+        entries, *_ = _list_dir_page(str(richer), "node_modules", True, None, 10)
+        assert [e["name"] for e in entries] == ["pkg"]
@@ -0,0 +1,518 @@
+"""Tests for streamed uploads and downloads under /api/files."""
+
+import asyncio
+import io
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.api.routers import files  # noqa: E402
+
+
+class _CountingFile(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.largest_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.largest_read = max(self.largest_read, len(chunk))
+        return chunk
+
+
+@pytest.fixture
+def target(tmp_path):
+    d = tmp_path / "target"
+    d.mkdir()
+    return d
+
+
+class TestStreamUpload:
+    def test_streams_in_chunks_and_replaces_atomically(self, target, monkeypatch):
+        monkeypatch.setattr(files, "UPLOAD_CHUNK_BYTES", 4096)
+        data = os.urandom(50_000)
+        src = _CountingFile(data)
+        dest = target / "data.bin"
+        dest.mkdir()  # overwriting a same-named directory replaces it
+        asyncio.run(files._stream_upload(UploadFile(src, filename="data.bin"), str(dest),
+                                         files._UploadBudget()))
+        assert dest.read_bytes() == data
+        assert src.largest_read == 4096
+        assert os.listdir(target) == ["data.bin"]
+
+    def test_budget_is_enforced_mid_file(self, target, monkeypatch):
+        monkeypatch.setattr(files, "UPLOAD_CHUNK_BYTES", 1024)
+        dest = target / "big.bin"
+        dest.write_bytes(b"old")
+        budget = files._UploadBudget(limit=5000)
+        upload = UploadFile(io.BytesIO(b"x" * 10_000), filename="big.bin")
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(files._stream_upload(upload, str(dest), budget))
+        assert exc.value.status_code == 413
+        assert dest.read_bytes() == b"old"
+        assert os.listdir(target) == ["big.bin"]
+
+    def test_low_disk_space_rejected(self, target, monkeypatch):
+        monkeypatch.setattr(files, "UPLOAD_MIN_FREE_BYTES", 1 << 62)
+        upload = UploadFile(io.BytesIO(b"abc"), filename="a.txt")
+        with pytest.raises(HTTPException) as exc:
+            asyncio.run(files._stream_upload(upload, str(target / "a.txt"),
+                                             files._UploadBudget()))
+        assert exc.value.status_code == 507
+        assert os.listdir(target) == []
+
+
+def _zip_bytes(members, compression=None):
+    import zipfile
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression or zipfile.ZIP_STORED) as zf:
+        for name, data in members:
+            if isinstance(data, zipfile.ZipInfo):
+                zf.writestr(data, name)
+            else:
+                zf.writestr(name, data)
+    buf.seek(0)
+    return buf
+
+
+class TestArchiveExtraction:
+    def _extract(self, fileobj, staging, budget=None):
+        checked = []
+        files._extract_archive(fileobj, str(staging), budget or files._UploadBudget(),
+                               checked.append)
+        return checked
+
+    def test_zip_rejects_traversal_and_links(self, target):
+        import stat
+        import zipfile
+
+        link = zipfile.ZipInfo("proj/link")
+        link.external_attr = (stat.S_IFLNK | 0o777) << 16
+        buf = _zip_bytes([
+            ("proj/main.py", "print(1)"),
+            ("proj/pkg/", ""),
+            ("../evil.py", "x"),
+            ("/etc/passwd", "x"),
+            ("__MACOSX/proj/._main.py", "x"),
+            ("/etc/shadow", link),
+        ])
+        checked = self._extract(buf, target)
+        assert checked == ["proj/main.py", "proj/pkg"]
+        assert (target / "proj" / "main.py").read_text() == "print(1)"
+        assert sorted(os.listdir(target)) == ["proj"]
+        assert sorted(os.listdir(target / "proj")) == ["main.py", "pkg"]
+
+    def test_tar_gz_streams(self, target):
+        import tarfile
+
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as tf:
+            for name, data in (("hw/a.py", b"a"), ("hw/sub/b.py", b"bb")):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+            sym = tarfile.TarInfo("hw/escape")
+            sym.type = tarfile.SYMTYPE
+            sym.linkname = "/etc"
+            tf.addfile(sym)
+        buf.seek(0)
+        self._extract(buf, target)
+        assert (target / "hw" / "sub" / "b.py").read_bytes() == b"bb"
+        assert not os.path.lexists(target / "hw" / "escape")
+
+    def test_zip_bomb_limits(self, target, monkeypatch):
+        import zipfile
+
+        bomb = _zip_bytes([("zeros.bin", b"\0" * (4 << 20))], zipfile.ZIP_DEFLATED)
+        with pytest.raises(HTTPException) as exc:
+            self._extract(bomb, target)
+        assert exc.value.status_code == 413
+
+        monkeypatch.setattr(files, "ARCHIVE_MAX_ENTRIES", 3)
+        many = _zip_bytes([(f"f{i}.txt", "x") for i in range(5)])
+        with pytest.raises(HTTPException) as exc:
+            self._extract(many, target)
+        assert exc.value.status_code == 413
+
+        with pytest.raises(HTTPException) as exc:
+            self._extract(_zip_bytes([("a.txt", "x" * 100)]), target,
+                          files._UploadBudget(limit=10))
+        assert exc.value.status_code == 413
+
+    def test_garbage_is_rejected(self, target):
+        with pytest.raises(HTTPException) as exc:
+            self._extract(io.BytesIO(b"not an archive at all" * 100), target)
+        assert exc.value.status_code == 400
+
+
+@pytest.fixture
+def engine():
+    from sqlalchemy.pool import StaticPool
+    from sqlmodel import SQLModel, create_engine
+
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, engine):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from sqlmodel import Session
+
+    from backend.api.database import User
+    from backend.api.dependencies import get_db, get_onboarded_user
+
+    monkeypatch.setattr(files, "UPLOADS_ROOT", str(tmp_path / "uploads"))
+    monkeypatch.setattr(files, "CLASSROOMS_ROOT", str(tmp_path / "classrooms"))
+    user = User(id="u1", email="s@test.com", role="student", port_start=10000, port_end=10009)
+
+    def db():
+        with Session(engine) as session:
+            yield session
+
+    app = FastAPI()
+    app.include_router(files.router, prefix="/api/files")
+    app.dependency_overrides[get_onboarded_user] = lambda: user
+    app.dependency_overrides[get_db] = db
+    return TestClient(app), tmp_path / "uploads" / "u1"
+
+
+class TestUploadRoutes:
+    def test_upload_writes_file(self, client):
+        c, ws = client
+        r = c.post("/api/files/upload", files={"files": ("a.txt", b"hello")})
+        assert r.status_code == 200
+        assert (ws / "a.txt").read_bytes() == b"hello"
+
+    def test_archive_upload_conflict_then_overwrite(self, client):
+        c, ws = client
+        archive = _zip_bytes([("proj/main.py", "v1"), ("proj/data/x.csv", "1,2")]).getvalue()
+        r = c.post("/api/files/upload-archive", files={"file": ("p.zip", archive)})
+        assert r.status_code == 200, r.text
+        assert (ws / "proj" / "data" / "x.csv").read_text() == "1,2"
+
+        archive = _zip_bytes([("proj/main.py", "v2")]).getvalue()
+        r = c.post("/api/files/upload-archive", files={"file": ("p.zip", archive)})
+        assert r.status_code == 409 and r.json()["conflicts"] == ["proj"]
+        assert (ws / "proj" / "main.py").read_text() == "v1"
+
+        r = c.post(
+            "/api/files/upload-archive",
+            files={"file": ("p.zip", archive)}, data={"overwrite": "true"},
+        )
+        assert r.status_code == 200
+        assert sorted(os.listdir(ws / "proj")) == ["main.py"]
+        assert not [n for n in os.listdir(ws) if n.startswith(".upload-")]
+
+
+    def test_classroom_folder_import_pushes_to_participants(
+        self, client, engine, tmp_path, monkeypatch,
+    ):
+        from sqlmodel import Session
+
+        from backend.api.database import Classroom, ClassroomMember, User
+
+        c, _ws = client
+        with Session(engine) as db:
+            db.add(User(id="s2", email="amy@test.com", port_start=10010, port_end=10019))
+            db.add(Classroom(id="c1", name="C", access_code="ABC", created_by="u1"))
+            db.add(ClassroomMember(classroom_id="c1", user_id="u1", role="instructor"))
+            db.add(ClassroomMember(classroom_id="c1", user_id="s2", role="participant"))
+            db.commit()
+        (tmp_path / "classrooms" / "c1" / "participants" / "amy@test.com").mkdir(parents=True)
+        started = []
+
+        class Jobs:
+            async def start(self, cid, template_name, src, targets, modes=None):
+                started.append((cid, template_name, targets))
+
+        monkeypatch.setattr(files, "get_publish_jobs", lambda: Jobs())
+
+        r = c.post(
+            "/api/files/upload-folder",
+            files={"files": ("lesson1/main.py", b"print(1)")},
+            data={"classroom_id": "c1", "move-into": "lesson1"},
+        )
+        assert r.status_code == 200, r.text
+        assert (tmp_path / "classrooms" / "c1" / "assignments" / "lesson1" / "main.py").exists()
+        dest = str(tmp_path / "classrooms" / "c1" / "participants" / "amy@test.com" / "lesson1")
+        assert started == [("c1", "lesson1", [("s2", dest)])]
+
+
+class TestResumableUploads:
+    @pytest.fixture
+    def store(self, tmp_path, monkeypatch):
+        from backend.api.upload_sessions import UploadSessionStore
+
+        store = UploadSessionStore(root=str(tmp_path / "partial"))
+        monkeypatch.setattr(files, "get_upload_sessions", lambda: store)
+        return store
+
+    def test_interrupted_upload_resumes_from_offset(self, client, store):
+        c, ws = client
+        data = os.urandom(300_000)
+        r = c.post("/api/files/uploads", json={"filename": "big.csv", "size": len(data)})
+        assert r.status_code == 200, r.text
+        sid = r.json()["id"]
+
+        r = c.put(f"/api/files/uploads/{sid}?offset=0", content=data[:100_000])
+        assert r.json()["offset"] == 100_000
+        # A retried chunk at a stale offset is refused with the real one.
+        r = c.put(f"/api/files/uploads/{sid}?offset=0", content=data[:100_000])
+        assert r.status_code == 409 and r.json()["offset"] == 100_000
+        assert c.post(f"/api/files/uploads/{sid}/complete").status_code == 409
+
+        offset = c.get(f"/api/files/uploads/{sid}").json()["offset"]
+        r = c.put(f"/api/files/uploads/{sid}?offset={offset}", content=data[offset:])
+        assert r.json()["offset"] == len(data)
+        assert c.post(f"/api/files/uploads/{sid}/complete").status_code == 200
+        assert (ws / "big.csv").read_bytes() == data
+        assert os.listdir(store.root) == []
+
+    def test_complete_rechecks_conflicts(self, client, store):
+        c, ws = client
+        sid = c.post("/api/files/uploads", json={"filename": "out", "size": 3}).json()["id"]
+        c.put(f"/api/files/uploads/{sid}?offset=0", content=b"new")
+        # A folder of the same name appeared while the upload ran.
+        (ws / "out").mkdir()
+        (ws / "out" / "keep.txt").write_text("x")
+
+        r = c.post(f"/api/files/uploads/{sid}/complete")
+        assert r.status_code == 409 and r.json()["conflicts"] == ["out"]
+        assert (ws / "out" / "keep.txt").read_text() == "x"
+
+        assert c.post(f"/api/files/uploads/{sid}/complete?overwrite=true").status_code == 200
+        assert (ws / "out").read_bytes() == b"new"
+
+    def test_overwrite_confirmed_at_create_is_kept(self, client, store):
+        c, ws = client
+        ws.mkdir(parents=True)
+        (ws / "a.txt").write_text("old")
+        r = c.post("/api/files/uploads", json={"filename": "a.txt", "size": 3})
+        assert r.status_code == 409
+        r = c.post(
+            "/api/files/uploads", json={"filename": "a.txt", "size": 3, "overwrite": True},
+        )
+        sid = r.json()["id"]
+        c.put(f"/api/files/uploads/{sid}?offset=0", content=b"new")
+        assert c.post(f"/api/files/uploads/{sid}/complete").status_code == 200
+        assert (ws / "a.txt").read_text() == "new"
+
+    def test_complete_copies_across_filesystems(self, client, store, monkeypatch):
+        import errno
+
+        c, ws = client
+        data = os.urandom(50_000)
+        sid = c.post("/api/files/uploads", json={"filename": "x.bin", "size": len(data)}).json()["id"]
+        c.put(f"/api/files/uploads/{sid}?offset=0", content=data)
+        real_replace = os.replace
+
+        def replace(src, dst):
+            # Partial uploads live on another volume than the workspace.
+            if str(src).startswith(store.root):
+                raise OSError(errno.EXDEV, "Invalid cross-device link")
+            return real_replace(src, dst)
+
+        monkeypatch.setattr(files.os, "replace", replace)
+        assert c.post(f"/api/files/uploads/{sid}/complete").status_code == 200
+        assert (ws / "x.bin").read_bytes() == data
+        assert os.listdir(store.root) == []
+        assert [p.name for p in ws.iterdir()] == ["x.bin"]
+
+    def test_sessions_are_private_and_bounded(self, client, store):
+        from backend.api.upload_sessions import UploadSessionError
+
+        c, _ws = client
+        sid = c.post("/api/files/uploads", json={"filename": "a", "size": 3}).json()["id"]
+        r = c.put(f"/api/files/uploads/{sid}?offset=0", content=b"abcd")
+        assert r.status_code == 413
+        assert c.get("/api/files/uploads/not-a-real-session-id").status_code == 404
+        assert store.load("u1", sid)["offset"] == 0
+        with pytest.raises(UploadSessionError):
+            store.load("someone-else", sid)
+
+    def test_gc_removes_idle_sessions(self, tmp_path):
+        from backend.api.upload_sessions import UploadSessionStore
+
+        now = [1_000_000.0]
+        store = UploadSessionStore(root=str(tmp_path / "p"), ttl=60, clock=lambda: now[0])
+        old = store.create("u1", filename="a", destination="", size=1)
+        for name in os.listdir(store.root):
+            os.utime(os.path.join(store.root, name), (now[0] - 120, now[0] - 120))
+        fresh = store.create("u1", filename="b", destination="", size=1)
+        assert sorted(os.listdir(store.root)) == sorted([f"{fresh['id']}.json", f"{fresh['id']}.part"])
+        assert old["id"] != fresh["id"]
+
+
+class TestFolderDownload:
+    def test_streams_zip_with_descriptors(self, client):
+        import zipfile
+
+        c, ws = client
+        proj = ws / "proj"
+        (proj / "src").mkdir(parents=True)
+        (proj / "src" / "main.py").write_text("print('hi')\n" * 100)
+        (proj / "logo.png").write_bytes(os.urandom(2000))
+        os.symlink("..", proj / "src" / "loop")
+        os.symlink("missing", proj / "broken")
+
+        r = c.get("/api/files/download/proj")
+        assert r.status_code == 200
+        zf = zipfile.ZipFile(io.BytesIO(r.content))
+        assert sorted(zf.namelist()) == ["proj/logo.png", "proj/src/main.py"]
+        assert zf.read("proj/src/main.py") == (proj / "src" / "main.py").read_bytes()
+        infos = {i.filename: i for i in zf.infolist()}
+        assert infos["proj/logo.png"].compress_type == zipfile.ZIP_STORED
+        assert infos["proj/src/main.py"].compress_type == zipfile.ZIP_DEFLATED
+        assert all(i.flag_bits & 0x08 for i in infos.values())
+
+    def test_iter_zip_yields_before_reading_everything(self, target):
+        from backend.api.zipstream import iter_zip
+
+        for i in range(3):
+            (target / f"f{i}.bin").write_bytes(os.urandom(10_000))
+        opened = []
+
+        def entries():
+            for i in range(3):
+                opened.append(i)
+                yield str(target / f"f{i}.bin"), f"f{i}.bin"
+
+        stream = iter_zip(entries(), chunk_size=4096)
+        next(stream)
+        assert opened == [0]
+        rest = b"".join(stream)
+        assert len(opened) == 3 and rest
+
+
+class TestReadFile:
+    def test_small_text_and_binary_sniff(self, client):
+        c, ws = client
+        ws.mkdir(parents=True)
+        (ws / "main.py").write_text("print('é')\n")
+        (ws / "data.txt").write_bytes(b"abc\0def")
+        r = c.get("/api/files/file/main.py")
+        assert r.text == "print('é')\n" and r.headers["content-type"].startswith("text/plain")
+        r = c.get("/api/files/file/data.txt")
+        assert r.content == b"abc\0def" and "x-file-size" not in r.headers
+
+    def test_large_text_is_streamed_or_previewed(self, client, monkeypatch):
+        monkeypatch.setattr(files, "READ_TEXT_MAX_BYTES", 10_000)
+        monkeypatch.setattr(files, "READ_PREVIEW_BYTES", 1000)
+        c, ws = client
+        ws.mkdir(parents=True)
+        lines = [f"row {i},{i * i}\n" for i in range(5000)]
+        (ws / "big.csv").write_text("".join(lines))
+
+        r = c.get("/api/files/file/big.csv")
+        assert r.text == "".join(lines)
+        assert "x-file-preview" not in r.headers
+
+        r = c.get("/api/files/file/big.csv?preview=1")
+        assert r.headers["x-file-preview"] == "head-tail"
+        assert int(r.headers["x-file-size"]) == len("".join(lines))
+        assert r.text.startswith("row 0,0\n") and r.text.endswith("row 4999,24990001\n")
+        assert "bytes not shown" in r.text and len(r.text) < 2100
+
+    def test_preview_covers_what_the_editor_refuses(self, client, monkeypatch):
+        monkeypatch.setattr(files, "EDITOR_MAX_LINES", 100)
+        monkeypatch.setattr(files, "EDITOR_MAX_CHARS", 5000)
+        monkeypatch.setattr(files, "READ_PREVIEW_LINES", 20)
+        c, ws = client
+        ws.mkdir(parents=True)
+        (ws / "many.txt").write_text("".join(f"{i}\n" for i in range(150)))
+        (ws / "wide.txt").write_text("é" * 3000 + "\n")
+        (ws / "ok.txt").write_text("".join(f"{i}\n" for i in range(99)))
+
+        r = c.get("/api/files/file/many.txt?preview=1")
+        assert r.headers["x-file-preview"] == "head-tail"
+        head, tail = r.text.split("bytes not shown")
+        assert head.startswith("0\n") and head.count("\n") == 21
+        assert tail.endswith("149\n") and tail.count("\n") == 22
+        # The full file is still there without ?preview.
+        assert c.get("/api/files/file/many.txt").text.count("\n") == 150
+
+        # 3,000 characters in 6,000 bytes: only the character cap applies.
+        assert "x-file-preview" not in c.get("/api/files/file/wide.txt?preview=1").headers
+        monkeypatch.setattr(files, "EDITOR_MAX_CHARS", 2000)
+        r = c.get("/api/files/file/wide.txt?preview=1")
+        assert r.headers["x-file-preview"] == "head-tail"
+        assert "bytes not shown" in r.text
+
+        r = c.get("/api/files/file/ok.txt?preview=1")
+        assert "x-file-preview" not in r.headers and "x-file-version" in r.headers
+
+    def test_range_request(self, client):
+        c, ws = client
+        ws.mkdir(parents=True)
+        (ws / "log.txt").write_text("0123456789")
+        r = c.get("/api/files/file/log.txt", headers={"Range": "bytes=2-5"})
+        assert r.status_code == 206 and r.content == b"2345"
+
+
+class TestPatchFile:
+    def test_delta_save_and_version_mismatch(self, client):
+        c, ws = client
+        ws.mkdir(parents=True)
+        (ws / "main.py").write_text("x = '😀'\nprint(x)\n")
+        r = c.get("/api/files/file/main.py")
+        version = r.headers["x-file-version"]
+
+        # Offsets are UTF-16 units: the emoji counts as two.
+        edits = [{"offset": 8, "delete": 0, "text": " # smile"},
+                 {"offset": 17, "delete": 5, "text": "repr"}]
+        r = c.patch("/api/files/file/main.py", json={"base": version, "edits": edits})
+        assert r.status_code == 200, r.text
+        assert (ws / "main.py").read_text() == "x = '😀' # smile\nrepr(x)\n"
+        new_version = r.headers["x-file-version"]
+        assert new_version == c.get("/api/files/file/main.py").headers["x-file-version"]
+
+        r = c.patch("/api/files/file/main.py", json={"base": version, "edits": edits})
+        assert r.status_code == 409 and r.json()["version"] == new_version
+
+        r = c.put("/api/files/file/main.py", content="full body")
+        assert r.headers["x-file-version"] != new_version
+        assert (ws / "main.py").read_text() == "full body"
+
+    def test_bom_is_hidden_from_the_editor_and_kept(self, client):
+        c, ws = client
+        ws.mkdir(parents=True)
+        bom = b"\xef\xbb\xbf"
+        (ws / "notes.txt").write_bytes(bom + b"abc\ndef\n")
+        r = c.get("/api/files/file/notes.txt")
+        assert r.content == b"abc\ndef\n"
+
+        # Offset 4 is "d" in the text the editor has, not the "c" it would
+        # land on if the BOM were counted.
+        edits = [{"offset": 4, "delete": 1, "text": "D"}]
+        r = c.patch(
+            "/api/files/file/notes.txt",
+            json={"base": r.headers["x-file-version"], "edits": edits},
+        )
+        assert r.status_code == 200, r.text
+        assert (ws / "notes.txt").read_bytes() == bom + b"abc\nDef\n"
+        assert r.headers["x-file-version"] == c.get("/api/files/file/notes.txt").headers["x-file-version"]
+
+        c.put("/api/files/file/notes.txt", content="full body")
+        assert (ws / "notes.txt").read_bytes() == bom + b"full body"
+
+    def test_rejects_bad_edits(self, client):
+        c, ws = client
+        ws.mkdir(parents=True)
+        (ws / "a.txt").write_text("😀")
+        version = c.get("/api/files/file/a.txt").headers["x-file-version"]
+        for edit in ({"offset": 5, "delete": 0, "text": "x"}, {"offset": 1, "delete": 0, "text": "x"}):
+            r = c.patch("/api/files/file/a.txt", json={"base": version, "edits": [edit]})
+            assert r.status_code == 400
+        assert (ws / "a.txt").read_text() == "😀"
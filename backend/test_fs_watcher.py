@@ -0,0 +1,126 @@
+"""Tests for the inotify-backed files-changed watcher."""
+
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.api.file_index import FileTreeIndex  # noqa: E402
+from backend.api.fs_watcher import ChangeSet, FsWatcher  # noqa: E402
+from backend.api.routers.files import _is_hidden  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify")
+
+
+class TestChangeSet:
+    def test_coalesces_bursts(self):
+        c = ChangeSet()
+        c.record("tmp.txt", "added", False)
+        c.record("tmp.txt", "removed", False)
+        c.record("main.py", "removed", False)
+        c.record("main.py", "added", False)
+        c.record("new.py", "added", False)
+        c.record("new.py", "modified", False)
+        assert c.payload() == {
+            "added": ["new.py"], "removed": [], "modified": ["main.py"], "overflow": False,
+        }
+
+    def test_removed_directory_swallows_children(self):
+        c = ChangeSet()
+        c.record("build/out.o", "modified", False)
+        c.record("build/obj", "removed", True)
+        c.record("build", "removed", True)
+        assert c.payload()["removed"] == ["build/"]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    ws = tmp_path / "uploads" / "u1"
+    (ws / "proj").mkdir(parents=True)
+    mount = tmp_path / "classrooms" / "c1" / "participants" / "a@b.c"
+    (mount / "hw1").mkdir(parents=True)
+    return ws, mount
+
+
+def _run_watcher(roots, actions, **kw):
+    """Run *actions(index)* against a live watcher; return delivered batches."""
+    delivered = []
+
+    async def deliver(user_id, paths, tree_changed, payload):
+        delivered.append((user_id, paths, tree_changed, payload))
+
+    async def main():
+        index = FileTreeIndex()
+        watcher = FsWatcher(
+            lambda uid: roots, deliver, asyncio.get_running_loop(), index=index,
+            is_hidden=_is_hidden, debounce=0.05, max_delay=0.5, **kw,
+        )
+        try:
+            watcher.watch_user("u1")
+            await asyncio.sleep(0.1)
+            await asyncio.to_thread(actions, index)
+            await asyncio.sleep(0.4)
+        finally:
+            watcher.stop()
+
+    asyncio.run(main())
+    return delivered
+
+
+def _merged(delivered, key):
+    return sorted({p for _u, _p, _t, payload in delivered for p in payload[key]})
+
+
+class TestFsWatcher:
+    def test_reports_explorer_paths(self, tree):
+        ws, mount = tree
+
+        def actions(index):
+            assert index.stats()["watched"] == 1
+            (ws / "proj" / "main.py").write_text("x")
+            (ws / "pkg" / "sub").mkdir(parents=True)
+            (ws / "pkg" / "sub" / "mod.py").write_text("")
+            (ws / ".cache").mkdir()
+            (ws / "build.pyc").write_text("")
+            (mount / "hw1" / "answer.py").write_text("")
+
+        delivered = _run_watcher([(str(ws), ""), (str(mount), "my-class")], actions)
+        assert _merged(delivered, "added") == [
+            "my-class/hw1/answer.py", "pkg/", "pkg/sub/", "pkg/sub/mod.py", "proj/main.py",
+        ]
+        assert all(u == "u1" and t for u, _p, t, _payload in delivered)
+        host_paths = {p for _u, paths, _t, _payload in delivered for p in paths}
+        assert str(mount / "hw1" / "answer.py") in host_paths
+
+    def test_edits_and_removals(self, tree):
+        ws, _mount = tree
+        (ws / "proj" / "main.py").write_text("")
+        (ws / "old").mkdir()
+        (ws / "old" / "a.py").write_text("")
+
+        def actions(index):
+            (ws / "proj" / "main.py").write_text("changed")
+            time.sleep(0.2)
+            os.remove(ws / "old" / "a.py")
+            os.rmdir(ws / "old")
+            os.rename(ws / "proj", ws / "proj2")
+
+        delivered = _run_watcher([(str(ws), "")], actions)
+        assert _merged(delivered, "modified") == ["proj/main.py"]
+        assert _merged(delivered, "removed") == ["old/", "proj/"]
+        assert "proj2/" in _merged(delivered, "added")
+
+    def test_directory_cap_degrades_to_refetch(self, tree):
+        ws, _mount = tree
+        for i in range(5):
+            (ws / f"d{i}").mkdir()
+
+        def actions(index):
+            assert index.stats()["watched"] == 0
+
+        _run_watcher([(str(ws), "")], actions, max_dirs=3)
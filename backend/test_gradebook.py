@@ -0,0 +1,146 @@
+"""Tests for the materialized classroom gradebook."""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.api.gradebook import GradebookCache, student_grade  # noqa: E402
+
+
+@pytest.fixture
+def classroom(tmp_path, monkeypatch):
+    from sqlalchemy.pool import StaticPool
+    from sqlmodel import Session, SQLModel, create_engine
+
+    from backend.api import gradebook
+    from backend.api.database import Classroom, ClassroomMember, TestResult, User
+
+    root = tmp_path / "classrooms"
+    for t in ("hw1", "hw2"):
+        (root / "c1" / "assignments" / t).mkdir(parents=True)
+    monkeypatch.setattr(gradebook, "CLASSROOMS_ROOT", str(root))
+
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.add(User(id="t1", email="teacher@test.com", port_start=10000, port_end=10009))
+        db.add(User(id="u1", email="bob@test.com", name="Bob", port_start=10010, port_end=10019))
+        db.add(User(id="u2", email="amy@test.com", name="Amy", port_start=10020, port_end=10029))
+        db.add(Classroom(id="c1", name="C", access_code="ABC", created_by="t1"))
+        db.add(ClassroomMember(classroom_id="c1", user_id="t1", role="instructor"))
+        db.add(ClassroomMember(classroom_id="c1", user_id="u1", role="participant"))
+        db.add(ClassroomMember(classroom_id="c1", user_id="u2", role="participant"))
+        db.add(TestResult(
+            classroom_id="c1", user_id="u1", template_name="hw1", tests_passed=1, tests_total=2,
+        ))
+        db.commit()
+    with Session(engine) as db:
+        yield db, root
+
+
+class TestGradebookCache:
+    def test_build_matches_progress_shape(self, classroom):
+        db, _root = classroom
+        body, etag = GradebookCache().get(db, "c1")
+        data = json.loads(body)
+
+        assert data["templates"] == ["hw1", "hw2"]
+        assert [s["name"] for s in data["students"]] == ["Amy", "Bob"]
+        bob = data["students"][1]
+        assert bob["results"]["hw1"] == {"passed": 1, "total": 2}
+        assert bob["results"]["hw2"] == {"passed": 0, "total": 0}
+        assert bob["grade"]["percent"] == 50
+        assert etag.startswith('"')
+
+    def test_unchanged_reads_skip_the_database(self, classroom):
+        db, _root = classroom
+        cache = GradebookCache()
+        _body, etag = cache.get(db, "c1")
+        db.close()  # any query now would reopen; the entry must be reused
+        assert cache.get(None, "c1")[1] == etag
+
+    def test_results_and_manual_scores_patch_in_place(self, classroom):
+        db, _root = classroom
+        cache = GradebookCache()
+        _body, etag = cache.get(db, "c1")
+
+        cache.apply_results("c1", [("u2", "hw2", 3, 3)])
+        body, etag2 = cache.get(None, "c1")
+        assert etag2 != etag
+        amy = json.loads(body)["students"][0]
+        assert amy["results"]["hw2"] == {"passed": 3, "total": 3}
+
+        cache.set_grading("c1", "manual", {"hw1": 10, "hw2": 0})
+        cache.set_manual_score("c1", "u2", "hw1", 5)
+        amy = json.loads(cache.get(None, "c1")[0])["students"][0]
+        assert amy["grade"] == {"percent": 50, "earned": 5, "possible": 10}
+
+    def test_invalidate_and_max_age_rebuild(self, classroom):
+        db, root = classroom
+        now = [0.0]
+        cache = GradebookCache(max_age=60, clock=lambda: now[0])
+        _body, etag = cache.get(db, "c1")
+
+        (root / "c1" / "assignments" / "hw3").mkdir()
+        assert cache.get(db, "c1")[1] == etag
+        now[0] = 61
+        body, etag2 = cache.get(db, "c1")
+        assert etag2 != etag
+        assert "hw3" in json.loads(body)["templates"]
+
+        # A rebuild that finds nothing new keeps the same ETag.
+        cache.invalidate("c1")
+        assert cache.get(db, "c1")[1] == etag2
+
+    def test_build_overtaken_by_a_change_is_not_cached(self, classroom):
+        db, root = classroom
+        cache = GradebookCache()
+        build = cache._build
+        calls = []
+
+        def racing_build(db, classroom_id):
+            entry = build(db, classroom_id)
+            if not calls:
+                # An assignment is added after this build listed them.
+                (root / "c1" / "assignments" / "hw3").mkdir()
+                cache.invalidate("c1")
+            calls.append(classroom_id)
+            return entry
+
+        cache._build = racing_build
+        body, etag = cache.get(db, "c1")
+        assert len(calls) == 2
+        assert "hw3" in json.loads(body)["templates"]
+        assert cache.get(None, "c1")[1] == etag
+
+    def test_assignment_folder_changes_through_the_files_api(self, classroom):
+        db, root = classroom
+        cache = GradebookCache()
+        _body, etag = cache.get(db, "c1")
+        assignments = root / "c1" / "assignments"
+
+        # Editing inside an existing assignment keeps the entry.
+        asyncio.run(cache.on_files_changed("t1", [str(assignments / "hw1" / "main.py")]))
+        assert cache.get(None, "c1")[1] == etag
+
+        (assignments / "hw3").mkdir()
+        asyncio.run(cache.on_files_changed("t1", [str(assignments / "hw3" / "main.py")]))
+        assert "hw3" in json.loads(cache.get(db, "c1")[0])["templates"]
+
+        (assignments / "hw1").rmdir()
+        asyncio.run(cache.on_files_changed("t1", [str(assignments / "hw1")]))
+        assert "hw1" not in json.loads(cache.get(db, "c1")[0])["templates"]
+
+
+def test_student_grade_weighted():
+    results = {"a": {"passed": 1, "total": 1}, "b": {"passed": 0, "total": 2}}
+    grade = student_grade(["a", "b"], results, "weighted", {"a": 3, "b": 1}, {})
+    assert grade["percent"] == 75
+    assert student_grade(["a"], {}, "equal", {}, {})["percent"] is None
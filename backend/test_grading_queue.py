@@ -0,0 +1,295 @@
+"""Tests for the process-wide grading scheduler."""
+
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.grading_queue import (  # noqa: E402
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    GradingScheduler,
+)
+
+
+@pytest.fixture
+def scheduler():
+    s = GradingScheduler(max_workers=4, limit_fn=lambda: 1)
+    yield s
+    s.shutdown()
+
+
+def _blocker(scheduler):
+    """Occupy the single slot until the returned event is set."""
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    fut = scheduler.submit("blocker", block)
+    assert started.wait(5)
+    return release, fut
+
+
+class TestGradingScheduler:
+    def test_returns_result_and_exception(self, scheduler):
+        assert scheduler.submit("c1", lambda a, b: a + b, 2, 3).result(5) == 5
+
+        def boom():
+            raise ValueError("nope")
+
+        with pytest.raises(ValueError):
+            scheduler.submit("c1", boom).result(5)
+
+    def test_concurrency_limit_respected(self):
+        s = GradingScheduler(max_workers=4, limit_fn=lambda: 2)
+        lock = threading.Lock()
+        running = [0]
+        peak = [0]
+
+        def job():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            threading.Event().wait(0.05)
+            with lock:
+                running[0] -= 1
+
+        try:
+            for f in [s.submit("c1", job) for _ in range(8)]:
+                f.result(5)
+        finally:
+            s.shutdown()
+        assert peak[0] == 2
+
+    def test_round_robin_between_classrooms(self, scheduler):
+        release, blocker = _blocker(scheduler)
+        order = []
+        futures = [scheduler.submit("big", order.append, f"big{i}") for i in range(3)]
+        futures.append(scheduler.submit("small", order.append, "small0"))
+        release.set()
+        for f in futures + [blocker]:
+            f.result(5)
+        # The small classroom is not stuck behind the whole big batch.
+        assert order.index("small0") < order.index("big2")
+
+    def test_priority_runs_first(self, scheduler):
+        release, blocker = _blocker(scheduler)
+        order = []
+        futures = [
+            scheduler.submit("c1", order.append, "batch", priority=PRIORITY_BATCH),
+            scheduler.submit("c1", order.append, "urgent", priority=PRIORITY_INTERACTIVE),
+        ]
+        release.set()
+        for f in futures + [blocker]:
+            f.result(5)
+        assert order == ["urgent", "batch"]
+
+    def test_duplicate_queued_job_is_collapsed(self, scheduler):
+        release, blocker = _blocker(scheduler)
+        calls = []
+        first = scheduler.submit("c1", calls.append, "x", key=("c1", "hw", "a@b.c"))
+        second = scheduler.submit(
+            "c1", calls.append, "x", key=("c1", "hw", "a@b.c"), priority=PRIORITY_INTERACTIVE,
+        )
+        assert first is second
+        release.set()
+        first.result(5)
+        blocker.result(5)
+        assert calls == ["x"]
+
+    def test_stats(self, scheduler):
+        release, blocker = _blocker(scheduler)
+        scheduler.submit("c1", lambda: None)
+        stats = scheduler.stats()
+        assert stats["active"] == 1
+        assert stats["queued"] == 1
+        assert stats["limit"] == 1
+        release.set()
+        blocker.result(5)
+
+
+class _FakeScheduler:
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.calls = []
+
+    def submit(self, classroom_id, fn, *args, **kwargs):
+        from concurrent.futures import Future
+
+        self.calls.append((classroom_id, args, kwargs))
+        fut = Future()
+        fut.set_result(self.outcome)
+        return fut
+
+
+class TestAutoGrader:
+    @pytest.fixture
+    def setup(self, tmp_path, monkeypatch):
+        from sqlalchemy.pool import StaticPool
+        from sqlmodel import Session, SQLModel, create_engine
+
+        from backend.api import grading
+        from backend.api.database import Classroom, User
+        from backend.test_runner import GradingOutcome
+
+        root = tmp_path / "classrooms"
+        (root / "c1" / "assignments" / "hw1").mkdir(parents=True)
+        student_dir = root / "c1" / "participants" / "alice@test.com" / "hw1"
+        student_dir.mkdir(parents=True)
+        monkeypatch.setattr(grading, "CLASSROOMS_ROOT", str(root))
+
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+        )
+        SQLModel.metadata.create_all(engine)
+        with Session(engine) as db:
+            db.add(User(id="u1", email="alice@test.com", port_start=10000, port_end=10009))
+            db.add(Classroom(id="c1", name="C", access_code="ABC", created_by="u1", auto_grade=True))
+            db.commit()
+
+        fake = _FakeScheduler(GradingOutcome(passed=2, total=3, fingerprint="fp"))
+        monkeypatch.setattr(grading, "get_grading_scheduler", lambda: fake)
+        grader = grading.AutoGrader(engine, debounce=0.05)
+        return grader, fake, engine, str(student_dir / "main.py")
+
+    @pytest.mark.asyncio
+    async def test_repeated_saves_coalesce(self, setup):
+        import asyncio
+
+        from sqlmodel import Session, select
+
+        from backend.api.database import TestResult
+
+        grader, fake, engine, path = setup
+        for _ in range(5):
+            await grader.on_files_changed("u1", [path])
+        await asyncio.sleep(0.2)
+
+        assert len(fake.calls) == 1
+        assert fake.calls[0][1][:3] == ("c1", "hw1", "alice@test.com")
+        with Session(engine) as db:
+            row = db.exec(select(TestResult)).one()
+        assert (row.tests_passed, row.tests_total, row.fingerprint) == (2, 3, "fp")
+
+    @pytest.mark.asyncio
+    async def test_disabled_classroom_and_unrelated_paths_ignored(self, setup, tmp_path):
+        import asyncio
+
+        from sqlmodel import Session
+
+        from backend.api.database import Classroom
+
+        grader, fake, engine, path = setup
+        await grader.on_files_changed("u1", [str(tmp_path / "elsewhere.py")])
+        with Session(engine) as db:
+            c = db.get(Classroom, "c1")
+            c.auto_grade = False
+            db.add(c)
+            db.commit()
+        await grader.on_files_changed("u1", [path])
+        await asyncio.sleep(0.2)
+
+        assert fake.calls == []
+
+    @pytest.mark.asyncio
+    async def test_lookups_leave_the_loop_free(self, setup, monkeypatch):
+        import asyncio
+        import time
+
+        from backend.api.loop_monitor import LoopMonitor
+
+        grader, fake, engine, path = setup
+
+        def slow(fn):
+            def wrapper(*args):
+                time.sleep(0.3)
+                return fn(*args)
+            return wrapper
+
+        for name in ("_auto_graded", "_grading_inputs", "_store"):
+            monkeypatch.setattr(grader, name, slow(getattr(grader, name)))
+        async with LoopMonitor(interval=0.005, slow_ms=100, cooldown=0) as monitor:
+            await grader.on_files_changed("u1", [path])
+            await asyncio.sleep(1.0)
+
+        assert len(fake.calls) == 1
+        assert monitor.max_lag_ms < 100
+
+
+class TestBatchRun:
+    @pytest.fixture
+    def app(self, monkeypatch):
+        from concurrent.futures import Future
+
+        from fastapi import FastAPI
+        from sqlalchemy.pool import StaticPool
+        from sqlmodel import Session, SQLModel, create_engine
+
+        import backend.grading_queue
+        from backend.api.database import Classroom, ClassroomMember, User
+        from backend.api.dependencies import get_db, get_onboarded_user
+        from backend.api.routers import classrooms
+
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+        )
+        SQLModel.metadata.create_all(engine)
+        teacher = User(id="t1", email="t@test.com", role="teacher", port_start=1, port_end=2)
+        with Session(engine) as db:
+            db.add(User(id="t1", email="t@test.com", port_start=1, port_end=2))
+            db.add(User(id="u1", email="alice@test.com", port_start=3, port_end=4))
+            db.add(Classroom(id="c1", name="C", access_code="ABC", created_by="t1"))
+            db.add(ClassroomMember(classroom_id="c1", user_id="t1", role="instructor"))
+            db.add(ClassroomMember(classroom_id="c1", user_id="u1", role="participant"))
+            db.commit()
+
+        gate = Future()
+
+        class Gated:
+            def submit(self, classroom_id, fn, *args, **kwargs):
+                return gate
+
+        monkeypatch.setattr(backend.grading_queue, "get_grading_scheduler", Gated)
+
+        def db():
+            with Session(engine) as session:
+                yield session
+
+        app = FastAPI()
+        app.include_router(classrooms.router, prefix="/api/classrooms")
+        app.dependency_overrides[get_onboarded_user] = lambda: teacher
+        app.dependency_overrides[get_db] = db
+        return app, gate, engine
+
+    @pytest.mark.asyncio
+    async def test_returns_once_queued_and_reports_progress(self, app):
+        import httpx
+        from sqlmodel import Session, select
+
+        from backend.api.database import TestResult
+        from backend.api.grading import get_grading_runs
+        from backend.test_runner import GradingOutcome
+
+        app, gate, engine = app
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            r = await client.post("/api/classrooms/c1/run-tests", json={"template_name": "hw1"})
+            assert r.status_code == 200, r.text
+            assert r.json()["count"] == 1
+
+            runs = (await client.get("/api/classrooms/c1/grading-runs")).json()["runs"]
+            assert [(x["completed"], x["count"]) for x in runs] == [(0, 1)]
+
+            gate.set_result(GradingOutcome(passed=1, total=2, fingerprint="fp"))
+            await get_grading_runs().wait()
+            assert (await client.get("/api/classrooms/c1/grading-runs")).json()["runs"] == []
+
+        with Session(engine) as db:
+            row = db.exec(select(TestResult)).one()
+        assert (row.user_id, row.tests_passed, row.tests_total) == ("u1", 1, 2)
@@ -0,0 +1,60 @@
+"""Tests for the event-loop lag sampler and slow-callback detector."""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.api.loop_monitor import LoopMonitor  # noqa: E402
+
+
+def _block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def _run(monitor, body):
+    async def go():
+        async with monitor:
+            await body()
+    asyncio.run(go())
+    return monitor.stats()
+
+
+class TestLoopMonitor:
+    def test_quiet_loop_has_no_stalls(self):
+        async def body():
+            await asyncio.sleep(0.2)
+
+        stats = _run(LoopMonitor(interval=0.01, slow_ms=100), body)
+        assert stats["samples"] >= 10
+        assert stats["stalls"] == 0
+        assert stats["lag_ms"]["max"] < 100
+        assert sum(stats["histogram"].values()) == stats["samples"]
+
+    def test_stall_is_measured_and_its_stack_captured(self):
+        async def body():
+            await asyncio.sleep(0.03)
+            _block_the_loop(0.3)
+            await asyncio.sleep(0.03)
+
+        stats = _run(LoopMonitor(interval=0.01, slow_ms=100), body)
+        assert stats["stalls"] == 1
+        assert stats["lag_ms"]["max"] >= 250
+        assert stats["histogram"]["le_500"] == 1
+        (capture,) = stats["slow_callbacks"]
+        assert "_block_the_loop" in capture["stack"]
+        # Filled in with the full stall once the loop came back.
+        assert capture["blocked_ms"] >= 250
+
+    def test_stack_captures_are_rate_limited(self):
+        async def body():
+            for _ in range(3):
+                await asyncio.sleep(0.03)
+                _block_the_loop(0.15)
+
+        stats = _run(LoopMonitor(interval=0.01, slow_ms=50, cooldown=60), body)
+        assert stats["stalls"] == 3
+        assert len(stats["slow_callbacks"]) == 1
+        assert stats["stacks_suppressed"] == 2
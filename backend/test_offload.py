@@ -0,0 +1,292 @@
+"""Tests that slow filesystem and DB work in the routers leaves the event loop free."""
+
+import asyncio
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.api import gradebook, offload  # noqa: E402
+from backend.api.loop_monitor import LoopMonitor  # noqa: E402
+from backend.api.routers import classrooms, files  # noqa: E402
+
+# Every blocking call below is made to take SLOW seconds; a request may hold
+# the loop for at most LOOP_BLOCK_BUDGET while it runs.
+SLOW = 0.3
+LOOP_BLOCK_BUDGET = 0.1
+
+
+def _slow(fn):
+    def wrapper(*args, **kwargs):
+        time.sleep(SLOW)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    from fastapi import FastAPI
+    from sqlalchemy.pool import StaticPool
+    from sqlmodel import Session, SQLModel, create_engine
+
+    from backend.api.database import Classroom, ClassroomMember, User
+    from backend.api.dependencies import get_db, get_onboarded_user
+
+    for mod in (files, classrooms, gradebook):
+        monkeypatch.setattr(mod, "CLASSROOMS_ROOT", str(tmp_path / "classrooms"))
+    monkeypatch.setattr(files, "UPLOADS_ROOT", str(tmp_path / "uploads"))
+    monkeypatch.setattr(classrooms, "notify_files_changed", lambda *a, **k: asyncio.sleep(0))
+    monkeypatch.setattr(files, "notify_files_changed", lambda *a, **k: asyncio.sleep(0))
+
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    user = User(id="t1", email="teacher@test.com", role="teacher", port_start=10000, port_end=10009)
+    with Session(engine) as db:
+        db.add(User(id="t1", email="teacher@test.com", port_start=10000, port_end=10009))
+        db.add(Classroom(id="c1", name="C", access_code="ABC", created_by="t1"))
+        db.add(ClassroomMember(classroom_id="c1", user_id="t1", role="instructor"))
+        db.add(User(id="s1", email="student@test.com", port_start=10010, port_end=10019))
+        db.add(ClassroomMember(classroom_id="c1", user_id="s1", role="participant"))
+        db.commit()
+
+    def db():
+        with Session(engine) as session:
+            yield session
+
+    app = FastAPI()
+    app.include_router(files.router, prefix="/api/files")
+    app.include_router(classrooms.router, prefix="/api/classrooms")
+    app.dependency_overrides[get_onboarded_user] = lambda: user
+    app.dependency_overrides[get_db] = db
+    (tmp_path / "uploads" / "t1").mkdir(parents=True)
+    return app, tmp_path
+
+
+def _call(app, method, url, **kwargs):
+    import httpx
+
+    async def go():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            # FastAPI builds each route's dependency state on first match;
+            # an unrouted request pays that once, outside the measurement.
+            await client.get("/warm-up")
+            async with LoopMonitor(
+                interval=0.005, slow_ms=LOOP_BLOCK_BUDGET * 1000, cooldown=0,
+            ) as monitor:
+                response = await client.request(method, url, **kwargs)
+            return response, monitor
+
+    return asyncio.run(go())
+
+
+def _assert_loop_free(monitor: LoopMonitor) -> None:
+    assert monitor.max_lag_ms < LOOP_BLOCK_BUDGET * 1000, "".join(
+        c["stack"] for c in monitor.captures
+    )
+
+
+class TestLoopStaysFree:
+    def test_delete_folder(self, app, monkeypatch):
+        app, root = app
+        (root / "uploads" / "t1" / "big" / "sub").mkdir(parents=True)
+        monkeypatch.setattr(shutil, "rmtree", _slow(shutil.rmtree))
+
+        r, monitor = _call(app, "DELETE", "/api/files/file/big")
+        assert r.status_code == 200, r.text
+        assert not (root / "uploads" / "t1" / "big").exists()
+        _assert_loop_free(monitor)
+
+    def test_list_files_walk_and_classroom_lookup(self, app, monkeypatch):
+        app, root = app
+        (root / "uploads" / "t1" / "a.py").write_text("x")
+        monkeypatch.setattr(files, "_build_file_tree", _slow(files._build_file_tree))
+        monkeypatch.setattr(files, "_classroom_meta", _slow(files._classroom_meta))
+
+        r, monitor = _call(app, "GET", "/api/files/list?show_hidden=true")
+        assert r.status_code == 200, r.text
+        assert "a.py" in r.text
+        _assert_loop_free(monitor)
+
+    def test_copy_folder(self, app, monkeypatch):
+        app, root = app
+        (root / "uploads" / "t1" / "src").mkdir()
+        (root / "uploads" / "t1" / "src" / "f.txt").write_text("hi")
+        monkeypatch.setattr(shutil, "copytree", _slow(shutil.copytree))
+
+        r, monitor = _call(app, "POST", "/api/files/copy", json={"source": "src", "destination": "dst"})
+        assert r.status_code == 200, r.text
+        assert (root / "uploads" / "t1" / "dst" / "f.txt").read_text() == "hi"
+        _assert_loop_free(monitor)
+
+    def test_delete_assignment(self, app, monkeypatch):
+        app, root = app
+        (root / "classrooms" / "c1" / "assignments" / "hw1").mkdir(parents=True)
+        monkeypatch.setattr(shutil, "rmtree", _slow(shutil.rmtree))
+
+        r, monitor = _call(app, "DELETE", "/api/classrooms/c1/assignments/hw1")
+        assert r.status_code == 200, r.text
+        _assert_loop_free(monitor)
+
+    def test_list_drafts(self, app, monkeypatch):
+        app, root = app
+        (root / "classrooms" / "c1" / "drafts" / "d1").mkdir(parents=True)
+        (root / "classrooms" / "c1" / "drafts" / "d1" / "main.py").write_text("")
+        monkeypatch.setattr(classrooms, "_list_dir_files", _slow(classrooms._list_dir_files))
+
+        r, monitor = _call(app, "GET", "/api/classrooms/c1/drafts")
+        assert r.json() == {"drafts": [{"name": "d1", "files": ["main.py"]}]}
+        _assert_loop_free(monitor)
+
+
+    def test_list_classrooms_and_participants(self, app, monkeypatch):
+        app, _root = app
+        monkeypatch.setattr(classrooms, "_classroom_lists", _slow(classrooms._classroom_lists))
+        monkeypatch.setattr(classrooms, "_participant_ids", _slow(classrooms._participant_ids))
+
+        r, monitor = _call(app, "GET", "/api/classrooms/")
+        assert [c["id"] for c in r.json()["owner"]] == ["c1"]
+        _assert_loop_free(monitor)
+
+        r, monitor = _call(app, "GET", "/api/classrooms/c1/participants")
+        assert r.json() == {"participants": ["s1"]}
+        _assert_loop_free(monitor)
+
+    def test_my_progress(self, app, monkeypatch):
+        app, root = app
+        (root / "classrooms" / "c1" / "assignments" / "hw1").mkdir(parents=True)
+        monkeypatch.setattr(classrooms, "_own_scores", _slow(classrooms._own_scores))
+        monkeypatch.setattr(classrooms, "list_assignments", _slow(classrooms.list_assignments))
+
+        r, monitor = _call(app, "GET", "/api/classrooms/c1/my-progress")
+        assert r.json()["templates"] == ["hw1"]
+        _assert_loop_free(monitor)
+
+    def test_student_files(self, app, monkeypatch):
+        app, root = app
+        (root / "classrooms" / "c1" / "participants" / "student@test.com" / "hw1").mkdir(parents=True)
+        (root / "classrooms" / "c1" / "participants" / "student@test.com" / "hw1" / "a.py").write_text("")
+        monkeypatch.setattr(
+            classrooms, "_require_participant_email", _slow(classrooms._require_participant_email),
+        )
+
+        r, monitor = _call(
+            app, "GET", "/api/classrooms/c1/student-files?email=student@test.com&template=hw1",
+        )
+        assert r.status_code == 200, r.text
+        assert "a.py" in r.text
+        _assert_loop_free(monitor)
+
+    def test_run_classroom_tests_queues_without_blocking(self, app, monkeypatch):
+        app, root = app
+        (root / "classrooms" / "c1" / "assignments" / "hw1").mkdir(parents=True)
+        monkeypatch.setattr(classrooms, "list_assignments", _slow(classrooms.list_assignments))
+        monkeypatch.setattr(classrooms, "_batch_jobs", _slow(lambda *a: ([], {})))
+
+        r, monitor = _call(app, "POST", "/api/classrooms/c1/run-tests", json={})
+        assert r.status_code == 200, r.text
+        assert r.json()["count"] == 0
+        _assert_loop_free(monitor)
+
+    def test_run_student_tests(self, app, monkeypatch):
+        import backend.grading_queue as grading_queue
+        from backend.test_runner import GradingOutcome
+
+        app, root = app
+
+        class Scheduler:
+            async def run(self, *args, **kwargs):
+                return GradingOutcome(passed=1, total=2, output="ok", fingerprint="f")
+
+        monkeypatch.setattr(grading_queue, "get_grading_scheduler", lambda: Scheduler())
+        for name in (
+            "_require_classroom", "_require_instructor",
+            "_student_run_inputs", "_store_student_outcome",
+        ):
+            monkeypatch.setattr(classrooms, name, _slow(getattr(classrooms, name)))
+
+        r, monitor = _call(
+            app, "POST", "/api/classrooms/c1/run-student-tests",
+            json={"student_email": "student@test.com", "template_name": "hw1"},
+        )
+        assert r.status_code == 200, r.text
+        assert (r.json()["passed"], r.json()["total"]) == (1, 2)
+        _assert_loop_free(monitor)
+
+        r, _monitor = _call(
+            app, "GET", "/api/classrooms/c1/test-cases?user_id=s1&template_name=hw1",
+        )
+        assert r.json()["passed"] == 1
+
+    def test_progress_cache_miss(self, app, monkeypatch):
+        app, root = app
+        (root / "classrooms" / "c1" / "assignments" / "hw1").mkdir(parents=True)
+        cache = gradebook.GradebookCache()
+        monkeypatch.setattr(classrooms, "get_gradebooks", lambda: cache)
+        monkeypatch.setattr(cache, "_build", _slow(cache._build))
+
+        r, monitor = _call(app, "GET", "/api/classrooms/c1/progress")
+        assert r.status_code == 200, r.text
+        assert r.json()["templates"] == ["hw1"]
+        _assert_loop_free(monitor)
+
+    def test_weights_and_manual_scores(self, app, monkeypatch):
+        app, _root = app
+        for name in ("_save_weights", "_save_manual_score", "_stored_manual_scores"):
+            monkeypatch.setattr(classrooms, name, _slow(getattr(classrooms, name)))
+
+        r, monitor = _call(
+            app, "PUT", "/api/classrooms/c1/weights",
+            json={"grading_mode": "manual", "weights": {"hw1": 10}},
+        )
+        assert r.json()["weights"] == {"hw1": 10}
+        _assert_loop_free(monitor)
+
+        r, monitor = _call(
+            app, "PUT", "/api/classrooms/c1/manual-score",
+            json={"user_id": "s1", "template_name": "hw1", "score": 7},
+        )
+        assert r.status_code == 200, r.text
+        _assert_loop_free(monitor)
+
+        r, monitor = _call(app, "GET", "/api/classrooms/c1/manual-scores")
+        assert r.json() == {"scores": {"s1": {"hw1": 7}}}
+        _assert_loop_free(monitor)
+
+    def test_upload_writes(self, app, monkeypatch):
+        app, root = app
+        monkeypatch.setattr(files, "_write_chunk", _slow(files._write_chunk))
+
+        r, monitor = _call(app, "POST", "/api/files/upload", files={"files": ("a.txt", b"hello")})
+        assert r.status_code == 200, r.text
+        assert (root / "uploads" / "t1" / "a.txt").read_bytes() == b"hello"
+        _assert_loop_free(monitor)
+
+
+class TestPools:
+    def test_fs_and_db_pools_are_separate_and_bounded(self, monkeypatch):
+        monkeypatch.setattr(offload, "FS_WORKERS", 2)
+        monkeypatch.setattr(offload, "_executors", {})
+        gate = threading.Event()
+
+        async def go():
+            fs = [asyncio.ensure_future(offload.run_fs(gate.wait)) for _ in range(4)]
+            await asyncio.sleep(0.05)
+            # The FS pool is saturated, but DB work still runs.
+            assert await offload.run_db(lambda: "db") == "db"
+            assert offload.offload_stats()["fs"] == {"workers": 2, "queued": 2}
+            gate.set()
+            await asyncio.gather(*fs)
+
+        try:
+            asyncio.run(go())
+        finally:
+            gate.set()
+            offload.shutdown_offload()
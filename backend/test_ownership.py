@@ -0,0 +1,110 @@
+"""Tests for the shared owner/mode normalizer."""
+
+import os
+import stat
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend import ownership  # noqa: E402
+
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "hw1"
+    (root / "src" / "pkg").mkdir(parents=True)
+    for rel in ("README.md", "src/main.py", "src/pkg/util.py"):
+        (root / rel).write_text("x")
+        os.chmod(root / rel, 0o600)
+    for d in (root, root / "src", root / "src" / "pkg"):
+        os.chmod(d, 0o755)
+    outside = tmp_path / "outside.txt"
+    outside.write_text("")
+    os.chmod(outside, 0o600)
+    os.symlink(outside, root / "link")
+    return root
+
+
+def _ids():
+    return {"uid": os.getuid(), "gid": os.getgid()}
+
+
+def _mode(p):
+    return stat.S_IMODE(os.stat(p, follow_symlinks=False).st_mode)
+
+
+class TestNormalizeTree:
+    def test_only_changes_what_differs(self, tree):
+        os.chmod(tree / "src" / "main.py", 0o664)
+        stats = ownership.normalize_tree(str(tree), **_ids())
+        assert stats.chown == 0 and stats.errors == 0
+        # 3 dirs + 2 files needed a chmod; main.py and the link did not.
+        assert stats.chmod == 5 and stats.checked == 7
+        assert _mode(tree / "src" / "pkg") == 0o2775
+        assert _mode(tree / "src" / "pkg" / "util.py") == 0o664
+        assert _mode(tree.parent / "outside.txt") == 0o600
+
+        again = ownership.normalize_tree(str(tree), **_ids())
+        assert (again.chown, again.chmod, again.checked) == (0, 0, 7)
+
+    def test_group_change_is_one_chown_per_entry(self, tree, monkeypatch):
+        calls = []
+        monkeypatch.setattr(ownership.os, "chown", lambda *a, **k: calls.append(a))
+        gid = os.getgid() + 1
+        stats = ownership.normalize_tree(str(tree), uid=os.getuid(), gid=gid)
+        assert stats.chown == len(calls) == 6  # everything but the symlink
+        assert all(c[2] == gid for c in calls)
+
+
+    def test_owner_refused_for_one_entry_only(self, tree, monkeypatch):
+        calls = []
+        refused = os.path.basename(tree / "README.md")
+
+        def chown(target, uid, gid, **kwargs):
+            calls.append((target, uid))
+            if target == refused and uid != -1:
+                raise PermissionError(1, "Operation not permitted")
+
+        monkeypatch.setattr(ownership, "_can_chown_owner", True)
+        monkeypatch.setattr(ownership.os, "chown", chown)
+        uid, gid = os.getuid() + 1, os.getgid() + 1
+        stats = ownership.normalize_tree(str(tree), uid=uid, gid=gid)
+        # README.md got its group only; every other entry still got the owner.
+        assert (refused, -1) in calls
+        assert sorted(t for t, u in calls if u == uid) == sorted(
+            [str(tree), "README.md", "src", "main.py", "pkg", "util.py"]
+        )
+        assert stats.errors == 0
+
+    def test_without_cap_chown_only_the_group_is_fixed(self, tree, monkeypatch):
+        calls = []
+        monkeypatch.setattr(ownership, "_can_chown_owner", False)
+        monkeypatch.setattr(ownership.os, "chown", lambda *a, **k: calls.append(a))
+        ownership.normalize_tree(str(tree), uid=os.getuid() + 1, gid=os.getgid() + 1)
+        assert len(calls) == 6 and all(c[1] == os.getuid() for c in calls)
+
+
+class TestNormalizePaths:
+    def test_batch_opens_each_parent_once(self, tree, monkeypatch):
+        opened = []
+        real_open = os.open
+
+        def counting_open(path, *args, **kwargs):
+            opened.append(path)
+            return real_open(path, *args, **kwargs)
+
+        monkeypatch.setattr(ownership.os, "open", counting_open)
+        paths = [str(tree / "README.md"), str(tree / "src"), str(tree / "src" / "main.py"),
+                 str(tree / "src" / "pkg" / "util.py"), str(tree / "src") + "/"]
+        stats = ownership.normalize_paths(paths, **_ids())
+        assert sorted(opened) == sorted({str(tree), str(tree / "src"), str(tree / "src" / "pkg")})
+        assert stats.checked == 4 and stats.chmod == 4
+        # Only the named entries: pkg itself was not in the batch.
+        assert _mode(tree / "src" / "pkg") == 0o755
+
+    def test_missing_paths_are_counted_not_raised(self, tmp_path):
+        stats = ownership.normalize_paths([str(tmp_path / "nope"), str(tmp_path / "a" / "b")])
+        assert stats.errors == 2 and stats.checked == 0
@@ -1,45 +1,23 @@
+import hashlib
+import inspect
 import logging
 import os
 import re
 import shutil
+import subprocess
+import sys
+import threading
+from dataclasses import dataclass, field
 
 from backend.docker import (
     CLASSROOMS_ROOT,
-    CONTAINER_USER_GID,
-    CONTAINER_USER_UID,
-    run_in_ephemeral_container,
+    run_grading_suite,
 )
+from backend.ownership import normalize_tree
 
 logger = logging.getLogger("test_runner")
 
 
-def _apply_shared_perms(root: str) -> None:
-    """Walk *root* and set ownership to the container user (999:995), mode
-    2775 on directories (setgid so children inherit GID 995), and 0664 on
-    files. Both the backend (www-data with supplementary 995) and the
-    container user can read/write, and subprocess stagings can overwrite
-    existing files via group permissions."""
-    for dirpath, _dirnames, filenames in os.walk(root):
-        try:
-            os.chown(dirpath, CONTAINER_USER_UID, CONTAINER_USER_GID)
-        except OSError:
-            pass
-        try:
-            os.chmod(dirpath, 0o2775)
-        except OSError:
-            pass
-        for fn in filenames:
-            fp = os.path.join(dirpath, fn)
-            try:
-                os.chown(fp, CONTAINER_USER_UID, CONTAINER_USER_GID)
-            except OSError:
-                pass
-            try:
-                os.chmod(fp, 0o664)
-            except OSError:
-                pass
-
-
 def _find_test_files(template_dir: str) -> list[str]:
     """Find test files in a template directory.
 
@@ -182,181 +160,669 @@ def _parse_script_output(output: str) -> tuple[int, int]:
     return 0, 0
 
 
-def run_tests_for_student_with_output(
-    classroom_id: str,
-    template_name: str,
-    student_email: str,
-) -> tuple[int, int, str]:
-    """Like run_tests_for_student but also returns the raw test output."""
-    student_email = (student_email or "participant").replace("/", "_")
+# Source shipped to the in-container driver so it can decide whether to run
+# the pytest fallback: it skips it only when a (non-timed-out) step's stdout
+# parses to a score under exactly the rule used when the results come back,
+# so the two can't disagree.
+SCORE_PARSER_SOURCE = "import re\n_RESULTS_MARKER = %r\n\n%s\n%s\n%s" % (
+    _RESULTS_MARKER,
+    inspect.getsource(_parse_unittest_output),
+    inspect.getsource(_parse_structured_output),
+    inspect.getsource(_parse_script_output),
+)
 
-    templates_dir = os.path.join(
-        CLASSROOMS_ROOT, classroom_id, "assignments", template_name
-    )
-    student_dir = os.path.join(
-        CLASSROOMS_ROOT, classroom_id, "participants", student_email, template_name
+_SCRIPT_TIMEOUT = 30
+
+
+# Bump whenever grading semantics change (driver, parsing, timeouts, image)
+# so every memoized result is invalidated.
+RUNNER_VERSION = "6"
+
+# Build artefacts that never affect a grade and would otherwise churn the
+# fingerprint.
+_FINGERPRINT_SKIP_DIRS = {"__pycache__", ".pytest_cache", ".mypy_cache"}
+
+# path -> (size, mtime_ns, sha256). Lets repeat fingerprints skip re-reading
+# files whose stat is unchanged; a touched-but-identical file is re-hashed
+# and still yields the same fingerprint.
+_digest_cache: dict[str, tuple[int, int, str]] = {}
+_digest_cache_lock = threading.Lock()
+_DIGEST_CACHE_MAX = 100_000
+
+
+def _file_digest(path: str) -> str:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    key = (st.st_size, st.st_mtime_ns)
+    with _digest_cache_lock:
+        cached = _digest_cache.get(path)
+    if cached is not None and cached[:2] == key:
+        return cached[2]
+
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                h.update(chunk)
+    except OSError:
+        return "unreadable"
+    digest = h.hexdigest()
+    with _digest_cache_lock:
+        if len(_digest_cache) >= _DIGEST_CACHE_MAX:
+            _digest_cache.clear()
+        _digest_cache[path] = (key[0], key[1], digest)
+    return digest
+
+
+def fingerprint(student_dir: str, test_files: dict[str, str]) -> str:
+    """Hash everything a grading run depends on: every file under
+    *student_dir* (mounted as /app), the staged test files and
+    ``RUNNER_VERSION``. Equal fingerprints mean re-grading would reproduce
+    the stored result."""
+    h = hashlib.sha256(f"runner:{RUNNER_VERSION}\n".encode())
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(student_dir):
+        dirnames[:] = sorted(d for d in dirnames if d not in _FINGERPRINT_SKIP_DIRS)
+        for fn in filenames:
+            fp = os.path.join(dirpath, fn)
+            entries.append(("app", os.path.relpath(fp, student_dir), fp))
+    for rel, host_path in test_files.items():
+        entries.append(("test", rel, host_path))
+    for kind, rel, path in sorted(entries):
+        h.update(f"{kind}\0{rel}\0{_file_digest(path)}\n".encode())
+    return h.hexdigest()
+
+
+def suite_fingerprint(test_files: dict[str, str]) -> str:
+    """Hash of just the test files and ``RUNNER_VERSION``. A stored result's
+    per-test records can only be merged with a partial re-run while this
+    is unchanged."""
+    h = hashlib.sha256(f"runner:{RUNNER_VERSION}\n".encode())
+    for rel, host_path in sorted(test_files.items()):
+        h.update(f"test\0{rel}\0{_file_digest(host_path)}\n".encode())
+    return h.hexdigest()
+
+
+# Pre-flight syntax check: parse (never execute) the student modules the
+# tests import, directly or through each other, on the host before paying
+# for a sandbox. A module that doesn't compile fails every test that imports
+# it, so the job is answered with 0/N straight away. Other .py files
+# (scratch files, vendored code) are never looked at. The parser runs in its
+# own short-lived, resource-limited process because compile() on hostile
+# input can still eat memory or recurse deeply. Grammar differs between
+# Python versions, so the check only runs when the parsing interpreter is
+# the sandbox's version (GRADING_SANDBOX_PYTHON); its version is read once
+# at import, and on a mismatch no checker process is ever started. Set
+# GRADING_SYNTAX_PRECHECK=0 to disable, or GRADING_PRECHECK_PYTHON to parse
+# with an interpreter matching the sandbox image.
+GRADING_SYNTAX_PRECHECK = os.environ.get("GRADING_SYNTAX_PRECHECK", "1") != "0"
+GRADING_PRECHECK_PYTHON = os.environ.get("GRADING_PRECHECK_PYTHON", sys.executable)
+GRADING_SANDBOX_PYTHON = os.environ.get("GRADING_SANDBOX_PYTHON", "3.12")
+_PRECHECK_TIMEOUT = 10
+
+
+def _python_version(python: str) -> str | None:
+    """``"X.Y"`` of the interpreter at *python*, or None if it won't run."""
+    if python == sys.executable:
+        return "%d.%d" % sys.version_info[:2]
+    try:
+        result = subprocess.run(
+            [python, "-I", "-c", "import sys; print('%d.%d' % sys.version_info[:2])"],
+            capture_output=True, text=True, timeout=_PRECHECK_TIMEOUT,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+GRADING_PRECHECK_VERSION = (
+    _python_version(GRADING_PRECHECK_PYTHON) if GRADING_SYNTAX_PRECHECK else None
+)
+if GRADING_SYNTAX_PRECHECK and GRADING_PRECHECK_VERSION != GRADING_SANDBOX_PYTHON:
+    logger.info(
+        "Syntax pre-check off: %s is Python %s, the sandbox runs %s",
+        GRADING_PRECHECK_PYTHON, GRADING_PRECHECK_VERSION, GRADING_SANDBOX_PYTHON,
     )
 
-    if not os.path.isdir(templates_dir):
-        return 0, 0, "Template directory not found."
 
-    if not os.path.isdir(student_dir):
-        logger.info(f"Creating student dir from template: {student_dir}")
+def _precheck_enabled() -> bool:
+    return GRADING_SYNTAX_PRECHECK and GRADING_PRECHECK_VERSION == GRADING_SANDBOX_PYTHON
+
+
+# argv: student dir, then the test scripts' host paths; relative paths of
+# student files to leave alone come newline-separated in $CSROOM_SKIP.
+# Prints the first compiler error (exit 1).
+_PRECHECK_SOURCE = r"""
+import ast, os, resource, sys, traceback
+
+resource.setrlimit(resource.RLIMIT_CPU, (5, 5))
+resource.setrlimit(resource.RLIMIT_AS, (512 << 20, 512 << 20))
+resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+sys.setrecursionlimit(2000)
+
+root, tests = os.path.realpath(sys.argv[1]), sys.argv[2:]
+skip = set(filter(None, os.environ.get("CSROOM_SKIP", "").split("\n")))
+
+def imports(tree, base):
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                yield root, alias.name
+        elif isinstance(node, ast.ImportFrom):
+            here = root
+            if node.level:
+                here = base
+                for _ in range(node.level - 1):
+                    here = os.path.dirname(here)
+            if node.module:
+                yield here, node.module
+            for alias in node.names:
+                yield here, ((node.module + ".") if node.module else "") + alias.name
+
+def candidates(base, name):
+    parts = name.split(".")
+    for i in range(1, len(parts) + 1):
+        path = os.path.join(base, *parts[:i])
+        yield path + ".py"
+        yield os.path.join(path, "__init__.py")
+
+def parse(path):
+    with open(path, "rb") as f:
+        return ast.parse(f.read(4 << 20), path)
+
+queue = []
+for test in tests:
+    try:
+        queue.extend(imports(parse(test), root))
+    except (SyntaxError, OSError, ValueError):
+        pass  # the teacher's script: the sandbox reports that one
+seen = set()
+while queue:
+    base, name = queue.pop()
+    for path in candidates(base, name):
+        path = os.path.realpath(path)
+        if path in seen or not path.startswith(root + os.sep) or not os.path.isfile(path):
+            continue
+        seen.add(path)
+        rel = os.path.relpath(path, root)
+        if rel in skip:
+            continue
         try:
-            shutil.copytree(templates_dir, student_dir)
-            _apply_shared_perms(student_dir)
-        except Exception as e:
-            return 0, 0, f"Failed to create student directory: {e}"
-
-    test_files = _find_test_files(templates_dir)
-    if not test_files:
-        return 0, 0, "No test files found."
-
-    # Build test file mapping: relative path -> host absolute path
-    test_file_map = {}
-    for tf in test_files:
-        test_file_map[tf] = os.path.join(templates_dir, tf)
-
-    py_tests = [f for f in test_files if f.endswith(".py")]
-    passed, total = 0, 0
-    all_output = ""
-
-    if py_tests:
-        for tf in py_tests:
-            rc, stdout, stderr = run_in_ephemeral_container(
-                student_dir=student_dir,
-                test_files=test_file_map,
-                command=["python3", f"/tmp/tests/{tf}"],
-                timeout=30,
-            )
-            output = stdout + stderr
-            all_output += output
-            if rc == -1:
-                all_output += f"\n[Timeout] {tf} exceeded 30s limit\n"
-            else:
-                # Structured N/M score is emitted to stdout by the test
-                # script's atexit handler. Stderr (e.g. tracebacks) would
-                # come last in `output` and break the "last non-empty line"
-                # heuristic, so parse stdout in isolation.
-                p, t = _parse_script_output(stdout)
-                passed += p
-                total += t
-
-        if total == 0:
-            rc, stdout, stderr = run_in_ephemeral_container(
-                student_dir=student_dir,
-                test_files=test_file_map,
-                command=["python3", "-m", "pytest", "--tb=short", "-q", "/app"],
-                timeout=30,
-            )
-            output = stdout + stderr
-            all_output += output
-            if rc == -1:
-                all_output += "\n[Timeout] pytest exceeded 30s limit\n"
-            else:
-                passed, total = _parse_pytest_output(output)
-                if total == 0:
-                    passed, total = _parse_unittest_output(output)
+            with open(path, "rb") as f:
+                tree = ast.parse(f.read(4 << 20), rel)
+            compile(tree, rel, "exec", dont_inherit=True)
+        except SyntaxError as e:
+            sys.stdout.write("".join(traceback.format_exception_only(type(e), e)))
+            sys.exit(1)
+        except (OSError, ValueError):
+            continue
+        queue.extend(imports(tree, os.path.dirname(path)))
+"""
 
-    return passed, total, all_output
+_precheck_stats = {"checked": 0, "rejected": 0, "errors": 0}
+_precheck_lock = threading.Lock()
 
 
-def run_tests_for_student(
-    classroom_id: str,
-    template_name: str,
-    student_email: str,
-) -> tuple[int, int]:
-    """Run teacher's tests against a student's code in an ephemeral container.
+def _count_precheck(key: str) -> None:
+    with _precheck_lock:
+        _precheck_stats[key] += 1
 
-    Student workspace is mounted read-only so malicious student code cannot
-    modify files. Test files are injected into /tmp inside the container.
-    Returns (tests_passed, tests_total).
 
-    Strategy: try running each test file as a Python script first (most
-    CS Room templates are designed as script-based runners). Fall back to
-    pytest if the script approach yields no results.
-    """
+def precheck_stats() -> dict:
+    """Counters for the syntax pre-check, for the admin stats page."""
+    with _precheck_lock:
+        stats = dict(_precheck_stats)
+    stats["enabled"] = _precheck_enabled()
+    stats["hit_rate"] = (
+        round(stats["rejected"] / stats["checked"], 3) if stats["checked"] else 0.0
+    )
+    return stats
+
+
+def syntax_precheck(
+    student_dir: str, tests: list[str], skip: list[str] | None = None,
+) -> str | None:
+    """Return the compiler message for the first student module imported by
+    the test scripts at *tests* (host paths) that fails to parse, or None.
+    Student files named in *skip* (relative paths) are not checked. If the
+    checker is off, would parse with a different Python than the sandbox,
+    or fails itself, None is returned and the job runs normally."""
+    if not _precheck_enabled() or not os.path.isdir(student_dir):
+        return None
+    try:
+        result = subprocess.run(
+            [GRADING_PRECHECK_PYTHON, "-I", "-B", "-c", _PRECHECK_SOURCE, student_dir, *tests],
+            capture_output=True,
+            text=True,
+            timeout=_PRECHECK_TIMEOUT,
+            env={
+                "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+                "CSROOM_SKIP": "\n".join(skip or []),
+            },
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning(f"Syntax pre-check failed for {student_dir}: {e}")
+        _count_precheck("errors")
+        return None
+    message = result.stdout
+    _count_precheck("checked")
+    if result.returncode == 1 and message:
+        _count_precheck("rejected")
+        return message
+    if result.returncode != 0:
+        # Killed by a limit or crashed: don't guess, let the sandbox decide.
+        _count_precheck("errors")
+    return None
+
+
+@dataclass
+class GradingOutcome:
+    """Result of grading one student on one template."""
+
+    passed: int = 0
+    total: int = 0
+    output: str = ""
+    # Empty when the result must not be reused (e.g. a step timed out,
+    # which can depend on host load rather than the student's code).
+    fingerprint: str = ""
+    cached: bool = False
+    # Per-test records: {"file", "test_id", "outcome", "message"}, where
+    # outcome is passed/failed/error/skipped.
+    tests: list[dict] = field(default_factory=list)
+    # Per test file (or "pytest" for the fallback): {"passed", "total",
+    # "granular"}. granular means the file's tests can be re-run by id.
+    file_scores: dict[str, dict] = field(default_factory=dict)
+    tests_fingerprint: str = ""
+
+
+_FALLBACK_NAME = "pytest"
+_FAILING = ("failed", "error")
+
+# "  ✅  description" / "  ❌  description" lines printed by check()-style
+# test scripts that don't use unittest.
+_CHECK_LINE = re.compile(r"^\s*(\u2705|\u274c)\s+(.+?)\s*$", re.M)
+
+
+def _check_line_records(stdout: str) -> list[dict]:
+    records = []
+    seen: dict[str, int] = {}
+    for mark, desc in _CHECK_LINE.findall(stdout):
+        seen[desc] = seen.get(desc, 0) + 1
+        test_id = desc if seen[desc] == 1 else f"{desc} #{seen[desc]}"
+        records.append({
+            "id": test_id,
+            "outcome": "passed" if mark == "\u2705" else "failed",
+            "message": "",
+        })
+    return records
+
+
+def _step_tests(file: str, res: dict) -> tuple[list[dict], bool]:
+    """Per-test rows for one step: the in-sandbox reporter's records when it
+    produced any (granular: re-runnable by id), else ✅/❌ check lines."""
+    records = res.get("tests") or []
+    granular = bool(records)
+    if not records:
+        records = _check_line_records(res["stdout"])
+    rows = [
+        {
+            "file": file,
+            "test_id": str(r.get("id", "")),
+            "outcome": r.get("outcome", "error"),
+            "message": str(r.get("message") or ""),
+        }
+        for r in records
+    ]
+    return rows, granular
+
+
+def _fallback_step(node_ids: list[str] | None = None) -> dict:
+    targets = [f"/app/{n}" for n in node_ids] if node_ids else ["/app"]
+    return {
+        "name": _FALLBACK_NAME,
+        "command": [
+            "python3", "-m", "pytest", "--tb=short", "-q",
+            "-p", "sitecustomize", "-p", "no:cacheprovider", *targets,
+        ],
+        "timeout": _SCRIPT_TIMEOUT,
+    }
+
+
+def _student_paths(
+    classroom_id: str, template_name: str, student_email: str
+) -> tuple[str, str, str]:
     student_email = (student_email or "participant").replace("/", "_")
-
     templates_dir = os.path.join(
         CLASSROOMS_ROOT, classroom_id, "assignments", template_name
     )
     student_dir = os.path.join(
         CLASSROOMS_ROOT, classroom_id, "participants", student_email, template_name
     )
+    return student_email, templates_dir, student_dir
+
+
+def grade_student(
+    classroom_id: str,
+    template_name: str,
+    student_email: str,
+    previous: GradingOutcome | None = None,
+    failed_only: bool = False,
+) -> GradingOutcome:
+    """Run teacher's tests against a student's code in ONE ephemeral container.
+
+    Every ``test_*.py`` script is staged once and run sequentially inside a
+    single hardened container, each with its own timeout and separately
+    captured stdout/stderr, so the container lifecycle is paid once per
+    (student, template) rather than once per test file. A pre-started
+    sandbox from the warm pool is used when one is free. If none of the
+    scripts report a score, pytest runs as a fallback step in the same
+    container.
+
+    If *previous* (the stored result) carries the same fingerprint as the
+    current files, it is returned as-is with ``cached=True`` and no
+    container is started. Code that doesn't parse is answered from a
+    host-side syntax pre-check without a container either. With
+    *failed_only*, only the tests that failed in *previous* are re-run and
+    merged into it (see ``_rerun_failed``).
+    """
+    student_email, templates_dir, student_dir = _student_paths(
+        classroom_id, template_name, student_email
+    )
 
     if not os.path.isdir(templates_dir):
         logger.warning(f"Template dir not found: {templates_dir}")
-        return 0, 0
+        return GradingOutcome(output="Template directory not found.")
 
     if not os.path.isdir(student_dir):
         logger.info(f"Creating student dir from template: {student_dir}")
         try:
             shutil.copytree(templates_dir, student_dir)
-            _apply_shared_perms(student_dir)
+            normalize_tree(student_dir)
         except Exception as e:
             logger.error(f"Failed to create student dir: {e}")
-            return 0, 0
+            return GradingOutcome(output=f"Failed to create student directory: {e}")
 
     test_files = _find_test_files(templates_dir)
     if not test_files:
         logger.info(f"No test files found in {templates_dir}")
-        return 0, 0
-
-    test_file_map = {}
-    for tf in test_files:
-        test_file_map[tf] = os.path.join(templates_dir, tf)
+        return GradingOutcome(output="No test files found.")
 
+    test_file_map = {tf: os.path.join(templates_dir, tf) for tf in test_files}
     py_tests = [f for f in test_files if f.endswith(".py")]
-    passed, total = 0, 0
-
-    if py_tests:
-        script_passed, script_total = 0, 0
-        for tf in py_tests:
-            rc, stdout, stderr = run_in_ephemeral_container(
-                student_dir=student_dir,
-                test_files=test_file_map,
-                command=["python3", f"/tmp/tests/{tf}"],
-                timeout=30,
-            )
-            output = stdout + stderr
-            logger.info(
-                f"script output for {student_email}/{template_name}/{tf} "
-                f"(exit={rc}): {output[:500]}"
-            )
-            if rc == -1:
-                logger.warning(
-                    f"Script timeout for {student_email} on {template_name}/{tf}"
-                )
-            else:
-                # See note in run_tests_for_student_with_output: parse stdout
-                # alone so a stderr traceback doesn't shadow the score.
-                p, t = _parse_script_output(stdout)
-                script_passed += p
-                script_total += t
-
-        if script_total > 0:
-            passed, total = script_passed, script_total
+    if not py_tests:
+        return GradingOutcome()
+
+    fp = fingerprint(student_dir, test_file_map)
+    if previous is not None and previous.fingerprint == fp:
+        logger.info(f"Reusing result for {student_email}/{template_name} (unchanged)")
+        return GradingOutcome(
+            passed=previous.passed,
+            total=previous.total,
+            output=previous.output,
+            fingerprint=fp,
+            cached=True,
+            tests=previous.tests,
+            file_scores=previous.file_scores,
+            tests_fingerprint=previous.tests_fingerprint,
+        )
+
+    tests_fp = suite_fingerprint(test_file_map)
+
+    syntax_error = syntax_precheck(
+        student_dir, [test_file_map[tf] for tf in py_tests], test_files,
+    )
+    if syntax_error is not None:
+        logger.info(f"Syntax pre-check rejected {student_email}/{template_name}")
+        total = len(py_tests)
+        if previous is not None and previous.tests_fingerprint == tests_fp and previous.total:
+            total = previous.total
+        return GradingOutcome(
+            total=total,
+            output=(
+                "[Syntax check] Your code could not be parsed, so no tests were run.\n\n"
+                + syntax_error
+            ),
+            fingerprint=fp,
+            tests_fingerprint=tests_fp,
+        )
+
+    if (
+        failed_only
+        and previous is not None
+        and previous.file_scores
+        and previous.tests_fingerprint == tests_fp
+    ):
+        return _rerun_failed(
+            student_email, template_name, student_dir, test_file_map, py_tests, previous,
+        )
+
+    steps = [
+        {
+            "name": tf,
+            "command": ["python3", f"/tmp/tests/{tf}"],
+            "timeout": _SCRIPT_TIMEOUT,
+        }
+        for tf in py_tests
+    ]
+    step_results = run_grading_suite(
+        student_dir=student_dir,
+        test_files=test_file_map,
+        steps=steps,
+        fallback=_fallback_step(),
+        score_parser=SCORE_PARSER_SOURCE,
+    )
+
+    outcome = GradingOutcome(tests_fingerprint=tests_fp)
+    script_passed, script_total = 0, 0
+    fallback_result = None
+    for res in step_results:
+        if res.get("fallback"):
+            fallback_result = res
+            continue
+        p, t = _record_script_step(outcome, student_email, template_name, res)
+        script_passed += p
+        script_total += t
+
+    if not any(res["timed_out"] for res in step_results):
+        outcome.fingerprint = fp
+
+    if script_total > 0:
+        outcome.passed, outcome.total = script_passed, script_total
+    elif fallback_result is not None:
+        # The scripts reported nothing; their check lines don't count either.
+        outcome.tests = []
+        outcome.file_scores = {}
+        outcome.passed, outcome.total = _record_fallback_step(
+            outcome, student_email, template_name, fallback_result, len(py_tests),
+        )
+
+    return outcome
+
+
+def _record_script_step(
+    outcome: GradingOutcome, student_email: str, template_name: str, res: dict,
+) -> tuple[int, int]:
+    """Append one test script's output and per-test rows to *outcome* and
+    return its (passed, total)."""
+    output = res["stdout"] + res["stderr"]
+    outcome.output += output
+    logger.info(
+        f"script output for {student_email}/{template_name}/{res['name']} "
+        f"(exit={res['returncode']}): {output[:500]}"
+    )
+    if res["timed_out"]:
+        logger.warning(
+            f"Script timeout for {student_email} on {template_name}/{res['name']}"
+        )
+        outcome.output += (
+            f"\n[Timeout] {res['name']} exceeded {_SCRIPT_TIMEOUT}s limit\n"
+        )
+        return 0, 0
+    # Structured N/M score is emitted to stdout by the test script's
+    # atexit handler. Stderr (e.g. tracebacks) would come last in
+    # `output` and break the "last non-empty line" heuristic, so
+    # parse stdout in isolation.
+    p, t = _parse_script_output(res["stdout"])
+    rows, granular = _step_tests(res["name"], res)
+    outcome.tests.extend(rows)
+    outcome.file_scores[res["name"]] = {"passed": p, "total": t, "granular": granular}
+    return p, t
+
+
+def _record_fallback_step(
+    outcome: GradingOutcome,
+    student_email: str,
+    template_name: str,
+    res: dict,
+    n_scripts: int,
+) -> tuple[int, int]:
+    output = res["stdout"] + res["stderr"]
+    outcome.output += output
+    logger.info(
+        f"pytest output for {student_email}/{template_name} "
+        f"(exit={res['returncode']}): {output[:500]}"
+    )
+    if res["timed_out"]:
+        logger.warning(f"Test timeout for {student_email} on {template_name}")
+        outcome.output += (
+            f"\n[Timeout] pytest exceeded {_SCRIPT_TIMEOUT}s limit\n"
+        )
+        return 0, n_scripts
+    p, t = _parse_pytest_output(output)
+    if t == 0:
+        p, t = _parse_unittest_output(output)
+    rows, granular = _step_tests(_FALLBACK_NAME, res)
+    outcome.tests.extend(rows)
+    outcome.file_scores[_FALLBACK_NAME] = {"passed": p, "total": t, "granular": granular}
+    return p, t
+
+
+def _rerun_failed(
+    student_email: str,
+    template_name: str,
+    student_dir: str,
+    test_file_map: dict[str, str],
+    py_tests: list[str],
+    previous: GradingOutcome,
+) -> GradingOutcome:
+    """Re-run only what failed in *previous* and merge the results into it.
+
+    Files whose tests all passed are not run again. Files with per-test ids
+    from the reporter re-run just their failing ids and have their score
+    adjusted by how many of those now pass; other files (check-line scripts,
+    or ones that never produced rows) are re-run whole. The merged result
+    is never memoized, since tests that passed before were not re-checked
+    against the current code.
+    """
+    by_file: dict[str, list[dict]] = {}
+    for row in previous.tests:
+        by_file.setdefault(row["file"], []).append(row)
+
+    steps: list[dict] = []
+    only: dict[str, list[str]] = {}
+    files = [_FALLBACK_NAME] if _FALLBACK_NAME in previous.file_scores else py_tests
+    for name in files:
+        score = previous.file_scores.get(name)
+        failing = [r["test_id"] for r in by_file.get(name, []) if r["outcome"] in _FAILING]
+        if score and not failing and score["passed"] >= score["total"]:
+            continue
+        if score and failing and score.get("granular"):
+            only[name] = failing
+        if name == _FALLBACK_NAME:
+            steps.append(_fallback_step(only.get(name)))
         else:
-            rc, stdout, stderr = run_in_ephemeral_container(
-                student_dir=student_dir,
-                test_files=test_file_map,
-                command=["python3", "-m", "pytest", "--tb=no", "-q", "/app"],
-                timeout=30,
-            )
-            output = stdout + stderr
-            logger.info(
-                f"pytest output for {student_email}/{template_name} "
-                f"(exit={rc}): {output[:500]}"
-            )
-            if rc == -1:
-                logger.warning(
-                    f"Test timeout for {student_email} on {template_name}"
-                )
-                return 0, len(py_tests)
+            step = {
+                "name": name,
+                "command": ["python3", f"/tmp/tests/{name}"],
+                "timeout": _SCRIPT_TIMEOUT,
+            }
+            if name in only:
+                step["only"] = only[name]
+            steps.append(step)
+
+    outcome = GradingOutcome(
+        output="[Re-ran failed tests only]\n",
+        tests_fingerprint=previous.tests_fingerprint,
+    )
+    if not steps:
+        outcome.passed, outcome.total = previous.passed, previous.total
+        outcome.tests = list(previous.tests)
+        outcome.file_scores = dict(previous.file_scores)
+        outcome.output += "Nothing to re-run: every test passed last time.\n"
+        return outcome
+
+    results = {
+        res["name"]: res
+        for res in run_grading_suite(
+            student_dir=student_dir, test_files=test_file_map, steps=steps,
+        )
+    }
+
+    for name in files:
+        res = results.get(name)
+        prev_rows = by_file.get(name, [])
+        prev_score = previous.file_scores.get(name, {"passed": 0, "total": 0, "granular": False})
+        if res is None:
+            outcome.tests.extend(prev_rows)
+            outcome.file_scores[name] = dict(prev_score)
+            continue
+        if name not in only:
+            # Whole-file re-run: its new rows and score replace the old.
+            if name == _FALLBACK_NAME:
+                _record_fallback_step(outcome, student_email, template_name, res, len(py_tests))
             else:
-                passed, total = _parse_pytest_output(output)
-                if total == 0:
-                    passed, total = _parse_unittest_output(output)
+                _record_script_step(outcome, student_email, template_name, res)
+            continue
 
-    return passed, total
+        outcome.output += res["stdout"] + res["stderr"]
+        if res["timed_out"]:
+            outcome.output += f"\n[Timeout] {name} exceeded {_SCRIPT_TIMEOUT}s limit\n"
+        rerun_ids = set(only[name])
+        fresh = {r["test_id"]: r for r in _step_tests(name, res)[0] if r["test_id"] in rerun_ids}
+        now_passing = 0
+        for row in prev_rows:
+            new = fresh.get(row["test_id"])
+            if new is not None:
+                now_passing += new["outcome"] == "passed"
+                outcome.tests.append(new)
+            else:
+                outcome.tests.append(row)
+        outcome.file_scores[name] = {
+            "passed": min(prev_score["passed"] + now_passing, prev_score["total"]),
+            "total": prev_score["total"],
+            "granular": True,
+        }
+
+    outcome.passed = sum(sc["passed"] for sc in outcome.file_scores.values())
+    outcome.total = sum(sc["total"] for sc in outcome.file_scores.values())
+    return outcome
+
+
+def run_tests_for_student_with_output(
+    classroom_id: str,
+    template_name: str,
+    student_email: str,
+    previous: GradingOutcome | None = None,
+) -> tuple[int, int, str]:
+    """Like run_tests_for_student but also returns the raw test output."""
+    outcome = grade_student(classroom_id, template_name, student_email, previous)
+    return outcome.passed, outcome.total, outcome.output
+
+
+def run_tests_for_student(
+    classroom_id: str,
+    template_name: str,
+    student_email: str,
+    previous: GradingOutcome | None = None,
+) -> tuple[int, int]:
+    """Run teacher's tests against a student's code in an ephemeral container.
+
+    Student workspace is mounted read-only so malicious student code cannot
+    modify files. Test files are injected into /tmp inside the container.
+    Returns (tests_passed, tests_total); a *previous* result with a matching
+    fingerprint is returned without re-running. See ``grade_student``.
+    """
+    outcome = grade_student(classroom_id, template_name, student_email, previous)
+    return outcome.passed, outcome.total
@@ -0,0 +1,200 @@
+"""Tests for the trigram search index behind /api/files/search."""
+
+import os
+import sys
+from collections import OrderedDict
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.api import search_index  # noqa: E402
+from backend.api.search_index import SearchIndex, trigrams  # noqa: E402
+
+
+@pytest.fixture
+def docs(tmp_path):
+    root = tmp_path / "ws"
+    root.mkdir()
+    (root / "main.py").write_text("import os\n\ndef Greet(name):\n    return 'hello ' + name\n")
+    (root / "notes.md").write_text("Remember to greet everyone.\n")
+    (root / "blob.bin").write_bytes(b"greet\0\0\0")
+    return root
+
+
+def _lister(root):
+    return lambda: {
+        os.path.relpath(os.path.join(d, f), root): os.path.join(d, f)
+        for d, _dirs, names in os.walk(root) for f in names
+    }
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    paths = []
+    real = search_index._read_text
+
+    def counting(host):
+        paths.append(os.path.basename(host))
+        return real(host)
+
+    monkeypatch.setattr(search_index, "_read_text", counting)
+    return paths
+
+
+class TestSearchIndex:
+    def test_trigrams(self):
+        assert trigrams("AbcD") == {"abc", "bcd"}
+        assert trigrams("ab") == set()
+
+    def test_case_insensitive_line_matches(self, docs):
+        index = SearchIndex("u1", _lister(docs))
+        body = index.search("greet", limit=10)
+        assert [(r["path"], r["line"], r["column"]) for r in body["results"]] == [
+            ("main.py", 3, 5), ("notes.md", 1, 13),
+        ]
+        assert body["results"][0]["text"] == "def Greet(name):"
+        assert body["files"] == 2 and not body["truncated"]
+        assert index.search("nowhere to be found", limit=10)["results"] == []
+
+    def test_only_candidates_are_read(self, docs, reads):
+        index = SearchIndex("u1", _lister(docs))
+        index.refresh()
+        reads.clear()
+        index.search("remember", limit=10)
+        assert reads == ["notes.md"]
+
+    def test_dirty_file_is_reindexed_alone(self, docs, reads):
+        index = SearchIndex("u1", _lister(docs))
+        index.refresh()
+        (docs / "notes.md").write_text("Nothing about that any more, just waves.\n")
+        reads.clear()
+        index.mark_dirty([str(docs / "notes.md")])
+        assert index.refresh()
+        assert reads == ["notes.md"]
+        assert index.search("waves", limit=10)["files"] == 1
+        assert index.search("greet", limit=10)["files"] == 1
+
+    def test_new_and_deleted_files(self, docs):
+        index = SearchIndex("u1", _lister(docs))
+        index.refresh()
+        (docs / "pkg").mkdir()
+        (docs / "pkg" / "util.py").write_text("def greet_all(): pass\n")
+        os.remove(docs / "notes.md")
+        index.mark_dirty([str(docs / "pkg" / "util.py"), str(docs / "notes.md")])
+        assert [r["path"] for r in index.search("greet", limit=10)["results"]] == [
+            "main.py", os.path.join("pkg", "util.py"),
+        ]
+
+    def test_hidden_paths_do_not_trigger_a_sweep(self, docs):
+        index = SearchIndex("u1", _lister(docs), is_hidden=lambda n: n.startswith("."))
+        index.refresh()
+        index.mark_dirty([str(docs / ".venv" / "lib" / "x.py")])
+        assert not index._dirty
+
+    def test_saved_index_is_reused_after_restart(self, docs, tmp_path, reads):
+        path = str(tmp_path / "idx" / "u1.json.gz")
+        first = SearchIndex("u1", _lister(docs), path)
+        first.refresh()
+        first.save()
+
+        (docs / "main.py").write_text("def wave(): pass\n")
+        reads.clear()
+        second = SearchIndex("u1", _lister(docs), path)
+        assert second.load()
+        # The reload sweep re-reads only the file changed while "down".
+        assert second.refresh()
+        assert reads == ["main.py"]
+        assert second.search("wave", limit=10)["files"] == 1
+
+    def test_limit_truncates(self, docs):
+        (docs / "many.txt").write_text("greet\n" * 50)
+        body = SearchIndex("u1", _lister(docs)).search("greet", limit=5)
+        assert len(body["results"]) == 5 and body["truncated"]
+
+    def test_dead_postings_are_compacted(self, docs):
+        index = SearchIndex("u1", _lister(docs))
+        index.refresh()
+        # The 257th dead posting set crosses the threshold.
+        for i in range(257):
+            (docs / "notes.md").write_text(f"version {i}\n")
+            os.utime(docs / "notes.md", ns=(i, i))
+            index.mark_dirty([str(docs / "notes.md")])
+            index.refresh()
+        assert index._dead == 0
+        assert all(ids <= index._docs.keys() for ids in index._postings.values())
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from sqlalchemy.pool import StaticPool
+    from sqlmodel import Session, SQLModel, create_engine
+
+    from backend.api.database import User
+    from backend.api.dependencies import get_db, get_onboarded_user
+    from backend.api.file_index import FileTreeIndex
+    from backend.api.routers import files
+
+    uploads = tmp_path / "uploads"
+    classrooms = tmp_path / "classrooms"
+    monkeypatch.setattr(files, "UPLOADS_ROOT", str(uploads))
+    monkeypatch.setattr(files, "CLASSROOMS_ROOT", str(classrooms))
+    monkeypatch.setattr(files, "get_file_index", lambda index=FileTreeIndex(): index)
+    # The process-wide registry, since that is what the listener feeds.
+    indexes = search_index.get_search_indexes()
+    monkeypatch.setattr(indexes, "root", str(tmp_path / "search-index"))
+    monkeypatch.setattr(indexes, "_indexes", OrderedDict())
+
+    ws = uploads / "u1"
+    ws.mkdir(parents=True)
+    (ws / "app.py").write_text("TOKEN = 'needle'\n")
+    (ws / ".secret").write_text("needle\n")
+    (ws / "__pycache__").mkdir()
+    (ws / "__pycache__" / "app.txt").write_text("needle\n")
+    mine = classrooms / "c1" / "participants" / "s@test.com" / "hw1"
+    mine.mkdir(parents=True)
+    (mine / "solution.py").write_text("# needle here\n")
+    theirs = classrooms / "c1" / "participants" / "other@test.com" / "hw1"
+    theirs.mkdir(parents=True)
+    (theirs / "solution.py").write_text("# needle there\n")
+    os.symlink("../../classrooms/c1/participants/s@test.com", ws / "intro")
+
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+    )
+    SQLModel.metadata.create_all(engine)
+    user = User(id="u1", email="s@test.com", role="student", port_start=10000, port_end=10009)
+
+    def db():
+        with Session(engine) as session:
+            yield session
+
+    app = FastAPI()
+    app.include_router(files.router, prefix="/api/files")
+    app.dependency_overrides[get_onboarded_user] = lambda: user
+    app.dependency_overrides[get_db] = db
+    return TestClient(app), ws, indexes
+
+
+class TestSearchRoute:
+    def test_follows_explorer_visibility_and_scope(self, client):
+        c, _ws, _indexes = client
+        r = c.get("/api/files/search", params={"q": "NEEDLE"})
+        assert r.status_code == 200, r.text
+        assert [x["path"] for x in r.json()["results"]] == ["app.py", "intro/hw1/solution.py"]
+
+    def test_api_writes_update_the_index(self, client):
+        c, ws, indexes = client
+        assert c.get("/api/files/search", params={"q": "haystack"}).json()["results"] == []
+        r = c.put("/api/files/file/app.py", content="haystack = 1\n")
+        assert r.status_code == 200, r.text
+        assert indexes.get("u1", dict)._dirty == {str(ws / "app.py")}
+        body = c.get("/api/files/search", params={"q": "haystack"}).json()
+        assert [x["path"] for x in body["results"]] == ["app.py"]
+
+    def test_short_queries_are_rejected(self, client):
+        c, _ws, _indexes = client
+        assert c.get("/api/files/search", params={"q": "ab"}).status_code == 400
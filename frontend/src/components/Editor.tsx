@@ -67,6 +67,8 @@ const runCommandMap: Partial<Record<keyof typeof languageMap, (location: string)
   javascript: (loc) => `node "/app${loc}"\n`,
 };
 
+// Mirrored by EDITOR_MAX_LINES / EDITOR_MAX_CHARS in routers/files.py, which
+// sends a head/tail preview for anything over them.
 const MAX_EDITOR_LINES = 10_000;
 // Upper bound on total characters too, so a single massive-line file
 // (minified bundles, generated blobs) can't sneak past the line check.
@@ -99,6 +101,7 @@ export default function Editor() {
   const [isImage, setIsImage] = useState<boolean>(false);
   const [isBinary, setIsBinary] = useState<boolean>(false);
   const [isTooLarge, setIsTooLarge] = useState<boolean>(false);
+  const [largePreview, setLargePreview] = useState<string | null>(null);
   const [saveStatus, setSaveStatus] = useState<'idle' | 'saving' | 'saved' | 'error'>('idle');
   const [loadError, setLoadError] = useState<string | null>(null);
   const [isClient, setIsClient] = useState(false);
@@ -112,23 +115,58 @@ export default function Editor() {
   const autosaveTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
   const currentFileLocationRef = useRef<string | undefined>(undefined);
   const lastSavedValueRef = useRef<string>('');
+  // Server-side version (X-File-Version) of lastSavedValueRef, for PATCH.
+  const lastSavedVersionRef = useRef<{ location: string; version: string } | null>(null);
   const broadcastChannelRef = useRef<BroadcastChannel | null>(null);
 
   useEffect(() => { setIsClient(true); }, []);
 
+  // Sends only the changed span of the file when the server still has the
+  // version we last saw; falls back to a full-body PUT otherwise.
+  const patchFile = async (location: string, content: string): Promise<Response | null> => {
+    const saved = lastSavedVersionRef.current;
+    if (!saved || saved.location !== location) return null;
+    const base = lastSavedValueRef.current;
+    let start = 0;
+    const max = Math.min(base.length, content.length);
+    while (start < max && base[start] === content[start]) start++;
+    let end = 0;
+    while (
+      end < max - start &&
+      base[base.length - 1 - end] === content[content.length - 1 - end]
+    ) end++;
+    const edit = {
+      offset: start,
+      delete: base.length - end - start,
+      text: content.slice(start, content.length - end),
+    };
+    // Not worth it when most of the file changed anyway.
+    if (edit.text.length > content.length / 2) return null;
+    const response = await fetch(`${apiUrl}/files/file${location}`, {
+      method: 'PATCH',
+      body: JSON.stringify({ base: saved.version, edits: [edit] }),
+      headers: { 'Content-Type': 'application/json' },
+      credentials: 'include',
+    });
+    return response.ok ? response : null;
+  };
+
   const saveFile = useCallback(async (location: string, content: string) => {
     setSaveStatus('saving');
     try {
-      const response = await fetch(`${apiUrl}/files/file${location}`, {
-        method: 'PUT',
-        body: content,
-        headers: { 'Content-Type': 'text/plain; charset=utf-8' },
-        credentials: 'include',
-      });
+      const response = (await patchFile(location, content).catch(() => null)) ??
+        await fetch(`${apiUrl}/files/file${location}`, {
+          method: 'PUT',
+          body: content,
+          headers: { 'Content-Type': 'text/plain; charset=utf-8' },
+          credentials: 'include',
+        });
       if (!response.ok) {
         setSaveStatus('error');
       } else {
         lastSavedValueRef.current = content;
+        const version = response.headers.get('X-File-Version');
+        lastSavedVersionRef.current = version ? { location, version } : null;
         // Stay on "Saved" until the next edit flips it back to "Saving…".
         setSaveStatus('saved');
         broadcastChannelRef.current?.postMessage({ type: 'file-saved', location });
@@ -136,6 +174,7 @@ export default function Editor() {
     } catch {
       setSaveStatus('error');
     }
+  // eslint-disable-next-line react-hooks/exhaustive-deps
   }, []);
 
   const onChange = useCallback((val: string | undefined) => {
@@ -328,6 +367,7 @@ export default function Editor() {
       setLoadError(null);
       setIsBinary(false);
       setIsTooLarge(false);
+      setLargePreview(null);
 
       const isImageFileType = isImageFile(currentFile.name);
       setIsImage(isImageFileType);
@@ -339,7 +379,9 @@ export default function Editor() {
         return;
       }
 
-      const fileres = await fetch(`${apiUrl}/files/file${currentFile.location}?t=${contentVersion ?? 0}`, {
+      // preview=1: files too big for the editor come back as a head/tail
+      // excerpt (flagged by X-File-Preview) instead of the full contents.
+      const fileres = await fetch(`${apiUrl}/files/file${currentFile.location}?t=${contentVersion ?? 0}&preview=1`, {
         credentials: 'include',
         signal: controller.signal,
       });
@@ -354,6 +396,13 @@ export default function Editor() {
       const file = await fileres.text();
       if (currentLocation !== userData.currentFile?.location) return;
 
+      if (fileres.headers.get('X-File-Preview')) {
+        setIsTooLarge(true);
+        setLargePreview(file);
+        setValue('');
+        return;
+      }
+
       // Detect binary content by null bytes
       if (file.includes('\0')) {
         setIsBinary(true);
@@ -375,6 +424,8 @@ export default function Editor() {
 
       setLoadError(null);
       lastSavedValueRef.current = file;
+      const version = fileres.headers.get('X-File-Version');
+      lastSavedVersionRef.current = version && currentLocation ? { location: currentLocation, version } : null;
       setValue(file);
       setSaveStatus('idle');
 
@@ -682,6 +733,11 @@ export default function Editor() {
             >
               Download
             </a>
+            {largePreview && (
+              <pre className="mt-4 max-h-64 overflow-auto text-left whitespace-pre text-ink-default text-xs leading-relaxed font-mono bg-ide-bg border border-ide-rule rounded-md p-3">
+                {largePreview}
+              </pre>
+            )}
           </div>
         </div>
       ) : loadError ? (
@@ -264,8 +264,8 @@ export function TerminalSession({ tabId, isActive }: TerminalSessionProps) {
       }
     });
 
-    socket.on('files-changed', () => {
-      window.dispatchEvent(new CustomEvent('csroom:files-changed'));
+    socket.on('files-changed', (data) => {
+      window.dispatchEvent(new CustomEvent('csroom:files-changed', { detail: data }));
     });
 
     socket.on('terminal-restart-required', () => {
@@ -20,11 +20,21 @@ interface StudentResult {
   total: number;
 }
 
+// Overall grade under the classroom's grading mode, computed by the server.
+// percent is null until something counts toward it; earned/possible are
+// points in manual mode and passed/total tests otherwise.
+interface StudentGrade {
+  percent: number | null;
+  earned: number;
+  possible: number;
+}
+
 interface Student {
   id: string;
   email: string;
   name: string;
   results: Record<string, StudentResult>;
+  grade: StudentGrade;
 }
 
 interface ProgressData {
@@ -47,6 +57,7 @@ interface ClassroomInfo {
   access_code: string;
   joins_paused: boolean;
   grading_mode: GradingMode;
+  auto_grade?: boolean;
   participants: string[];
 }
 
@@ -192,20 +203,68 @@ export default function ClassroomDetailPage({
     }
   }, [classroom, demoMode, isInstructor, fetchProgress, fetchMyProgress, fetchWeights]);
 
+  // A batch run grades in the background. While one is in flight, poll its
+  // progress and refresh the gradebook whenever more results have been
+  // stored, so they show up as they land instead of after the whole batch.
+  // Also picks up a run started before a reload.
+  useEffect(() => {
+    if (!isInstructor || demoMode || !classroom) return;
+    let cancelled = false;
+    let timer: number | undefined;
+    let lastCompleted = -1;
+    const poll = async () => {
+      let runs: { completed: number }[] = [];
+      try {
+        const res = await fetch(`${apiBase}/grading-runs`, { credentials: 'include' });
+        if (res.ok) runs = (await res.json()).runs ?? [];
+      } catch {
+        // Network blip: keep polling while we think a run is active.
+        if (!cancelled && runningTests) timer = window.setTimeout(poll, 2000);
+        return;
+      }
+      if (cancelled) return;
+      const completed = runs.reduce((n, r) => n + r.completed, 0);
+      if (runs.length === 0) {
+        if (runningTests) {
+          setRunningTests(false);
+          fetchProgress();
+        }
+        return;
+      }
+      if (!runningTests) setRunningTests(true);
+      if (completed !== lastCompleted) {
+        lastCompleted = completed;
+        fetchProgress();
+      }
+      timer = window.setTimeout(poll, 1000);
+    };
+    poll();
+    return () => {
+      cancelled = true;
+      window.clearTimeout(timer);
+    };
+  }, [apiBase, classroom, isInstructor, demoMode, runningTests, fetchProgress]);
+
+  // Auto-graded results arrive without a run to poll; /progress answers an
+  // unchanged gradebook with a bodiless 304, so a slow poll is cheap.
+  useEffect(() => {
+    if (!isInstructor || demoMode || !classroom?.auto_grade) return;
+    const timer = window.setInterval(() => {
+      if (document.visibilityState === 'visible') fetchProgress();
+    }, 15000);
+    return () => window.clearInterval(timer);
+  }, [classroom?.auto_grade, isInstructor, demoMode, fetchProgress]);
+
   const runTests = async (templateName?: string) => {
     if (readOnly) return;
-    setRunningTests(true);
-    try {
-      await fetch(`${apiBase}/run-tests`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        credentials: 'include',
-        body: JSON.stringify({ template_name: templateName ?? null }),
-      });
-      await fetchProgress();
-    } finally {
-      setRunningTests(false);
-    }
+    const res = await fetch(`${apiBase}/run-tests`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      credentials: 'include',
+      body: JSON.stringify({ template_name: templateName ?? null }),
+    });
+    // Flipping runningTests on starts the progress poll above.
+    if (res.ok) setRunningTests(true);
   };
 
   const toggleJoins = async () => {
@@ -221,6 +280,19 @@ export default function ClassroomDetailPage({
     }
   };
 
+  const toggleAutoGrade = async () => {
+    if (readOnly || !classroom) return;
+    const res = await fetch(`${apiBase}`, {
+      method: 'PATCH',
+      headers: { 'Content-Type': 'application/json' },
+      credentials: 'include',
+      body: JSON.stringify({ auto_grade: !classroom.auto_grade }),
+    });
+    if (res.ok) {
+      setClassroom({ ...classroom, auto_grade: !classroom.auto_grade });
+    }
+  };
+
   const regenerateCode = async () => {
     if (readOnly) return;
     const res = await fetch(`${apiBase}/access-code`, {
@@ -273,6 +345,7 @@ export default function ClassroomDetailPage({
       if (res.ok) {
         const saved: WeightsData = await res.json();
         setWeights(saved);
+        fetchProgress();
       }
     } catch { /* ignore */ }
   };
@@ -468,6 +541,7 @@ export default function ClassroomDetailPage({
               progress={progress}
               weights={weights}
               onSaveWeights={saveWeights}
+              onGradesChanged={fetchProgress}
               onRunTests={runTests}
               runningTests={runningTests}
             />
@@ -493,6 +567,9 @@ export default function ClassroomDetailPage({
           onTogglePause={async () => {
             await toggleJoins();
           }}
+          onToggleAutoGrade={async () => {
+            await toggleAutoGrade();
+          }}
           onRegenerate={async () => {
             await regenerateCode();
           }}
@@ -516,16 +593,19 @@ function SettingsDialog({
   classroom,
   onClose,
   onTogglePause,
+  onToggleAutoGrade,
   onRegenerate,
   onRename,
 }: {
   classroom: ClassroomInfo;
   onClose: () => void;
   onTogglePause: () => Promise<void>;
+  onToggleAutoGrade: () => Promise<void>;
   onRegenerate: () => Promise<void>;
   onRename: () => void;
 }) {
   const [paused, setPaused] = useState(classroom.joins_paused);
+  const [autoGrade, setAutoGrade] = useState(!!classroom.auto_grade);
   const [working, setWorking] = useState(false);
 
   const handleTogglePause = async () => {
@@ -538,6 +618,16 @@ function SettingsDialog({
     }
   };
 
+  const handleToggleAutoGrade = async () => {
+    setWorking(true);
+    try {
+      setAutoGrade((a) => !a);
+      await onToggleAutoGrade();
+    } finally {
+      setWorking(false);
+    }
+  };
+
   const handleRegenerate = async () => {
     if (!window.confirm('Regenerate the join code? Existing students stay in the classroom, but the old code stops working.')) return;
     setWorking(true);
@@ -572,6 +662,22 @@ function SettingsDialog({
           </label>
         </div>
 
+        <div className="flex items-center justify-between gap-4 py-3 border-b border-rule-soft">
+          <div className="flex-1 min-w-0">
+            <p className="body text-ink-strong font-semibold">Auto-grade</p>
+            <p className="body-sm">Re-run tests in the background shortly after a student saves.</p>
+          </div>
+          <label className="inline-flex items-center cursor-pointer">
+            <input
+              type="checkbox"
+              className="accent-navy w-4 h-4 cursor-pointer"
+              checked={autoGrade}
+              onChange={handleToggleAutoGrade}
+              disabled={working}
+            />
+          </label>
+        </div>
+
         <div className="flex items-center justify-between gap-4 py-3 border-b border-rule-soft">
           <div className="flex-1 min-w-0">
             <p className="body text-ink-strong font-semibold">Regenerate join code</p>
@@ -1215,6 +1321,7 @@ function GradebookTab({
   progress,
   weights,
   onSaveWeights,
+  onGradesChanged,
   onRunTests,
   runningTests,
 }: {
@@ -1223,6 +1330,7 @@ function GradebookTab({
   progress: ProgressData | null;
   weights: WeightsData | null;
   onSaveWeights: (w: WeightsData) => void;
+  onGradesChanged: () => void;
   onRunTests: (t?: string) => void;
   runningTests: boolean;
 }) {
@@ -1294,40 +1402,13 @@ function GradebookTab({
       ...prev,
       [userId]: { ...prev[userId], [template]: score },
     }));
-    await fetch(`${apiBase}/manual-score`, {
+    const res = await fetch(`${apiBase}/manual-score`, {
       method: 'PUT',
       headers: { 'Content-Type': 'application/json' },
       credentials: 'include',
       body: JSON.stringify({ user_id: userId, template_name: template, score }),
     });
-  };
-
-  const getWeightedAverage = (student: Student): string => {
-    if (localMode === 'manual') {
-      let totalPoints = 0;
-      let earnedPoints = 0;
-      for (const t of templates) {
-        const total = localWeights[t] ?? 0;
-        if (total === 0) continue;
-        const score = manualScores[student.id]?.[t] ?? 0;
-        totalPoints += total;
-        earnedPoints += score;
-      }
-      if (totalPoints === 0) return '—';
-      return `${Math.round((earnedPoints / totalPoints) * 100)}%`;
-    }
-
-    let totalWeight = 0;
-    let weightedSum = 0;
-    for (const t of templates) {
-      const w = localMode === 'equal' ? 1 : (localWeights[t] ?? 0);
-      const result = student.results[t];
-      if (!result || result.total === 0) continue;
-      totalWeight += w;
-      weightedSum += w * (result.passed / result.total);
-    }
-    if (totalWeight === 0) return '—';
-    return `${Math.round((weightedSum / totalWeight) * 100)}%`;
+    if (res.ok) onGradesChanged();
   };
 
   return (
@@ -1539,31 +1620,23 @@ function GradebookTab({
                       </td>
                     );
                   })}
-                  {localMode === 'manual' && (() => {
-                    let earned = 0;
-                    let possible = 0;
-                    for (const t of templates) {
-                      const total = localWeights[t] ?? 0;
-                      const score = manualScores[student.id]?.[t] ?? 0;
-                      earned += score;
-                      possible += total;
-                    }
-                    return (
-                      <td className="pl-3! pr-3 py-2.5 text-center">
-                        <span
-                          className={cn(
-                            'font-mono text-sm tabular-nums',
-                            possible > 0 && earned >= possible ? 'text-forest font-semibold' : 'text-ink-default',
-                          )}
-                        >
-                          {earned}/{possible}
-                        </span>
-                      </td>
-                    );
-                  })()}
+                  {localMode === 'manual' && (
+                    <td className="pl-3! pr-3 py-2.5 text-center">
+                      <span
+                        className={cn(
+                          'font-mono text-sm tabular-nums',
+                          student.grade.possible > 0 && student.grade.earned >= student.grade.possible
+                            ? 'text-forest font-semibold'
+                            : 'text-ink-default',
+                        )}
+                      >
+                        {student.grade.earned}/{student.grade.possible}
+                      </span>
+                    </td>
+                  )}
                   <td className="pl-3! pr-3 py-2.5 text-center">
                     <span className="font-mono text-sm tabular-nums font-semibold text-ink-strong">
-                      {getWeightedAverage(student)}
+                      {student.grade.percent === null ? '—' : `${Math.round(student.grade.percent)}%`}
                     </span>
                   </td>
                 </tr>
@@ -1608,6 +1681,68 @@ function AssignmentsTab({
   const [renamingDraft, setRenamingDraft] = useState<string | null>(null);
   const [renameDraftValue, setRenameDraftValue] = useState<string>('');
   const folderInputRef = useRef<HTMLInputElement>(null);
+  // Student copies of a just-published assignment are made in the
+  // background; poll /publish-jobs while any are running. Bumping
+  // `pushPoll` (after a publish) starts polling again.
+  const [pushProgress, setPushProgress] = useState<
+    Record<string, { done: number; total: number; failed: number }>
+  >({});
+  const [pushPoll, setPushPoll] = useState(0);
+  // Jobs seen running, so finishing is reported once and a job that ended
+  // before this page loaded is not reported at all.
+  const pushJobsRef = useRef<Set<string>>(new Set());
+
+  useEffect(() => {
+    if (!isInstructor) return;
+    type PublishJob = {
+      job_id: string;
+      template_name: string;
+      done: number;
+      total: number;
+      failed: number;
+      finished: boolean;
+    };
+    let cancelled = false;
+    let timer: number | undefined;
+    const seen = pushJobsRef.current;
+    const poll = async () => {
+      let jobs: PublishJob[] = [];
+      try {
+        const res = await fetch(`${apiBase}/publish-jobs`, { credentials: 'include' });
+        if (!res.ok) return;
+        jobs = (await res.json()).jobs ?? [];
+      } catch {
+        // Network blip: try again while we think a job is running.
+        if (!cancelled && seen.size > 0) timer = window.setTimeout(poll, 2000);
+        return;
+      }
+      if (cancelled) return;
+      const running = jobs.filter((job) => !job.finished);
+      let ended = false;
+      for (const id of Array.from(seen)) {
+        const job = jobs.find((j) => j.job_id === id);
+        if (job && !job.finished) continue;
+        // Finished, or gone (a job that failed outright is dropped).
+        seen.delete(id);
+        ended = true;
+        if (job?.failed) {
+          alert(`"${job.template_name}" could not be copied to ${job.failed} student(s).`);
+        }
+      }
+      running.forEach((job) => seen.add(job.job_id));
+      setPushProgress(Object.fromEntries(running.map((job) => [
+        job.template_name, { done: job.done, total: job.total, failed: job.failed },
+      ])));
+      if (ended) onPublished();
+      if (running.length > 0) timer = window.setTimeout(poll, 1000);
+    };
+    poll();
+    return () => {
+      cancelled = true;
+      window.clearTimeout(timer);
+    };
+  // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [classroomId, apiBase, isInstructor, pushPoll]);
 
   const fetchDrafts = useCallback(async () => {
     if (!isInstructor) {
@@ -1729,6 +1864,11 @@ function AssignmentsTab({
         alert(message || 'Publish failed');
         return;
       }
+      const { job_id: jobId } = await res.json();
+      if (jobId) {
+        pushJobsRef.current.add(jobId);
+        setPushPoll((n) => n + 1);
+      }
       // Wait for all refreshes before clearing the spinner so the UI reflects
       // the new state atomically — otherwise the teacher may see the draft and
       // published assignment side-by-side while fetchProgress is still in flight.
@@ -1791,6 +1931,12 @@ function AssignmentsTab({
             <span className="eyebrow text-ochre">Drafts</span>
             <span className="caption">Edit and preview before publishing.</span>
           </div>
+          {Object.entries(pushProgress).map(([name, p]) => (
+            <div key={name} className="caption mb-2">
+              Copying “{name}” to students… {p.done}/{p.total}
+              {p.failed > 0 && ` (${p.failed} failed)`}
+            </div>
+          ))}
           {drafts.length === 0 ? (
             <div className="bg-paper-elevated border border-rule-soft rounded-lg shadow-sm p-6 text-center body-sm">
           No drafts. Upload a folder above to create one.
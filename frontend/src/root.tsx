@@ -3,7 +3,10 @@ import { Links, Meta, Outlet, Scripts, ScrollRestoration, useLoaderData } from '
 import NavComponent from './components/Nav';
 import { UserData, UserDataContext, apiUrl, clientLoader, StudentViewContext } from './util/UserData';
 import {
+  applyFileChanges,
   fetchFilesList,
+  getShowHidden,
+  isFileChanges,
   setLastOpenLocation,
   Files,
   FileType,
@@ -295,12 +298,24 @@ export function Layout({ children }: { children: ReactNode }) {
   useEffect(() => {
     if (!loaderData?.userInfo) return;
 
-    const handler = () => {
-      if (!isUserEditingName) refreshFiles();
+    const handler = (e: Event) => {
+      if (isUserEditingName) return;
+      // Watcher events list exactly what changed; patch the tree in place.
+      // The watcher only sees the default (non-hidden) view.
+      const detail = (e as CustomEvent).detail;
+      if (isFileChanges(detail) && !getShowHidden() && files) {
+        if (!detail.added.length && !detail.removed.length && !detail.overflow) return;
+        const next = applyFileChanges(files, detail, classroomSymlinks);
+        if (next) {
+          setFilesClientSide(next);
+          return;
+        }
+      }
+      refreshFiles();
     };
     window.addEventListener('csroom:files-changed', handler);
     return () => window.removeEventListener('csroom:files-changed', handler);
-  }, [loaderData?.userInfo, refreshFiles, isUserEditingName]);
+  }, [loaderData?.userInfo, refreshFiles, isUserEditingName, files, classroomSymlinks]);
 
   // Fallback poll to catch CLI changes inside the container (e.g. touch, rm)
   useEffect(() => {
@@ -127,6 +127,63 @@ export function pickInitialFile(
   return defaultPicker(files);
 }
 
+// Inserts one listing entry (directories end in '/') into the tree,
+// creating intermediate folders as needed.
+function insertPath(
+  files: Files,
+  path: string,
+  classroomSymlinks: FilesResponse['classroomSymlinks'],
+): void {
+  const parts = path.split('/');
+  let current = files;
+  for (let i = 0; i < parts.length; i++) {
+    const part = parts[i];
+    if (part === '') continue; // skip empty parts (e.g. leading slash)
+
+    // if the part already exists, we just continue
+    const existing = current.find((f) => f.name === part);
+    if (existing) {
+      if ('files' in existing) {
+        current = existing.files;
+      } else {
+        current = [];
+      }
+      continue;
+    }
+
+    // if it's the last part, we create a file
+    if (i === parts.length - 1) {
+      const location = `/${parts.slice(0, i + 1).join('/')}`;
+      const classroomMeta = classroomSymlinks[parts[0]];
+      current.push({
+        name: part,
+        location,
+        classroomId: classroomMeta?.id,
+      } as FileType);
+      continue;
+    }
+
+    // otherwise we create a folder
+    const existingFolder = current.find(
+      (f) => 'files' in f && f.name === part,
+    );
+    if (existingFolder && 'files' in existingFolder) {
+      current = existingFolder.files;
+      continue;
+    }
+    // create a new folder
+    const classroomMeta = classroomSymlinks[parts[0]];
+    const folder: FolderType = {
+      name: part,
+      location: `/${parts.slice(0, i + 1).join('/')}`,
+      files: [],
+      ...(classroomMeta?.id ? { classroomId: classroomMeta.id } : {}),
+    } as FolderType;
+    current.push(folder);
+    current = folder.files;
+  }
+}
+
 export async function fetchFilesList(): Promise<FilesResponse> {
   // Fetch the list of files
   const url = new URL(`${apiUrl}/files/list`, window.location.origin);
@@ -143,56 +200,8 @@ export async function fetchFilesList(): Promise<FilesResponse> {
 
   // Construct the files structure
   const files: Files = [];
-  for (let i = 0; i < filesData.files.length; i++) {
-    // split by the slashes and then put them into an object
-    const parts = filesData.files[i].split('/');
-    let current = files;
-    for (let i = 0; i < parts.length; i++) {
-      const part = parts[i];
-      if (part === '') continue; // skip empty parts (e.g. leading slash)
-
-      // if the part already exists, we just continue
-      const existing = current.find((f) => f.name === part);
-      if (existing) {
-        if ('files' in existing) {
-          current = existing.files;
-        } else {
-          current = [];
-        }
-        continue;
-      }
-
-      // if it's the last part, we create a file
-      if (i === parts.length - 1) {
-        const location = `/${parts.slice(0, i + 1).join('/')}`;
-        const classroomMeta = classroomSymlinks[parts[0]];
-        current.push({
-          name: part,
-          location,
-          classroomId: classroomMeta?.id,
-        } as FileType);
-        continue;
-      }
-
-      // otherwise we create a folder
-      const existingFolder = current.find(
-        (f) => 'files' in f && f.name === part,
-      );
-      if (existingFolder && 'files' in existingFolder) {
-        current = existingFolder.files;
-        continue;
-      }
-      // create a new folder
-      const classroomMeta = classroomSymlinks[parts[0]];
-      const folder: FolderType = {
-        name: part,
-        location: `/${parts.slice(0, i + 1).join('/')}`,
-        files: [],
-        ...(classroomMeta?.id ? { classroomId: classroomMeta.id } : {}),
-      } as FolderType;
-      current.push(folder);
-      current = folder.files;
-    }
+  for (const path of filesData.files) {
+    insertPath(files, path, classroomSymlinks);
   }
 
   // Ensure stable alphabetical ordering
@@ -201,6 +210,53 @@ export async function fetchFilesList(): Promise<FilesResponse> {
   return { files, classroomSymlinks };
 }
 
+// Payload of a watcher-originated `files-changed` event. API-originated
+// events carry no payload and mean "refetch".
+export type FileChanges = {
+  added: string[];
+  removed: string[];
+  modified: string[];
+  overflow: boolean;
+};
+
+export function isFileChanges(data: unknown): data is FileChanges {
+  return (
+    !!data && typeof data === 'object' &&
+    Array.isArray((data as FileChanges).added) &&
+    Array.isArray((data as FileChanges).removed)
+  );
+}
+
+// Returns a new tree with the watcher's added/removed paths applied, or
+// undefined when the caller should refetch the list instead.
+export function applyFileChanges(
+  files: Files,
+  changes: FileChanges,
+  classroomSymlinks: FilesResponse['classroomSymlinks'],
+): Files | undefined {
+  if (changes.overflow) return undefined;
+  const clone = (items: Files): Files => items.map((it) =>
+    'files' in it ? ({ ...it, files: clone(it.files) } as FolderType) : it,
+  );
+  const next = clone(files);
+  for (const path of changes.removed) {
+    const parts = path.split('/').filter(Boolean);
+    let current: Files | undefined = next;
+    for (let i = 0; current && i < parts.length - 1; i++) {
+      const folder = current.find((f) => 'files' in f && f.name === parts[i]);
+      current = folder && 'files' in folder ? folder.files : undefined;
+    }
+    if (!current) continue;
+    const idx = current.findIndex((f) => f.name === parts[parts.length - 1]);
+    if (idx >= 0) current.splice(idx, 1);
+  }
+  for (const path of changes.added) {
+    insertPath(next, path, classroomSymlinks);
+  }
+  sortFilesRecursive(next, true);
+  return next;
+}
+
 export interface StatusContextType {
   status: string | null;
   setStatus: (status: string | null) => void;
@@ -1,3 +1,86 @@
+// Files at least this big go through the resumable /files/uploads protocol,
+// so a dropped connection only re-sends the chunk that was in flight.
+const RESUMABLE_MIN_BYTES = 32 * 1024 * 1024;
+const RESUMABLE_RETRIES = 6;
+
+// Create an upload session, PUT the file in chunks (re-syncing the offset
+// with the server after any failure) and complete it. A name collision, at
+// create or (if something appeared there meanwhile) at complete, asks
+// `confirmReplace` and retries with overwrite; null means the user declined.
+// Otherwise returns the response of a rejected call or the final complete.
+async function uploadResumable(
+  file: File,
+  destination: string,
+  apiUrl: string,
+  overwrite: boolean,
+  confirmReplace: () => boolean,
+  onProgress: (sent: number) => void,
+): Promise<Response | null> {
+  const create = (replace: boolean) => fetch(`${apiUrl}/files/uploads`, {
+    method: 'POST',
+    credentials: 'include',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ filename: file.name, size: file.size, destination, overwrite: replace }),
+  });
+  let created = await create(overwrite);
+  if (created.status === 409 && !overwrite) {
+    if (!confirmReplace()) return null;
+    created = await create(true);
+  }
+  if (!created.ok) return created;
+  const { id, chunkSize } = await created.json();
+
+  let offset = 0;
+  let failures = 0;
+  while (offset < file.size) {
+    try {
+      const res = await fetch(`${apiUrl}/files/uploads/${id}?offset=${offset}`, {
+        method: 'PUT',
+        credentials: 'include',
+        body: file.slice(offset, offset + chunkSize),
+      });
+      if (res.ok) {
+        offset = (await res.json()).offset;
+        failures = 0;
+        onProgress(offset);
+        continue;
+      }
+      // 409 means our offset is stale; anything else 4xx is final.
+      if (res.status !== 409 && res.status < 500) return res;
+    } catch {
+      // Network drop mid-chunk: whatever arrived is kept server-side.
+    }
+    failures += 1;
+    if (failures > RESUMABLE_RETRIES) throw new Error('connection lost');
+    await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** failures));
+    const status = await fetch(`${apiUrl}/files/uploads/${id}`, { credentials: 'include' })
+      .catch(() => null);
+    if (status?.ok) offset = (await status.json()).offset;
+  }
+  const complete = (replace: boolean) =>
+    fetch(`${apiUrl}/files/uploads/${id}/complete${replace ? '?overwrite=true' : ''}`, {
+      method: 'POST',
+      credentials: 'include',
+    });
+  const done = await complete(false);
+  if (done.status !== 409) return done;
+  const body = await done.clone().json().catch(() => ({}));
+  if (!Array.isArray(body.conflicts)) return done;
+  if (confirmReplace()) return complete(true);
+  await fetch(`${apiUrl}/files/uploads/${id}`, { method: 'DELETE', credentials: 'include' })
+    .catch(() => null);
+  return null;
+}
+
+function conflictPrompt(conflicts: string[], destination: string): string {
+  const where =
+    !destination || destination === '/' ? 'at root' : `in "${destination}"`;
+  const list = conflicts.length === 1
+    ? `"${conflicts[0]}" already exists ${where}`
+    : `${conflicts.length} files already exist ${where} (${conflicts.slice(0, 3).map((c) => `"${c}"`).join(', ')}${conflicts.length > 3 ? ', …' : ''})`;
+  return `${list}. Replace? This cannot be undone.`;
+}
+
 export async function uploadLocalFiles(
   files: FileList | File[],
   destination: string,
@@ -7,6 +90,10 @@ export async function uploadLocalFiles(
 ) {
   if (!files || (files as FileList).length === 0) return;
   setStatus('Uploading...');
+  const all = Array.from(files);
+  const small = all.filter((f) => f.size < RESUMABLE_MIN_BYTES);
+  const large = all.filter((f) => f.size >= RESUMABLE_MIN_BYTES);
+  const dest = destination && destination !== '/' ? destination.replace(/^\/|\/$/g, '') : '';
 
   // Mirror /files/move's 409-then-retry-with-overwrite handshake so users
   // get the same "Replace? This cannot be undone." prompt as on rename /
@@ -14,8 +101,8 @@ export async function uploadLocalFiles(
   // and re-POST with `overwrite=true`.
   const post = async (overwrite: boolean) => {
     const formData = new FormData();
-    Array.from(files).forEach((file) => formData.append('files', file, file.name));
-    if (destination && destination !== '/') formData.append('destination', destination.replace(/^\/|\/$/g, ''));
+    small.forEach((file) => formData.append('files', file, file.name));
+    if (dest) formData.append('destination', dest);
     if (overwrite) formData.append('overwrite', 'true');
     const controller = new AbortController();
     const timeoutId = setTimeout(() => controller.abort(), 10 * 60 * 1000);
@@ -31,40 +118,64 @@ export async function uploadLocalFiles(
     }
   };
 
+  const failed = async (res: Response) => {
+    const body = await res.text().catch(() => '');
+    let detail = body;
+    try {
+      const parsed = JSON.parse(body);
+      detail = parsed.detail ?? parsed.error ?? body;
+    } catch { /* not JSON */ }
+    setStatus(detail ? `Upload failed: ${detail}` : `Upload failed (${res.status})`);
+  };
+
   try {
-    let res = await post(false);
-    if (res.status === 409) {
-      const body = await res.json().catch(() => ({}));
-      const conflicts: string[] = Array.isArray(body.conflicts) ? body.conflicts : [];
-      const where =
-        !destination || destination === '/' ? 'at root' : `in "${destination}"`;
-      const list = conflicts.length === 1
-        ? `"${conflicts[0]}" already exists ${where}`
-        : `${conflicts.length} files already exist ${where} (${conflicts.slice(0, 3).map((c) => `"${c}"`).join(', ')}${conflicts.length > 3 ? ', …' : ''})`;
-      const confirmed = window.confirm(`${list}. Replace? This cannot be undone.`);
-      if (!confirmed) {
-        setStatus('Upload cancelled');
+    let confirmedOverwrite = false;
+    if (small.length > 0) {
+      let res = await post(false);
+      if (res.status === 409) {
+        const body = await res.json().catch(() => ({}));
+        const conflicts: string[] = Array.isArray(body.conflicts) ? body.conflicts : [];
+        if (!window.confirm(conflictPrompt(conflicts, destination))) {
+          setStatus('Upload cancelled');
+          return;
+        }
+        confirmedOverwrite = true;
+        res = await post(true);
+      }
+      if (!res.ok) {
+        await failed(res);
         return;
       }
-      res = await post(true);
     }
-    if (res.ok) {
-      setStatus('Upload successful');
-      try {
-        await refreshFiles();
-      } catch (err) {
-        // The upload itself succeeded — don't downgrade that to a generic
-        // failure if the followup tree refresh hiccups.
-        console.error('refreshFiles failed after upload', err);
+    for (const file of large) {
+      const progress = (sent: number) =>
+        setStatus(`Uploading ${file.name} (${Math.floor((sent / file.size) * 100)}%)...`);
+      const confirmReplace = () => {
+        if (!confirmedOverwrite && !window.confirm(conflictPrompt([file.name], destination))) {
+          return false;
+        }
+        confirmedOverwrite = true;
+        return true;
+      };
+      const res = await uploadResumable(
+        file, dest, apiUrl, confirmedOverwrite, confirmReplace, progress,
+      );
+      if (res === null) {
+        setStatus('Upload cancelled');
+        return;
       }
-    } else {
-      const body = await res.text().catch(() => '');
-      let detail = body;
-      try {
-        const parsed = JSON.parse(body);
-        detail = parsed.detail ?? parsed.error ?? body;
-      } catch { /* not JSON */ }
-      setStatus(detail ? `Upload failed: ${detail}` : `Upload failed (${res.status})`);
+      if (!res.ok) {
+        await failed(res);
+        return;
+      }
+    }
+    setStatus('Upload successful');
+    try {
+      await refreshFiles();
+    } catch (err) {
+      // The upload itself succeeded — don't downgrade that to a generic
+      // failure if the followup tree refresh hiccups.
+      console.error('refreshFiles failed after upload', err);
     }
   } catch (err) {
     console.error('Upload network/abort error', err);
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Benchmark the classroom grading path end to end.
+
+Builds a synthetic classroom (N students x M assignments) under a temporary
+CLASSROOMS_ROOT with an in-memory database, then drives the real
+``run_classroom_tests`` handler: shared scheduler, syntax pre-check,
+fingerprinting, result upserts and the background batch run all run as in
+production. Only the sandbox runtime is swappable:
+
+- ``fake``: runs the real in-sandbox suite driver and per-test reporter as
+  a local process (no isolation; the synthetic tests are trusted). It
+  measures everything except container overhead.
+- ``docker``: the real warm pool / ephemeral containers. Needs Docker and
+  the ``3compute:latest`` image.
+
+Reports jobs/sec, p50/p99 job latency (time inside grade_student), p50/p99
+time-to-result from the start of the run, and asyncio event-loop lag while
+grading was in flight (a stand-in for terminal responsiveness). By default
+a cold pass (force re-run) is followed by a warm pass that should be
+answered from stored fingerprints.
+
+Usage (from repo root):
+    python3 tools/bench_grading.py --students 30 --assignments 8
+    python3 tools/bench_grading.py --runtime docker --concurrency 4 --json out.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+CLASSROOM_ID = "bench-classroom"
+TEACHER_ID = "bench-teacher"
+
+MAIN_OK = "def add(a, b):\n    return a + b\n"
+MAIN_BUGGY = "def add(a, b):\n    return a - b\n"
+MAIN_BROKEN = "def add(a, b)\n    return a + b\n"
+
+TEST_TEMPLATE = '''import time
+import unittest
+
+import main
+
+
+class TestAdd(unittest.TestCase):
+{cases}
+
+if __name__ == "__main__":
+    result = unittest.main(exit=False, verbosity=0).result
+    bad = len(result.failures) + len(result.errors)
+    print(f"{{result.testsRun - bad}}/{{result.testsRun}}")
+'''
+
+CASE_TEMPLATE = '''    def test_add_{i}(self):
+        time.sleep({work})
+        self.assertEqual(main.add({i}, 1), {i} + 1)
+'''
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[k]
+
+
+def build_classroom(root: Path, students: int, assignments: int, tests: int,
+                    work_ms: float, buggy_every: int, broken_every: int) -> list[str]:
+    """Lay out assignments and participant copies; return student emails."""
+    cases = "".join(
+        CASE_TEMPLATE.format(i=i, work=work_ms / 1000) for i in range(tests)
+    )
+    base = root / CLASSROOM_ID
+    for a in range(assignments):
+        tmpl = base / "assignments" / f"hw{a + 1}"
+        tmpl.mkdir(parents=True)
+        (tmpl / "main.py").write_text(MAIN_OK)
+        (tmpl / "test_add.py").write_text(TEST_TEMPLATE.format(cases=cases))
+
+    emails = []
+    for s in range(students):
+        email = f"student{s + 1}@bench.test"
+        emails.append(email)
+        if broken_every and s % broken_every == broken_every - 1:
+            main = MAIN_BROKEN
+        elif buggy_every and s % buggy_every == buggy_every - 1:
+            main = MAIN_BUGGY
+        else:
+            main = MAIN_OK
+        for a in range(assignments):
+            src = base / "assignments" / f"hw{a + 1}"
+            dst = base / "participants" / email / f"hw{a + 1}"
+            shutil.copytree(src, dst)
+            (dst / "main.py").write_text(main)
+    return emails
+
+
+class FakeRuntime:
+    """Drop-in for ``run_grading_suite`` that runs the real suite driver in
+    a local process, staged the same way as a warm-pool job."""
+
+    def __init__(self, jobs_root: Path):
+        self.jobs_root = jobs_root
+
+    def __call__(self, student_dir, test_files, steps, fallback=None, score_parser=None):
+        from backend import docker
+
+        job_dir = str(self.jobs_root / secrets.token_hex(8))
+        scratch = job_dir + ".tmp"
+        marker = f"###CSROOM_SUITE_{secrets.token_hex(8)}###"
+
+        def _rebase(step: dict) -> dict:
+            return {**step, "command": [docker._rebase_arg(a, job_dir) for a in step["command"]]}
+
+        spec = {
+            "steps": [_rebase(s) for s in steps],
+            "fallback": _rebase(fallback) if fallback else None,
+            "score_parser": score_parser,
+            "marker": marker,
+            "max_output": docker._SUITE_MAX_OUTPUT,
+            "max_tests": docker._SUITE_MAX_TESTS,
+            "reporter": docker._TEST_REPORTER,
+            "cwd": f"{job_dir}/app",
+        }
+        env = {
+            "PATH": os.environ.get("PATH", "/usr/bin:/bin"),
+            "TCOMPUTE_SCORE": "1",
+            "HOME": f"{job_dir}/app",
+            "PYTHONPATH": f"{job_dir}/app",
+            "TMPDIR": scratch,
+            "CSROOM_SUITE": json.dumps(spec),
+        }
+        payload = io.BytesIO()
+        docker.write_job_tar(payload, student_dir, test_files)
+        try:
+            subprocess.run(
+                [sys.executable, "-c", docker._UNPACK_DRIVER, job_dir],
+                input=payload.getvalue(), check=True, capture_output=True,
+            )
+            result = subprocess.run(
+                [sys.executable, "-c", docker._SUITE_DRIVER],
+                capture_output=True, env=env, cwd=str(self.jobs_root),
+            )
+        finally:
+            for dp, dns, _fns in os.walk(job_dir):
+                for d in dns:
+                    os.chmod(os.path.join(dp, d), 0o755)
+            if os.path.isdir(job_dir):
+                os.chmod(job_dir, 0o755)
+            shutil.rmtree(job_dir, ignore_errors=True)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+        for line in reversed(result.stdout.decode(errors="replace").splitlines()):
+            if line.startswith(marker):
+                return json.loads(line[len(marker):])
+        raise RuntimeError(f"suite driver produced no results: {result.stderr[:500]!r}")
+
+
+def docker_available() -> bool:
+    if not shutil.which("docker"):
+        return False
+    probe = subprocess.run(
+        ["docker", "image", "inspect", "3compute:latest"], capture_output=True,
+    )
+    return probe.returncode == 0
+
+
+async def monitor_loop_lag(samples: list[float], stop: asyncio.Event, interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def run_pass(engine, force: bool) -> dict:
+    from sqlmodel import Session, select
+
+    from backend import test_runner
+    from backend.api.database import User
+    from backend.api.grading import get_grading_runs
+    from backend.api.routers.classrooms import RunTestsRequest, run_classroom_tests
+
+    latencies: list[float] = []
+    results: list = []
+    finished: list[float] = []
+    lock = threading.Lock()
+    real_grade = test_runner.grade_student
+    t0 = time.perf_counter()
+
+    def timed_grade(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            outcome = real_grade(*args, **kwargs)
+            with lock:
+                results.append(outcome)
+            return outcome
+        finally:
+            end = time.perf_counter()
+            with lock:
+                latencies.append(end - start)
+                finished.append(end - t0)
+
+    lag: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(lag, stop))
+    test_runner.grade_student = timed_grade
+    try:
+        with Session(engine) as db:
+            teacher = db.exec(select(User).where(User.id == TEACHER_ID)).one()
+            t0 = time.perf_counter()
+            response = await run_classroom_tests(
+                classroom_id=CLASSROOM_ID,
+                body=RunTestsRequest(force=force),
+                user=teacher,
+                db=db,
+            )
+            # The handler returns once the jobs are queued.
+            await get_grading_runs().wait()
+            wall = time.perf_counter() - t0
+    finally:
+        test_runner.grade_student = real_grade
+        stop.set()
+        await monitor
+
+    jobs = response["count"]
+    return {
+        "force": force,
+        "jobs": jobs,
+        "cached": sum(1 for r in results if r.cached),
+        "full_marks": sum(1 for r in results if r.total and r.passed == r.total),
+        "wall_s": wall,
+        "jobs_per_s": jobs / wall if wall else 0.0,
+        "job_latency_ms": {
+            "p50": percentile(latencies, 50) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+        },
+        "time_to_result_ms": {
+            "p50": percentile(finished, 50) * 1000,
+            "p99": percentile(finished, 99) * 1000,
+        },
+        "loop_lag_ms": {
+            "p50": percentile(lag, 50) * 1000,
+            "p99": percentile(lag, 99) * 1000,
+            "max": max(lag, default=0.0) * 1000,
+        },
+    }
+
+
+def print_report(config: dict, passes: list[dict]) -> None:
+    print(
+        f"runtime={config['runtime']} students={config['students']} "
+        f"assignments={config['assignments']} tests={config['tests']} "
+        f"concurrency={config['concurrency']}"
+    )
+    header = (
+        f"{'pass':<10}{'jobs':>6}{'cached':>8}{'full':>6}{'wall s':>9}{'jobs/s':>9}"
+        f"{'job p50':>10}{'job p99':>10}{'done p50':>10}{'done p99':>10}"
+        f"{'lag p50':>9}{'lag p99':>9}{'lag max':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for i, p in enumerate(passes, 1):
+        label = f"{i}{' (cold)' if p['force'] else ' (warm)'}"
+        print(
+            f"{label:<10}{p['jobs']:>6}{p['cached']:>8}{p['full_marks']:>6}{p['wall_s']:>9.2f}"
+            f"{p['jobs_per_s']:>9.1f}"
+            f"{p['job_latency_ms']['p50']:>10.1f}{p['job_latency_ms']['p99']:>10.1f}"
+            f"{p['time_to_result_ms']['p50']:>10.1f}{p['time_to_result_ms']['p99']:>10.1f}"
+            f"{p['loop_lag_ms']['p50']:>9.2f}{p['loop_lag_ms']['p99']:>9.2f}"
+            f"{p['loop_lag_ms']['max']:>9.2f}"
+        )
+    print(
+        "full = jobs with every test passing; latencies in ms; "
+        "'done' = time from run start until the job finished"
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--assignments", type=int, default=8)
+    parser.add_argument("--tests", type=int, default=5, help="test cases per assignment")
+    parser.add_argument("--work-ms", type=float, default=5.0, help="sleep per test case")
+    parser.add_argument("--buggy-every", type=int, default=3,
+                        help="every Nth student fails tests (0 = none)")
+    parser.add_argument("--broken-every", type=int, default=10,
+                        help="every Nth student has a syntax error (0 = none)")
+    parser.add_argument("--runtime", choices=("fake", "docker", "auto"), default="fake")
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="pin the grading concurrency (0 = derive from free CPU)")
+    parser.add_argument("--passes", type=int, default=2,
+                        help="first pass forces a re-run, later ones may hit the cache")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    runtime = args.runtime
+    if runtime == "auto":
+        runtime = "docker" if docker_available() else "fake"
+    elif runtime == "docker" and not docker_available():
+        print("docker runtime requested but docker/3compute:latest is unavailable",
+              file=sys.stderr)
+        return 2
+
+    workdir = Path(tempfile.mkdtemp(prefix="csroom-bench-"))
+    # Module-level settings are read at import time, so set them first.
+    os.environ["CLASSROOMS_ROOT"] = str(workdir / "classrooms")
+    os.environ["UPLOADS_ROOT"] = str(workdir / "uploads")
+    if args.concurrency:
+        os.environ["GRADING_MAX_CONCURRENCY"] = str(args.concurrency)
+        os.environ["GRADING_MAX_WORKERS"] = str(
+            max(args.concurrency, int(os.environ.get("GRADING_MAX_WORKERS", "0") or 0))
+        )
+    if runtime == "fake":
+        os.environ["GRADING_POOL_SIZE"] = "0"
+    sys.path.insert(0, str(REPO_ROOT))
+
+    from sqlalchemy.pool import StaticPool
+    from sqlmodel import Session, create_engine
+
+    from backend import test_runner
+    from backend.api.database import Classroom, ClassroomMember, User, create_db_and_tables
+    from backend.docker import get_grading_pool
+    from backend.grading_queue import get_grading_scheduler
+
+    try:
+        emails = build_classroom(
+            workdir / "classrooms", args.students, args.assignments, args.tests,
+            args.work_ms, args.buggy_every, args.broken_every,
+        )
+        engine = create_engine(
+            "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool,
+        )
+        create_db_and_tables(engine)
+        with Session(engine) as db:
+            db.add(User(id=TEACHER_ID, email="teacher@bench.test", port_start=0, port_end=0))
+            db.add(Classroom(
+                id=CLASSROOM_ID, name="Bench", access_code="BENCH1", created_by=TEACHER_ID,
+            ))
+            db.add(ClassroomMember(classroom_id=CLASSROOM_ID, user_id=TEACHER_ID, role="instructor"))
+            for i, email in enumerate(emails):
+                uid = f"bench-student-{i + 1}"
+                db.add(User(id=uid, email=email, name=f"Student {i + 1}", port_start=0, port_end=0))
+                db.add(ClassroomMember(classroom_id=CLASSROOM_ID, user_id=uid, role="participant"))
+            db.commit()
+
+        if runtime == "fake":
+            jobs_root = workdir / "jobs"
+            jobs_root.mkdir()
+            test_runner.run_grading_suite = FakeRuntime(jobs_root)
+        else:
+            get_grading_pool().warm()
+
+        passes = []
+        for i in range(max(1, args.passes)):
+            passes.append(asyncio.run(run_pass(engine, force=(i == 0))))
+
+        config = {
+            "runtime": runtime,
+            "students": args.students,
+            "assignments": args.assignments,
+            "tests": args.tests,
+            "concurrency": args.concurrency or get_grading_scheduler().stats().get("limit"),
+        }
+        print_report(config, passes)
+        print(f"syntax pre-check: {test_runner.precheck_stats()}")
+        if args.json:
+            Path(args.json).write_text(json.dumps({"config": config, "passes": passes}, indent=2))
+    finally:
+        get_grading_scheduler().shutdown()
+        if runtime == "docker":
+            get_grading_pool().shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())